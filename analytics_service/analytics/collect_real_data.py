@@ -5,14 +5,21 @@
 # rolling window of samples, and appends the resulting rows to training_data.csv.
 # Existing synthetic rows in the CSV are preserved.
 
-# Usage: python -m analytics_service.analytics.collect_real_data
+# Usage: python -m analytics_service.analytics.collect_real_data [db ...]
+# With no arguments the DB_FILES below are read. For a fleet, merge the per-machine
+# files first (python -m storage_service.storage.merge) and pass the merged file.
 
 import csv
 import sqlite3
+import sys
 from pathlib import Path
 
+import numpy as np
+
 from analytics_service.analytics.features import FeatureExtractor, WINDOW_SIZE
 from analytics_service.analytics.labels import LabelEngine, LABEL_NAMES
+from storage_service.storage.model_input import ModelInput
+from storage_service.storage.schema import init_db
 
 OUTPUT_PATH = Path("analytics_service/data/training_data.csv")
 
@@ -23,6 +30,9 @@ DB_FILES = [
     "telemetry-andrew-pc.db",
 ]
 
+# Same ticks the old inner-join query kept
+REQUIRED_KEYS = ["cpu_percent_total", "ram_usage_percent", "read_speed_bytes", "disk_usage_percent"]
+
 
 def fetch_sessions(conn):
     return [
@@ -31,10 +41,20 @@ def fetch_sessions(conn):
     ]
 
 
+def complete_ticks(cols):
+    """Keeps only ticks with CPU, RAM, disk I/O and partition data (arrays stay oldest first)."""
+    complete = np.ones(len(cols["sample_id"]), dtype=bool)
+    for key in REQUIRED_KEYS:
+        complete &= ~np.isnan(cols[key])
+    return {key: values[complete] for key, values in cols.items()}
+
 
 def process_db(db_path):
-    conn = sqlite3.connect(db_path)
+    # init_db brings older files up to the current schema (archive tables included)
+    conn = init_db(db_path)
     conn.row_factory = sqlite3.Row
+    # Files written before model_input existed get their rows once
+    ModelInput.catch_up(conn)
 
     host = conn.execute("SELECT hostname FROM host LIMIT 1").fetchone()
     hostname = host["hostname"] if host else db_path
@@ -43,32 +63,11 @@ def process_db(db_path):
     rows = []
 
     for sid in sessions:
-        samples = conn.execute('''
-            SELECT s.sample_id,
-                   c.cpu_percent_total, c.freq_current_mhz,
-                   r.ram_usage_percent, r.swap_usage_percent,
-                   di.read_speed_bytes, di.write_speed_bytes,
-                   di.avg_read_latency_ms, di.avg_write_latency_ms,
-                   MAX(dp.usage_percent) AS disk_usage_percent,
-                   g.gpu_util_percent, g.gpu_mem_util_percent,
-                   g.gpu_temp_c, g.gpu_core_clock_mhz,
-                   g.gpu_power_usage_w, g.gpu_power_limit_w
-            FROM sample s
-            JOIN cpu_sample c ON c.sample_id = s.sample_id
-            JOIN ram_sample r ON r.sample_id = s.sample_id
-            JOIN disk_io_sample di ON di.sample_id = s.sample_id
-            JOIN disk_partition_sample dp ON dp.sample_id = s.sample_id
-            LEFT JOIN gpu_sample g ON g.sample_id = s.sample_id AND g.gpu_id = 0
-            WHERE s.session_id = ?
-            GROUP BY s.sample_id
-            ORDER BY s.sample_id ASC
-        ''', (sid,)).fetchall()
-
-        samples = [dict(r) for r in samples]
-
-        for i in range(len(samples) - WINDOW_SIZE + 1):
-            window = list(reversed(samples[i:i + WINDOW_SIZE]))
-            features = FeatureExtractor.compute(window)
+        # Model inputs in feature order; archived sessions are decoded from their chunks
+        cols = complete_ticks(ModelInput.read_session(conn, sid))
+
+        for end in range(WINDOW_SIZE, len(cols["sample_id"]) + 1):
+            features = FeatureExtractor.compute_columns(cols, end)
             if features is None:
                 continue
             labels = LabelEngine.apply(features)
@@ -82,7 +81,7 @@ def process_db(db_path):
     return hostname, rows
 
 
-def collect():
+def collect(db_files=DB_FILES):
     # Load existing CSV to preserve synthetic rows and get fieldnames
     existing_rows = []
     fieldnames = None
@@ -94,7 +93,7 @@ def collect():
             existing_rows = [r for r in reader if r.get("source") == "synthetic"]
 
     new_rows = []
-    for db_file in DB_FILES:
+    for db_file in db_files:
         path = Path(db_file)
         if not path.exists():
             print(f"  Skipping {db_file} (not found)")
@@ -125,4 +124,4 @@ def collect():
 
 if __name__ == "__main__":
     print("Collecting real telemetry data...")
-    collect()
+    collect(sys.argv[1:] or DB_FILES)
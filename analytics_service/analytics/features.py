@@ -10,6 +10,25 @@ import numpy as np
 
 WINDOW_SIZE = 10
 
+# Point-in-time features, in feature-vector order (also storage_service model_input.py's columns)
+POINT_METRICS = [
+    "cpu_percent_total",
+    "freq_current_mhz",
+    "ram_usage_percent",
+    "swap_usage_percent",
+    "gpu_util_percent",
+    "gpu_mem_util_percent",
+    "gpu_temp_c",
+    "gpu_core_clock_mhz",
+    "gpu_power_usage_w",
+    "gpu_power_limit_w",
+    "avg_read_latency_ms",
+    "avg_write_latency_ms",
+    "read_speed_bytes",
+    "write_speed_bytes",
+    "disk_usage_percent",
+]
+
 ROLLING_METRICS = [
     "cpu_percent_total",
     "freq_current_mhz",
@@ -69,6 +88,35 @@ class FeatureExtractor:
 
         return features
 
+    @staticmethod
+    def compute_columns(columns, end=None):
+        """
+        Same features as compute(), from column arrays (oldest first, NaN = missing) such as
+        StorageManager.get_recent_columns() or get_session_columns(). Uses the WINDOW_SIZE
+        ticks ending just before index end (default: the last tick).
+        Returns None if there are not enough ticks.
+        """
+        n = len(columns["sample_id"])
+        end = n if end is None else end
+        if end < WINDOW_SIZE or end > n:
+            return None
+
+        def window(key):
+            values = columns.get(key)
+            if values is None:
+                return np.zeros(WINDOW_SIZE)
+            return np.nan_to_num(np.asarray(values[end - WINDOW_SIZE:end], dtype=float), nan=0.0)
+
+        features = {}
+        for metric in POINT_METRICS:
+            features[metric] = float(window(metric)[-1])
+        for metric in ROLLING_METRICS:
+            values = window(metric)
+            features[f"{metric}_roll_mean"]  = float(np.mean(values))
+            features[f"{metric}_roll_std"]   = float(np.std(values))
+            features[f"{metric}_roll_slope"] = FeatureExtractor._slope(values)
+        return features
+
     @staticmethod
     def _safe(sample, key, default):
         """Returns the value from the sample, or default if missing or None."""
@@ -0,0 +1,60 @@
+# analytics_service/tests/test_features.py
+# Author: Andrew Fox
+# Run with: python -m pytest analytics_service/tests/test_features.py -v
+
+import numpy as np
+import pytest
+from analytics_service.analytics.features import FeatureExtractor, WINDOW_SIZE, POINT_METRICS
+from storage_service.storage.model_input import MODEL_INPUT_METRICS
+
+
+# -----------------------------
+# Shared helpers
+# -----------------------------
+def make_samples(n):
+    """n raw sample dicts, newest first, with a trend and a missing GPU reading."""
+    samples = []
+    for i in range(n):
+        s = {metric: float(10 + i * (j + 1)) for j, metric in enumerate(POINT_METRICS)}
+        if i == n - 2:
+            s["gpu_core_clock_mhz"] = None
+        samples.append(s)
+    return list(reversed(samples))
+
+
+def to_columns(samples):
+    """Newest-first dicts -> oldest-first column arrays (None -> NaN)."""
+    oldest_first = list(reversed(samples))
+    cols = {"sample_id": np.arange(len(oldest_first))}
+    for metric in POINT_METRICS:
+        cols[metric] = np.array([s[metric] for s in oldest_first], dtype=float)
+    return cols
+
+
+# -----------------------------
+# Columnar features
+# -----------------------------
+class TestComputeColumns:
+
+    def test_matches_dict_path(self):
+        samples = make_samples(WINDOW_SIZE)
+        expected = FeatureExtractor.compute(samples)
+        got = FeatureExtractor.compute_columns(to_columns(samples))
+        assert list(got) == list(expected)
+        for key in expected:
+            assert got[key] == pytest.approx(expected[key])
+
+    def test_window_end(self):
+        samples = make_samples(WINDOW_SIZE + 5)
+        cols = to_columns(samples)
+        # Window ending at index WINDOW_SIZE is the oldest WINDOW_SIZE ticks
+        expected = FeatureExtractor.compute(samples[5:])
+        got = FeatureExtractor.compute_columns(cols, WINDOW_SIZE)
+        assert got["cpu_percent_total"] == expected["cpu_percent_total"]
+
+    def test_too_few_ticks(self):
+        assert FeatureExtractor.compute_columns(to_columns(make_samples(WINDOW_SIZE - 1))) is None
+
+    def test_model_input_table_in_feature_order(self):
+        # storage_service model_input columns are written in this order
+        assert list(MODEL_INPUT_METRICS) == POINT_METRICS
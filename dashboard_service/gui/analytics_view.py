@@ -6,9 +6,10 @@
 # Imports
 # -----------------------------
 import csv
-import sqlite3
 from datetime import datetime
 
+import numpy as np
+
 from PyQt6.QtWidgets import (
     QWidget, QVBoxLayout, QHBoxLayout, QLabel, QFrame,
     QScrollArea, QSizePolicy, QPushButton,
@@ -20,6 +21,10 @@ from dashboard_service.gui.settings_manager import load_settings
 from analytics_service.analytics.features import FeatureExtractor, WINDOW_SIZE
 from analytics_service.analytics.labels import LABEL_COMPONENTS
 from analytics_service.analytics.model import PerformanceModel
+from storage_service.storage.hot_tier import get_hot_tier
+from storage_service.storage.episodes import IssueEpisodes
+from storage_service.storage.schema import init_db
+from collector_service.collector.system_info_collector import SystemInfoCollector
 
 
 # -----------------------------
@@ -64,28 +69,6 @@ ISSUE_META = {
                                 "Lower texture quality or resolution in your application. Closing other GPU-intensive programs will free up VRAM."),
 }
 
-_SAMPLE_QUERY = """
-    SELECT
-        c.cpu_percent_total, c.freq_current_mhz,
-        r.ram_usage_percent, r.swap_usage_percent,
-        g.gpu_util_percent, g.gpu_mem_util_percent,
-        g.gpu_temp_c, g.gpu_core_clock_mhz,
-        g.gpu_power_usage_w, g.gpu_power_limit_w,
-        d.avg_read_latency_ms, d.avg_write_latency_ms,
-        d.read_speed_bytes, d.write_speed_bytes,
-        MAX(dp.usage_percent) AS disk_usage_percent
-    FROM sample s
-    LEFT JOIN cpu_sample            c  ON c.sample_id  = s.sample_id
-    LEFT JOIN ram_sample            r  ON r.sample_id  = s.sample_id
-    LEFT JOIN disk_io_sample        d  ON d.sample_id  = s.sample_id
-    LEFT JOIN disk_partition_sample dp ON dp.sample_id = s.sample_id
-    LEFT JOIN gpu_sample            g  ON g.sample_id  = s.sample_id AND g.gpu_id = 0
-    WHERE s.session_id = ?
-    GROUP BY s.sample_id
-    ORDER BY s.ts_unix_ms DESC
-    LIMIT ?
-"""
-
 
 # -----------------------------
 # Analytics Thread
@@ -98,32 +81,36 @@ class AnalyticsThread(QThread):
     MIN_SAMPLES = 100
     INTERVAL_MS = 5000
 
+    def __init__(self, parent=None, episodes_db="telemetry.db"):
+        super().__init__(parent)
+        self.episodes_db = episodes_db
+
     def run(self):
-        try:
-            conn = sqlite3.connect("telemetry.db")
-            conn.row_factory = sqlite3.Row
-        except Exception:
-            self.status_signal.emit("DB unavailable", 0)
-            return
+        # Window and count come from the writer's in-memory hot tier: no SQL per cycle
+        tier = get_hot_tier("telemetry.db")
 
         try:
             model = PerformanceModel()
         except Exception:
             self.status_signal.emit("Model not found", 0)
-            conn.close()
             return
 
-        session_id = conn.execute("SELECT MAX(session_id) FROM session").fetchone()[0]
-        if session_id is None:
-            self.status_signal.emit("No session", 0)
+        # Issue episodes persist across runs (episodes.py); the thread owns its connection
+        conn = init_db(self.episodes_db)
+        host_uuid = SystemInfoCollector.get_system_info()["host_uuid"]
+        try:
+            self._predict_loop(tier, model, conn, host_uuid)
+        finally:
+            IssueEpisodes.close_open(conn, host_uuid)
+            conn.commit()
             conn.close()
-            return
 
+    def _predict_loop(self, tier, model, conn, host_uuid):
         while not self.isInterruptionRequested():
             try:
-                count = conn.execute(
-                    "SELECT COUNT(*) FROM sample WHERE session_id = ?", (session_id,)
-                ).fetchone()[0]
+                session_id = tier.session_id
+                count = tier.count(session_id) if session_id is not None else 0
+                columns = tier.recent(WINDOW_SIZE, session_id)
 
                 if count < self.MIN_SAMPLES:
                     self.status_signal.emit("Collecting\u2026", count)
@@ -132,9 +119,7 @@ class AnalyticsThread(QThread):
 
                 self.status_signal.emit("Ready", count)
 
-                rows = conn.execute(_SAMPLE_QUERY, (session_id, WINDOW_SIZE)).fetchall()
-                samples = [dict(r) for r in rows]
-                features = FeatureExtractor.compute(samples)
+                features = FeatureExtractor.compute_columns(columns)
 
                 if features is None:
                     self.msleep(self.INTERVAL_MS)
@@ -155,8 +140,8 @@ class AnalyticsThread(QThread):
                     })
 
                 def _avg(key):
-                    vals = [s[key] for s in samples if s.get(key) is not None]
-                    return sum(vals) / len(vals) if vals else None
+                    vals = columns[key][~np.isnan(columns[key])]
+                    return float(vals.mean()) if len(vals) else None
 
                 snapshot = {
                     "cpu_percent":    _avg("cpu_percent_total"),
@@ -171,6 +156,13 @@ class AnalyticsThread(QThread):
                     "disk_usage":     _avg("disk_usage_percent"),
                 }
 
+                IssueEpisodes.record(
+                    conn, host_uuid, session_id, int(datetime.now().timestamp() * 1000),
+                    {label: result["probabilities"].get(label, 0.0) for label in fired_set},
+                    {key: float(col[-1]) for key, col in columns.items() if len(col) and not np.isnan(col[-1])},
+                    max_gap_ms=3 * self.INTERVAL_MS,
+                )
+
                 self.prediction_signal.emit(issues, result["health_score"], snapshot)
 
             except Exception:
@@ -178,8 +170,6 @@ class AnalyticsThread(QThread):
 
             self.msleep(self.INTERVAL_MS)
 
-        conn.close()
-
 
 # -----------------------------
 # Alerts Dialog
@@ -394,6 +384,7 @@ class AnalyticsWidget(QWidget):
         self.alert_log = []
         self.metrics_log = []
         self._prev_fired = set()
+        self.episodes_db = "telemetry.db"     # the shard catalog in the sharded layout
 
         # Layout
         outer = QVBoxLayout()
@@ -601,7 +592,7 @@ class AnalyticsWidget(QWidget):
         self.sess_preds_val.setText("0")
         self.sess_flags_val.setText("0")
 
-        self._thread = AnalyticsThread(self)
+        self._thread = AnalyticsThread(self, episodes_db=self.episodes_db)
         self._thread.status_signal.connect(self.update_status)
         self._thread.prediction_signal.connect(self.update_predictions)  # (issues, health_score, snapshot)
         self._thread.start()
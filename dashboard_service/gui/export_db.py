@@ -0,0 +1,165 @@
+# dashboard_service/gui/export_db.py
+# Author: Andrew Fox
+
+# "Export DB" options dialog and background export thread.
+# The export itself is storage_service/storage/export.py; this module only picks the
+# time range and columns and runs it off the GUI thread with progress and cancel.
+
+
+# -----------------------------
+# Imports
+# -----------------------------
+from datetime import datetime, timedelta
+
+from PyQt6.QtWidgets import (
+    QVBoxLayout, QHBoxLayout, QLabel, QPushButton, QDialog, QCheckBox,
+    QComboBox, QGridLayout,
+)
+from PyQt6.QtCore import QThread, pyqtSignal
+
+from storage_service.storage.export import (
+    EXPORT_COLUMNS, ExportCancelled, export_csv, export_columnar, parquet_available, shard_connections,
+)
+from storage_service.storage.read_pool import get_read_pool
+
+# Format label -> export format; CSV writes one file, the others a partitioned folder
+EXPORT_FORMATS = {
+    "CSV (.csv)":             "csv",
+    "NumPy arrays (.npz)":    "npz",
+    "Parquet (needs pyarrow)": "parquet",
+}
+
+# Range label -> lookback (None = everything)
+EXPORT_RANGES = {
+    "All data":      None,
+    "Last hour":     timedelta(hours=1),
+    "Last 24 hours": timedelta(days=1),
+    "Last 7 days":   timedelta(days=7),
+    "Last 30 days":  timedelta(days=30),
+}
+
+
+# -----------------------------
+# Export Thread
+# -----------------------------
+class ExportDbThread(QThread):
+    """
+    Streams the export to disk; cancel with requestInterruption(). With shards (a
+    sharding.ShardCatalog) it reads the shard files instead of telemetry.db.
+    """
+
+    progress_signal = pyqtSignal(int, int)       # (rows_done, rows_total)
+    finished_signal = pyqtSignal(str, str)       # (status: "done" / "cancelled" / "failed", message)
+
+    def __init__(self, filename, columns, start_ms, exported_at, fmt="csv", parent=None, shards=None):
+        super().__init__(parent)
+        self.filename = filename
+        self.fmt = fmt
+        self.columns = columns
+        self.start_ms = start_ms
+        self.exported_at = exported_at
+        self.shards = shards
+
+    def run(self):
+        try:
+            options = dict(
+                columns=self.columns,
+                start_ms=self.start_ms,
+                exported_at=self.exported_at,
+                progress=self.progress_signal.emit,
+                cancelled=self.isInterruptionRequested,
+            )
+            if self.shards is not None:
+                conns = shard_connections(self.shards, self.start_ms)
+                try:
+                    rows = self._export(conns, options)
+                finally:
+                    for conn in conns:
+                        conn.close()
+            else:
+                with get_read_pool("telemetry.db").connection() as conn:
+                    rows = self._export(conn, options)
+            self.finished_signal.emit("done", f"Exported {rows:,} samples to:\n{self.filename}")
+        except ExportCancelled:
+            self.finished_signal.emit("cancelled", "Export cancelled.")
+        except Exception as e:
+            self.finished_signal.emit("failed", f"Could not export database:\n{e}")
+
+    def _export(self, conn, options):
+        if self.fmt == "csv":
+            return export_csv(conn, self.filename, **options)
+        return export_columnar(conn, self.filename, fmt=self.fmt, **options)
+
+
+# -----------------------------
+# Export Options Dialog
+# -----------------------------
+class ExportDbDialog(QDialog):
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Export Telemetry Database")
+        self.setFixedWidth(460)
+        self.setModal(True)
+
+        layout = QVBoxLayout()
+        layout.setContentsMargins(20, 16, 20, 16)
+        layout.setSpacing(12)
+        self.setLayout(layout)
+
+        layout.addWidget(QLabel("<b>Format</b>"))
+        self.format_combo = QComboBox()
+        self.format_combo.addItems(list(EXPORT_FORMATS))
+        if not parquet_available():
+            # Keep the entry visible but disabled so users know it exists
+            self.format_combo.model().item(2).setEnabled(False)
+        layout.addWidget(self.format_combo)
+
+        layout.addWidget(QLabel("<b>Time range</b>"))
+        self.range_combo = QComboBox()
+        self.range_combo.addItems(list(EXPORT_RANGES))
+        layout.addWidget(self.range_combo)
+
+        layout.addWidget(QLabel("<b>Columns</b>"))
+        grid = QGridLayout()
+        self.column_checks = {}
+        for i, name in enumerate(EXPORT_COLUMNS):
+            chk = QCheckBox(name)
+            chk.setChecked(True)
+            self.column_checks[name] = chk
+            grid.addWidget(chk, i // 2, i % 2)
+        layout.addLayout(grid)
+
+        btn_row = QHBoxLayout()
+        btn_row.setSpacing(8)
+
+        cancel_btn = QPushButton("Cancel")
+        cancel_btn.setFixedHeight(34)
+        cancel_btn.clicked.connect(self.reject)
+
+        self.export_btn = QPushButton("Export")
+        self.export_btn.setFixedHeight(34)
+        self.export_btn.setObjectName("accentButton")
+        self.export_btn.clicked.connect(self.accept)
+
+        for chk in self.column_checks.values():
+            chk.toggled.connect(self._update_export_enabled)
+
+        btn_row.addWidget(cancel_btn)
+        btn_row.addWidget(self.export_btn)
+        layout.addLayout(btn_row)
+
+    def _update_export_enabled(self):
+        self.export_btn.setEnabled(bool(self.selected_columns()))
+
+    def selected_columns(self):
+        return [name for name, chk in self.column_checks.items() if chk.isChecked()]
+
+    def export_format(self):
+        return EXPORT_FORMATS[self.format_combo.currentText()]
+
+    def start_ms(self):
+        lookback = EXPORT_RANGES[self.range_combo.currentText()]
+        if lookback is None:
+            return None
+        return int((datetime.now() - lookback).timestamp() * 1000)
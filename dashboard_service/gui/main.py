@@ -4,15 +4,14 @@
 # -----------------------------
 # Imports
 # -----------------------------
-import csv
-import sqlite3
+import os
 import sys
 import time
 from datetime import datetime
 from PyQt6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
     QPushButton, QLabel, QFrame, QGridLayout, QSizePolicy, QDialog,
-    QComboBox, QSpinBox, QColorDialog, QLineEdit, QMessageBox, QFileDialog
+    QComboBox, QSpinBox, QColorDialog, QLineEdit, QMessageBox, QFileDialog, QProgressDialog
 )
 from PyQt6.QtCore import Qt, QThread
 from PyQt6.QtGui import QFontDatabase, QFont, QCursor, QColor
@@ -24,11 +23,19 @@ from collector_service.collector.ram_collector import RAMCollector
 from collector_service.collector.gpu_collector import GPUCollector
 from collector_service.collector.disk_collector import DiskCollector
 from storage_service.storage.main import StorageManager
+from storage_service.storage.retention import RetentionManager
+from storage_service.storage.archive import SessionArchiver
+from storage_service.storage.checkpoint import CheckpointManager
+from storage_service.storage.optimize import OptimizeManager
+from storage_service.storage.read_pool import get_read_pool
+from storage_service.storage.writer import AsyncStorageWriter, DEFAULT_MAX_QUEUE
+from storage_service.storage.sharding import ShardCatalog
 
 # Import the Live System Monitoring panel
 from dashboard_service.gui.live_monitor import LiveSystemMonitor
 # Import the Analytics panel
 from dashboard_service.gui.analytics_view import AnalyticsWidget, AlertsDialog
+from dashboard_service.gui.export_db import ExportDbDialog, ExportDbThread
 # Import settings manager
 from dashboard_service.gui.settings_manager import load_settings, save_settings
 
@@ -37,11 +44,27 @@ from dashboard_service.gui.settings_manager import load_settings, save_settings
 # Background Storage Thread
 # -----------------------------
 class StorageThread(QThread):
-    """Collects and stores one sample per second in a background thread."""
+    """Collects one sample per second; an AsyncStorageWriter persists them on its own thread."""
+
+    def __init__(self, parent=None, shards=None, writer_settings=None, change_only=False, profile=None):
+        super().__init__(parent)
+        self.shards = shards
+        self.writer_settings = writer_settings or {}
+        self.change_only = change_only
+        self.profile = profile
 
     def run(self):
-        storage = StorageManager(db_path="telemetry.db", sample_interval_ms=1000)
+        writer = AsyncStorageWriter(
+            lambda: StorageManager(db_path="telemetry.db", sample_interval_ms=1000, shards=self.shards,
+                                   autocheckpoint=self.shards is not None, change_only=self.change_only,
+                                   profile=self.profile),
+            max_queue=self.writer_settings.get("max_queue", DEFAULT_MAX_QUEUE),
+            policy=self.writer_settings.get("overflow_policy", "drop_oldest"),
+        )
+        writer.start()
         try:
+            # Fixed-rate schedule: collection time no longer stretches the interval
+            next_tick = time.perf_counter()
             while not self.isInterruptionRequested():
                 try:
                     _t0 = time.perf_counter()
@@ -53,12 +76,17 @@ class StorageThread(QThread):
                         gpu = None
                     disk = DiskCollector.get_disk_data()
                     collect_ms = int((time.perf_counter() - _t0) * 1000)
-                    storage.insert_sample(cpu, ram, gpu, disk, collect_ms)
+                    writer.submit(cpu, ram, gpu, disk, collect_ms)
                 except Exception:
                     pass
-                self.msleep(1000)
+                next_tick += 1.0
+                delay_ms = int((next_tick - time.perf_counter()) * 1000)
+                if delay_ms > 0:
+                    self.msleep(delay_ms)
+                else:
+                    next_tick = time.perf_counter()   # fell behind; don't burst to catch up
         finally:
-            storage.close()
+            writer.stop()
 
 
 # -----------------------------
@@ -97,14 +125,60 @@ class DashboardWindow(QMainWindow):
         self.set_active_button(self.live_button)
         self.content_widgets["Live System Monitoring"].show()
 
+        # Optional day/week sharded layout
+        shard_period = self.settings_data.get("storage_shard_period")
+        profile = self.settings_data.get("storage_tuning_profile")
+        self._shards = ShardCatalog("telemetry_shards", shard_period, profile=profile) if shard_period else None
+        if self._shards is not None:
+            self.analytics_widget.episodes_db = self._shards.catalog_path
+
         # Start background storage thread
-        self._storage_thread = StorageThread(self)
+        self._storage_thread = StorageThread(self, shards=self._shards,
+                                             writer_settings=self.settings_data.get("storage_writer"),
+                                             change_only=self.settings_data.get("storage_change_only", False),
+                                             profile=profile)
         self._storage_thread.start()
 
+        # Start retention job (deletes expired data in small chunks on its own connection)
+        self._retention = RetentionManager("telemetry.db", self.settings_data.get("storage_retention"),
+                                           shards=self._shards)
+        self._retention.start()
+
+        # Compress closed sessions in the background (single-file layout only)
+        self._archiver = SessionArchiver("telemetry.db") if self._shards is None else None
+        if self._archiver is not None:
+            self._archiver.start()
+
+        # WAL checkpoints off the writer thread (single-file layout; shards keep autocheckpoint)
+        self._checkpointer = (CheckpointManager("telemetry.db", self.settings_data.get("storage_checkpoint"))
+                              if self._shards is None else None)
+        if self._checkpointer is not None:
+            self._checkpointer.start()
+
+        # Refresh query planner statistics now and then (single-file layout)
+        self._optimizer = (OptimizeManager("telemetry.db", self.settings_data.get("storage_optimize"))
+                           if self._shards is None else None)
+        if self._optimizer is not None:
+            self._optimizer.start()
+
+        # Background Export DB job (see export_db_to_csv)
+        self._export_thread = None
+
     def closeEvent(self, event):
+        if self._export_thread is not None:
+            self._export_thread.requestInterruption()
+            self._export_thread.wait()
         self.analytics_widget.shutdown()
+        self._retention.stop()
+        if self._archiver is not None:
+            self._archiver.stop()
         self._storage_thread.requestInterruption()
         self._storage_thread.wait()
+        if self._checkpointer is not None:
+            self._checkpointer.stop()
+        if self._optimizer is not None:
+            self._optimizer.stop()
+        get_read_pool("telemetry.db").close()
         super().closeEvent(event)
 
     # -----------------------------
@@ -247,113 +321,58 @@ class DashboardWindow(QMainWindow):
     # Export full telemetry DB to CSV
     # -----------------------------
     def export_db_to_csv(self):
+        if self._export_thread is not None:
+            return   # one export at a time
+
+        options = ExportDbDialog(self)
+        if options.exec() != QDialog.DialogCode.Accepted:
+            return
+
         export_time = datetime.now()
-        filename, _ = QFileDialog.getSaveFileName(
-            self,
-            "Export Telemetry Database",
-            f"telemetry_export_{export_time.strftime('%Y-%m-%d_%H-%M-%S')}.csv",
-            "CSV Files (*.csv);;All Files (*)",
-        )
+        fmt = options.export_format()
+        if fmt == "csv":
+            filename, _ = QFileDialog.getSaveFileName(
+                self,
+                "Export Telemetry Database",
+                f"telemetry_export_{export_time.strftime('%Y-%m-%d_%H-%M-%S')}.csv",
+                "CSV Files (*.csv);;All Files (*)",
+            )
+        else:
+            # Columnar formats write a host/session partitioned folder
+            parent = QFileDialog.getExistingDirectory(self, "Export Telemetry Database To Folder")
+            filename = (os.path.join(parent, f"telemetry_export_{export_time.strftime('%Y-%m-%d_%H-%M-%S')}")
+                        if parent else "")
         if not filename:
             return
 
-        try:
-            conn = sqlite3.connect("telemetry.db")
-            conn.row_factory = sqlite3.Row
-
-            with open(filename, "w", newline="", encoding="utf-8") as f:
-                writer = csv.writer(f)
-
-                # --- Host Info ---
-                writer.writerow(["--- Host Info ---"])
-                writer.writerow(["Exported at", export_time.strftime("%Y-%m-%d %H:%M:%S")])
-                host = conn.execute("SELECT * FROM host LIMIT 1").fetchone()
-                if host:
-                    writer.writerow(["Hostname",         host["hostname"]])
-                    writer.writerow(["OS",               f"{host['os_name']} {host['os_version']}"])
-                    writer.writerow(["Machine",          host["machine"]])
-                    writer.writerow(["CPU Model",        host["cpu_model"]])
-                    writer.writerow(["CPU Cores",        host["cpu_core_count"]])
-                    writer.writerow(["CPU Threads",      host["cpu_thread_count"]])
-                    writer.writerow(["CPU Max MHz",      host["cpu_max_mhz"]])
-                    writer.writerow(["Total RAM (GB)",   host["total_ram_gb"]])
-                    writer.writerow(["GPU Detected",     "Yes" if host["gpu_detected"] else "No"])
-                writer.writerow([])
-
-                # --- Sessions ---
-                writer.writerow(["--- Sessions ---"])
-                writer.writerow(["Session ID", "Started At", "Sample Interval (ms)", "First Sample ID"])
-                sessions = conn.execute("SELECT * FROM session ORDER BY session_id").fetchall()
-                for s in sessions:
-                    first_sample = conn.execute(
-                        "SELECT MIN(sample_id) FROM sample WHERE session_id = ?", (s["session_id"],)
-                    ).fetchone()[0]
-                    writer.writerow([
-                        s["session_id"],
-                        s["started_at_iso"],
-                        s["sample_interval_ms"],
-                        first_sample if first_sample is not None else "—",
-                    ])
-                writer.writerow([])
-
-                # --- Sample Data ---
-                writer.writerow(["--- Sample Data ---"])
-                writer.writerow([
-                    "Timestamp", "Sample ID", "Session ID",
-                    "CPU %", "CPU MHz",
-                    "RAM %", "Swap %",
-                    "GPU Util %", "GPU Mem %", "GPU Mem Used (MB)",
-                    "GPU Temp (C)", "GPU Clock (MHz)", "GPU Power (W)", "GPU Power Limit (W)",
-                    "Disk Read (B/s)", "Disk Write (B/s)",
-                    "Disk Read Latency (ms)", "Disk Write Latency (ms)",
-                    "Disk Usage %",
-                ])
-
-                sample_rows = conn.execute("""
-                    SELECT
-                        s.ts_iso, s.sample_id, s.session_id,
-                        c.cpu_percent_total, c.freq_current_mhz,
-                        r.ram_usage_percent, r.swap_usage_percent,
-                        g.gpu_util_percent, g.gpu_mem_util_percent, g.gpu_mem_used_mb,
-                        g.gpu_temp_c, g.gpu_core_clock_mhz,
-                        g.gpu_power_usage_w, g.gpu_power_limit_w,
-                        d.read_speed_bytes, d.write_speed_bytes,
-                        d.avg_read_latency_ms, d.avg_write_latency_ms,
-                        MAX(dp.usage_percent) AS disk_usage_percent
-                    FROM sample s
-                    LEFT JOIN cpu_sample            c  ON c.sample_id  = s.sample_id
-                    LEFT JOIN ram_sample            r  ON r.sample_id  = s.sample_id
-                    LEFT JOIN gpu_sample            g  ON g.sample_id  = s.sample_id AND g.gpu_id = 0
-                    LEFT JOIN disk_io_sample        d  ON d.sample_id  = s.sample_id
-                    LEFT JOIN disk_partition_sample dp ON dp.sample_id = s.sample_id
-                    GROUP BY s.sample_id
-                    ORDER BY s.session_id, s.sample_id
-                """).fetchall()
-
-                def fmt(v):
-                    if v is None:
-                        return "N/A"
-                    return f"{v:.2f}" if isinstance(v, float) else v
-
-                for row in sample_rows:
-                    writer.writerow([
-                        row["ts_iso"], row["sample_id"], row["session_id"],
-                        fmt(row["cpu_percent_total"]), fmt(row["freq_current_mhz"]),
-                        fmt(row["ram_usage_percent"]), fmt(row["swap_usage_percent"]),
-                        fmt(row["gpu_util_percent"]), fmt(row["gpu_mem_util_percent"]),
-                        fmt(row["gpu_mem_used_mb"]),
-                        fmt(row["gpu_temp_c"]), fmt(row["gpu_core_clock_mhz"]),
-                        fmt(row["gpu_power_usage_w"]), fmt(row["gpu_power_limit_w"]),
-                        fmt(row["read_speed_bytes"]), fmt(row["write_speed_bytes"]),
-                        fmt(row["avg_read_latency_ms"]), fmt(row["avg_write_latency_ms"]),
-                        fmt(row["disk_usage_percent"]),
-                    ])
-
-            conn.close()
-            QMessageBox.information(self, "Export Complete",
-                                    f"Database exported successfully to:\n{filename}")
-        except Exception as e:
-            QMessageBox.critical(self, "Export Failed", f"Could not export database:\n{e}")
+        # Runs on its own thread so the window stays responsive on large databases
+        self._export_progress = QProgressDialog("Exporting telemetry…", "Cancel", 0, 100, self)
+        self._export_progress.setWindowTitle("Export DB")
+        self._export_progress.setMinimumDuration(300)
+        self._export_progress.setAutoClose(False)
+        self._export_progress.setAutoReset(False)
+
+        self._export_thread = ExportDbThread(filename, options.selected_columns(), options.start_ms(),
+                                             export_time, fmt, self, shards=self._shards)
+        self._export_thread.progress_signal.connect(self._on_export_progress)
+        self._export_thread.finished_signal.connect(self._on_export_finished)
+        self._export_progress.canceled.connect(self._export_thread.requestInterruption)
+        self.export_db_button.setEnabled(False)
+        self._export_thread.start()
+
+    def _on_export_progress(self, done, total):
+        self._export_progress.setValue(int(done * 100 / total) if total else 100)
+        self._export_progress.setLabelText(f"Exporting telemetry… {done:,} / {total:,} samples")
+
+    def _on_export_finished(self, status, message):
+        self._export_thread.wait()
+        self._export_thread = None
+        self._export_progress.close()
+        self.export_db_button.setEnabled(True)
+        if status == "done":
+            QMessageBox.information(self, "Export Complete", message)
+        elif status == "failed":
+            QMessageBox.critical(self, "Export Failed", message)
 
     # -----------------------------
     # Open settings
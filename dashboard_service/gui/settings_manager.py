@@ -13,7 +13,40 @@ import os
 # Default settings values
 DEFAULT_SETTINGS = {
     "graph_refresh_rate": 1000, # ms
-    "accent_colour": "#FF0000" # red
+    "accent_colour": "#FF0000", # red
+    # Telemetry retention (null = keep forever), see storage_service/storage/retention.py
+    # Raw and archived ticks are only deleted once raw_days is set
+    "storage_retention": {
+        "raw_days": None,
+        "rollup_1m_days": 90,
+        "rollup_1h_days": None,
+        "rollup_1d_days": None,
+        "max_db_mb": None,
+    },
+    # "day" or "week" stores telemetry as one file per period under telemetry_shards/
+    "storage_shard_period": None,
+    # Queue between collection and the SQLite writer, see storage_service/storage/writer.py
+    # overflow_policy: "block", "drop_oldest" or "coalesce"
+    "storage_writer": {
+        "max_queue": 300,
+        "overflow_policy": "drop_oldest",
+    },
+    # Write partition rows / GPU power limits only when they change, see
+    # storage_service/storage/change_encoding.py
+    "storage_change_only": False,
+    # SQLite tuning profile: null, "laptop", "server", "bulk_import" or "archive"
+    # (python -m storage_service.storage.tuning recommends one), see storage_service/storage/tuning.py
+    "storage_tuning_profile": None,
+    # Planner statistics refresh (ANALYZE sampling analysis_limit rows per index)
+    "storage_optimize": {
+        "interval_s": 21600,
+        "analysis_limit": 1000,
+    },
+    # Background WAL checkpoints (PASSIVE every interval, TRUNCATE above the cap)
+    "storage_checkpoint": {
+        "interval_s": 30,
+        "wal_cap_mb": 64,
+    },
 }
 
 # Path to settings file
@@ -0,0 +1,455 @@
+# storage_service/storage/archive.py
+# Author: Andrew Fox
+
+# Background archiver for closed sessions. Sessions are never written again once they
+# end, so their raw rows are converted into compressed chunks (sample_chunk /
+# metric_chunk, codecs in compression.py) and the raw rows are deleted.
+# read_session() returns the same columns whether a session is raw, archived or
+# half-way through archiving, as NumPy arrays.
+#
+# Archived metric names:
+#   base tick metrics         cpu_percent_total, ram_usage_percent, ...
+#   per GPU                   gpu<gpu_id>.<column>        e.g. gpu0.gpu_temp_c
+#   per partition             partition<partition_id>.<column>
+# Change-only sessions (change_encoding.py) are filled forward before chunking.
+# read_session() also adds the analytics view (GPU 0 columns under their plain names
+# and disk_usage_percent = fullest partition), matching queries.py.
+#
+# Time-range readers (export.py, StorageManager range/recent reads) merge the raw rows
+# with iter_ticks() / read_chunks() / recent_ticks(), which decode only the chunks
+# overlapping the range. Read both sides in one read transaction (or the raw side first,
+# dropping repeated sample ids), or a session archived in between is lost or doubled.
+#
+# Usage:
+#   from storage_service.storage.archive import SessionArchiver
+#   SessionArchiver("telemetry.db").start()          # background job
+#   cols = SessionArchiver.read_session(conn, session_id)
+#   for row in SessionArchiver.iter_ticks(conn, ["sample_id", "cpu_percent_total"], start_ms, end_ms): ...
+
+import datetime
+import heapq
+import threading
+import time
+
+import numpy as np
+
+from storage_service.storage.change_encoding import ChangeEncoder
+from storage_service.storage.compression import encode_ints, decode_ints, encode_floats, decode_floats
+from storage_service.storage.metrics import METRICS
+from storage_service.storage.query_cache import invalidate_query_cache
+from storage_service.storage.rollups import RollupManager
+from storage_service.storage.schema import init_db
+
+CHUNK_TICKS = 3600
+
+BASE_METRICS = [
+    "collect_duration_ms", "dropped_metrics",
+    "cpu_percent_total", "freq_current_mhz",
+    "used_ram_gb", "ram_usage_percent", "swap_usage_percent",
+    "read_speed_bytes", "write_speed_bytes", "avg_read_latency_ms", "avg_write_latency_ms",
+]
+
+GPU_COLUMNS = [
+    "gpu_util_percent", "gpu_mem_util_percent", "gpu_mem_used_mb",
+    "gpu_temp_c", "gpu_core_clock_mhz", "gpu_power_usage_w", "gpu_power_limit_w",
+]
+
+PARTITION_COLUMNS = ["total_gb", "used_gb", "usage_percent"]
+
+_BASE_SQL = """
+    SELECT s.sample_id, s.ts_unix_ms, s.collect_duration_ms, s.dropped_metrics,
+           c.cpu_percent_total, c.freq_current_mhz,
+           r.used_ram_gb, r.ram_usage_percent, r.swap_usage_percent,
+           d.read_speed_bytes, d.write_speed_bytes, d.avg_read_latency_ms, d.avg_write_latency_ms
+    FROM sample s
+    LEFT JOIN cpu_sample     c ON c.sample_id = s.sample_id
+    LEFT JOIN ram_sample     r ON r.sample_id = s.sample_id
+    LEFT JOIN disk_io_sample d ON d.sample_id = s.sample_id
+    WHERE s.session_id = ? AND s.sample_id > ? AND s.sample_id <= ?
+    ORDER BY s.sample_id
+"""
+
+
+class SessionArchiver:
+    # Background job plus static helpers to archive and read sessions.
+
+    def __init__(self, db_path="telemetry.db", interval_s=600, conn=None):
+        self.db_path = db_path
+        self.interval_s = interval_s
+        self._conn = conn
+        self._stop = threading.Event()
+        self._thread = None
+
+    # -----------------------------
+    # Background job
+    # -----------------------------
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="SessionArchiver", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _loop(self):
+        self._conn = init_db(self.db_path)
+        try:
+            while not self._stop.is_set():
+                try:
+                    self.run()
+                except Exception:
+                    METRICS.incr("archive.errors")
+                self._stop.wait(self.interval_s)
+        finally:
+            self._conn.close()
+            self._conn = None
+
+    def run(self):
+        """Archives every closed session that still has raw rows. Returns the session ids done."""
+        conn = self._conn if self._conn is not None else init_db(self.db_path)
+        done = []
+        try:
+            for session_id in self.closed_sessions(conn):
+                if self._stop.is_set():
+                    break
+                with METRICS.timer("archive.session_ms"):
+                    ticks = self.archive_session(conn, session_id)
+                METRICS.incr("archive.sessions")
+                METRICS.incr("archive.ticks", ticks)
+                done.append(session_id)
+        finally:
+            if conn is not self._conn:
+                conn.close()
+        return done
+
+    @staticmethod
+    def closed_sessions(conn):
+        # Closed = ended cleanly, or superseded by a newer session on the same host (crash).
+        # Sessions wait while backfill.py still has to read their raw rows
+        return [
+            row[0] for row in conn.execute(
+                """SELECT se.session_id FROM session se
+                   WHERE se.archived_at_unix_ms IS NULL
+                     AND (se.ended_at_unix_ms IS NOT NULL
+                          OR EXISTS (SELECT 1 FROM session nx
+                                     WHERE nx.host_uuid = se.host_uuid AND nx.session_id > se.session_id))
+                     AND NOT EXISTS (SELECT 1 FROM backfill_range)
+                     AND (EXISTS (SELECT 1 FROM session_summary ss WHERE ss.session_id = se.session_id)
+                          OR NOT EXISTS (SELECT 1 FROM sample s WHERE s.session_id = se.session_id))
+                   ORDER BY se.session_id"""
+            )
+        ]
+
+    # -----------------------------
+    # Archive
+    # -----------------------------
+    @staticmethod
+    def archive_session(conn, session_id, chunk_ticks=CHUNK_TICKS):
+        """
+        Moves a session's raw rows into compressed chunks, one committed transaction per chunk,
+        then stamps archived_at_unix_ms. Returns the number of ticks archived.
+        """
+        # Raw rows are about to go, so make sure the rollups already hold them
+        RollupManager.catch_up(conn)
+
+        archived = 0
+        lo = 0
+        while True:
+            hi = conn.execute(
+                """SELECT MAX(sample_id) FROM (
+                     SELECT sample_id FROM sample WHERE session_id = ? AND sample_id > ?
+                     ORDER BY sample_id LIMIT ?)""",
+                (session_id, lo, chunk_ticks),
+            ).fetchone()[0]
+            if hi is None:
+                break
+
+            cols = SessionArchiver._raw_columns(conn, session_id, lo, hi)
+            n = len(cols["sample_id"])
+            first_id = int(cols["sample_id"][0])
+            try:
+                conn.execute("BEGIN")
+                conn.execute(
+                    """INSERT INTO sample_chunk
+                         (session_id, first_sample_id, chunk_start_unix_ms, chunk_end_unix_ms,
+                          sample_count, ts_blob, sample_id_blob)
+                       VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                    (session_id, first_id, int(cols["ts_unix_ms"][0]), int(cols["ts_unix_ms"][-1]), n,
+                     encode_ints(cols["ts_unix_ms"]), encode_ints(cols["sample_id"])),
+                )
+                conn.executemany(
+                    """INSERT INTO metric_chunk (session_id, first_sample_id, metric, value_blob)
+                       VALUES (?, ?, ?, ?)""",
+                    [
+                        (session_id, first_id, name, encode_floats(values))
+                        for name, values in cols.items()
+                        if name not in ("sample_id", "ts_unix_ms")
+                    ],
+                )
+                # Change-only sessions: the raw rows left behind still need a keyframe
+                ChangeEncoder.anchor_after(conn, session_id, hi)
+                conn.execute(
+                    "DELETE FROM sample WHERE session_id = ? AND sample_id > ? AND sample_id <= ?",
+                    (session_id, lo, hi),
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            # Deletes don't move the sample watermark
+            invalidate_query_cache(conn)
+            archived += n
+            lo = hi
+
+        conn.execute(
+            "UPDATE session SET archived_at_unix_ms = ? WHERE session_id = ?",
+            (int(time.time() * 1000), session_id),
+        )
+        conn.commit()
+        return archived
+
+    @staticmethod
+    def _raw_columns(conn, session_id, lo_id=0, hi_id=2 ** 63 - 1):
+        """Raw rows of one session with lo_id < sample_id <= hi_id, pivoted into arrays."""
+        rows = conn.execute(_BASE_SQL, (session_id, lo_id, hi_id)).fetchall()
+        n = len(rows)
+        cols = {
+            "sample_id":  np.array([r[0] for r in rows], dtype=np.int64),
+            "ts_unix_ms": np.array([r[1] for r in rows], dtype=np.int64),
+        }
+        for j, name in enumerate(BASE_METRICS):
+            cols[name] = np.array([r[j + 2] for r in rows], dtype=np.float64)
+        if n == 0:
+            return cols
+
+        index = {sid: i for i, sid in enumerate(cols["sample_id"].tolist())}
+        per_device = [
+            ("gpu", GPU_COLUMNS,
+             f"""SELECT g.sample_id, g.gpu_id, {", ".join("g." + c for c in GPU_COLUMNS)}
+                 FROM gpu_sample g JOIN sample s ON s.sample_id = g.sample_id
+                 WHERE s.session_id = ? AND s.sample_id > ? AND s.sample_id <= ?"""),
+            ("partition", PARTITION_COLUMNS,
+             f"""SELECT p.sample_id, p.partition_id, {", ".join("p." + c for c in PARTITION_COLUMNS)}
+                 FROM disk_partition_sample p JOIN sample s ON s.sample_id = p.sample_id
+                 WHERE s.session_id = ? AND s.sample_id > ? AND s.sample_id <= ?"""),
+        ]
+        for prefix, columns, sql in per_device:
+            for sample_id, device, *values in conn.execute(sql, (session_id, lo_id, hi_id)):
+                i = index[sample_id]
+                for col, value in zip(columns, values):
+                    key = f"{prefix}{device}.{col}"
+                    if key not in cols:
+                        cols[key] = np.full(n, np.nan)
+                    cols[key][i] = np.nan if value is None else value
+        # Change-only sessions store slow fields on keyframe ticks only; chunks hold them dense
+        return ChangeEncoder.fill_forward(conn, session_id, cols)
+
+    # -----------------------------
+    # Read
+    # -----------------------------
+    @staticmethod
+    def read_session(conn, session_id):
+        """
+        Returns a dict of NumPy arrays for one session, oldest tick first: sample_id and
+        ts_unix_ms (int64) plus every metric (float64, NaN = missing). Archived chunks are
+        decoded and any raw rows not yet archived are appended.
+        """
+        parts = [
+            SessionArchiver._decode_chunk(conn, session_id, first_id, count)
+            for first_id, count in conn.execute(
+                """SELECT first_sample_id, sample_count FROM sample_chunk
+                   WHERE session_id = ? ORDER BY first_sample_id""",
+                (session_id,),
+            ).fetchall()
+        ]
+
+        raw = SessionArchiver._raw_columns(conn, session_id)
+        if len(raw["sample_id"]) or not parts:
+            parts.append(raw)
+
+        # Concatenate, filling metrics missing from a part (e.g. a GPU that appeared later) with NaN
+        names = []
+        for part in parts:
+            names.extend(k for k in part if k not in names)
+        out = {}
+        for name in names:
+            dtype = np.int64 if name in ("sample_id", "ts_unix_ms") else np.float64
+            out[name] = np.concatenate([
+                part[name] if name in part else np.full(len(part["sample_id"]), np.nan)
+                for part in parts
+            ]).astype(dtype, copy=False)
+
+        SessionArchiver._add_analytics_view(out)
+        return out
+
+    @staticmethod
+    def _decode_chunk(conn, session_id, first_id, count):
+        ts_blob, id_blob = conn.execute(
+            "SELECT ts_blob, sample_id_blob FROM sample_chunk WHERE session_id = ? AND first_sample_id = ?",
+            (session_id, first_id),
+        ).fetchone()
+        cols = {
+            "sample_id":  decode_ints(id_blob, count),
+            "ts_unix_ms": decode_ints(ts_blob, count),
+        }
+        for metric, blob in conn.execute(
+            "SELECT metric, value_blob FROM metric_chunk WHERE session_id = ? AND first_sample_id = ?",
+            (session_id, first_id),
+        ):
+            cols[metric] = decode_floats(blob, count)
+        return cols
+
+    @staticmethod
+    def _add_analytics_view(cols):
+        n = len(cols["sample_id"])
+        for col in GPU_COLUMNS:
+            cols[col] = cols.get(f"gpu0.{col}", np.full(n, np.nan))
+        usage = [v for k, v in cols.items() if k.startswith("partition") and k.endswith(".usage_percent")]
+        cols["disk_usage_percent"] = np.fmax.reduce(usage) if usage else np.full(n, np.nan)
+
+    # -----------------------------
+    # Time-range reads
+    # -----------------------------
+    @staticmethod
+    def chunks_overlapping(conn, start_ms=None, end_ms=None, session_id=None, order="chunk_start_unix_ms"):
+        """[(chunk_start_ms, chunk_end_ms, session_id, first_sample_id, sample_count)] overlapping [start_ms, end_ms)."""
+        clauses, params = [], []
+        if session_id is not None:
+            clauses.append("session_id = ?")
+            params.append(session_id)
+        if start_ms is not None:
+            clauses.append("chunk_end_unix_ms >= ?")
+            params.append(start_ms)
+        if end_ms is not None:
+            clauses.append("chunk_start_unix_ms < ?")
+            params.append(end_ms)
+        where = " WHERE " + " AND ".join(clauses) if clauses else ""
+        return [tuple(row) for row in conn.execute(
+            f"""SELECT chunk_start_unix_ms, chunk_end_unix_ms, session_id, first_sample_id, sample_count
+                FROM sample_chunk{where} ORDER BY {order}, session_id, first_sample_id""",
+            params,
+        )]
+
+    @staticmethod
+    def read_chunks(conn, start_ms=None, end_ms=None, session_id=None):
+        """
+        Yields the archived chunks overlapping [start_ms, end_ms) one at a time, oldest
+        first: read_session() columns plus session_id, trimmed to the range.
+        """
+        for chunk in SessionArchiver.chunks_overlapping(conn, start_ms, end_ms, session_id):
+            cols = SessionArchiver._chunk_columns(conn, chunk, start_ms, end_ms)
+            if len(cols["sample_id"]):
+                yield cols
+
+    @staticmethod
+    def count_ticks(conn, start_ms=None, end_ms=None):
+        """Archived ticks in [start_ms, end_ms); only chunks cut by the range are decoded."""
+        total = 0
+        for chunk_start, chunk_end, session_id, first_id, count in SessionArchiver.chunks_overlapping(
+            conn, start_ms, end_ms
+        ):
+            if (start_ms is None or chunk_start >= start_ms) and (end_ms is None or chunk_end < end_ms):
+                total += count
+                continue
+            ts_blob = conn.execute(
+                "SELECT ts_blob FROM sample_chunk WHERE session_id = ? AND first_sample_id = ?",
+                (session_id, first_id),
+            ).fetchone()[0]
+            total += int(SessionArchiver._in_range(decode_ints(ts_blob, count), start_ms, end_ms).sum())
+        return total
+
+    @staticmethod
+    def iter_ticks(conn, names, start_ms=None, end_ms=None, after=None):
+        """
+        Yields archived ticks in [start_ms, end_ms) as tuples of the named columns
+        (read_session() names, session_id or ts_iso; NaN becomes None), in
+        (ts_unix_ms, sample_id) order across sessions, like the raw range queries.
+        after=(ts_unix_ms, sample_id) skips ticks up to that keyset cursor. A chunk is
+        only decoded once the stream reaches its start, so memory stays at the chunks
+        that overlap in time.
+        """
+        chunks = SessionArchiver.chunks_overlapping(conn, start_ms, end_ms)
+        heap, opened = [], 0
+        while True:
+            # Any chunk not yet opened starts after every tick on the heap
+            while opened < len(chunks) and (not heap or chunks[opened][0] <= heap[0][0][0]):
+                cols = SessionArchiver._chunk_columns(conn, chunks[opened], start_ms, end_ms)
+                rows = SessionArchiver._rows(cols, names, after)
+                SessionArchiver._push_next(heap, rows)
+                opened += 1
+            if not heap:
+                return
+            _, row, rows = heapq.heappop(heap)
+            yield row
+            SessionArchiver._push_next(heap, rows)
+
+    @staticmethod
+    def recent_ticks(conn, n):
+        """
+        The n newest archived ticks across sessions, newest first, as dicts of every
+        archived column (read_session() names, session_id and ts_iso; NaN becomes None).
+        """
+        ticks = []
+        for chunk in SessionArchiver.chunks_overlapping(conn, order="chunk_end_unix_ms DESC"):
+            # Everything in this chunk is older than the n newest collected so far
+            if len(ticks) >= n and chunk[1] < ticks[n - 1][0][0]:
+                break
+            cols = SessionArchiver._chunk_columns(conn, chunk)
+            names = ["ts_iso"] + list(cols)
+            ticks += [(key, dict(zip(names, row))) for key, row in SessionArchiver._rows(cols, names)]
+            ticks.sort(key=lambda tick: tick[0], reverse=True)
+        return [tick for _, tick in ticks[:n]]
+
+    @staticmethod
+    def latest_chunk_end(conn):
+        """ts_unix_ms of the newest archived tick, or None when nothing is archived."""
+        return conn.execute("SELECT MAX(chunk_end_unix_ms) FROM sample_chunk").fetchone()[0]
+
+    @staticmethod
+    def _push_next(heap, rows):
+        tick = next(rows, None)
+        if tick is not None:
+            # Keys are unique (sample ids are), so the iterator itself is never compared
+            heapq.heappush(heap, (tick[0], tick[1], rows))
+
+    @staticmethod
+    def _chunk_columns(conn, chunk, start_ms=None, end_ms=None):
+        _, _, session_id, first_id, count = chunk
+        cols = SessionArchiver._decode_chunk(conn, session_id, first_id, count)
+        SessionArchiver._add_analytics_view(cols)
+        cols["session_id"] = np.full(count, session_id, dtype=np.int64)
+        if start_ms is not None or end_ms is not None:
+            keep = SessionArchiver._in_range(cols["ts_unix_ms"], start_ms, end_ms)
+            cols = {name: values[keep] for name, values in cols.items()}
+        return cols
+
+    @staticmethod
+    def _rows(cols, names, after=None):
+        """Iterator of ((ts_unix_ms, sample_id), row) over decoded columns, oldest first."""
+        keys = list(zip(cols["ts_unix_ms"].tolist(), cols["sample_id"].tolist()))
+        n = len(keys)
+        columns = []
+        for name in names:
+            if name == "ts_iso":
+                columns.append([datetime.datetime.fromtimestamp(ts / 1000).isoformat() for ts, _ in keys])
+            elif name not in cols:
+                columns.append([None] * n)
+            elif cols[name].dtype.kind == "i":
+                columns.append(cols[name].tolist())
+            else:
+                columns.append([None if v != v else v for v in cols[name].tolist()])
+        ticks = zip(keys, zip(*columns))
+        if after is not None:
+            ticks = ((key, row) for key, row in ticks if key > after)
+        return iter(ticks)
+
+    @staticmethod
+    def _in_range(ts, start_ms, end_ms):
+        keep = np.ones(len(ts), dtype=bool)
+        if start_ms is not None:
+            keep &= ts >= start_ms
+        if end_ms is not None:
+            keep &= ts < end_ms
+        return keep
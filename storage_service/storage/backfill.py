@@ -0,0 +1,185 @@
+# storage_service/storage/backfill.py
+# Author: Andrew Fox
+
+# Background back-fill of the derived tables StorageManager otherwise keeps up per tick:
+# session_summary, model_input, metric_sketch and zone_map. Files written without them
+# (older versions, bulk loads, a writer that crashed mid-minute) used to be caught up in
+# the StorageManager constructor, which took seconds on a large file and held up the
+# first tick. The constructor now only runs record() and this job builds the rest on its
+# own connection, one committed batch at a time, so the writer's ticks interleave:
+#   session_summary, model_input   sessions with raw ticks and no rows, one per commit
+#   metric_sketch, zone_map        the sample id ranges in backfill_range, batch_size
+#                                  ids per commit (progress is saved with each batch)
+# Rollups are still caught up in the constructor: the writer advances their watermark one
+# tick at a time, so they can't have a gap. The sketch and zone watermarks move on with
+# the live ticks, which is why record() notes their gaps in backfill_range first; the job
+# only ever fills those ranges, never "everything above the watermark", which would count
+# live ticks twice.
+#
+# Metrics (METRICS, backfill.*): runs / errors / batches counters, ms timing.
+#
+# Usage:
+#   from storage_service.storage.backfill import BackfillManager
+#   BackfillManager.record(conn)                     # writer, before its first tick
+#   job = BackfillManager("telemetry.db")
+#   job.start()                                      # background thread, runs once
+#   ...
+#   job.stop()
+#   BackfillManager.catch_up(conn)                   # record + fill on a connection with
+#                                                    # no other writer (merge.py)
+
+import threading
+
+from storage_service.storage.metrics import METRICS
+from storage_service.storage.model_input import ModelInput
+from storage_service.storage.schema import connect
+from storage_service.storage.session_summary import SessionSummary
+from storage_service.storage.sketches import SketchManager
+from storage_service.storage.zone_maps import ZoneMap
+
+# Smaller than the one-off CATCH_UP_BATCH: each batch holds the write lock the writer waits on
+BACKFILL_BATCH = 10_000
+
+_RANGES_SQL = """
+    SELECT after_sample_id, last_sample_id FROM backfill_range
+    WHERE structure = ? ORDER BY last_sample_id
+"""
+
+
+class BackfillManager:
+    # One-shot background job for one database, plus the static helpers it runs.
+
+    def __init__(self, db_path="telemetry.db", batch_size=BACKFILL_BATCH, conn=None, on_batch=None):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.on_batch = on_batch     # called after each commit, e.g. QueryCache.invalidate
+        self._conn = conn
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_stats = None
+
+    # -----------------------------
+    # Background job
+    # -----------------------------
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="BackfillManager", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops after the current batch; what is left stays recorded for the next start."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def wait(self, timeout=None):
+        """Waits for the job to finish. Returns True once it has."""
+        if self._thread is not None:
+            self._thread.join(timeout)
+            return not self._thread.is_alive()
+        return True
+
+    def _loop(self):
+        try:
+            self.run()
+        except Exception:
+            METRICS.incr("backfill.errors")
+
+    def run(self):
+        """Builds everything record() and the session checks find missing; returns fill()'s stats."""
+        conn = self._conn if self._conn is not None else connect(self.db_path)
+        try:
+            with METRICS.timer("backfill.ms"):
+                stats = self.fill(conn, self.batch_size, self._stop.is_set, self.on_batch)
+        finally:
+            if conn is not self._conn:
+                conn.close()
+        METRICS.incr("backfill.runs")
+        self.last_stats = stats
+        return stats
+
+    # -----------------------------
+    # Writer side
+    # -----------------------------
+    @staticmethod
+    def record(conn):
+        """
+        Notes the sample ids the sketch and zone rows don't cover yet in backfill_range and
+        moves the sketch watermark past them, so the writer's per-tick updates can carry on.
+        Commits. Returns the number of ranges recorded.
+        """
+        min_id, max_id = conn.execute("SELECT MIN(sample_id), MAX(sample_id) FROM sample").fetchone()
+        if max_id is None:
+            return 0
+        # Ids below the oldest raw tick are gone (retention, archiving) and need no pass
+        gaps = [
+            (structure, after, max_id)
+            for structure, after in (("metric_sketch", SketchManager.get_watermark(conn)),
+                                     ("zone_map", max(ZoneMap.get_watermark(conn), min_id - 1)))
+            if after < max_id
+        ]
+        conn.executemany(
+            "INSERT OR IGNORE INTO backfill_range (structure, after_sample_id, last_sample_id) VALUES (?, ?, ?)",
+            gaps,
+        )
+        SketchManager._set_watermark(conn, max_id)
+        conn.commit()
+        return len(gaps)
+
+    # -----------------------------
+    # Back-fill
+    # -----------------------------
+    @staticmethod
+    def catch_up(conn, batch_size=BACKFILL_BATCH):
+        """record() and fill() in one go, for a connection no other writer uses. Returns fill()'s stats."""
+        BackfillManager.record(conn)
+        return BackfillManager.fill(conn, batch_size)
+
+    @staticmethod
+    def fill(conn, batch_size=BACKFILL_BATCH, stop=None, on_batch=None):
+        """
+        Builds the missing session summaries and model inputs, then the recorded sketch
+        and zone ranges. stop() is checked between batches. Returns {"summaries",
+        "model_input" (sessions), "sketch_ticks", "zone_ticks"}.
+        """
+        stop = stop or (lambda: False)
+        on_batch = on_batch or (lambda: None)
+        stats = {"summaries": SessionSummary.catch_up(conn, stop), "model_input": ModelInput.catch_up(conn, stop)}
+        if stats["summaries"] or stats["model_input"]:
+            on_batch()
+        for key, structure, manager in (("sketch_ticks", "metric_sketch", SketchManager),
+                                        ("zone_ticks", "zone_map", ZoneMap)):
+            stats[key] = BackfillManager._fill_ranges(conn, structure, manager.apply_range, batch_size,
+                                                      stop, on_batch)
+        return stats
+
+    @staticmethod
+    def _fill_ranges(conn, structure, apply_range, batch_size, stop, on_batch):
+        # Each batch commits together with the range's progress, so a stop or crash resumes cleanly
+        ticks = 0
+        for after_id, last_id in conn.execute(_RANGES_SQL, (structure,)).fetchall():
+            while after_id < last_id:
+                if stop():
+                    return ticks
+                hi = min(after_id + batch_size, last_id)
+                try:
+                    conn.execute("BEGIN IMMEDIATE")
+                    ticks += apply_range(conn, after_id, hi)
+                    if hi < last_id:
+                        conn.execute(
+                            "UPDATE backfill_range SET after_sample_id = ? WHERE structure = ? AND last_sample_id = ?",
+                            (hi, structure, last_id),
+                        )
+                    else:
+                        conn.execute(
+                            "DELETE FROM backfill_range WHERE structure = ? AND last_sample_id = ?",
+                            (structure, last_id),
+                        )
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+                METRICS.incr("backfill.batches")
+                after_id = hi
+                on_batch()
+        return ticks
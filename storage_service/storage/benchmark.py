@@ -0,0 +1,264 @@
+# storage_service/storage/benchmark.py
+# Author: Andrew Fox
+
+# Storage benchmark suite. For each scale it builds a synthetic telemetry.db of that
+# many 1 Hz ticks (one GPU, two partitions, ending "now"), then measures:
+#   insert   StorageManager.insert_sample() throughput on top of the existing data
+#   reads    median latency of the recent-window queries, the hot tier, 1 h / 1 day
+#            time-range reads through the columnar API, and keyset range pages at
+#            both ends of the table
+#   export   CSV and .npz export throughput for the last day
+#   size     file bytes, bytes per tick and bytes per day of 1 Hz data
+# Results are written as JSON so schema and index changes can be compared run to run.
+#
+# build_db() uses recursive CTEs (no Python per row); 100M ticks needs roughly 10 GB of
+# disk and a long coffee, so pick scales with --scales.
+#
+# CLI:
+#   python -m storage_service.storage.benchmark --scales 1000000 10000000 --out bench.json
+
+import datetime
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from storage_service.storage.columnar import fetch_columns
+from storage_service.storage.export import export_columnar, export_csv
+from storage_service.storage.hot_tier import HotTier
+from storage_service.storage.model_input import ModelInput
+from storage_service.storage.queries import (
+    COLUMNAR_NAMES, RANGE_COLUMNS_SQL, RANGE_PAGE_SQL, RECENT_ALL_SQL, RECENT_COLUMNS_SQL, RECENT_SESSION_SQL,
+)
+from storage_service.storage.rollups import RollupManager
+from storage_service.storage.schema import init_db
+from storage_service.storage.session_summary import SessionSummary
+from storage_service.storage.sketches import SketchManager
+from storage_service.storage.zone_maps import ZoneMap
+
+DEFAULT_SCALES = (1_000_000, 10_000_000, 100_000_000)
+DAY_TICKS = 86_400
+HOUR_TICKS = 3_600
+
+CPU_DATA = {"cpu_percent_total": 25.0, "freq_current_mhz": 2800.0}
+RAM_DATA = {"used_ram_gb": 8.0, "ram_usage_percent": 50.0, "swap_usage_percent": 5.0}
+DISK_DATA = {
+    "read_speed_bytes": 1000.0, "write_speed_bytes": 500.0,
+    "avg_read_latency_ms": 1.0, "avg_write_latency_ms": 2.0,
+    "disks": [
+        {"device": "dev0", "mountpoint": "mnt0", "fstype": "NTFS",
+         "total_gb": 500.0, "used_gb": 200.0, "usage_percent": 40.0},
+    ],
+}
+
+
+# -----------------------------
+# Synthetic database
+# -----------------------------
+def build_db(path, n_ticks, n_partitions=2, end_ms=0, profile=None):
+    """
+    Fill a fresh DB with n_ticks ticks (one GPU, n_partitions mounts) using recursive CTEs.
+    Tick i is at end_ms - (n_ticks - i) * 1000. Values vary per tick, since SQLite stores
+    whole-number REALs as small integers and constants would understate the file size.
+    Like synthetic.py, the rollup and sketch watermarks are set past the data and the
+    session summary, model inputs and zone maps are built, so a StorageManager opened on
+    the file has nothing to catch up or back-fill while it is measured.
+    profile is a tuning.py profile for the new file.
+    """
+    conn = init_db(path, profile=profile)
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("INSERT INTO host (host_uuid, hostname, created_at_iso) VALUES ('h', 'bench', '')")
+    conn.execute("INSERT INTO session (session_id, host_uuid, started_at_iso, started_at_unix_ms) VALUES (1, 'h', '', 0)")
+    conn.execute("INSERT INTO gpu_device (gpu_uuid, host_uuid, first_seen_iso) VALUES ('gpu-0', 'h', '')")
+    for p in range(n_partitions):
+        conn.execute(
+            "INSERT INTO disk_partition (partition_id, host_uuid, device, mountpoint, first_seen_iso) VALUES (?, 'h', ?, ?, '')",
+            (p + 1, f"dev{p}", f"mnt{p}"),
+        )
+    start_ms = end_ms - n_ticks * 1000
+    seq = "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?) "
+    conn.execute(seq + "INSERT INTO sample (sample_id, session_id, ts_iso, ts_unix_ms) SELECT i, 1, '', ? + i * 1000 FROM n",
+                 (n_ticks, start_ms))
+    conn.execute(seq + "INSERT INTO cpu_sample SELECT i, (i * 37 % 10000) / 100.0, 2800 + i % 7 * 0.5 FROM n", (n_ticks,))
+    conn.execute(seq + "INSERT INTO ram_sample SELECT i, 8 + i % 13 * 0.01, 50 + i % 11 * 0.1, 5.5 FROM n", (n_ticks,))
+    conn.execute(seq + "INSERT INTO disk_io_sample SELECT i, i % 977 * 1024.5, i % 499 * 512.5, 1.5, 1.25 FROM n", (n_ticks,))
+    conn.execute(seq + "INSERT INTO gpu_sample SELECT i, 'gpu-0', 0, i % 100 * 0.5, 20.5, 100, 55.5 + i % 9, 300, 8.5, 150 FROM n",
+                 (n_ticks,))
+    for p in range(n_partitions):
+        conn.execute(seq + "INSERT INTO disk_partition_sample SELECT i, ?, 500, 200.5, 40.1 FROM n", (n_ticks, p + 1))
+    RollupManager._set_watermark(conn, n_ticks)
+    SketchManager._set_watermark(conn, n_ticks)
+    conn.commit()
+    SessionSummary.catch_up(conn)
+    ModelInput.catch_up(conn)
+    ZoneMap.catch_up(conn)
+    return conn
+
+
+# -----------------------------
+# Measurements
+# -----------------------------
+def median_ms(fn, repeats=50):
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(times)
+
+
+def bench_reads(conn, end_ms, repeats=50):
+    hour = (end_ms - HOUR_TICKS * 1000, end_ms + 1)
+    day = (end_ms - DAY_TICKS * 1000, end_ms + 1)
+    tier = HotTier()
+    tier.load(conn, 1)
+    first_ts, last_ts = conn.execute("SELECT MIN(ts_unix_ms), MAX(ts_unix_ms) FROM sample").fetchone()
+    return {
+        "recent_session_10_ms":    median_ms(lambda: conn.execute(RECENT_SESSION_SQL, (1, 10)).fetchall(), repeats),
+        "recent_session_1000_ms":  median_ms(lambda: conn.execute(RECENT_SESSION_SQL, (1, 1000)).fetchall(), repeats),
+        "recent_all_10_ms":        median_ms(lambda: conn.execute(RECENT_ALL_SQL, (10,)).fetchall(), repeats),
+        "recent_columns_1000_ms":  median_ms(
+            lambda: fetch_columns(conn, RECENT_COLUMNS_SQL, (1, 1000), COLUMNAR_NAMES), repeats),
+        "hot_tier_1000_ms":        median_ms(lambda: tier.recent(1000, 1), repeats),
+        "range_1h_columns_ms":     median_ms(
+            lambda: fetch_columns(conn, RANGE_COLUMNS_SQL, hour, COLUMNAR_NAMES), max(repeats // 5, 1)),
+        "range_1d_columns_ms":     median_ms(
+            lambda: fetch_columns(conn, RANGE_COLUMNS_SQL, day, COLUMNAR_NAMES), max(repeats // 10, 1)),
+        # Keyset pages should cost the same at either end of the table
+        "range_page_first_ms":     median_ms(
+            lambda: conn.execute(RANGE_PAGE_SQL, (first_ts, 0, end_ms + 1, 1000)).fetchall(), repeats),
+        "range_page_last_ms":      median_ms(
+            lambda: conn.execute(RANGE_PAGE_SQL, (last_ts - 1_000_000, 0, end_ms + 1, 1000)).fetchall(), repeats),
+    }
+
+
+def bench_export(conn, end_ms, work_dir):
+    start_ms = end_ms - DAY_TICKS * 1000
+    results = {}
+    for fmt in ("csv", "npz"):
+        out = Path(work_dir) / f"export.{fmt}"
+        t0 = time.perf_counter()
+        if fmt == "csv":
+            rows = export_csv(conn, out, start_ms=start_ms)
+            size = out.stat().st_size
+        else:
+            rows = export_columnar(conn, out, fmt="npz", start_ms=start_ms)
+            size = sum(p.stat().st_size for p in out.rglob("*") if p.is_file())
+        elapsed = time.perf_counter() - t0
+        results[fmt] = {"rows": rows, "seconds": elapsed, "rows_per_s": rows / elapsed if elapsed else None,
+                        "bytes": size}
+        shutil.rmtree(out) if out.is_dir() else out.unlink()
+    return results
+
+
+def bench_insert(db_path, n_inserts, profile=None):
+    # Imported here: StorageManager pulls in the system info collector
+    from storage_service.storage.main import StorageManager
+
+    storage = StorageManager(db_path=str(db_path), hot_tier=HotTier(), profile=profile)
+    try:
+        times = []
+        t0 = time.perf_counter()
+        for i in range(n_inserts):
+            t1 = time.perf_counter()
+            storage.insert_sample({**CPU_DATA, "cpu_percent_total": float(i % 100)}, RAM_DATA, None, DISK_DATA)
+            times.append((time.perf_counter() - t1) * 1000)
+        elapsed = time.perf_counter() - t0
+    finally:
+        storage.close()
+    times.sort()
+    return {
+        "ticks":       n_inserts,
+        "ticks_per_s": n_inserts / elapsed if elapsed else None,
+        "p50_ms":      times[len(times) // 2],
+        "p99_ms":      times[int(len(times) * 0.99) - 1] if len(times) >= 100 else times[-1],
+        "max_ms":      times[-1],
+    }
+
+
+def run_scale(n_ticks, work_dir, n_inserts=2000, repeats=50):
+    """Builds one DB of n_ticks ticks in work_dir and returns its results dict."""
+    db_path = Path(work_dir) / f"bench_{n_ticks}.db"
+    end_ms = int(time.time() * 1000)
+
+    t0 = time.perf_counter()
+    conn = build_db(db_path, n_ticks, end_ms=end_ms)
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    build_s = time.perf_counter() - t0
+    db_bytes = os.path.getsize(db_path)
+
+    try:
+        reads = bench_reads(conn, end_ms, repeats)
+        export = bench_export(conn, end_ms, work_dir)
+    finally:
+        conn.close()
+    insert = bench_insert(db_path, n_inserts)
+
+    result = {
+        "ticks":          n_ticks,
+        "build_s":        build_s,
+        "db_bytes":       db_bytes,
+        "bytes_per_tick": db_bytes / n_ticks,
+        "bytes_per_day":  db_bytes / n_ticks * DAY_TICKS,
+        "insert":         insert,
+        "reads":          reads,
+        "export":         export,
+    }
+    for suffix in ("", "-wal", "-shm"):
+        try:
+            os.remove(f"{db_path}{suffix}")
+        except OSError:
+            pass
+    return result
+
+
+def run(scales=DEFAULT_SCALES, work_dir=None, n_inserts=2000, repeats=50, progress=None):
+    """Runs every scale and returns the full results document."""
+    own_dir = work_dir is None
+    work_dir = tempfile.mkdtemp(prefix="telemetry_bench_") if own_dir else work_dir
+    try:
+        results = []
+        for n_ticks in scales:
+            if progress is not None:
+                progress(f"Building and measuring {n_ticks:,} ticks")
+            results.append(run_scale(n_ticks, work_dir, n_inserts, repeats))
+    finally:
+        if own_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return {
+        "generated_at":   datetime.datetime.now().isoformat(),
+        "python":         sys.version.split()[0],
+        "sqlite_version": sqlite3.sqlite_version,
+        "platform":       platform.platform(),
+        "scales":         results,
+    }
+
+
+# -----------------------------
+# CLI
+# -----------------------------
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark telemetry storage at several scales")
+    parser.add_argument("--scales", type=int, nargs="+", default=list(DEFAULT_SCALES))
+    parser.add_argument("--out", default="storage_benchmark.json")
+    parser.add_argument("--work-dir", default=None, help="where the temporary DBs go (default: system temp)")
+    parser.add_argument("--inserts", type=int, default=2000)
+    parser.add_argument("--repeats", type=int, default=50)
+    args = parser.parse_args(argv)
+
+    results = run(args.scales, args.work_dir, args.inserts, args.repeats, progress=print)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
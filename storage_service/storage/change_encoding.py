@@ -0,0 +1,198 @@
+# storage_service/storage/change_encoding.py
+# Author: Andrew Fox
+
+# Change-only encoding for slow-moving device fields. Partition total/used/percent and
+# GPU power limits barely move, yet a dense writer stores them on every tick. With
+# StorageManager(change_only=True) the writer keeps the values it last wrote and only
+# writes again when one moves beyond its tolerance (or a partition/GPU appears or goes):
+#   - partitions: a keyframe tick writes a row for every partition; other ticks write none
+#   - GPUs: gpu_sample rows are still written every tick, but gpu_power_limit_w is NULL
+#     except on keyframe ticks
+# Each keyframe is recorded in change_keyframe, so readers find the last one at or before
+# any tick with one seek (queries.py, the *_locf views in schema.py) and fill_forward()
+# does the same for NumPy arrays. Values read back can lag the collected ones by up to
+# the tolerance; rollups, summaries and the hot tier still see the collected values.
+#
+# Deleting ticks (retention, archive) must not take a session's base keyframe with it,
+# so both call anchor_after() first to turn the next surviving tick into a keyframe.
+#
+# Usage:
+#   storage = StorageManager("telemetry.db", change_only=True)
+#   cols = ChangeEncoder.fill_forward(conn, session_id, cols)    # NumPy LOCF
+
+import numpy as np
+
+PARTITION_FIELDS = ("total_gb", "used_gb", "usage_percent")
+
+# Field -> largest change that is not written
+DEFAULT_TOLERANCES = {
+    "total_gb":          0.01,
+    "used_gb":           0.05,
+    "usage_percent":     0.05,
+    "gpu_power_limit_w": 0.5,
+}
+
+
+class ChangeEncoder:
+    # Writer-side state: the partition values and GPU power limits of the last keyframe.
+    # Decisions are staged until commit() so a rolled-back tick doesn't count as written.
+
+    def __init__(self, tolerances=None):
+        self.tolerances = {**DEFAULT_TOLERANCES, **(tolerances or {})}
+        self._last = {}
+        self._pending = {}
+
+    def reset(self):
+        """Forgets what was written (new session or new shard file): the next tick is a keyframe."""
+        self._last = {}
+        self._pending = {}
+
+    # -----------------------------
+    # Write decisions
+    # -----------------------------
+    def partition_keyframe(self, values):
+        """values: {partition_id: (total_gb, used_gb, usage_percent)}. True if this tick must write them."""
+        return self._keyframe("partition", values, PARTITION_FIELDS)
+
+    def gpu_keyframe(self, limits):
+        """limits: {gpu_uuid: gpu_power_limit_w}. True if this tick must write them."""
+        return self._keyframe("gpu", {k: (v,) for k, v in limits.items()}, ("gpu_power_limit_w",))
+
+    def commit(self):
+        self._last.update(self._pending)
+        self._pending = {}
+
+    def rollback(self):
+        self._pending = {}
+
+    def _keyframe(self, kind, values, fields):
+        if not values:
+            return False
+        last = self._last.get(kind)
+        changed = last is None or last.keys() != values.keys() or any(
+            abs(new - old) > self.tolerances[field]
+            for key, row in values.items()
+            for field, new, old in zip(fields, row, last[key])
+        )
+        if changed:
+            self._pending[kind] = values
+        return changed
+
+    # -----------------------------
+    # SQL helpers
+    # -----------------------------
+    @staticmethod
+    def mark(conn, session_id, sample_id, kind):
+        conn.execute(
+            "INSERT OR IGNORE INTO change_keyframe (session_id, kind, sample_id) VALUES (?, ?, ?)",
+            (session_id, kind, sample_id),
+        )
+
+    @staticmethod
+    def session_kinds(conn, session_id):
+        """Keyframe kinds a session uses; empty for densely stored sessions."""
+        return {row[0] for row in conn.execute(
+            "SELECT kind FROM change_keyframe WHERE session_id = ? GROUP BY kind", (session_id,)
+        )}
+
+    @staticmethod
+    def gpu_limit_nullable(conn):
+        # Files created before change-only encoding declare the column NOT NULL
+        for row in conn.execute("PRAGMA table_info(gpu_sample)"):
+            if row[1] == "gpu_power_limit_w":
+                return not row[3]
+        return False
+
+    @staticmethod
+    def anchor_after(conn, session_id, sample_id):
+        """
+        Makes the session's first tick after sample_id a keyframe holding its carried-forward
+        values, so ticks up to sample_id can be deleted. Caller commits (with the delete).
+        """
+        kinds = ChangeEncoder.session_kinds(conn, session_id)
+        if not kinds:
+            return
+        row = conn.execute(
+            "SELECT sample_id FROM sample WHERE sample_id > ? AND session_id = ? ORDER BY sample_id LIMIT 1",
+            (sample_id, session_id),
+        ).fetchone()
+        if row is None:
+            return
+        tick = row[0]
+        if "partition" in kinds:
+            conn.execute(
+                """INSERT OR IGNORE INTO disk_partition_sample
+                     (sample_id, partition_id, total_gb, used_gb, usage_percent)
+                   SELECT sample_id, partition_id, total_gb, used_gb, usage_percent
+                   FROM disk_partition_sample_locf WHERE sample_id = ?""",
+                (tick,),
+            )
+            ChangeEncoder.mark(conn, session_id, tick, "partition")
+        if "gpu" in kinds:
+            conn.execute(
+                """UPDATE gpu_sample SET gpu_power_limit_w = (
+                     SELECT l.gpu_power_limit_w FROM gpu_sample_locf l
+                     WHERE l.sample_id = gpu_sample.sample_id AND l.gpu_uuid = gpu_sample.gpu_uuid)
+                   WHERE sample_id = ? AND gpu_power_limit_w IS NULL""",
+                (tick,),
+            )
+            ChangeEncoder.mark(conn, session_id, tick, "gpu")
+
+    # -----------------------------
+    # NumPy read path
+    # -----------------------------
+    @staticmethod
+    def fill_forward(conn, session_id, cols):
+        """
+        Carries keyframe values forward in pivoted arrays (archive.py layout:
+        partition<id>.<field>, gpu<id>.<column>), in place. The first tick is seeded from
+        the *_locf views since its keyframe may lie before the arrays. Returns cols.
+        """
+        n = len(cols["sample_id"])
+        kinds = ChangeEncoder.session_kinds(conn, session_id) if n else set()
+        if not kinds:
+            return cols
+        first_id = int(cols["sample_id"][0])
+
+        if "partition" in kinds:
+            names = [k for k in cols if k.startswith("partition")]
+            if not any(not np.isnan(cols[k][0]) for k in names):
+                for partition_id, *values in conn.execute(
+                    """SELECT partition_id, total_gb, used_gb, usage_percent
+                       FROM disk_partition_sample_locf WHERE sample_id = ?""",
+                    (first_id,),
+                ):
+                    for field, value in zip(PARTITION_FIELDS, values):
+                        key = f"partition{partition_id}.{field}"
+                        if key not in cols:
+                            cols[key] = np.full(n, np.nan)
+                            names.append(key)
+                        cols[key][0] = value
+            # Keyframe rows write every partition, so a tick with none is a carried tick
+            written = np.zeros(n, dtype=bool)
+            for k in names:
+                written |= ~np.isnan(cols[k])
+            src = _last_index(written)
+            for k in names:
+                cols[k] = np.where(src >= 0, cols[k][np.maximum(src, 0)], np.nan)
+
+        if "gpu" in kinds:
+            seed = dict(conn.execute(
+                "SELECT gpu_id, gpu_power_limit_w FROM gpu_sample_locf WHERE sample_id = ?", (first_id,)
+            ).fetchall())
+            for key in [k for k in cols if k.startswith("gpu") and k.endswith(".gpu_power_limit_w")]:
+                prefix = key[:-len(".gpu_power_limit_w")]
+                limit = cols[key]
+                if np.isnan(limit[0]) and seed.get(int(prefix[3:])) is not None:
+                    limit[0] = seed[int(prefix[3:])]
+                present = ~np.isnan(cols[f"{prefix}.gpu_util_percent"])
+                src = _last_index(~np.isnan(limit))
+                carried = present & np.isnan(limit) & (src >= 0)
+                limit[carried] = limit[src[carried]]
+        return cols
+
+
+def _last_index(mask):
+    # For each position, the index of the last True at or before it (-1 if none)
+    idx = np.where(mask, np.arange(len(mask)), -1)
+    return np.maximum.accumulate(idx) if len(idx) else idx
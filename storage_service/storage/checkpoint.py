@@ -0,0 +1,141 @@
+# storage_service/storage/checkpoint.py
+# Author: Andrew Fox
+
+# Background WAL checkpointing for telemetry.db.
+# SQLite's autocheckpoint runs on the writer's own commit once the WAL passes 1000 pages,
+# so the writer pays for it, and a long reader (export, training data collection) can
+# keep it from ever catching up while the -wal file grows. This job takes that work
+# onto its own thread and connection:
+#   PASSIVE   on every tick of the timer; copies what it can without waiting on anyone
+#   RESTART   after escalate_after PASSIVE runs in a row that left frames behind
+#   TRUNCATE  when the -wal file is over wal_cap_mb; resets the log and shrinks the file
+# RESTART and TRUNCATE wait for readers for at most busy_timeout_ms, then report busy
+# and are retried on the next run. Run the writer with autocheckpoint=False
+# (StorageManager) so only this job checkpoints.
+#
+# Metrics (METRICS, checkpoint.*): wal_bytes / backlog_frames gauges, ms and <mode>_ms
+# timings, and runs / passive / restart / truncate / busy / frames / errors counters.
+#
+# Usage:
+#   from storage_service.storage.checkpoint import CheckpointManager
+#   job = CheckpointManager("telemetry.db", {"wal_cap_mb": 64})
+#   job.start()          # background thread, runs every interval_s
+#   ...
+#   job.stop()
+
+import os
+import threading
+import time
+
+from storage_service.storage.metrics import METRICS
+from storage_service.storage.schema import connect
+
+DEFAULT_POLICY = {
+    "interval_s":      30,
+    "wal_cap_mb":      64,     # above this the WAL is truncated
+    "escalate_after":  10,     # lagging PASSIVE runs in a row before a RESTART
+    "busy_timeout_ms": 1000,   # how long RESTART / TRUNCATE wait for readers
+}
+
+
+class CheckpointManager:
+    # Checkpoints one WAL database, either on demand or on a timer.
+
+    def __init__(self, db_path="telemetry.db", policy=None, conn=None):
+        self.db_path = db_path
+        self.policy = {**DEFAULT_POLICY, **(policy or {})}
+        self._conn = conn
+        self._stop = threading.Event()
+        self._thread = None
+        self._lagging = 0
+        self.last_stats = None
+
+    # -----------------------------
+    # Background job
+    # -----------------------------
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="CheckpointManager", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _loop(self):
+        self._conn = self._open()
+        try:
+            while not self._stop.wait(self.policy["interval_s"]):
+                try:
+                    self.run()
+                except Exception:
+                    METRICS.incr("checkpoint.errors")
+        finally:
+            self._conn.close()
+            self._conn = None
+
+    def _open(self):
+        conn = connect(self.db_path)
+        conn.execute(f"PRAGMA busy_timeout = {int(self.policy['busy_timeout_ms'])};")
+        return conn
+
+    # -----------------------------
+    # One checkpoint
+    # -----------------------------
+    def wal_size_bytes(self):
+        try:
+            return os.path.getsize(f"{self.db_path}-wal")
+        except OSError:
+            return 0
+
+    def choose_mode(self, wal_bytes):
+        if wal_bytes > self.policy["wal_cap_mb"] * 1024 * 1024:
+            return "TRUNCATE"
+        if self._lagging >= self.policy["escalate_after"]:
+            return "RESTART"
+        return "PASSIVE"
+
+    def run(self, mode=None):
+        """Runs one checkpoint (mode picked by choose_mode() unless given) and returns a stats dict."""
+        conn = self._conn if self._conn is not None else self._open()
+        try:
+            wal_before = self.wal_size_bytes()
+            mode = mode or self.choose_mode(wal_before)
+            t0 = time.perf_counter()
+            busy, log_frames, checkpointed = conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+            elapsed_ms = (time.perf_counter() - t0) * 1000
+        finally:
+            if conn is not self._conn:
+                conn.close()
+
+        # log_frames is -1 when the database is not in WAL mode
+        backlog = max(log_frames - checkpointed, 0)
+        if busy or backlog:
+            self._lagging += 1
+        else:
+            self._lagging = 0
+
+        stats = {
+            "mode":                mode,
+            "busy":                bool(busy),
+            "log_frames":          log_frames,
+            "checkpointed_frames": checkpointed,
+            "backlog_frames":      backlog,
+            "wal_bytes_before":    wal_before,
+            "wal_bytes":           self.wal_size_bytes(),
+            "elapsed_ms":          elapsed_ms,
+        }
+
+        METRICS.incr("checkpoint.runs")
+        METRICS.incr(f"checkpoint.{mode.lower()}")
+        METRICS.incr("checkpoint.frames", max(checkpointed, 0))
+        if busy:
+            METRICS.incr("checkpoint.busy")
+        METRICS.set_gauge("checkpoint.wal_bytes", stats["wal_bytes"])
+        METRICS.set_gauge("checkpoint.backlog_frames", backlog)
+        METRICS.observe("checkpoint.ms", elapsed_ms)
+        METRICS.observe(f"checkpoint.{mode.lower()}_ms", elapsed_ms)
+
+        self.last_stats = stats
+        return stats
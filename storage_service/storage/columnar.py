@@ -0,0 +1,100 @@
+# storage_service/storage/columnar.py
+# Author: Andrew Fox
+
+# Column-oriented reads: run a query and return {column: np.ndarray} instead of a list
+# of dicts. Rows are pulled from the cursor with fetchmany() and copied straight into a
+# preallocated 2-D float64 buffer (NULL -> NaN), so no per-row dict or Row object is
+# built. Integer id/timestamp columns are cast back to int64 at the end (exact, since
+# they fit in float64's 53-bit mantissa).
+#
+# Usage:
+#   from storage_service.storage.columnar import fetch_columns
+#   cols = fetch_columns(conn, SESSION_COLUMNS_SQL, (session_id,), COLUMNAR_NAMES)
+#   cols["cpu_percent_total"]   # np.float64 array, NaN where missing
+
+import numpy as np
+
+CHUNK_ROWS = 4096
+
+INT_COLUMNS = ("sample_id", "ts_unix_ms", "session_id")
+
+
+def fetch_columns(conn, sql, params, names, size_hint=None, chunk_rows=CHUNK_ROWS):
+    """
+    Runs sql and returns a dict of 1-D arrays keyed by names (one per selected column).
+    size_hint preallocates the buffer (e.g. a COUNT or LIMIT); it grows if exceeded.
+    """
+    cur = conn.cursor()
+    cur.row_factory = None   # plain tuples
+    cur.execute(sql, params)
+
+    capacity = max(size_hint or chunk_rows, 1)
+    buf = np.empty((capacity, len(names)), dtype=np.float64)
+    n = 0
+    while True:
+        rows = cur.fetchmany(chunk_rows)
+        if not rows:
+            break
+        if n + len(rows) > capacity:
+            capacity = max(capacity * 2, n + len(rows))
+            grown = np.empty((capacity, len(names)), dtype=np.float64)
+            grown[:n] = buf[:n]
+            buf = grown
+        buf[n:n + len(rows)] = rows
+        n += len(rows)
+    cur.close()
+
+    return _split(buf[:n], names)
+
+
+def iter_column_blocks(conn, sql, params, names, block_rows, chunk_rows=CHUNK_ROWS):
+    """
+    Like fetch_columns() but yields dicts of at most block_rows rows, reusing one
+    preallocated buffer, so memory stays bounded however many rows the query returns.
+    """
+    cur = conn.cursor()
+    cur.row_factory = None
+    cur.execute(sql, params)
+
+    buf = np.empty((block_rows, len(names)), dtype=np.float64)
+    n = 0
+    try:
+        while True:
+            rows = cur.fetchmany(min(chunk_rows, block_rows - n))
+            if rows:
+                buf[n:n + len(rows)] = rows
+                n += len(rows)
+            if n and (n == block_rows or not rows):
+                yield _split(buf[:n], names)
+                n = 0
+            if not rows:
+                break
+    finally:
+        cur.close()
+
+
+def _split(block, names):
+    return {
+        name: block[:, j].astype(np.int64) if name in INT_COLUMNS else block[:, j].copy()
+        for j, name in enumerate(names)
+    }
+
+
+def reverse_columns(columns):
+    """Flips newest-first columns (e.g. from a DESC ... LIMIT query) to oldest first."""
+    return {name: values[::-1].copy() for name, values in columns.items()}
+
+
+def merge_columns(parts, names):
+    """
+    Concatenates dicts of columns (e.g. raw and archived ticks) into one, oldest first by
+    (ts_unix_ms, sample_id). Names missing from a part are NaN.
+    """
+    cols = {
+        name: np.concatenate([
+            part[name] if name in part else np.full(len(part["sample_id"]), np.nan) for part in parts
+        ]).astype(np.int64 if name in INT_COLUMNS else np.float64, copy=False)
+        for name in names
+    }
+    order = np.lexsort((cols["sample_id"], cols["ts_unix_ms"]))
+    return {name: values[order] for name, values in cols.items()}
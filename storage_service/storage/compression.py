@@ -0,0 +1,177 @@
+# storage_service/storage/compression.py
+# Author: Andrew Fox
+
+# Gorilla-style codecs for archived telemetry (see archive.py).
+#   - Integer series (timestamps, sample ids) use delta-of-delta encoding: a steady
+#     1 Hz series costs one bit per tick, small jitter 9-16 bits.
+#   - Float series XOR each value with the previous one and store only the
+#     meaningful bits, reusing the previous leading/trailing-zero window when it fits.
+#     Missing values are stored as NaN, so no separate null bitmap is needed.
+# Decoders return NumPy arrays.
+#
+# Usage:
+#   blob = encode_floats(values)             # list or array of float64 (NaN = missing)
+#   arr  = decode_floats(blob, len(values))  # np.float64 array
+
+import numpy as np
+
+# Delta-of-delta buckets: (prefix bits, prefix length, value bits)
+_DOD_BUCKETS = [
+    (0b10,   2, 7),
+    (0b110,  3, 9),
+    (0b1110, 4, 12),
+]
+
+
+class _BitWriter:
+    # Appends variable-width fields MSB-first into a bytearray.
+
+    def __init__(self):
+        self._buf = bytearray()
+        self._acc = 0
+        self._n = 0
+
+    def write(self, value, nbits):
+        self._acc = (self._acc << nbits) | (value & ((1 << nbits) - 1))
+        self._n += nbits
+        while self._n >= 8:
+            self._n -= 8
+            self._buf.append((self._acc >> self._n) & 0xFF)
+        self._acc &= (1 << self._n) - 1
+
+    def getvalue(self):
+        if self._n:
+            return bytes(self._buf) + bytes([(self._acc << (8 - self._n)) & 0xFF])
+        return bytes(self._buf)
+
+
+class _BitReader:
+    # Reads fields written by _BitWriter.
+
+    def __init__(self, data):
+        self._data = data
+        self._pos = 0
+        self._acc = 0
+        self._n = 0
+
+    def read(self, nbits):
+        while self._n < nbits:
+            self._acc = (self._acc << 8) | self._data[self._pos]
+            self._pos += 1
+            self._n += 8
+        self._n -= nbits
+        value = self._acc >> self._n
+        self._acc &= (1 << self._n) - 1
+        return value
+
+
+# -----------------------------
+# Integers (delta-of-delta)
+# -----------------------------
+def encode_ints(values):
+    """Encodes a series of int64 values (e.g. ts_unix_ms) with delta-of-delta."""
+    values = [int(v) for v in values]
+    w = _BitWriter()
+    if not values:
+        return b""
+    w.write(values[0], 64)
+    prev, prev_delta = values[0], 0
+    for v in values[1:]:
+        delta = v - prev
+        dod = delta - prev_delta
+        if dod == 0:
+            w.write(0, 1)
+        else:
+            for prefix, plen, vbits in _DOD_BUCKETS:
+                half = 1 << (vbits - 1)
+                if -half < dod <= half:
+                    w.write(prefix, plen)
+                    w.write(dod + half - 1, vbits)
+                    break
+            else:
+                w.write(0b1111, 4)
+                w.write(dod, 64)
+        prev, prev_delta = v, delta
+    return w.getvalue()
+
+
+def decode_ints(blob, count):
+    out = np.empty(count, dtype=np.int64)
+    if count == 0:
+        return out
+    r = _BitReader(blob)
+    prev = r.read(64)
+    if prev >= 1 << 63:
+        prev -= 1 << 64
+    out[0] = prev
+    prev_delta = 0
+    for i in range(1, count):
+        if r.read(1) == 0:
+            dod = 0
+        else:
+            for _, plen, vbits in _DOD_BUCKETS:
+                if r.read(1) == 0:
+                    dod = r.read(vbits) - (1 << (vbits - 1)) + 1
+                    break
+            else:
+                dod = r.read(64)
+                if dod >= 1 << 63:
+                    dod -= 1 << 64
+        prev_delta += dod
+        prev += prev_delta
+        out[i] = prev
+    return out
+
+
+# -----------------------------
+# Floats (XOR)
+# -----------------------------
+def encode_floats(values):
+    """Encodes a float64 series with Gorilla XOR compression. NaN marks a missing value."""
+    bits = np.asarray(values, dtype=np.float64).view(np.uint64).tolist()
+    w = _BitWriter()
+    if not bits:
+        return b""
+    w.write(bits[0], 64)
+    prev = bits[0]
+    prev_lead, prev_trail = -1, -1
+    for b in bits[1:]:
+        x = b ^ prev
+        prev = b
+        if x == 0:
+            w.write(0, 1)
+            continue
+        lead = min(64 - x.bit_length(), 63)
+        trail = (x & -x).bit_length() - 1
+        if prev_lead >= 0 and lead >= prev_lead and trail >= prev_trail:
+            # Fits in the previous window: '10' + meaningful bits
+            w.write(0b10, 2)
+            w.write(x >> prev_trail, 64 - prev_lead - prev_trail)
+        else:
+            # New window: '11' + 6-bit leading zeros + 6-bit length - 1 + meaningful bits
+            length = 64 - lead - trail
+            w.write(0b11, 2)
+            w.write(lead, 6)
+            w.write(length - 1, 6)
+            w.write(x >> trail, length)
+            prev_lead, prev_trail = lead, trail
+    return w.getvalue()
+
+
+def decode_floats(blob, count):
+    out = np.empty(count, dtype=np.uint64)
+    if count == 0:
+        return out.view(np.float64)
+    r = _BitReader(blob)
+    prev = r.read(64)
+    out[0] = prev
+    lead, trail = 0, 0
+    for i in range(1, count):
+        if r.read(1) == 1:
+            if r.read(1) == 1:
+                lead = r.read(6)
+                length = r.read(6) + 1
+                trail = 64 - lead - length
+            prev ^= r.read(64 - lead - trail) << trail
+        out[i] = prev
+    return out.view(np.float64)
@@ -0,0 +1,161 @@
+# storage_service/storage/episodes.py
+# Author: Andrew Fox
+
+# Maintains the issue_episode table: one row per stretch of time a detected issue label
+# kept firing on a host, with its start and end, how many predictions it spanned, the
+# peak model probability and the peak of the metric behind the label. The analytics
+# thread calls record() after every prediction: a label that fired last time extends its
+# open row in place, a new rising edge inserts one, and labels that stopped firing (or
+# whose row is older than max_gap_ms, e.g. the app was closed) are closed.
+#
+# Rows are indexed on (label, start) and (start, end). issue_episode_span keeps the
+# longest episode per label, so an episode overlapping a range can only start up to that
+# long before it: query() is one index range scan instead of a scan of all history.
+#
+# Usage:
+#   from storage_service.storage.episodes import IssueEpisodes
+#   IssueEpisodes.record(conn, host_uuid, session_id, ts_ms, {"gpu_overheating": 0.93}, values)
+#   IssueEpisodes.query(conn, "cpu_thermal_throttle", quarter_start_ms, quarter_end_ms,
+#                       min_duration_ms=5 * 60_000)
+
+# Label -> metrics behind it (analytics_service labels.LABEL_NAMES; test_episodes.py keeps
+# the two in step). The highest of them on the episode's ticks is its peak metric.
+EPISODE_METRICS = {
+    "cpu_thermal_throttle":    ("cpu_percent_total",),
+    "cpu_bottleneck":          ("cpu_percent_total",),
+    "cpu_sustained_high_load": ("cpu_percent_total",),
+    "ram_pressure":            ("ram_usage_percent",),
+    "ram_memory_leak":         ("ram_usage_percent",),
+    "excessive_swap_usage":    ("swap_usage_percent",),
+    "disk_full":               ("disk_usage_percent",),
+    "disk_bottleneck":         ("read_speed_bytes", "write_speed_bytes"),
+    "disk_high_latency":       ("avg_read_latency_ms", "avg_write_latency_ms"),
+    "gpu_overheating":         ("gpu_temp_c",),
+    "gpu_power_throttle":      ("gpu_power_usage_w",),
+    "gpu_vram_pressure":       ("gpu_mem_util_percent",),
+}
+
+# A label that fires again after a longer silence than this starts a new episode
+EPISODE_GAP_MS = 30_000
+
+EPISODE_COLUMNS = (
+    "episode_id", "host_uuid", "session_id", "label", "start_unix_ms", "end_unix_ms",
+    "prediction_count", "peak_probability", "peak_unix_ms", "peak_metric", "peak_value", "is_open",
+)
+
+_EXTEND_SQL = """
+    UPDATE issue_episode SET
+      end_unix_ms      = MAX(end_unix_ms, :ts),
+      prediction_count = prediction_count + 1,
+      peak_unix_ms     = CASE WHEN :probability > peak_probability THEN :ts ELSE peak_unix_ms END,
+      peak_probability = MAX(peak_probability, :probability),
+      peak_metric      = CASE WHEN :value > COALESCE(peak_value, -1e308) THEN :metric ELSE peak_metric END,
+      peak_value       = CASE WHEN :value > COALESCE(peak_value, -1e308) THEN :value ELSE peak_value END
+    WHERE host_uuid = :host AND label = :label AND is_open = 1
+"""
+
+_OPEN_SQL = """
+    INSERT INTO issue_episode
+      (host_uuid, session_id, label, start_unix_ms, end_unix_ms, prediction_count,
+       peak_probability, peak_unix_ms, peak_metric, peak_value, is_open)
+    VALUES (:host, :session, :label, :ts, :ts, 1, :probability, :ts, :metric, :value, 1)
+"""
+
+_SPAN_SQL = """
+    INSERT INTO issue_episode_span (label, max_duration_ms)
+    SELECT label, end_unix_ms - start_unix_ms FROM issue_episode
+    WHERE host_uuid = :host AND label = :label AND is_open = 1
+    ON CONFLICT (label) DO UPDATE SET max_duration_ms = MAX(max_duration_ms, excluded.max_duration_ms)
+"""
+
+
+class IssueEpisodes:
+    # Stateless helpers around the issue_episode table.
+
+    # -----------------------------
+    # Write path
+    # -----------------------------
+    @staticmethod
+    def record(conn, host_uuid, session_id, ts_unix_ms, fired, values=None, max_gap_ms=EPISODE_GAP_MS):
+        """
+        Folds one prediction in and commits. fired maps each firing label to its
+        probability; values holds the latest metric values (for the peak metric).
+        Returns the labels that started a new episode.
+        """
+        values = values or {}
+        started = []
+        try:
+            conn.execute("BEGIN")
+            conn.execute(
+                f"""UPDATE issue_episode SET is_open = 0
+                    WHERE host_uuid = ? AND is_open = 1
+                      AND (end_unix_ms < ? OR label NOT IN ({", ".join("?" * len(fired))}))""",
+                (host_uuid, ts_unix_ms - max_gap_ms, *fired),
+            )
+            for label, probability in fired.items():
+                metric, value = IssueEpisodes._peak_metric(label, values)
+                params = {"host": host_uuid, "session": session_id, "label": label, "ts": ts_unix_ms,
+                          "probability": float(probability), "metric": metric, "value": value}
+                if conn.execute(_EXTEND_SQL, params).rowcount == 0:
+                    conn.execute(_OPEN_SQL, params)
+                    started.append(label)
+                conn.execute(_SPAN_SQL, params)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return started
+
+    @staticmethod
+    def close_open(conn, host_uuid):
+        """Closes every open episode of the host (analytics stopped). Caller commits."""
+        return conn.execute(
+            "UPDATE issue_episode SET is_open = 0 WHERE host_uuid = ? AND is_open = 1", (host_uuid,)
+        ).rowcount
+
+    @staticmethod
+    def _peak_metric(label, values):
+        # (name, value) of the highest metric behind the label, or (None, None) if none was measured
+        measured = [(values[m], m) for m in EPISODE_METRICS.get(label, ()) if values.get(m) is not None]
+        if not measured:
+            return None, None
+        value, metric = max(measured)
+        return metric, float(value)
+
+    # -----------------------------
+    # Read path
+    # -----------------------------
+    @staticmethod
+    def query(conn, label=None, start_ms=None, end_ms=None, min_duration_ms=0, host_uuid=None):
+        """
+        Episodes overlapping [start_ms, end_ms) that lasted at least min_duration_ms,
+        oldest first, as dicts of EPISODE_COLUMNS. label=None returns every label.
+        """
+        span_sql = "SELECT MAX(max_duration_ms) FROM issue_episode_span"
+        span = conn.execute(span_sql + (" WHERE label = ?" if label else ""), (label,) if label else ()).fetchone()[0]
+        if span is None or span < min_duration_ms:
+            return []
+        start_ms = -2 ** 62 if start_ms is None else start_ms
+        end_ms = 2 ** 62 if end_ms is None else end_ms
+
+        # Starts are bounded on both sides, so the (label, start) / (start, end) index does the work
+        params = [start_ms - span, end_ms, start_ms, min_duration_ms]
+        if label is not None:
+            params.insert(0, label)
+        if host_uuid is not None:
+            params.append(host_uuid)
+        rows = conn.execute(IssueEpisodes._query_sql(label is not None, host_uuid is not None), params).fetchall()
+        return [dict(zip(EPISODE_COLUMNS, row)) for row in rows]
+
+    @staticmethod
+    def _query_sql(by_label, by_host):
+        # Parameters: [label,] earliest start, end_ms, start_ms, min_duration_ms [, host_uuid].
+        # The ORDER BY follows the index in use so no sort is needed
+        where = ["start_unix_ms >= ?", "start_unix_ms < ?", "end_unix_ms >= ?", "end_unix_ms - start_unix_ms >= ?"]
+        if by_label:
+            where.insert(0, "label = ?")
+        if by_host:
+            where.append("host_uuid = ?")
+        return f"""SELECT {", ".join(EPISODE_COLUMNS)} FROM issue_episode
+                   WHERE {" AND ".join(where)}
+                   ORDER BY start_unix_ms{"" if by_label else ", end_unix_ms"}, episode_id"""
@@ -0,0 +1,501 @@
+# storage_service/storage/export.py
+# Author: Andrew Fox
+
+# Streaming exports of telemetry.db (used by the dashboard's "Export DB" button and the CLI).
+# Sample rows are read with a fetchmany() cursor and written in one pass through a
+# buffered file, so memory stays flat no matter how large the database is.
+# Column choice and the time range are pushed down into SQL: only the tables the
+# chosen columns need are joined, and the range filter walks idx_sample_ts.
+# Ticks of archived sessions (archive.py) are decoded chunk by chunk and merged into
+# the raw rows in (ts_unix_ms, sample_id) order; the whole export reads one snapshot.
+#
+# export_columnar() writes the same data as typed arrays instead (compressed .npz, or
+# Parquet when pyarrow is installed), one file per host/session partition, with a
+# manifest.json; load_columnar() reads it back into pandas.
+#
+# A sharded install (sharding.py) exports from a list of connections, one per shard
+# oldest first (shard_connections()); shards cover disjoint time ranges, so their rows
+# are written one shard after the other.
+#
+# Usage:
+#   from storage_service.storage.export import export_csv
+#   with get_read_pool("telemetry.db").connection() as conn:
+#       export_csv(conn, "out.csv", columns=["CPU %", "RAM %"], start_ms=..., end_ms=...,
+#                  progress=lambda done, total: ..., cancelled=lambda: False)
+#   conns = shard_connections(shards, start_ms, end_ms)     # sharded layout
+#   export_csv(conns, "out.csv")
+#
+# CLI:
+#   python -m storage_service.storage.export --out telemetry_export --format npz
+#   python -m storage_service.storage.export --shards telemetry_shards --out export.csv
+
+import csv
+import datetime
+import heapq
+import itertools
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+from storage_service.storage.archive import SessionArchiver
+from storage_service.storage.columnar import INT_COLUMNS, iter_column_blocks
+from storage_service.storage.queries import DISK_USAGE_SQL, GPU_POWER_LIMIT_SQL
+from storage_service.storage.sharding import ShardCatalog
+
+CHUNK_ROWS = 5000
+WRITE_BUFFER_BYTES = 1 << 20
+
+# Which join each table alias needs
+_JOINS = {
+    "c":  "LEFT JOIN cpu_sample     c ON c.sample_id = s.sample_id",
+    "r":  "LEFT JOIN ram_sample     r ON r.sample_id = s.sample_id",
+    "g":  "LEFT JOIN gpu_sample     g ON g.sample_id = s.sample_id AND g.gpu_id = 0",
+    "d":  "LEFT JOIN disk_io_sample d ON d.sample_id = s.sample_id",
+}
+
+# CSV header -> (field name for columnar formats, SQL expression, table alias it needs or None)
+EXPORT_COLUMNS = {
+    "Timestamp":               ("ts_iso",               "s.ts_iso", None),
+    "Sample ID":               ("sample_id",            "s.sample_id", None),
+    "Session ID":              ("session_id",           "s.session_id", None),
+    "CPU %":                   ("cpu_percent_total",    "c.cpu_percent_total", "c"),
+    "CPU MHz":                 ("freq_current_mhz",     "c.freq_current_mhz", "c"),
+    "RAM %":                   ("ram_usage_percent",    "r.ram_usage_percent", "r"),
+    "Swap %":                  ("swap_usage_percent",   "r.swap_usage_percent", "r"),
+    "GPU Util %":              ("gpu_util_percent",     "g.gpu_util_percent", "g"),
+    "GPU Mem %":               ("gpu_mem_util_percent", "g.gpu_mem_util_percent", "g"),
+    "GPU Mem Used (MB)":       ("gpu_mem_used_mb",      "g.gpu_mem_used_mb", "g"),
+    "GPU Temp (C)":            ("gpu_temp_c",           "g.gpu_temp_c", "g"),
+    "GPU Clock (MHz)":         ("gpu_core_clock_mhz",   "g.gpu_core_clock_mhz", "g"),
+    "GPU Power (W)":           ("gpu_power_usage_w",    "g.gpu_power_usage_w", "g"),
+    "GPU Power Limit (W)":     ("gpu_power_limit_w",    GPU_POWER_LIMIT_SQL, "g"),
+    "Disk Read (B/s)":         ("read_speed_bytes",     "d.read_speed_bytes", "d"),
+    "Disk Write (B/s)":        ("write_speed_bytes",    "d.write_speed_bytes", "d"),
+    "Disk Read Latency (ms)":  ("avg_read_latency_ms",  "d.avg_read_latency_ms", "d"),
+    "Disk Write Latency (ms)": ("avg_write_latency_ms", "d.avg_write_latency_ms", "d"),
+    "Disk Usage %":            ("disk_usage_percent",   DISK_USAGE_SQL, None),
+}
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+def build_export_sql(columns=None, start_ms=None, end_ms=None):
+    """Returns (sql, params, headers) for the sample section."""
+    headers = _export_headers(columns)
+    where, params = _range_filter(start_ms, end_ms)
+    return _select_sql([EXPORT_COLUMNS[h] for h in headers], where), params, headers
+
+
+def _export_headers(columns):
+    headers = list(EXPORT_COLUMNS) if not columns else [c for c in EXPORT_COLUMNS if c in columns]
+    if not headers:
+        raise ValueError("No export columns selected")
+    return headers
+
+
+def _select_sql(specs, where):
+    # specs: (field, expression, alias) tuples; only the aliases they use are joined
+    aliases = []
+    for _, _, alias in specs:
+        if alias and alias not in aliases:
+            aliases.append(alias)
+    return (
+        f"SELECT {', '.join(expr for _, expr, _ in specs)} FROM sample s "
+        + " ".join(_JOINS[a] for a in aliases)
+        + where
+        + " ORDER BY s.ts_unix_ms, s.sample_id"
+    )
+
+
+def _range_filter(start_ms, end_ms, session_id=None):
+    clauses, params = [], []
+    if session_id is not None:
+        clauses.append("s.session_id = ?")
+        params.append(session_id)
+    if start_ms is not None:
+        clauses.append("s.ts_unix_ms >= ?")
+        params.append(start_ms)
+    if end_ms is not None:
+        clauses.append("s.ts_unix_ms < ?")
+        params.append(end_ms)
+    return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+
+# Merge key of raw and archived rows; the CSV sample query selects it first
+_KEY_SPECS = [("ts_unix_ms", "s.ts_unix_ms", None), ("sample_id", "s.sample_id", None)]
+
+
+def _sample_rows(conn, specs, start_ms, end_ms, chunk_rows):
+    """Raw and archived rows of specs in [start_ms, end_ms), oldest first, as tuples."""
+    where, params = _range_filter(start_ms, end_ms)
+    cur = conn.cursor()
+    cur.row_factory = None
+    cur.execute(_select_sql(_KEY_SPECS + specs, where), params)
+
+    def raw():
+        while True:
+            rows = cur.fetchmany(chunk_rows)
+            if not rows:
+                return
+            yield from rows
+
+    names = [field for field, _, _ in _KEY_SPECS + specs]
+    archived = SessionArchiver.iter_ticks(conn, names, start_ms, end_ms)
+    try:
+        for row in heapq.merge(raw(), archived, key=lambda r: (r[0], r[1])):
+            yield row[2:]
+    finally:
+        cur.close()
+
+
+def _archived_blocks(conn, fields, start_ms, end_ms, session_id, block_rows):
+    """Archived ticks of one session as dicts of arrays of up to block_rows rows, oldest first."""
+    parts, size = [], 0
+    for cols in SessionArchiver.read_chunks(conn, start_ms, end_ms, session_id):
+        n = len(cols["sample_id"])
+        parts.append({f: cols[f] if f in cols else np.full(n, np.nan) for f in fields})
+        size += n
+        if size < block_rows:
+            continue
+        block = {f: np.concatenate([p[f] for p in parts]) for f in fields}
+        while size >= block_rows:
+            yield {f: values[:block_rows] for f, values in block.items()}
+            block = {f: values[block_rows:] for f, values in block.items()}
+            size -= block_rows
+        parts = [block]
+    if size:
+        yield {f: np.concatenate([p[f] for p in parts]) for f in fields}
+
+
+def shard_connections(shards, start_ms=None, end_ms=None):
+    """Read-only connections to the shards overlapping [start_ms, end_ms), oldest first. Caller closes them."""
+    start_ms = -2 ** 62 if start_ms is None else start_ms
+    end_ms = 2 ** 62 if end_ms is None else end_ms
+    return [ShardCatalog.connect_read_only(path) for _, _, path in shards.shards_overlapping(start_ms, end_ms)]
+
+
+def _begin_snapshots(conns):
+    # Raw and archived ticks must come from one snapshot, or a session archived
+    # mid-export is written twice or not at all. Returns the connections the caller ends.
+    started = [c for c in conns if not c.in_transaction]
+    for c in started:
+        c.execute("BEGIN")
+    return started
+
+
+def _count_rows(conns, start_ms, end_ms):
+    where, params = _range_filter(start_ms, end_ms)
+    return sum(
+        c.execute(f"SELECT COUNT(*) FROM sample s{where}", params).fetchone()[0]
+        + SessionArchiver.count_ticks(c, start_ms, end_ms)
+        for c in conns
+    )
+
+
+def _sessions(conns):
+    """
+    (session_id, started_iso, interval_ms, first_sample_id, last_sample_id, count, hostname)
+    per session. A session that ran across shards has a row and a partial summary in each.
+    """
+    sessions = {}
+    for c in conns:
+        for row in c.execute(
+            """SELECT se.session_id, se.started_at_iso, se.sample_interval_ms,
+                      ss.first_sample_id, ss.last_sample_id, ss.sample_count,
+                      COALESCE(h.hostname, se.host_uuid)
+               FROM session se
+               LEFT JOIN session_summary ss ON ss.session_id = se.session_id
+               LEFT JOIN host h ON h.host_uuid = se.host_uuid
+               ORDER BY se.session_id"""
+        ):
+            session_id, started, interval, first_id, last_id, count, hostname = row
+            if session_id in sessions:
+                _, _, _, seen_first, seen_last, seen_count, _ = sessions[session_id]
+                first_id = _pick(min, first_id, seen_first)
+                last_id = _pick(max, last_id, seen_last)
+                count = (count or 0) + (seen_count or 0)
+            sessions[session_id] = (session_id, started, interval, first_id, last_id, count, hostname)
+    return [sessions[k] for k in sorted(sessions)]
+
+
+def _pick(fn, *values):
+    values = [v for v in values if v is not None]
+    return fn(values) if values else None
+
+
+def _fmt(v):
+    if v is None:
+        return "N/A"
+    return f"{v:.2f}" if isinstance(v, float) else v
+
+
+def export_csv(conn, path, columns=None, start_ms=None, end_ms=None, exported_at=None,
+               progress=None, cancelled=None, chunk_rows=CHUNK_ROWS):
+    """
+    Writes host info, sessions and the sample rows to path in a single pass. conn may
+    also be a list of shard connections, oldest first (shard_connections()).
+    progress(done, total) is called after each chunk; if cancelled() returns True the
+    partial file is removed and ExportCancelled is raised. Returns the sample row count.
+    """
+    conns = list(conn) if isinstance(conn, (list, tuple)) else [conn]
+    headers = _export_headers(columns)
+    specs = [EXPORT_COLUMNS[h] for h in headers]
+    snapshots = _begin_snapshots(conns)
+
+    done = 0
+    try:
+        total = _count_rows(conns, start_ms, end_ms)
+        with open(path, "w", newline="", encoding="utf-8", buffering=WRITE_BUFFER_BYTES) as f:
+            writer = csv.writer(f)
+
+            # --- Host Info ---
+            writer.writerow(["--- Host Info ---"])
+            if exported_at is not None:
+                writer.writerow(["Exported at", exported_at.strftime("%Y-%m-%d %H:%M:%S")])
+            host = None
+            for c in conns:
+                host = host or c.execute(
+                    """SELECT hostname, os_name, os_version, machine, cpu_model, cpu_core_count,
+                              cpu_thread_count, cpu_max_mhz, total_ram_gb, gpu_detected
+                       FROM host LIMIT 1"""
+                ).fetchone()
+            if host:
+                writer.writerow(["Hostname",         host[0]])
+                writer.writerow(["OS",               f"{host[1]} {host[2]}"])
+                writer.writerow(["Machine",          host[3]])
+                writer.writerow(["CPU Model",        host[4]])
+                writer.writerow(["CPU Cores",        host[5]])
+                writer.writerow(["CPU Threads",      host[6]])
+                writer.writerow(["CPU Max MHz",      host[7]])
+                writer.writerow(["Total RAM (GB)",   host[8]])
+                writer.writerow(["GPU Detected",     "Yes" if host[9] else "No"])
+            writer.writerow([])
+
+            # --- Sessions (counts and first/last ids come from session_summary) ---
+            writer.writerow(["--- Sessions ---"])
+            writer.writerow(["Session ID", "Started At", "Sample Interval (ms)", "First Sample ID",
+                             "Last Sample ID", "Sample Count"])
+            for session_id, started, interval, first_sample, last_sample, count, _ in _sessions(conns):
+                writer.writerow([session_id, started, interval,
+                                 first_sample if first_sample is not None else "—",
+                                 last_sample if last_sample is not None else "—",
+                                 count or 0])
+            writer.writerow([])
+
+            # --- Sample Data (shards hold disjoint time ranges, oldest first) ---
+            writer.writerow(["--- Sample Data ---"])
+            writer.writerow(headers)
+            for c in conns:
+                samples = _sample_rows(c, specs, start_ms, end_ms, chunk_rows)
+                while True:
+                    if cancelled is not None and cancelled():
+                        raise ExportCancelled()
+                    rows = list(itertools.islice(samples, chunk_rows))
+                    if not rows:
+                        break
+                    writer.writerows([_fmt(v) for v in row] for row in rows)
+                    done += len(rows)
+                    if progress is not None:
+                        progress(done, max(total, done))
+                samples.close()
+    except BaseException:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        raise
+    finally:
+        for c in snapshots:
+            c.rollback()
+    return done
+
+
+# -----------------------------
+# Columnar export (.npz / Parquet)
+# -----------------------------
+COLUMNAR_FORMATS = ("npz", "parquet")
+ROWS_PER_FILE = 500_000
+
+# Typed epoch timestamp replaces the ts_iso text column
+_TS_SPEC = ("ts_unix_ms", "s.ts_unix_ms", None)
+
+
+def parquet_available():
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _safe_name(text):
+    return "".join(ch if ch.isalnum() or ch in "-_." else "_" for ch in str(text)) or "unknown"
+
+
+def _write_part(path, fmt, cols):
+    if fmt == "npz":
+        np.savez_compressed(path, **cols)
+        return
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    arrays, names = [], []
+    for name, values in cols.items():
+        # SQLite REAL cannot hold NaN, so NaN here always means NULL
+        mask = np.isnan(values) if values.dtype.kind == "f" else None
+        arrays.append(pa.array(values, mask=mask))
+        names.append(name)
+    pq.write_table(pa.Table.from_arrays(arrays, names=names), path, compression="zstd")
+
+
+def export_columnar(conn, out_dir, fmt=None, columns=None, start_ms=None, end_ms=None,
+                    exported_at=None, progress=None, cancelled=None,
+                    rows_per_file=ROWS_PER_FILE, chunk_rows=CHUNK_ROWS):
+    """
+    Writes typed column arrays partitioned as out_dir/host=<hostname>/session=<id>/part-NNNNN.<fmt>
+    plus out_dir/manifest.json. fmt is "npz" (compressed NumPy) or "parquet" (needs pyarrow);
+    the default is Parquet when pyarrow is installed. Integer ids and ts_unix_ms are int64,
+    metrics float64 with NaN (npz) or real nulls (Parquet) for missing values.
+    conn and progress/cancelled behave as in export_csv(). Returns the number of rows written.
+    """
+    conns = list(conn) if isinstance(conn, (list, tuple)) else [conn]
+    fmt = fmt or ("parquet" if parquet_available() else "npz")
+    if fmt not in COLUMNAR_FORMATS:
+        raise ValueError(f"Unknown columnar format: {fmt}")
+    if fmt == "parquet" and not parquet_available():
+        raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow)")
+
+    headers = list(EXPORT_COLUMNS) if not columns else [c for c in EXPORT_COLUMNS if c in columns]
+    specs = [_TS_SPEC] + [EXPORT_COLUMNS[h] for h in headers if EXPORT_COLUMNS[h][0] != "ts_iso"]
+    fields = [field for field, _, _ in specs]
+
+    out_dir = Path(out_dir)
+    snapshots = _begin_snapshots(conns)
+
+    written, files, done = [], [], 0
+    try:
+        total = _count_rows(conns, start_ms, end_ms)
+        for session_id, *_, hostname in _sessions(conns):
+            # Archived ticks of a session are older than its raw ones, and older shards than newer
+            where, params = _range_filter(start_ms, end_ms, session_id)
+            blocks = itertools.chain.from_iterable(
+                itertools.chain(
+                    _archived_blocks(c, fields, start_ms, end_ms, session_id, rows_per_file),
+                    iter_column_blocks(c, _select_sql(specs, where), params, fields,
+                                       block_rows=rows_per_file, chunk_rows=chunk_rows),
+                )
+                for c in conns
+            )
+            for part, cols in enumerate(blocks):
+                if cancelled is not None and cancelled():
+                    raise ExportCancelled()
+                rel = Path(f"host={_safe_name(hostname)}") / f"session={session_id}" / f"part-{part:05d}.{fmt}"
+                path = out_dir / rel
+                path.parent.mkdir(parents=True, exist_ok=True)
+                written.append(path)
+                _write_part(path, fmt, cols)
+                rows = len(cols["ts_unix_ms"])
+                files.append({"path": rel.as_posix(), "host": hostname, "session_id": session_id, "rows": rows})
+                done += rows
+                if progress is not None:
+                    progress(done, max(total, done))
+
+        manifest = {
+            "format":      fmt,
+            "exported_at": exported_at.isoformat() if exported_at is not None else None,
+            "start_ms":    start_ms,
+            "end_ms":      end_ms,
+            "columns":     {f: ("int64" if f in INT_COLUMNS else "float64") for f in fields},
+            "rows":        done,
+            "files":       files,
+        }
+        out_dir.mkdir(parents=True, exist_ok=True)
+        written.append(out_dir / "manifest.json")
+        with open(out_dir / "manifest.json", "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+    except BaseException:
+        for path in written:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        raise
+    finally:
+        for c in snapshots:
+            c.rollback()
+    return done
+
+
+def load_columnar(out_dir):
+    """Loads a columnar export back into one pandas DataFrame (adds host and session_id)."""
+    import pandas as pd
+
+    out_dir = Path(out_dir)
+    with open(out_dir / "manifest.json", encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    frames = []
+    for entry in manifest["files"]:
+        path = out_dir / entry["path"]
+        if manifest["format"] == "npz":
+            with np.load(path) as data:
+                df = pd.DataFrame({name: data[name] for name in data.files})
+        else:
+            import pyarrow.parquet as pq
+            df = pq.read_table(path).to_pandas()
+        df["host"] = entry["host"]
+        df["session_id"] = entry["session_id"]
+        frames.append(df)
+    if not frames:
+        return pd.DataFrame(columns=list(manifest["columns"]) + ["host"])
+    return pd.concat(frames, ignore_index=True)
+
+
+# -----------------------------
+# CLI
+# -----------------------------
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export telemetry.db to CSV, .npz or Parquet")
+    parser.add_argument("--db", default="telemetry.db")
+    parser.add_argument("--shards", default=None, help="shard directory of a sharded install (instead of --db)")
+    parser.add_argument("--out", required=True, help="CSV file, or output directory for npz/parquet")
+    parser.add_argument("--format", choices=("csv",) + COLUMNAR_FORMATS, default="csv")
+    parser.add_argument("--start-ms", type=int, default=None)
+    parser.add_argument("--end-ms", type=int, default=None)
+    parser.add_argument("--columns", nargs="*", default=None, help="CSV header names, e.g. \"CPU %%\"")
+    args = parser.parse_args(argv)
+    if args.shards is not None and not (Path(args.shards) / "catalog.db").exists():
+        parser.error(f"no shard catalog in {args.shards}")
+
+    def run(conn):
+        kwargs = dict(columns=args.columns, start_ms=args.start_ms, end_ms=args.end_ms,
+                      exported_at=datetime.datetime.now())
+        if args.format == "csv":
+            return export_csv(conn, args.out, **kwargs)
+        return export_columnar(conn, args.out, fmt=args.format, **kwargs)
+
+    if args.shards is not None:
+        conns = shard_connections(ShardCatalog(args.shards), args.start_ms, args.end_ms)
+        try:
+            rows = run(conns)
+        finally:
+            for conn in conns:
+                conn.close()
+    else:
+        from storage_service.storage.read_pool import ReadPool
+        pool = ReadPool(args.db, size=1)
+        try:
+            with pool.connection() as conn:
+                rows = run(conn)
+        finally:
+            pool.close()
+    print(f"Exported {rows:,} samples to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
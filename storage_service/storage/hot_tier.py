@@ -0,0 +1,126 @@
+# storage_service/storage/hot_tier.py
+# Author: Andrew Fox
+
+# In-memory hot tier: a fixed-size ring of the most recent ticks, stored as one
+# preallocated float64 array (rows = ticks, columns = COLUMNAR_NAMES, NaN = missing).
+# StorageManager appends each tick right after its insert commits, and refills the ring
+# from disk when it opens, so recent-window reads and per-session counts are answered
+# under a lock with no SQL at all. The arrays it returns have the same layout as
+# columnar.fetch_columns() (oldest first, ids and timestamps as int64).
+#
+# StorageManager lives on the writer thread while the dashboard reads from the GUI and
+# analytics threads, so tiers are shared through a process-wide registry keyed by the
+# database path, like read_pool.get_read_pool().
+#
+# Usage:
+#   from storage_service.storage.hot_tier import get_hot_tier
+#   tier = get_hot_tier("telemetry.db")
+#   sid = tier.session_id                      # session the writer is filling
+#   count = tier.count(sid)
+#   cols = tier.recent(WINDOW_SIZE, sid)       # {name: np.ndarray}, oldest first
+
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from storage_service.storage.columnar import _split, fetch_columns, reverse_columns
+from storage_service.storage.queries import (
+    COLUMNAR_NAMES, HOT_REFILL_NAMES, HOT_REFILL_SQL, SESSION_COUNT_SQL,
+)
+
+HOT_CAPACITY = 3600   # one hour of 1 Hz ticks
+
+
+class HotTier:
+    # Ring buffer of the last `capacity` ticks across sessions (the newest at _head - 1).
+
+    def __init__(self, capacity=HOT_CAPACITY):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.capacity = capacity
+        self.names = list(COLUMNAR_NAMES)
+        self._buf = np.full((capacity, len(self.names)), np.nan)
+        self._sessions = np.zeros(capacity, dtype=np.int64)
+        self._head = 0
+        self._size = 0
+        self._counts = {}          # session_id -> ticks written (including ones evicted)
+        self._lock = threading.Lock()
+        self.session_id = None     # session currently being written
+
+    # -----------------------------
+    # Write side
+    # -----------------------------
+    def load(self, conn, session_id=None):
+        """Replaces the ring with the newest ticks on disk and makes session_id current."""
+        cols = reverse_columns(fetch_columns(conn, HOT_REFILL_SQL, (self.capacity,), HOT_REFILL_NAMES,
+                                             size_hint=self.capacity))
+        sessions = cols.pop("session_id")
+        counts = {
+            int(sid): conn.execute(SESSION_COUNT_SQL, (int(sid),)).fetchone()[0]
+            for sid in np.unique(sessions)
+        }
+        n = len(sessions)
+        with self._lock:
+            self._buf[:n] = np.column_stack([cols[name] for name in self.names]) if n else 0
+            self._sessions[:n] = sessions
+            self._head = n % self.capacity
+            self._size = n
+            self._counts = counts
+            if session_id is not None:
+                self._counts.setdefault(session_id, 0)
+            self.session_id = session_id
+
+    def append(self, session_id, values):
+        """Adds one tick. values maps COLUMNAR_NAMES -> value; missing or None becomes NaN."""
+        row = [np.nan if values.get(name) is None else values[name] for name in self.names]
+        with self._lock:
+            self._buf[self._head] = row
+            self._sessions[self._head] = session_id
+            self._head = (self._head + 1) % self.capacity
+            self._size = min(self._size + 1, self.capacity)
+            self._counts[session_id] = self._counts.get(session_id, 0) + 1
+
+    # -----------------------------
+    # Read side
+    # -----------------------------
+    def count(self, session_id):
+        """Ticks written in session_id (same answer as SESSION_COUNT_SQL)."""
+        with self._lock:
+            return self._counts.get(session_id, 0)
+
+    def __len__(self):
+        with self._lock:
+            return self._size
+
+    def recent(self, n, session_id=None):
+        """
+        Last n ticks (oldest first) as {name: np.ndarray}. With session_id only that
+        session's trailing ticks are returned, so a window never spans a restart.
+        """
+        with self._lock:
+            take = min(n, self._size)
+            idx = (self._head - take + np.arange(take)) % self.capacity
+            block = self._buf[idx]
+            if session_id is not None:
+                other = np.flatnonzero(self._sessions[idx] != session_id)
+                if len(other):
+                    block = block[other[-1] + 1:]
+        return _split(block, self.names)
+
+
+# -----------------------------
+# Process-wide registry
+# -----------------------------
+_TIERS = {}
+_TIERS_LOCK = threading.Lock()
+
+
+def get_hot_tier(db_path="telemetry.db", capacity=HOT_CAPACITY):
+    """Returns the process-wide hot tier for db_path, creating it on first use."""
+    key = str(Path(db_path).resolve())
+    with _TIERS_LOCK:
+        tier = _TIERS.get(key)
+        if tier is None:
+            tier = _TIERS[key] = HotTier(capacity)
+        return tier
@@ -2,20 +2,52 @@
 # Author: Andrew Fox
 
 import datetime
+import heapq
+import itertools
 
 from storage_service.storage.schema import init_db
+from storage_service.storage.rollups import RollupManager
+from storage_service.storage.session_summary import SessionSummary, SUMMARY_COLUMNS
+from storage_service.storage.change_encoding import ChangeEncoder
+from storage_service.storage.model_input import ModelInput
+from storage_service.storage.sketches import DEFAULT_QUANTILES, SketchManager, SketchWriter
+from storage_service.storage.zone_maps import ZoneMap
+from storage_service.storage.backfill import BackfillManager
+from storage_service.storage.optimize import close_optimize
+from storage_service.storage.sharding import DAY_MS, ShardCatalog
+from storage_service.storage.archive import GPU_COLUMNS, PARTITION_COLUMNS, SessionArchiver
+from storage_service.storage.queries import (
+    RECENT_SESSION_SQL, RECENT_ALL_SQL, SESSION_COUNT_SQL, RANGE_PAGE_SQL, TICK_NAMES, RANGE_PAGE_NAMES,
+    COLUMNAR_NAMES, SESSION_COLUMNS_SQL, RANGE_COLUMNS_SQL, RECENT_COLUMNS_SQL,
+    RECENT_SESSION_GPUS_SQL, RECENT_SESSION_PARTITIONS_SQL, RECENT_ALL_GPUS_SQL, RECENT_ALL_PARTITIONS_SQL,
+)
+from storage_service.storage.columnar import fetch_columns, merge_columns, reverse_columns
+from storage_service.storage.hot_tier import HotTier, get_hot_tier
+from storage_service.storage.query_cache import QueryCache, get_query_cache
 from collector_service.collector.system_info_collector import SystemInfoCollector
 
 
 class StorageManager:
 
-    def __init__(self, db_path="telemetry.db", sample_interval_ms=1000):
-        self.conn = init_db(db_path)
-
+    def __init__(self, db_path="telemetry.db", sample_interval_ms=1000, shards=None, hot_tier=None,
+                 autocheckpoint=True, change_only=False, change_tolerances=None, profile=None,
+                 query_cache=None, background_backfill=True):
         now = datetime.datetime.now()
         ts_iso = now.isoformat()
         ts_unix_ms = int(now.timestamp() * 1000)
 
+        # Sharded layout (sharding.ShardCatalog): db_path is ignored and the writer
+        # follows the shard for the current day/week, rotating in insert_sample()
+        self.shards = shards
+        self._shard_end_ms = None
+        if shards is not None:
+            self.conn, self._shard_end_ms = shards.open_shard(ts_unix_ms)
+        else:
+            self.conn = init_db(db_path, profile=profile)
+            if not autocheckpoint:
+                # checkpoint.CheckpointManager checkpoints on its own thread instead
+                self.conn.execute("PRAGMA wal_autocheckpoint = 0;")
+
         info = SystemInfoCollector.get_system_info()
 
         # Register host (upsert by UUID)
@@ -44,11 +76,14 @@ class StorageManager:
             )
         self.conn.commit()
 
-        # Open session
+        # Open session (ids come from the catalog when sharded so they stay unique)
+        session_id = None
+        if shards is not None:
+            session_id = shards.allocate_session(self.host_uuid, ts_unix_ms)
         cur = self.conn.execute(
-            """INSERT INTO session (host_uuid, started_at_iso, started_at_unix_ms, sample_interval_ms)
-               VALUES (?, ?, ?, ?)""",
-            (self.host_uuid, ts_iso, ts_unix_ms, sample_interval_ms),
+            """INSERT INTO session (session_id, host_uuid, started_at_iso, started_at_unix_ms, sample_interval_ms)
+               VALUES (?, ?, ?, ?, ?)""",
+            (session_id, self.host_uuid, ts_iso, ts_unix_ms, sample_interval_ms),
         )
         self.conn.commit()
         self.session_id = cur.lastrowid
@@ -63,11 +98,50 @@ class StorageManager:
             ).fetchall()
         }
 
+        # Back-fill rollups for any raw data written without them, so the
+        # per-tick updates below can advance the watermark one sample at a time
+        RollupManager.catch_up(self.conn)
+        # Summaries, model inputs, sketches and zone maps are built off this thread
+        # (backfill.py, started below); here only the sample ids they lack are noted
+        BackfillManager.record(self.conn)
+        self._next_sample_id = ShardCatalog.next_sample_id(self.conn) if shards is not None else None
+
+        # Recent ticks in memory (hot_tier.py); in-memory DBs get a private ring
+        if hot_tier is None:
+            hot_tier = HotTier() if db_path == ":memory:" else get_hot_tier(db_path)
+        self.hot_tier = hot_tier
+        self.hot_tier.load(self.conn, self.session_id)
+
+        # Read results keyed by the sample watermark (query_cache.py). The catch-ups above
+        # may have changed derived rows without a new sample, so start from an empty cache
+        if query_cache is None:
+            query_cache = QueryCache() if db_path == ":memory:" or shards is not None else get_query_cache(db_path)
+        self.query_cache = query_cache
+        self.query_cache.invalidate()
+
+        # In-memory databases can't be opened from another thread, so they back-fill here
+        db_file = self.conn.execute("PRAGMA database_list").fetchone()[2]
+        self.backfill = None
+        if background_backfill and db_file:
+            self.backfill = BackfillManager(db_file, on_batch=self.query_cache.invalidate)
+            self.backfill.start()
+        else:
+            BackfillManager.catch_up(self.conn)
+            self.query_cache.invalidate()
+
+        # Change-only encoding of slow partition/GPU fields (change_encoding.py)
+        self.change_encoder = ChangeEncoder(change_tolerances) if change_only else None
+        self._gpu_limit_nullable = change_only and ChangeEncoder.gpu_limit_nullable(self.conn)
+
+        # Current-minute quantile sketches, written out when the minute ends (sketches.py)
+        self.sketch_writer = SketchWriter(self.host_uuid)
+
     # -----------------------------
     # Insert one tick of data
     # -----------------------------
-    def insert_sample(self, cpu_data, ram_data, gpu_data, disk_data, collect_duration_ms=0):
-        now = datetime.datetime.now()
+    def insert_sample(self, cpu_data, ram_data, gpu_data, disk_data, collect_duration_ms=0, collected_at=None):
+        # collected_at: when the tick was sampled (the async writer may insert it later)
+        now = collected_at or datetime.datetime.now()
         ts_iso = now.isoformat()
         ts_unix_ms = int(now.timestamp() * 1000)
 
@@ -75,16 +149,20 @@ class StorageManager:
         if gpu_data is None:
             dropped += 1
 
+        if self.shards is not None and ts_unix_ms >= self._shard_end_ms:
+            self._rotate_shard(ts_unix_ms)
+
         try:
             self.conn.execute("BEGIN")
 
-            # -- sample row --
+            # -- sample row (explicit id when sharded so ids stay unique across files) --
             cur = self.conn.execute(
-                """INSERT INTO sample (session_id, ts_iso, ts_unix_ms, collect_duration_ms, dropped_metrics)
-                   VALUES (?, ?, ?, ?, ?)""",
-                (self.session_id, ts_iso, ts_unix_ms, collect_duration_ms, 0),
+                """INSERT INTO sample (sample_id, session_id, ts_iso, ts_unix_ms, collect_duration_ms, dropped_metrics)
+                   VALUES (?, ?, ?, ?, ?, ?)""",
+                (self._next_sample_id, self.session_id, ts_iso, ts_unix_ms, collect_duration_ms, 0),
             )
             sample_id = cur.lastrowid
+            tick_values = {}
 
             # -- CPU --
             try:
@@ -94,6 +172,8 @@ class StorageManager:
                     (sample_id, cpu_data["cpu_percent_total"],
                      cpu_data.get("freq_current_mhz")),
                 )
+                tick_values["cpu_percent_total"] = cpu_data["cpu_percent_total"]
+                tick_values["freq_current_mhz"] = cpu_data.get("freq_current_mhz")
             except Exception:
                 dropped += 1
 
@@ -106,15 +186,24 @@ class StorageManager:
                     (sample_id, ram_data["used_ram_gb"],
                      ram_data["ram_usage_percent"], ram_data["swap_usage_percent"]),
                 )
+                tick_values["used_ram_gb"] = ram_data["used_ram_gb"]
+                tick_values["ram_usage_percent"] = ram_data["ram_usage_percent"]
+                tick_values["swap_usage_percent"] = ram_data["swap_usage_percent"]
             except Exception:
                 dropped += 1
 
             # -- GPU --
             if gpu_data and gpu_data.get("gpus"):
-                for gpu in gpu_data["gpus"]:
-                    gpu_uuid = self.gpu_uuid_map.get(gpu["gpu_id"])
-                    if not gpu_uuid:
-                        continue
+                gpus = [(self.gpu_uuid_map.get(gpu["gpu_id"]), gpu) for gpu in gpu_data["gpus"]]
+                gpus = [(gpu_uuid, gpu) for gpu_uuid, gpu in gpus if gpu_uuid]
+                write_limit = True
+                if self._gpu_limit_nullable:
+                    write_limit = self.change_encoder.gpu_keyframe(
+                        {gpu_uuid: gpu["gpu_power_limit_w"] for gpu_uuid, gpu in gpus}
+                    )
+                    if write_limit:
+                        ChangeEncoder.mark(self.conn, self.session_id, sample_id, "gpu")
+                for gpu_uuid, gpu in gpus:
                     try:
                         self.conn.execute(
                             """INSERT INTO gpu_sample
@@ -127,8 +216,12 @@ class StorageManager:
                              gpu["gpu_util_percent"], gpu["gpu_mem_util_percent"],
                              gpu["gpu_mem_used_mb"], gpu["gpu_temp_c"],
                              gpu["gpu_core_clock_mhz"], gpu["gpu_power_usage_w"],
-                             gpu["gpu_power_limit_w"]),
+                             gpu["gpu_power_limit_w"] if write_limit else None),
                         )
+                        if gpu["gpu_id"] == 0:
+                            for key in ("gpu_util_percent", "gpu_mem_util_percent", "gpu_mem_used_mb", "gpu_temp_c",
+                                        "gpu_core_clock_mhz", "gpu_power_usage_w", "gpu_power_limit_w"):
+                                tick_values[key] = gpu[key]
                     except Exception:
                         dropped += 1
 
@@ -142,10 +235,14 @@ class StorageManager:
                     (sample_id, disk_data["read_speed_bytes"], disk_data["write_speed_bytes"],
                      disk_data["avg_read_latency_ms"], disk_data["avg_write_latency_ms"]),
                 )
+                for key in ("read_speed_bytes", "write_speed_bytes",
+                            "avg_read_latency_ms", "avg_write_latency_ms"):
+                    tick_values[key] = disk_data[key]
             except Exception:
                 dropped += 1
 
             # -- Disk partitions --
+            disks = []
             for disk in disk_data.get("disks", []):
                 key = (disk["device"], disk["mountpoint"])
                 partition_id = self.partition_id_map.get(key)
@@ -166,7 +263,22 @@ class StorageManager:
                         ).fetchone()
                         partition_id = row["partition_id"]
                     self.partition_id_map[key] = partition_id
+                disks.append((partition_id, disk))
+
+            if self.change_encoder is not None:
+                # Only keyframe ticks write partition rows; the rest carry the last ones forward
+                values = {pid: (d["total_gb"], d["used_gb"], d["usage_percent"]) for pid, d in disks}
+                if self.change_encoder.partition_keyframe(values):
+                    ChangeEncoder.mark(self.conn, self.session_id, sample_id, "partition")
+                else:
+                    for _, disk in disks:
+                        tick_values["disk_usage_percent"] = max(
+                            tick_values.get("disk_usage_percent", disk["usage_percent"]),
+                            disk["usage_percent"],
+                        )
+                    disks = []
 
+            for partition_id, disk in disks:
                 try:
                     self.conn.execute(
                         """INSERT INTO disk_partition_sample
@@ -175,9 +287,20 @@ class StorageManager:
                         (sample_id, partition_id, disk["total_gb"],
                          disk["used_gb"], disk["usage_percent"]),
                     )
+                    tick_values["disk_usage_percent"] = max(
+                        tick_values.get("disk_usage_percent", disk["usage_percent"]),
+                        disk["usage_percent"],
+                    )
                 except Exception:
                     dropped += 1
 
+            # -- Rollups --
+            RollupManager.apply_tick(self.conn, self.host_uuid, sample_id, ts_unix_ms, tick_values)
+            SessionSummary.apply_tick(self.conn, self.session_id, sample_id, ts_unix_ms, tick_values)
+            ModelInput.apply_tick(self.conn, self.session_id, sample_id, ts_unix_ms, tick_values)
+            self.sketch_writer.apply_tick(self.conn, sample_id, ts_unix_ms, tick_values)
+            ZoneMap.apply_tick(self.conn, sample_id, ts_unix_ms, tick_values)
+
             # Update dropped count on the sample row
             if dropped:
                 self.conn.execute(
@@ -189,34 +312,46 @@ class StorageManager:
 
         except Exception:
             self.conn.execute("ROLLBACK")
+            if self.change_encoder is not None:
+                self.change_encoder.rollback()
+            self.sketch_writer.rollback()
             raise
 
+        if self.change_encoder is not None:
+            self.change_encoder.commit()
+        self.sketch_writer.commit()
+
+        self.hot_tier.append(self.session_id, {**tick_values, "sample_id": sample_id, "ts_unix_ms": ts_unix_ms})
+
+        if self._next_sample_id is not None:
+            self._next_sample_id = sample_id + 1
+
+    def _rotate_shard(self, ts_unix_ms):
+        # Close the finished shard and continue the same session in the next one
+        self.sketch_writer.flush(self.conn)
+        self.conn.commit()
+        self.conn.close()
+        self.conn, self._shard_end_ms = self.shards.open_shard(ts_unix_ms, session_id=self.session_id)
+        self.query_cache.invalidate()
+        if self.change_encoder is not None:
+            # Keyframes don't cross files, so the new shard starts with one
+            self.change_encoder.reset()
+        self._next_sample_id = max(self._next_sample_id, ShardCatalog.next_sample_id(self.conn))
+
     # -----------------------------
     # Read
     # -----------------------------
-    def get_recent_samples(self, n=1000):
-        rows = self.conn.execute(
-            """SELECT
-                 s.sample_id, s.ts_iso, s.ts_unix_ms,
-                 c.cpu_percent_total, c.freq_current_mhz,
-                 r.used_ram_gb, r.ram_usage_percent, r.swap_usage_percent,
-                 g.gpu_util_percent, g.gpu_mem_util_percent, g.gpu_mem_used_mb,
-                 g.gpu_temp_c, g.gpu_core_clock_mhz, g.gpu_power_usage_w, g.gpu_power_limit_w,
-                 d.read_speed_bytes, d.write_speed_bytes,
-                 d.avg_read_latency_ms, d.avg_write_latency_ms,
-                 dp.usage_percent AS disk_usage_percent
-               FROM sample s
-               LEFT JOIN cpu_sample     c  ON c.sample_id  = s.sample_id
-               LEFT JOIN ram_sample     r  ON r.sample_id  = s.sample_id
-               LEFT JOIN gpu_sample     g  ON g.sample_id  = s.sample_id
-               LEFT JOIN disk_io_sample d  ON d.sample_id  = s.sample_id
-               LEFT JOIN disk_partition_sample dp ON dp.sample_id = s.sample_id
-               WHERE s.session_id = ?
-               ORDER BY s.ts_unix_ms DESC
-               LIMIT ?""",
-            (self.session_id, n),
-        ).fetchall()
-        return [dict(row) for row in rows]
+    def get_recent_samples(self, n=1000, devices=False):
+        # One dict per tick, newest first. devices=True adds "gpus" and "partitions" lists
+        params = (self.session_id, n)
+        samples = [dict(row) for row in self.query_cache.fetchall(self.conn, RECENT_SESSION_SQL, params)]
+        if devices:
+            self._attach_devices(samples, RECENT_SESSION_GPUS_SQL, RECENT_SESSION_PARTITIONS_SQL, params)
+        if self.shards is not None:
+            # A session that ran across a shard boundary continues in the older files
+            self._fill_from_shards(samples, n, self.shards.session_shards(self.session_id), RECENT_SESSION_SQL,
+                                   RECENT_SESSION_GPUS_SQL, RECENT_SESSION_PARTITIONS_SQL, (self.session_id,), devices)
+        return samples
 
     def get_host_cpu_max_mhz(self):
         row = self.conn.execute(
@@ -225,35 +360,300 @@ class StorageManager:
         ).fetchone()
         return row["cpu_max_mhz"] if row else None
 
-    def get_recent_samples_all_sessions(self, n=1000):
-        rows = self.conn.execute(
-            """SELECT
-                 s.sample_id, s.ts_iso, s.ts_unix_ms,
-                 c.cpu_percent_total, c.freq_current_mhz,
-                 r.used_ram_gb, r.ram_usage_percent, r.swap_usage_percent,
-                 g.gpu_util_percent, g.gpu_mem_util_percent, g.gpu_mem_used_mb,
-                 g.gpu_temp_c, g.gpu_core_clock_mhz, g.gpu_power_usage_w, g.gpu_power_limit_w,
-                 d.read_speed_bytes, d.write_speed_bytes,
-                 d.avg_read_latency_ms, d.avg_write_latency_ms,
-                 dp.usage_percent AS disk_usage_percent
-               FROM sample s
-               LEFT JOIN cpu_sample     c  ON c.sample_id  = s.sample_id
-               LEFT JOIN ram_sample     r  ON r.sample_id  = s.sample_id
-               LEFT JOIN gpu_sample     g  ON g.sample_id  = s.sample_id
-               LEFT JOIN disk_io_sample d  ON d.sample_id  = s.sample_id
-               LEFT JOIN disk_partition_sample dp ON dp.sample_id = s.sample_id
-               ORDER BY s.ts_unix_ms DESC
-               LIMIT ?""",
-            (n,),
-        ).fetchall()
-        return [dict(row) for row in rows]
+    def get_recent_samples_all_sessions(self, n=1000, devices=False):
+        samples = [dict(row) for row in self.query_cache.fetchall(self.conn, RECENT_ALL_SQL, (n,))]
+        if devices:
+            self._attach_devices(samples, RECENT_ALL_GPUS_SQL, RECENT_ALL_PARTITIONS_SQL, (n,))
+        if self.shards is not None:
+            # The archiver doesn't run on shards; older ticks are in the older files
+            return self._fill_from_shards(samples, n, self.shards.list_shards(), RECENT_ALL_SQL,
+                                          RECENT_ALL_GPUS_SQL, RECENT_ALL_PARTITIONS_SQL, (), devices)
+
+        # Archived sessions (archive.py) only matter when they reach into the newest n ticks
+        newest_archived = SessionArchiver.latest_chunk_end(self.conn)
+        if newest_archived is None or (len(samples) == n and newest_archived < samples[-1]["ts_unix_ms"]):
+            return samples
+        # Read after the raw rows: a chunk archived in between shows up twice, never not at all
+        ticks = self.query_cache.get_or_compute(
+            self.conn, "recent_archived", (n,), lambda: tuple(SessionArchiver.recent_ticks(self.conn, n))
+        )
+        seen = {sample["sample_id"] for sample in samples}
+        samples += [self._archived_sample(tick, devices) for tick in ticks if tick["sample_id"] not in seen]
+        samples.sort(key=lambda sample: (sample["ts_unix_ms"], sample["sample_id"]), reverse=True)
+        return samples[:n]
+
+    def _archived_sample(self, tick, devices):
+        # SessionArchiver.recent_ticks() dict in the shape of a RECENT_ALL_SQL row
+        sample = {name: tick.get(name) for name in TICK_NAMES}
+        if not devices:
+            return sample
+        # Devices come from the gpu<id>.<column> / partition<id>.<column> arrays; GPU uuids aren't archived
+        mounts = {
+            row["partition_id"]: (row["device"], row["mountpoint"])
+            for row in self.conn.execute("SELECT partition_id, device, mountpoint FROM disk_partition")
+        }
+        gpu_ids = sorted({int(key[3:key.index(".")]) for key in tick if key.startswith("gpu") and "." in key})
+        partition_ids = sorted({int(key[9:key.index(".")]) for key in tick if key.startswith("partition")})
+        sample["gpus"], sample["partitions"] = [], []
+        for gpu_id in gpu_ids:
+            values = {col: tick.get(f"gpu{gpu_id}.{col}") for col in GPU_COLUMNS}
+            if any(v is not None for v in values.values()):
+                sample["gpus"].append({"gpu_id": gpu_id, "gpu_uuid": None, **values})
+        for partition_id in partition_ids:
+            values = {col: tick.get(f"partition{partition_id}.{col}") for col in PARTITION_COLUMNS}
+            if any(v is not None for v in values.values()):
+                device, mountpoint = mounts.get(partition_id, (None, None))
+                sample["partitions"].append(
+                    {"partition_id": partition_id, "device": device, "mountpoint": mountpoint, **values}
+                )
+        return sample
+
+    def _fill_from_shards(self, samples, n, shards, sql, gpu_sql, partition_sql, params, devices):
+        # Tops newest-first samples up to n ticks from the shards before the current one,
+        # newest shard first (shards don't overlap, so the order carries over)
+        for _, end, path in reversed(shards):
+            if len(samples) >= n:
+                break
+            if end >= self._shard_end_ms:
+                continue
+            conn = ShardCatalog.connect_read_only(path)
+            try:
+                limited = params + (n - len(samples),)
+                older = [dict(row) for row in conn.execute(sql, limited)]
+                if devices:
+                    self._attach_devices(older, gpu_sql, partition_sql, limited, conn)
+            finally:
+                conn.close()
+            samples += older
+        return samples
+
+    def _attach_devices(self, samples, gpu_sql, partition_sql, params, conn=None):
+        # Device rows come back unordered; group by tick, then order by device id.
+        # conn reads another shard instead of the cached writer connection
+        by_id = {}
+        for sample in samples:
+            sample["gpus"], sample["partitions"] = [], []
+            by_id[sample["sample_id"]] = sample
+        for sql, key, order in ((gpu_sql, "gpus", "gpu_id"), (partition_sql, "partitions", "partition_id")):
+            rows = self.query_cache.fetchall(self.conn, sql, params) if conn is None else conn.execute(sql, params)
+            for row in rows:
+                device = dict(row)
+                sample = by_id.get(device.pop("sample_id"))
+                if sample is not None:
+                    sample[key].append(device)
+            for sample in samples:
+                sample[key].sort(key=lambda d: d[order])
 
     def get_sample_count(self):
-        row = self.conn.execute(
-            "SELECT COUNT(*) AS cnt FROM sample WHERE session_id = ?",
-            (self.session_id,),
-        ).fetchone()
-        return row["cnt"]
+        return self.hot_tier.count(self.session_id)
+
+    def get_session_summary(self, session_id=None):
+        """Counts, first/last ids and min/max/mean of key metrics for a session (default: current)."""
+        session_id = self.session_id if session_id is None else session_id
+        if self.shards is None:
+            return SessionSummary.get(self.conn, session_id)
+        # Each shard holds the part of the session written while it was current; the
+        # catalog holds the parts merged in from dropped shards
+        sql = f"SELECT {', '.join(SUMMARY_COLUMNS)} FROM session_summary WHERE session_id = ?"
+        rows = ShardCatalog.read_shard(self.shards.catalog_path, sql, (session_id,))
+        for _, _, path in self.shards.session_shards(session_id):
+            rows += ShardCatalog.read_shard(path, sql, (session_id,))
+        return SessionSummary.merge(rows)
+
+    # -----------------------------
+    # Time-range read (all sessions, keyset pages)
+    # -----------------------------
+    def get_range_page(self, start_ms, end_ms, cursor=None, page_size=1000):
+        """
+        One page of ticks in [start_ms, end_ms), oldest first, as (rows, next_cursor).
+        Pass next_cursor back to get the following page; it is None after the last one.
+        """
+        after_ts, after_id = cursor if cursor is not None else (start_ms, 0)
+        if self.shards is None:
+            params = (after_ts, after_id, end_ms, page_size)
+            rows = [dict(row) for row in self.query_cache.get_or_compute(
+                self.conn, RANGE_PAGE_SQL, params, lambda: self._range_page_rows(*params)
+            )]
+        else:
+            # Shards are time-ordered: fill the page from the shard holding the cursor onwards
+            rows = []
+            for _, _, path in self.shards.shards_overlapping(after_ts, end_ms):
+                params = (after_ts, after_id, end_ms, page_size - len(rows))
+                rows += [dict(row) for row in ShardCatalog.read_shard(path, RANGE_PAGE_SQL, params)]
+                if len(rows) == page_size:
+                    break
+        if len(rows) < page_size:
+            return rows, None
+        return rows, (rows[-1]["ts_unix_ms"], rows[-1]["sample_id"])
+
+    def _range_page_rows(self, after_ts, after_id, end_ms, page_size):
+        # Raw rows and archived ticks (archive.py) after the cursor, merged in keyset order
+        raw = self.conn.execute(RANGE_PAGE_SQL, (after_ts, after_id, end_ms, page_size)).fetchall()
+        archived = (
+            dict(zip(RANGE_PAGE_NAMES, row))
+            for row in SessionArchiver.iter_ticks(self.conn, RANGE_PAGE_NAMES, after_ts, end_ms,
+                                                  after=(after_ts, after_id))
+        )
+        merged = heapq.merge(raw, archived, key=lambda row: (row["ts_unix_ms"], row["sample_id"]))
+        return tuple(itertools.islice(merged, page_size))
+
+    def iter_range(self, start_ms, end_ms, page_size=1000):
+        """Yields every tick in [start_ms, end_ms) page by page; memory stays at one page."""
+        cursor = None
+        while True:
+            rows, cursor = self.get_range_page(start_ms, end_ms, cursor, page_size)
+            yield from rows
+            if cursor is None:
+                return
+
+    # -----------------------------
+    # Columnar read (dict of NumPy arrays, oldest first, NaN = missing)
+    # -----------------------------
+    def get_session_columns(self, session_id=None):
+        session_id = self.session_id if session_id is None else session_id
+
+        def compute():
+            size = self.conn.execute(SESSION_COUNT_SQL, (session_id,)).fetchone()[0]
+            cols = fetch_columns(self.conn, SESSION_COLUMNS_SQL, (session_id,), COLUMNAR_NAMES, size_hint=size)
+            return self._with_archived(cols, SessionArchiver.read_chunks(self.conn, session_id=session_id))
+
+        cols = self.query_cache.columns(self.conn, SESSION_COLUMNS_SQL, (session_id,), compute)
+        if self.shards is None:
+            return cols
+        older = self._older_shard_columns(self.shards.session_shards(session_id), SESSION_COLUMNS_SQL, (session_id,))
+        return merge_columns(older + [cols], COLUMNAR_NAMES) if older else cols
+
+    def get_range_columns(self, start_ms, end_ms):
+        def compute():
+            cols = fetch_columns(self.conn, RANGE_COLUMNS_SQL, (start_ms, end_ms), COLUMNAR_NAMES)
+            return self._with_archived(cols, SessionArchiver.read_chunks(self.conn, start_ms, end_ms))
+
+        cols = self.query_cache.columns(self.conn, RANGE_COLUMNS_SQL, (start_ms, end_ms), compute)
+        if self.shards is None:
+            return cols
+        older = self._older_shard_columns(self.shards.shards_overlapping(start_ms, end_ms),
+                                          RANGE_COLUMNS_SQL, (start_ms, end_ms))
+        return merge_columns(older + [cols], COLUMNAR_NAMES) if older else cols
+
+    def _older_shard_columns(self, shards, sql, params):
+        # The same columnar query on each shard before the current one, oldest first
+        parts = []
+        for _, end, path in shards:
+            if end >= self._shard_end_ms:
+                continue
+            conn = ShardCatalog.connect_read_only(path)
+            try:
+                parts.append(fetch_columns(conn, sql, params, COLUMNAR_NAMES))
+            finally:
+                conn.close()
+        return parts
+
+    @staticmethod
+    def _with_archived(cols, chunks):
+        # Adds archived ticks (archive.py) to raw columns; the common case has none to decode
+        chunks = list(chunks)
+        return merge_columns([cols] + chunks, COLUMNAR_NAMES) if chunks else cols
+
+    def get_recent_columns(self, n=1000):
+        if n <= self.hot_tier.capacity:
+            return self.hot_tier.recent(n, self.session_id)
+        compute = lambda: reverse_columns(
+            fetch_columns(self.conn, RECENT_COLUMNS_SQL, (self.session_id, n), COLUMNAR_NAMES, size_hint=n)
+        )
+        return self.query_cache.columns(self.conn, RECENT_COLUMNS_SQL, (self.session_id, n), compute)
+
+    def get_model_input(self, n=None, session_id=None):
+        # Model point inputs (model_input.py): last n ticks, or the whole session if n is None
+        session_id = self.session_id if session_id is None else session_id
+        if n is None:
+            compute = lambda: ModelInput.read_session(self.conn, session_id)
+        else:
+            compute = lambda: ModelInput.recent(self.conn, session_id, n)
+        return self.query_cache.columns(self.conn, "model_input", (session_id, n), compute)
+
+    def get_rollups(self, metric, start_ms, end_ms, max_points=500, host_uuid=None):
+        def compute():
+            history = self._history_connections(start_ms, end_ms)
+            try:
+                return tuple(RollupManager.query([self.conn] + history, metric, start_ms, end_ms,
+                                                 max_points=max_points, host_uuid=host_uuid))
+            finally:
+                for conn in history:
+                    conn.close()
+
+        params = (metric, start_ms, end_ms, max_points, host_uuid)
+        points = self.query_cache.get_or_compute(self.conn, "rollups", params, compute)
+        return [dict(p) for p in points]
+
+    def get_percentiles(self, metric, start_ms, end_ms, quantiles=DEFAULT_QUANTILES, host_uuid=None):
+        """
+        Quantiles of metric over [start_ms, end_ms) from the minute sketches (sketches.py),
+        each within relative_accuracy of the exact value; includes the current minute.
+        """
+        def compute():
+            history = self._history_connections(start_ms, end_ms)
+            try:
+                sketch = SketchManager.merged([self.conn] + history, metric, start_ms, end_ms, host_uuid)
+            finally:
+                for conn in history:
+                    conn.close()
+            pending = self.sketch_writer.pending(metric, start_ms, end_ms, host_uuid)
+            if pending is not None:
+                sketch.merge(pending)
+            return SketchManager.describe(sketch, quantiles)
+
+        params = (metric, start_ms, end_ms, tuple(quantiles), host_uuid)
+        stats = self.query_cache.get_or_compute(self.conn, "percentiles", params, compute)
+        return {**stats, "quantiles": dict(stats["quantiles"])}
+
+    def _history_connections(self, start_ms, end_ms):
+        # Sharded: read-only connections to the catalog (rollups and sketches of dropped
+        # shards) and the other shards within a day of the range, as no bucket is wider.
+        # Dropping a shard moves its buckets without changing the sums, so cached results hold
+        if self.shards is None:
+            return []
+        paths = [self.shards.catalog_path] + [
+            path for _, end, path in self.shards.shards_overlapping(start_ms - DAY_MS, end_ms + DAY_MS)
+            if end != self._shard_end_ms
+        ]
+        return [ShardCatalog.connect_read_only(path) for path in paths]
+
+    def search_threshold(self, metric, threshold, op=">", start_ms=None, end_ms=None, host_uuid=None):
+        """
+        Intervals where metric <op> threshold held (zone_maps.py), oldest first; only the
+        1024-tick chunks whose min/max allow a match are read.
+        """
+        params = (metric, threshold, op, start_ms, end_ms, host_uuid)
+        if self.shards is None:
+            intervals = self.query_cache.get_or_compute(
+                self.conn, "zone_search", params, lambda: tuple(ZoneMap.search(self.conn, *params)),
+            )
+            return [dict(i) for i in intervals]
+        # Each shard keeps the zone maps of its own ticks
+        intervals = []
+        lo = -2 ** 63 if start_ms is None else start_ms
+        hi = 2 ** 63 - 1 if end_ms is None else end_ms
+        for _, _, path in self.shards.shards_overlapping(lo, hi):
+            conn = ShardCatalog.connect_read_only(path)
+            try:
+                intervals += ZoneMap.search(conn, *params)
+            finally:
+                conn.close()
+        return intervals
 
     def close(self):
+        # Unfinished back-fill ranges stay recorded for the next start
+        if self.backfill is not None:
+            self.backfill.stop()
+        # Mark the session closed so SessionArchiver can compress it
+        ended_at_unix_ms = int(datetime.datetime.now().timestamp() * 1000)
+        self.conn.execute(
+            "UPDATE session SET ended_at_unix_ms = ? WHERE session_id = ?",
+            (ended_at_unix_ms, self.session_id),
+        )
+        SessionSummary.finalise(self.conn, self.session_id, ended_at_unix_ms)
+        self.sketch_writer.flush(self.conn)
+        self.conn.commit()
+        # Refresh planner statistics for the tables this connection used
+        close_optimize(self.conn)
         self.conn.close()
@@ -0,0 +1,315 @@
+# storage_service/storage/merge.py
+# Author: Andrew Fox
+
+# Consolidates many per-machine telemetry.db files into one fleet database.
+# Each source is ATTACHed to the target and copied table by table with INSERT ... SELECT,
+# so rows never pass through Python (archived chunks excepted, see below):
+#   - hosts and GPUs are deduplicated by host_uuid / gpu_uuid
+#   - partitions are matched on (host_uuid, device, mountpoint), new ones get fresh ids
+#   - session_id and sample_id are shifted past the ids already in the target
+#   - archived chunks (archive.py) are re-encoded with the shifted sample ids and
+#     renamed partition metrics; there are few of them (one per hour of ticks)
+#   - rollups, quantile sketches, zone maps and session summaries are merged from the
+#     source instead of recomputed, so archived sessions keep theirs; sketches for a
+#     bucket both files have are merged in Python (sketches.py)
+#   - issue episodes (episodes.py) are copied with fresh ids
+# A source whose sessions are already in the target (same host and start time) is
+# skipped, so re-running a merge doesn't duplicate data.
+# Secondary indexes on the per-tick tables are dropped for the copy and rebuilt once at
+# the end; each source is one transaction.
+#
+# Usage:
+#   from storage_service.storage.merge import merge_dbs
+#   stats = merge_dbs("fleet.db", ["telemetry-a.db", "telemetry-b.db"])
+#
+# CLI:
+#   python -m storage_service.storage.merge --out fleet.db telemetry-a.db telemetry-b.db
+
+import time
+
+from storage_service.storage.backfill import BackfillManager
+from storage_service.storage.compression import decode_ints, encode_ints
+from storage_service.storage.rollups import CATCH_UP_BATCH, RollupManager, _UPSERT_SQL
+from storage_service.storage.schema import drop_bulk_indexes, init_db
+from storage_service.storage.sketches import DDSketch, SketchManager
+from storage_service.storage.zone_maps import ZONE_BITS, ZoneMap, _CHUNK_UPSERT_SQL, _ZONE_UPSERT_SQL
+
+# Per-tick child tables: table -> {column: expression over the source row}.
+# Columns not listed are copied as they are; :sample_offset shifts the ids.
+_SAMPLE_TABLES = {
+    "cpu_sample":            {"sample_id": "sample_id + :sample_offset"},
+    "ram_sample":            {"sample_id": "sample_id + :sample_offset"},
+    "gpu_sample":            {"sample_id": "sample_id + :sample_offset"},
+    "disk_io_sample":        {"sample_id": "sample_id + :sample_offset"},
+    "disk_partition_sample": {"sample_id": "sample_id + :sample_offset",
+                              "partition_id": "(SELECT new_id FROM temp.merge_partition_map"
+                                              " WHERE old_id = partition_id)"},
+    "model_input":           {"sample_id": "sample_id + :sample_offset",
+                              "session_id": "session_id + :session_offset"},
+}
+
+
+def _columns(conn, schema, table):
+    return [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+
+
+def _copy(conn, table, overrides, params):
+    """INSERT INTO main.table SELECT ... FROM src.table, with some columns rewritten. Returns rows copied."""
+    columns = _columns(conn, "main", table)
+    select = ", ".join(overrides.get(c, c) for c in columns)
+    cur = conn.execute(
+        f"INSERT INTO main.{table} ({', '.join(columns)}) SELECT {select} FROM src.{table}",
+        params,
+    )
+    return cur.rowcount
+
+
+# -----------------------------
+# One source
+# -----------------------------
+def _already_merged(conn):
+    return conn.execute(
+        """SELECT EXISTS (SELECT 1 FROM src.session s
+                          JOIN main.session m ON m.host_uuid = s.host_uuid
+                                             AND m.started_at_unix_ms = s.started_at_unix_ms)"""
+    ).fetchone()[0]
+
+
+def _merge_source(conn):
+    """Copies the attached `src` database into main. Caller handles the transaction."""
+    params = {
+        "session_offset": conn.execute("SELECT COALESCE(MAX(session_id), 0) FROM main.session").fetchone()[0],
+        # Above every id in use and every id the rollup / sketch / zone watermarks already cover
+        "sample_offset": max(
+            conn.execute("SELECT COALESCE(MAX(sample_id), 0) FROM main.sample").fetchone()[0],
+            RollupManager.get_watermark(conn),
+            SketchManager.get_watermark(conn),
+            ZoneMap.get_watermark(conn),
+        ),
+    }
+    rows = 0
+
+    # -- Hosts, GPUs, partitions (dedup by natural key) --
+    conn.execute("INSERT OR IGNORE INTO main.host SELECT * FROM src.host")
+    conn.execute("INSERT OR IGNORE INTO main.gpu_device SELECT * FROM src.gpu_device")
+    conn.execute(
+        """INSERT OR IGNORE INTO main.disk_partition
+             (host_uuid, device, mountpoint, fstype, first_seen_iso, first_seen_unix_ms)
+           SELECT host_uuid, device, mountpoint, fstype, first_seen_iso, first_seen_unix_ms
+           FROM src.disk_partition"""
+    )
+    conn.execute("DROP TABLE IF EXISTS temp.merge_partition_map")
+    conn.execute(
+        """CREATE TEMP TABLE merge_partition_map (old_id INTEGER PRIMARY KEY, new_id INTEGER NOT NULL)"""
+    )
+    conn.execute(
+        """INSERT INTO temp.merge_partition_map
+           SELECT s.partition_id, m.partition_id
+           FROM src.disk_partition s
+           JOIN main.disk_partition m USING (host_uuid, device, mountpoint)"""
+    )
+
+    # -- Sessions and ticks (ids shifted) --
+    rows += _copy(conn, "session", {"session_id": "session_id + :session_offset"}, params)
+    rows += _copy(conn, "sample", {"sample_id": "sample_id + :sample_offset",
+                                   "session_id": "session_id + :session_offset"}, params)
+    for table, overrides in _SAMPLE_TABLES.items():
+        rows += _copy(conn, table, overrides, params)
+    _copy(conn, "change_keyframe", {"session_id": "session_id + :session_offset",
+                                    "sample_id": "sample_id + :sample_offset"}, params)
+
+    # -- Archived chunks (sample ids live inside the blobs) --
+    partition_map = dict(conn.execute("SELECT old_id, new_id FROM temp.merge_partition_map"))
+    for session_id, first_id, start_ms, end_ms, count, ts_blob, id_blob in conn.execute(
+        """SELECT session_id, first_sample_id, chunk_start_unix_ms, chunk_end_unix_ms,
+                  sample_count, ts_blob, sample_id_blob
+           FROM src.sample_chunk"""
+    ).fetchall():
+        new_session = session_id + params["session_offset"]
+        new_first = first_id + params["sample_offset"]
+        conn.execute(
+            """INSERT INTO main.sample_chunk
+                 (session_id, first_sample_id, chunk_start_unix_ms, chunk_end_unix_ms,
+                  sample_count, ts_blob, sample_id_blob)
+               VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            (new_session, new_first, start_ms, end_ms, count, ts_blob,
+             encode_ints(decode_ints(id_blob, count) + params["sample_offset"])),
+        )
+        conn.executemany(
+            "INSERT INTO main.metric_chunk (session_id, first_sample_id, metric, value_blob) VALUES (?, ?, ?, ?)",
+            [
+                (new_session, new_first, _rename_metric(metric, partition_map), blob)
+                for metric, blob in conn.execute(
+                    "SELECT metric, value_blob FROM src.metric_chunk WHERE session_id = ? AND first_sample_id = ?",
+                    (session_id, first_id),
+                )
+            ],
+        )
+        rows += count
+
+    # -- Rollups and summaries (merged, not recomputed) --
+    conn.execute(_UPSERT_SQL.format(
+        source="""SELECT resolution_ms, metric, bucket_unix_ms, host_uuid, sample_count,
+                         min_value, max_value, sum_value, sum_sq_value
+                  FROM src.metric_rollup WHERE true"""
+    ))
+    _copy(conn, "session_summary", {
+        "session_id":      "session_id + :session_offset",
+        "first_sample_id": "first_sample_id + :sample_offset",
+        "last_sample_id":  "last_sample_id + :sample_offset",
+    }, params)
+    src_watermark = conn.execute(
+        "SELECT COALESCE(MAX(last_sample_id), 0) FROM src.rollup_watermark"
+    ).fetchone()[0]
+    RollupManager._set_watermark(conn, src_watermark + params["sample_offset"])
+
+    # Sketches for buckets both files have are merged one by one, the rest copied
+    shared = conn.execute(
+        """SELECT s.resolution_ms, s.metric, s.bucket_unix_ms, s.host_uuid, s.min_value, s.max_value, s.sketch_blob
+           FROM src.metric_sketch s
+           JOIN main.metric_sketch m USING (resolution_ms, metric, bucket_unix_ms, host_uuid)"""
+    ).fetchall()
+    SketchManager.merge_rows(conn, {
+        (res_ms, metric, bucket, host): DDSketch.from_blob(blob, lo, hi)
+        for res_ms, metric, bucket, host, lo, hi, blob in shared
+    })
+    conn.execute("INSERT OR IGNORE INTO main.metric_sketch SELECT * FROM src.metric_sketch")
+    src_watermark = conn.execute(
+        "SELECT COALESCE(MAX(last_sample_id), 0) FROM src.sketch_watermark"
+    ).fetchone()[0]
+    SketchManager._set_watermark(conn, src_watermark + params["sample_offset"])
+
+    # Issue episodes get fresh ids; the longest-episode bounds only grow
+    _copy(conn, "issue_episode", {"episode_id": "NULL", "session_id": "session_id + :session_offset"}, params)
+    conn.execute(
+        """INSERT INTO main.issue_episode_span SELECT * FROM src.issue_episode_span WHERE true
+           ON CONFLICT (label) DO UPDATE SET max_duration_ms = MAX(max_duration_ms, excluded.max_duration_ms)"""
+    )
+
+    # Zone maps: shifted ids can put a source chunk across two target chunks, so its
+    # bounds go to both (wider bounds only cost extra reads); ticks count once
+    spans = f"""
+        SELECT (first_sample_id + :sample_offset) >> {ZONE_BITS} AS target_chunk, chunk_id AS source_chunk,
+               first_sample_id, last_sample_id, start_unix_ms, end_unix_ms, tick_count
+        FROM src.zone_chunk
+        UNION ALL
+        SELECT (last_sample_id + :sample_offset) >> {ZONE_BITS}, chunk_id,
+               first_sample_id, last_sample_id, start_unix_ms, end_unix_ms, 0
+        FROM src.zone_chunk
+        WHERE (last_sample_id + :sample_offset) >> {ZONE_BITS} != (first_sample_id + :sample_offset) >> {ZONE_BITS}"""
+    conn.execute(_CHUNK_UPSERT_SQL.format(
+        source=f"""SELECT target_chunk, first_sample_id + :sample_offset, last_sample_id + :sample_offset,
+                          start_unix_ms, end_unix_ms, tick_count
+                   FROM ({spans}) WHERE true"""
+    ), params)
+    conn.execute(_ZONE_UPSERT_SQL.format(
+        source=f"""SELECT z.metric, c.target_chunk, z.min_value, z.max_value
+                   FROM ({spans}) c JOIN src.zone_map z ON z.chunk_id = c.source_chunk WHERE true"""
+    ), params)
+    return rows
+
+
+def _rename_metric(metric, partition_map):
+    # partition<id>.<column> -> partition<new id>.<column>
+    if not metric.startswith("partition"):
+        return metric
+    old_id, column = metric[len("partition"):].split(".", 1)
+    return f"partition{partition_map[int(old_id)]}.{column}"
+
+
+# -----------------------------
+# Merge
+# -----------------------------
+def merge_dbs(target_path, source_paths, progress=None):
+    """
+    Merges every source database into target_path (created if missing) and returns a
+    stats dict. progress(path, rows_copied) is called after each source.
+    """
+    t0 = time.perf_counter()
+    conn = init_db(target_path)
+    conn.row_factory = None
+    # The target's own rollups and summaries must be complete before merged ones
+    # are stacked on top (the watermark jumps past the merged ids)
+    RollupManager.catch_up(conn)
+    BackfillManager.catch_up(conn, CATCH_UP_BATCH)
+
+    merged, skipped, rows = [], [], 0
+    conn.execute("PRAGMA foreign_keys = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("PRAGMA cache_size = -262144")   # 256 MiB
+    try:
+        index_sql = drop_bulk_indexes(conn)
+        conn.commit()
+
+        for path in source_paths:
+            # Bring the source up to the current schema with complete rollups/summaries
+            src = init_db(path)
+            try:
+                RollupManager.catch_up(src)
+                BackfillManager.catch_up(src, CATCH_UP_BATCH)
+            finally:
+                src.close()
+
+            conn.execute("ATTACH DATABASE ? AS src", (str(path),))
+            try:
+                if _already_merged(conn):
+                    skipped.append(str(path))
+                    continue
+                try:
+                    conn.execute("BEGIN")
+                    copied = _merge_source(conn)
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+                rows += copied
+                merged.append(str(path))
+                if progress is not None:
+                    progress(str(path), copied)
+            finally:
+                conn.execute("DROP TABLE IF EXISTS temp.merge_partition_map")
+                conn.execute("DETACH DATABASE src")
+
+        load_s = time.perf_counter() - t0
+        for sql in index_sql:
+            conn.execute(sql)
+        conn.commit()
+    finally:
+        conn.execute("PRAGMA foreign_keys = ON")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.close()
+
+    elapsed = time.perf_counter() - t0
+    return {
+        "merged":        merged,
+        "skipped":       skipped,
+        "rows":          rows,
+        "load_s":        load_s,
+        "seconds":       elapsed,
+        "rows_per_min":  rows / elapsed * 60 if elapsed else None,
+    }
+
+
+# -----------------------------
+# CLI
+# -----------------------------
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Merge per-machine telemetry databases into one")
+    parser.add_argument("--out", required=True, help="target database (created if missing)")
+    parser.add_argument("sources", nargs="+")
+    args = parser.parse_args(argv)
+
+    def progress(path, copied):
+        print(f"  {path}: {copied:,} rows")
+
+    stats = merge_dbs(args.out, args.sources, progress=progress)
+    for path in stats["skipped"]:
+        print(f"  {path}: skipped (already merged)")
+    print(f"Merged {len(stats['merged'])} databases, {stats['rows']:,} rows in {stats['seconds']:.1f} s "
+          f"({stats['rows_per_min']:,.0f} rows/min) into {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+# storage_service/storage/metrics.py
+# Author: Andrew Fox
+
+# Small in-process metrics registry for the storage service.
+# Background jobs (retention, checkpointing, the writer thread) publish counters,
+# gauges and timings here; the GUI or a debug script can read METRICS.snapshot().
+#
+# Usage:
+#   from storage_service.storage.metrics import METRICS
+#   METRICS.incr("retention.samples_deleted", 500)
+#   with METRICS.timer("retention.run_ms"):
+#       ...
+
+import threading
+import time
+from contextlib import contextmanager
+
+
+class MetricsRegistry:
+    # Thread-safe counters, gauges and timing summaries keyed by dotted name.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._timings = {}
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set_gauge(self, name, value):
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name, elapsed_ms):
+        """Records one timing sample; keeps count, total, max and last."""
+        with self._lock:
+            t = self._timings.setdefault(name, {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "last_ms": 0.0})
+            t["count"] += 1
+            t["total_ms"] += elapsed_ms
+            t["max_ms"] = max(t["max_ms"], elapsed_ms)
+            t["last_ms"] = elapsed_ms
+
+    @contextmanager
+    def timer(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, (time.perf_counter() - t0) * 1000)
+
+    def snapshot(self):
+        with self._lock:
+            timings = {
+                name: {**t, "mean_ms": t["total_ms"] / t["count"] if t["count"] else 0.0}
+                for name, t in self._timings.items()
+            }
+            return {
+                "counters": dict(self._counters),
+                "gauges":   dict(self._gauges),
+                "timings":  timings,
+            }
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._timings.clear()
+
+
+# Shared registry for the whole process
+METRICS = MetricsRegistry()
@@ -0,0 +1,163 @@
+# storage_service/storage/model_input.py
+# Author: Andrew Fox
+
+# Maintains the model_input table: one narrow row per tick with the 15 point inputs of
+# the analytics model, in FeatureExtractor order (analytics_service features.POINT_METRICS;
+# test_model_input.py keeps the two lists in step). StorageManager.insert_sample() writes
+# the row from the values it already has in hand, inside the tick's transaction, so
+# feature reads no longer join cpu/ram/gpu/disk_io and take MAX() over the partitions
+# for every tick: a session or a recent window is one primary-key range scan.
+# catch_up() fills sessions that have raw ticks but no rows (older files, bulk loads).
+#
+# Rows cascade away with their sample, so archived ticks (archive.py) are only in the
+# chunks; read_session() falls back to SessionArchiver.read_session() for those.
+#
+# Usage:
+#   from storage_service.storage.model_input import ModelInput
+#   cols = ModelInput.read_session(conn, session_id)     # dict of NumPy arrays
+#   cols = ModelInput.recent(conn, session_id, 10)       # last 10 ticks, oldest first
+
+from storage_service.storage.archive import SessionArchiver
+from storage_service.storage.columnar import fetch_columns, reverse_columns
+from storage_service.storage.queries import DISK_USAGE_SQL, GPU_POWER_LIMIT_SQL
+
+# Point inputs, in feature-vector order
+MODEL_INPUT_METRICS = (
+    "cpu_percent_total",
+    "freq_current_mhz",
+    "ram_usage_percent",
+    "swap_usage_percent",
+    "gpu_util_percent",
+    "gpu_mem_util_percent",
+    "gpu_temp_c",
+    "gpu_core_clock_mhz",
+    "gpu_power_usage_w",
+    "gpu_power_limit_w",
+    "avg_read_latency_ms",
+    "avg_write_latency_ms",
+    "read_speed_bytes",
+    "write_speed_bytes",
+    "disk_usage_percent",
+)
+
+MODEL_INPUT_NAMES = ["sample_id", "ts_unix_ms", *MODEL_INPUT_METRICS]
+
+_INSERT_SQL = """
+    INSERT INTO model_input (session_id, sample_id, ts_unix_ms, {columns})
+    VALUES (?, ?, ?, {placeholders})
+""".format(
+    columns=", ".join(MODEL_INPUT_METRICS),
+    placeholders=", ".join("?" * len(MODEL_INPUT_METRICS)),
+)
+
+# Same values the tick queries read (queries.py), for one session's raw ticks
+_SOURCE_EXPRESSIONS = {
+    "cpu_percent_total":    "c.cpu_percent_total",
+    "freq_current_mhz":     "c.freq_current_mhz",
+    "ram_usage_percent":    "r.ram_usage_percent",
+    "swap_usage_percent":   "r.swap_usage_percent",
+    "gpu_util_percent":     "g.gpu_util_percent",
+    "gpu_mem_util_percent": "g.gpu_mem_util_percent",
+    "gpu_temp_c":           "g.gpu_temp_c",
+    "gpu_core_clock_mhz":   "g.gpu_core_clock_mhz",
+    "gpu_power_usage_w":    "g.gpu_power_usage_w",
+    "gpu_power_limit_w":    GPU_POWER_LIMIT_SQL,
+    "avg_read_latency_ms":  "d.avg_read_latency_ms",
+    "avg_write_latency_ms": "d.avg_write_latency_ms",
+    "read_speed_bytes":     "d.read_speed_bytes",
+    "write_speed_bytes":    "d.write_speed_bytes",
+    "disk_usage_percent":   DISK_USAGE_SQL,
+}
+
+_REBUILD_SQL = """
+    INSERT OR REPLACE INTO model_input (session_id, sample_id, ts_unix_ms, {columns})
+    SELECT s.session_id, s.sample_id, s.ts_unix_ms, {expressions}
+    FROM sample s
+    LEFT JOIN cpu_sample     c ON c.sample_id = s.sample_id
+    LEFT JOIN ram_sample     r ON r.sample_id = s.sample_id
+    LEFT JOIN gpu_sample     g ON g.sample_id = s.sample_id AND g.gpu_id = 0
+    LEFT JOIN disk_io_sample d ON d.sample_id = s.sample_id
+    WHERE s.session_id = ?
+""".format(
+    columns=", ".join(MODEL_INPUT_METRICS),
+    expressions=", ".join(_SOURCE_EXPRESSIONS[m] for m in MODEL_INPUT_METRICS),
+)
+
+_SELECT = f"SELECT sample_id, ts_unix_ms, {', '.join(MODEL_INPUT_METRICS)} FROM model_input"
+
+# Whole session, oldest first. Params: (session_id,)
+SESSION_SQL = f"{_SELECT} WHERE session_id = ? ORDER BY sample_id"
+
+# Last N ticks of one session, newest first. Params: (session_id, n)
+RECENT_SQL = f"{_SELECT} WHERE session_id = ? ORDER BY sample_id DESC LIMIT ?"
+
+
+class ModelInput:
+    # Stateless helpers around the model_input table.
+
+    # -----------------------------
+    # Write path
+    # -----------------------------
+    @staticmethod
+    def apply_tick(conn, session_id, sample_id, ts_unix_ms, values):
+        """
+        Writes one tick's row. values maps metric name -> value (missing/None -> NULL).
+        Must be called inside the caller's insert transaction.
+        """
+        conn.execute(
+            _INSERT_SQL,
+            (session_id, sample_id, ts_unix_ms, *(values.get(m) for m in MODEL_INPUT_METRICS)),
+        )
+
+    @staticmethod
+    def rebuild(conn, session_id):
+        """(Re)writes rows for every raw tick of one session. Caller commits."""
+        conn.execute(_REBUILD_SQL, (session_id,))
+
+    @staticmethod
+    def catch_up(conn, stop=None):
+        """
+        Fills sessions that have raw ticks but no model_input rows, one transaction per
+        session. Returns the number of sessions filled; stop() (if given) is checked
+        between sessions.
+        """
+        missing = [
+            row[0] for row in conn.execute(
+                """SELECT se.session_id FROM session se
+                   WHERE NOT EXISTS (SELECT 1 FROM model_input m WHERE m.session_id = se.session_id)
+                     AND EXISTS (SELECT 1 FROM sample s WHERE s.session_id = se.session_id)"""
+            )
+        ]
+        for i, session_id in enumerate(missing):
+            if stop is not None and stop():
+                return i
+            try:
+                conn.execute("BEGIN IMMEDIATE")     # the backfill job runs this beside the writer
+                ModelInput.rebuild(conn, session_id)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return len(missing)
+
+    # -----------------------------
+    # Read path (dict of NumPy arrays, oldest first, NaN = missing)
+    # -----------------------------
+    @staticmethod
+    def recent(conn, session_id, n):
+        cols = fetch_columns(conn, RECENT_SQL, (session_id, n), MODEL_INPUT_NAMES, size_hint=n)
+        return reverse_columns(cols)
+
+    @staticmethod
+    def read_session(conn, session_id):
+        """
+        Every tick of one session. Sessions with archived chunks are read through
+        SessionArchiver.read_session(), since their archived ticks have no rows here.
+        """
+        archived = conn.execute(
+            "SELECT EXISTS (SELECT 1 FROM sample_chunk WHERE session_id = ?)", (session_id,)
+        ).fetchone()[0]
+        if archived:
+            cols = SessionArchiver.read_session(conn, session_id)
+            return {name: cols[name] for name in MODEL_INPUT_NAMES}
+        return fetch_columns(conn, SESSION_SQL, (session_id,), MODEL_INPUT_NAMES)
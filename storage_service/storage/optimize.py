@@ -0,0 +1,94 @@
+# storage_service/storage/optimize.py
+# Author: Andrew Fox
+
+# Keeps the query planner's statistics (sqlite_stat1) fresh. Without them SQLite guesses
+# index selectivity; the hot queries are written to pick the right index anyway
+# (test_query_plans.py checks the plans both with and without statistics), but
+# ad-hoc / export / analytics queries benefit as the tables grow.
+#   OptimizeManager   background job: ANALYZE every interval_s on its own connection
+#   close_optimize()  PRAGMA optimize on a connection that is about to close, which
+#                     re-analyses the tables its own queries used if they changed a lot
+# analysis_limit bounds both to a sample of rows per index, so a run takes milliseconds
+# at any table size instead of a full scan of a 100M-row index under the write lock.
+#
+# Metrics (METRICS, optimize.*): runs / errors counters, ms timing, stat_rows gauge.
+#
+# Usage:
+#   from storage_service.storage.optimize import OptimizeManager
+#   job = OptimizeManager("telemetry.db", {"interval_s": 21600})
+#   job.start()          # background thread, runs every interval_s
+#   ...
+#   job.stop()
+
+import threading
+import time
+
+from storage_service.storage.metrics import METRICS
+from storage_service.storage.schema import connect
+
+DEFAULT_POLICY = {
+    "interval_s":     21600,   # 6 h
+    "analysis_limit": 1000,    # rows sampled per index (0 = whole index)
+}
+
+
+def close_optimize(conn, analysis_limit=DEFAULT_POLICY["analysis_limit"]):
+    """PRAGMA optimize, as SQLite recommends before closing a long-lived connection."""
+    conn.execute(f"PRAGMA analysis_limit = {int(analysis_limit)};")
+    conn.execute("PRAGMA optimize;")
+
+
+class OptimizeManager:
+    # Refreshes planner statistics for one database, either on demand or on a timer.
+
+    def __init__(self, db_path="telemetry.db", policy=None, conn=None):
+        self.db_path = db_path
+        self.policy = {**DEFAULT_POLICY, **(policy or {})}
+        self._conn = conn
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_stats = None
+
+    # -----------------------------
+    # Background job
+    # -----------------------------
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="OptimizeManager", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _loop(self):
+        while not self._stop.wait(self.policy["interval_s"]):
+            try:
+                self.run()
+            except Exception:
+                METRICS.incr("optimize.errors")
+
+    # -----------------------------
+    # One run
+    # -----------------------------
+    def run(self):
+        """Runs ANALYZE once (bounded by analysis_limit) and returns a stats dict."""
+        conn = self._conn if self._conn is not None else connect(self.db_path)
+        try:
+            t0 = time.perf_counter()
+            conn.execute(f"PRAGMA analysis_limit = {int(self.policy['analysis_limit'])};")
+            conn.execute("ANALYZE;")
+            conn.commit()
+            elapsed_ms = (time.perf_counter() - t0) * 1000
+            stat_rows = conn.execute("SELECT COUNT(*) FROM sqlite_stat1").fetchone()[0]
+        finally:
+            if conn is not self._conn:
+                conn.close()
+
+        stats = {"stat_rows": stat_rows, "elapsed_ms": elapsed_ms}
+        METRICS.incr("optimize.runs")
+        METRICS.set_gauge("optimize.stat_rows", stat_rows)
+        METRICS.observe("optimize.ms", elapsed_ms)
+        self.last_stats = stats
+        return stats
@@ -0,0 +1,208 @@
+# storage_service/storage/queries.py
+# Author: Andrew Fox
+
+# Hot read queries shared by StorageManager, AnalyticsThread and the tests.
+# Each query returns one row per tick and is written so SQLite can walk an index in
+# ts_unix_ms order and stop after LIMIT rows (no GROUP BY, no temp B-tree):
+#   - sample rows come from idx_sample_session_ts / idx_sample_ts
+#   - GPU 0 is found through idx_gpu_sample_sample_gpu
+#   - disk usage is a correlated MAX() over the covering idx_disk_part_sample_usage
+# storage_service/tests/test_query_plans.py pins the EXPLAIN QUERY PLAN output.
+#
+# Tick rows carry GPU 0 and the busiest partition only. Every device is read with a
+# second query per device table that joins the same LIMITed window of sample ids, so a
+# host with G GPUs and P partitions returns n tick rows plus n*G + n*P device rows
+# (never n*G*P) and LIMIT always means ticks.
+#
+# Sessions written in change-only mode (change_encoding.py) store partition rows and GPU
+# power limits on keyframe ticks only. Disk usage and the power limit fall back to the
+# session's last keyframe at or before the tick (one change_keyframe seek), and device
+# rows come from the *_locf views; dense sessions never reach the fallback.
+
+# Numeric per-tick metrics, in column order (also the columnar API's array names)
+TICK_METRICS = [
+    "cpu_percent_total", "freq_current_mhz",
+    "used_ram_gb", "ram_usage_percent", "swap_usage_percent",
+    "gpu_util_percent", "gpu_mem_util_percent", "gpu_mem_used_mb",
+    "gpu_temp_c", "gpu_core_clock_mhz", "gpu_power_usage_w", "gpu_power_limit_w",
+    "read_speed_bytes", "write_speed_bytes",
+    "avg_read_latency_ms", "avg_write_latency_ms",
+    "disk_usage_percent",
+]
+
+# Last change_keyframe of a kind at or before tick s of its session
+_KEYFRAME_SQL = """(SELECT MAX(k.sample_id) FROM change_keyframe k
+      WHERE k.session_id = s.session_id AND k.kind = '{kind}' AND k.sample_id <= s.sample_id)"""
+
+# Fullest partition on tick s (needs alias s)
+DISK_USAGE_SQL = f"""COALESCE(
+      (SELECT MAX(dp.usage_percent) FROM disk_partition_sample dp WHERE dp.sample_id = s.sample_id),
+      (SELECT MAX(dp.usage_percent) FROM disk_partition_sample dp
+        WHERE dp.sample_id = {_KEYFRAME_SQL.format(kind="partition")}))"""
+
+# Power limit of GPU row g on tick s (needs aliases s and g)
+GPU_POWER_LIMIT_SQL = f"""COALESCE(g.gpu_power_limit_w,
+      (SELECT gk.gpu_power_limit_w FROM gpu_sample gk
+        WHERE gk.sample_id = {_KEYFRAME_SQL.format(kind="gpu")} AND gk.gpu_uuid = g.gpu_uuid))"""
+
+_METRIC_COLUMNS = f"""
+    c.cpu_percent_total, c.freq_current_mhz,
+    r.used_ram_gb, r.ram_usage_percent, r.swap_usage_percent,
+    g.gpu_util_percent, g.gpu_mem_util_percent, g.gpu_mem_used_mb,
+    g.gpu_temp_c, g.gpu_core_clock_mhz, g.gpu_power_usage_w,
+    {GPU_POWER_LIMIT_SQL} AS gpu_power_limit_w,
+    d.read_speed_bytes, d.write_speed_bytes,
+    d.avg_read_latency_ms, d.avg_write_latency_ms,
+    {DISK_USAGE_SQL} AS disk_usage_percent
+"""
+
+_TICK_COLUMNS = "s.sample_id, s.ts_iso, s.ts_unix_ms," + _METRIC_COLUMNS
+TICK_NAMES = ["sample_id", "ts_iso", "ts_unix_ms"] + TICK_METRICS
+
+# Columnar reads skip ts_iso so every column is numeric
+COLUMNAR_NAMES = ["sample_id", "ts_unix_ms"] + TICK_METRICS
+_COLUMNAR_COLUMNS = "s.sample_id, s.ts_unix_ms," + _METRIC_COLUMNS
+
+_TICK_JOINS = """
+    FROM sample s
+    LEFT JOIN cpu_sample     c ON c.sample_id = s.sample_id
+    LEFT JOIN ram_sample     r ON r.sample_id = s.sample_id
+    LEFT JOIN gpu_sample     g ON g.sample_id = s.sample_id AND g.gpu_id = 0
+    LEFT JOIN disk_io_sample d ON d.sample_id = s.sample_id
+"""
+
+# Last N ticks of one session, newest first. Params: (session_id, n)
+RECENT_SESSION_SQL = f"""
+    SELECT {_TICK_COLUMNS}
+    {_TICK_JOINS}
+    WHERE s.session_id = ?
+    ORDER BY s.ts_unix_ms DESC, s.sample_id DESC
+    LIMIT ?
+"""
+
+# Last N ticks across every session, newest first. Params: (n,)
+RECENT_ALL_SQL = f"""
+    SELECT {_TICK_COLUMNS}
+    {_TICK_JOINS}
+    ORDER BY s.ts_unix_ms DESC, s.sample_id DESC
+    LIMIT ?
+"""
+
+# One page of [start_ms, end_ms) across sessions, oldest first, resuming after the keyset
+# cursor (ts_unix_ms, sample_id) of the previous page's last row. idx_sample_ts holds
+# (ts_unix_ms, rowid), so the row-value comparison is an index seek and every page costs
+# the same wherever it starts. First page: cursor (start_ms, 0).
+# Params: (cursor_ts_ms, cursor_sample_id, end_ms, page_size)
+RANGE_PAGE_NAMES = ["sample_id", "session_id", "ts_iso", "ts_unix_ms"] + TICK_METRICS
+RANGE_PAGE_SQL = f"""
+    SELECT s.sample_id, s.session_id, s.ts_iso, s.ts_unix_ms, {_METRIC_COLUMNS}
+    {_TICK_JOINS}
+    WHERE (s.ts_unix_ms, s.sample_id) > (?, ?) AND s.ts_unix_ms < ?
+    ORDER BY s.ts_unix_ms, s.sample_id
+    LIMIT ?
+"""
+
+# Columnar variants (numeric columns only, see COLUMNAR_NAMES)
+# Whole session, oldest first. Params: (session_id,)
+SESSION_COLUMNS_SQL = f"""
+    SELECT {_COLUMNAR_COLUMNS}
+    {_TICK_JOINS}
+    WHERE s.session_id = ?
+    ORDER BY s.ts_unix_ms, s.sample_id
+"""
+
+# Time range [start_ms, end_ms) across sessions, oldest first. Params: (start_ms, end_ms)
+RANGE_COLUMNS_SQL = f"""
+    SELECT {_COLUMNAR_COLUMNS}
+    {_TICK_JOINS}
+    WHERE s.ts_unix_ms >= ? AND s.ts_unix_ms < ?
+    ORDER BY s.ts_unix_ms, s.sample_id
+"""
+
+# Last N ticks of one session, newest first. Params: (session_id, n)
+RECENT_COLUMNS_SQL = f"""
+    SELECT {_COLUMNAR_COLUMNS}
+    {_TICK_JOINS}
+    WHERE s.session_id = ?
+    ORDER BY s.ts_unix_ms DESC, s.sample_id DESC
+    LIMIT ?
+"""
+
+# Per-device rows for the same windows. No ORDER BY (that would need a temp B-tree over
+# the join); StorageManager groups rows by sample_id and sorts each tick's few devices.
+_RECENT_SESSION_IDS = """
+    SELECT sample_id FROM sample
+    WHERE session_id = ?
+    ORDER BY ts_unix_ms DESC, sample_id DESC
+    LIMIT ?
+"""
+
+_RECENT_ALL_IDS = """
+    SELECT sample_id FROM sample
+    ORDER BY ts_unix_ms DESC, sample_id DESC
+    LIMIT ?
+"""
+
+GPU_DEVICE_COLUMNS = [
+    "gpu_id", "gpu_uuid",
+    "gpu_util_percent", "gpu_mem_util_percent", "gpu_mem_used_mb",
+    "gpu_temp_c", "gpu_core_clock_mhz", "gpu_power_usage_w", "gpu_power_limit_w",
+]
+
+PARTITION_DEVICE_COLUMNS = [
+    "partition_id", "device", "mountpoint", "total_gb", "used_gb", "usage_percent",
+]
+
+
+def _gpu_sql(ids_sql):
+    return f"""
+    SELECT g.sample_id, {", ".join("g." + c for c in GPU_DEVICE_COLUMNS)}
+    FROM ({ids_sql}) t
+    JOIN gpu_sample_locf g ON g.sample_id = t.sample_id
+"""
+
+
+def _partition_sql(ids_sql):
+    return f"""
+    SELECT dp.sample_id, dp.partition_id, p.device, p.mountpoint,
+           dp.total_gb, dp.used_gb, dp.usage_percent
+    FROM ({ids_sql}) t
+    JOIN disk_partition_sample_locf dp ON dp.sample_id = t.sample_id
+    JOIN disk_partition             p  ON p.partition_id = dp.partition_id
+"""
+
+
+# Params match RECENT_SESSION_SQL / RECENT_ALL_SQL
+RECENT_SESSION_GPUS_SQL = _gpu_sql(_RECENT_SESSION_IDS)
+RECENT_SESSION_PARTITIONS_SQL = _partition_sql(_RECENT_SESSION_IDS)
+RECENT_ALL_GPUS_SQL = _gpu_sql(_RECENT_ALL_IDS)
+RECENT_ALL_PARTITIONS_SQL = _partition_sql(_RECENT_ALL_IDS)
+
+# Last N ticks across every session with their session id, newest first (hot tier
+# refill on startup). Params: (n,)
+HOT_REFILL_NAMES = ["session_id"] + COLUMNAR_NAMES
+HOT_REFILL_SQL = f"""
+    SELECT s.session_id, {_COLUMNAR_COLUMNS}
+    {_TICK_JOINS}
+    ORDER BY s.ts_unix_ms DESC, s.sample_id DESC
+    LIMIT ?
+"""
+
+# Tick count for one session (answered from idx_sample_session_ts alone). Params: (session_id,)
+SESSION_COUNT_SQL = "SELECT COUNT(*) FROM sample WHERE session_id = ?"
+
+# Every hot query with representative parameters, for plan checks
+HOT_QUERIES = {
+    "recent_session":  (RECENT_SESSION_SQL, (1, 10)),
+    "recent_all":      (RECENT_ALL_SQL, (10,)),
+    "session_count":   (SESSION_COUNT_SQL, (1,)),
+    "session_columns": (SESSION_COLUMNS_SQL, (1,)),
+    "range_columns":   (RANGE_COLUMNS_SQL, (0, 1000)),
+    "recent_columns":  (RECENT_COLUMNS_SQL, (1, 10)),
+    "recent_session_gpus":       (RECENT_SESSION_GPUS_SQL, (1, 10)),
+    "recent_session_partitions": (RECENT_SESSION_PARTITIONS_SQL, (1, 10)),
+    "recent_all_gpus":           (RECENT_ALL_GPUS_SQL, (10,)),
+    "recent_all_partitions":     (RECENT_ALL_PARTITIONS_SQL, (10,)),
+    "hot_refill":      (HOT_REFILL_SQL, (10,)),
+    "range_page":      (RANGE_PAGE_SQL, (0, 0, 1000, 10)),
+}
@@ -0,0 +1,227 @@
+# storage_service/storage/query_cache.py
+# Author: Andrew Fox
+
+# Result cache for repeated reads. The dashboard, analytics and export paths run the same
+# recent-window and aggregate queries many times between two ticks; telemetry only grows
+# at the end, so a result stays valid until the next sample is written. Entries are keyed
+# by (normalised SQL, parameters, watermark) where the watermark is MAX(sample_id), one
+# seek at the end of the sample rowid tree, read in the same read transaction as the
+# query. When a newer watermark is seen, entries for older ones are dropped as stale.
+#
+# Deletes and rewrites don't move the watermark, so retention.py and archive.py call
+# invalidate_query_cache(conn) after they change rows; that bumps an epoch that is also
+# part of the key.
+#
+# Entries are evicted least recently used first once their estimated size passes
+# max_bytes. Cached values are shared, so row lists are handed out as copies and NumPy
+# arrays are read-only. Counters: hits / misses / stale / evictions (also published to
+# METRICS, query_cache.*). Reads on a connection with an open write transaction bypass
+# the cache (counted as bypassed).
+#
+# Caches are shared through a process-wide registry keyed by database path, like
+# hot_tier.get_hot_tier().
+#
+# Usage:
+#   from storage_service.storage.query_cache import get_query_cache
+#   cache = get_query_cache("telemetry.db")
+#   rows = cache.fetchall(conn, RECENT_SESSION_SQL, (session_id, 10))
+#   cols = cache.fetch_columns(conn, SESSION_COLUMNS_SQL, (session_id,), COLUMNAR_NAMES)
+
+import re
+import sys
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+from storage_service.storage.columnar import fetch_columns
+from storage_service.storage.metrics import METRICS
+
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+
+# A single entry may use at most this share of max_bytes
+_MAX_ENTRY_SHARE = 4
+
+# Quoted literals are kept as they are; whitespace elsewhere collapses to one space
+_SQL_TOKENS = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")|\s+""")
+
+
+def normalise_sql(sql):
+    return _SQL_TOKENS.sub(lambda m: m.group(1) or " ", sql).strip()
+
+
+def _estimate_bytes(value, depth=0):
+    if isinstance(value, np.ndarray):
+        return value.nbytes + 112
+    size = sys.getsizeof(value)
+    if depth > 2:
+        return size
+    if isinstance(value, dict):
+        return size + sum(_estimate_bytes(k, depth + 1) + _estimate_bytes(v, depth + 1) for k, v in value.items())
+    if isinstance(value, (list, tuple)) or hasattr(value, "keys"):   # sqlite3.Row included
+        return size + sum(_estimate_bytes(v, depth + 1) for v in value)
+    return size
+
+
+class QueryCache:
+    # LRU of query results for one database; safe to share between threads.
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()   # key -> (value, nbytes)
+        self._bytes = 0
+        self._watermark = None          # newest watermark seen
+        self._epoch = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+        self.bypassed = 0
+
+    # -----------------------------
+    # Reads
+    # -----------------------------
+    def fetchall(self, conn, sql, params=()):
+        """conn.execute(sql, params).fetchall(), cached. Returns a new list of the shared rows."""
+        rows = self.get_or_compute(conn, sql, params, lambda: tuple(conn.execute(sql, params).fetchall()))
+        return list(rows)
+
+    def fetch_columns(self, conn, sql, params, names, size_hint=None):
+        """columnar.fetch_columns(), cached. size_hint may be a callable, evaluated on a miss only."""
+        def compute():
+            hint = size_hint() if callable(size_hint) else size_hint
+            return fetch_columns(conn, sql, params, names, size_hint=hint)
+
+        return self.columns(conn, sql, params, compute, kind=("columns", tuple(names)))
+
+    def columns(self, conn, label, params, compute, kind="columns"):
+        """get_or_compute() for a dict of NumPy arrays. Returns a new dict of read-only arrays."""
+        def frozen():
+            cols = compute()
+            for values in cols.values():
+                values.setflags(write=False)
+            return cols
+
+        return dict(self.get_or_compute(conn, label, params, frozen, kind=kind))
+
+    def get_or_compute(self, conn, sql, params, compute, kind="rows"):
+        """
+        Returns the cached value for (sql, params, kind) at the current watermark, or runs
+        compute() and caches what it returns. sql may also be any label naming the
+        computation. The watermark and compute() share one read transaction.
+        """
+        if conn.in_transaction:
+            # Uncommitted writes may still roll back; their watermark can't key a result
+            with self._lock:
+                self.bypassed += 1
+            return compute()
+
+        conn.execute("BEGIN")
+        try:
+            watermark = conn.execute("SELECT MAX(sample_id) FROM sample").fetchone()[0] or 0
+            with self._lock:
+                if self._watermark is None or watermark > self._watermark:
+                    self._drop_older(watermark)
+                key = (normalise_sql(sql), tuple(params), kind, watermark, self._epoch)
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    METRICS.incr("query_cache.hits")
+                    return entry[0]
+                self.misses += 1
+            METRICS.incr("query_cache.misses")
+            value = compute()
+        finally:
+            conn.rollback()
+
+        self._store(key, value)
+        return value
+
+    # -----------------------------
+    # Maintenance
+    # -----------------------------
+    def invalidate(self):
+        """Drops every entry; results computed before this call are not stored."""
+        with self._lock:
+            self._epoch += 1
+            self._watermark = None      # deletes may have lowered it
+            self.stale += len(self._entries)
+            self._entries.clear()
+            self._bytes = 0
+            self._publish()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits":      self.hits,
+                "misses":    self.misses,
+                "hit_rate":  self.hits / lookups if lookups else None,
+                "stale":     self.stale,
+                "evictions": self.evictions,
+                "bypassed":  self.bypassed,
+                "entries":   len(self._entries),
+                "bytes":     self._bytes,
+                "watermark": self._watermark,
+            }
+
+    def _drop_older(self, watermark):
+        # Caller holds the lock
+        self._watermark = watermark
+        for key in [k for k in self._entries if k[3] < watermark]:
+            self._bytes -= self._entries.pop(key)[1]
+            self.stale += 1
+            METRICS.incr("query_cache.stale")
+        self._publish()
+
+    def _store(self, key, value):
+        nbytes = _estimate_bytes(value)
+        if nbytes > self.max_bytes // _MAX_ENTRY_SHARE:
+            return
+        with self._lock:
+            # Skip results that went stale while they were computed
+            if key[4] != self._epoch or key[3] < (self._watermark or 0) or key in self._entries:
+                return
+            self._entries[key] = (value, nbytes)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                _, (_, dropped) = self._entries.popitem(last=False)
+                self._bytes -= dropped
+                self.evictions += 1
+                METRICS.incr("query_cache.evictions")
+            self._publish()
+
+    def _publish(self):
+        METRICS.set_gauge("query_cache.bytes", self._bytes)
+        METRICS.set_gauge("query_cache.entries", len(self._entries))
+
+
+# -----------------------------
+# Process-wide registry
+# -----------------------------
+_CACHES = {}
+_CACHES_LOCK = threading.Lock()
+
+
+def get_query_cache(db_path="telemetry.db", max_bytes=DEFAULT_MAX_BYTES):
+    """Returns the process-wide cache for db_path, creating it on first use."""
+    key = str(Path(db_path).resolve())
+    with _CACHES_LOCK:
+        cache = _CACHES.get(key)
+        if cache is None:
+            cache = _CACHES[key] = QueryCache(max_bytes)
+        return cache
+
+
+def invalidate_query_cache(conn):
+    """Invalidates the registered cache for conn's database file, if there is one."""
+    path = conn.execute("PRAGMA database_list").fetchone()[2]
+    if not path:
+        return   # in-memory database
+    with _CACHES_LOCK:
+        cache = _CACHES.get(str(Path(path).resolve()))
+    if cache is not None:
+        cache.invalidate()
@@ -0,0 +1,137 @@
+# storage_service/storage/read_pool.py
+# Author: Andrew Fox
+
+# Pool of read-only connections for the GUI, analytics and export paths.
+# Connections are opened with the mode=ro URI (a reader can never take the write lock)
+# and the same busy/temp pragmas as schema.connect(), plus query_only as a second guard.
+#
+# Borrows are short: connection() hands out a connection for one statement or a few
+# independent ones. snapshot() wraps the borrow in a read transaction so several
+# statements see the same committed state; keep it short, because an open read
+# transaction stops the WAL checkpoint from advancing past it. Wait and hold times are
+# published to METRICS (read_pool.*).
+#
+# Usage:
+#   from storage_service.storage.read_pool import get_read_pool
+#   pool = get_read_pool("telemetry.db")
+#   with pool.snapshot() as conn:
+#       count = conn.execute(SESSION_COUNT_SQL, (sid,)).fetchone()[0]
+#       rows  = conn.execute(RECENT_SESSION_SQL, (sid, 10)).fetchall()
+
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from storage_service.storage.metrics import METRICS
+
+DEFAULT_POOL_SIZE = 4
+BORROW_TIMEOUT_S = 10.0
+
+
+class ReadPool:
+    # Fixed-size pool; connections are created lazily and reused across threads
+    # (one borrower at a time per connection).
+
+    def __init__(self, db_path="telemetry.db", size=DEFAULT_POOL_SIZE):
+        self.db_path = Path(db_path)
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _open(self):
+        conn = sqlite3.connect(
+            f"{self.db_path.resolve().as_uri()}?mode=ro", uri=True, check_same_thread=False
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA query_only = ON;")
+        conn.execute("PRAGMA temp_store = MEMORY;")
+        conn.execute("PRAGMA busy_timeout = 5000;")  # ms
+        return conn
+
+    def _acquire(self, timeout_s):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return self._open()
+                except Exception:
+                    self._created -= 1
+                    raise
+        try:
+            return self._idle.get(timeout=timeout_s)
+        except queue.Empty:
+            METRICS.incr("read_pool.timeouts")
+            raise TimeoutError(f"No read connection free after {timeout_s}s") from None
+
+    def _release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        if self._closed:
+            conn.close()
+        else:
+            self._idle.put(conn)
+
+    # -----------------------------
+    # Borrowing
+    # -----------------------------
+    @contextmanager
+    def connection(self, timeout_s=BORROW_TIMEOUT_S):
+        """Borrows a read-only connection (autocommit reads) for the duration of the block."""
+        if self._closed:
+            raise RuntimeError("ReadPool is closed")
+        t0 = time.perf_counter()
+        conn = self._acquire(timeout_s)
+        t1 = time.perf_counter()
+        METRICS.observe("read_pool.wait_ms", (t1 - t0) * 1000)
+        METRICS.incr("read_pool.borrows")
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+            METRICS.observe("read_pool.hold_ms", (time.perf_counter() - t1) * 1000)
+
+    @contextmanager
+    def snapshot(self, timeout_s=BORROW_TIMEOUT_S):
+        """Borrows a connection inside one read transaction: every statement sees the same data."""
+        with self.connection(timeout_s) as conn:
+            t0 = time.perf_counter()
+            conn.execute("BEGIN")
+            # BEGIN is deferred; the first read pins the snapshot
+            conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchone()
+            try:
+                yield conn
+            finally:
+                conn.rollback()
+                METRICS.observe("read_pool.snapshot_ms", (time.perf_counter() - t0) * 1000)
+
+    def close(self):
+        """Closes idle connections; borrowed ones are closed when they come back."""
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def get_read_pool(db_path="telemetry.db", size=DEFAULT_POOL_SIZE):
+    """Returns the process-wide pool for db_path, creating it on first use."""
+    key = str(Path(db_path).resolve())
+    with _POOLS_LOCK:
+        pool = _POOLS.get(key)
+        if pool is None or pool._closed:
+            pool = _POOLS[key] = ReadPool(db_path, size)
+        return pool
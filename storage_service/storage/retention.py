@@ -0,0 +1,372 @@
+# storage_service/storage/retention.py
+# Author: Andrew Fox
+
+# Retention and downsampling policy for telemetry.db.
+# Raw ticks can be limited to a window (raw_days, off unless set; rollups.py keeps the
+# downsampled history), older rollup resolutions expire on their own schedules, and an optional size cap
+# trims the oldest data until the file fits. Deletes run in small committed chunks so
+# the StorageThread writer is never blocked for long, and freed pages are returned to
+# the OS with PRAGMA incremental_vacuum.
+#
+# Files created before auto_vacuum was enabled keep freed pages on the freelist, where
+# new inserts reuse them. Switching them over needs a full VACUUM, which rewrites the
+# file under the write lock, so the background job never does it; run it offline:
+#   python -m storage_service.storage.retention --enable-incremental-vacuum telemetry.db
+#
+# Usage:
+#   from storage_service.storage.retention import RetentionManager
+#   job = RetentionManager("telemetry.db", {"raw_days": 7})
+#   job.start()          # background thread, runs every interval_s
+#   ...
+#   job.stop()
+#
+# With the sharded layout (sharding.py) pass shards=ShardCatalog(...): raw retention then
+# drops whole shard files and the rollup policy applies to the catalog database.
+
+import threading
+import time
+
+from storage_service.storage.change_encoding import ChangeEncoder
+from storage_service.storage.metrics import METRICS
+from storage_service.storage.query_cache import invalidate_query_cache
+from storage_service.storage.rollups import RESOLUTIONS_MS, RollupManager
+from storage_service.storage.schema import init_db
+from storage_service.storage.zone_maps import ZoneMap
+
+DAY_MS = 86_400_000
+
+# None means "keep forever"; deleting raw (and archived) ticks is opt-in
+DEFAULT_POLICY = {
+    "raw_days":       None,
+    "rollup_1m_days": 90,
+    "rollup_1h_days": None,
+    "rollup_1d_days": None,
+    "max_db_mb":      None,
+    "chunk_size":     5000,   # rows per DELETE transaction
+    "chunk_pause_ms": 20,     # gap between chunks so the writer can get in
+    "interval_s":     3600,
+}
+
+VACUUM_STEP_PAGES = 2000
+
+
+class RetentionManager:
+    # Applies a retention policy to one database, either on demand or on a timer.
+
+    def __init__(self, db_path="telemetry.db", policy=None, conn=None, shards=None):
+        self.shards = shards
+        self.db_path = shards.catalog_path if shards is not None else db_path
+        self.policy = {**DEFAULT_POLICY, **(policy or {})}
+        self._conn = conn
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_stats = None
+
+    # -----------------------------
+    # Background job
+    # -----------------------------
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="RetentionManager", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _loop(self):
+        # The thread owns its own connection; sqlite3 connections are not shared across threads
+        self._conn = init_db(self.db_path)
+        try:
+            while not self._stop.is_set():
+                try:
+                    self.run()
+                except Exception:
+                    METRICS.incr("retention.errors")
+                self._stop.wait(self.policy["interval_s"])
+        finally:
+            self._conn.close()
+            self._conn = None
+
+    # -----------------------------
+    # One retention pass
+    # -----------------------------
+    def run(self, now_ms=None):
+        """Applies the policy once and returns a stats dict (also published to METRICS)."""
+        conn = self._conn if self._conn is not None else init_db(self.db_path)
+        now_ms = int(time.time() * 1000) if now_ms is None else now_ms
+        t0 = time.perf_counter()
+
+        stats = {
+            "samples_deleted":      0,
+            "rollup_rows_deleted":  0,
+            "sketch_rows_deleted":  0,
+            "pages_vacuumed":       0,
+            "size_cap_samples_deleted": 0,
+            "shards_dropped":       0,
+            "chunks_deleted":       0,
+            "zone_chunks_deleted":  0,
+        }
+
+        try:
+            # Never drop raw ticks that have not been downsampled yet
+            RollupManager.catch_up(conn)
+
+            if self.policy["raw_days"] is not None:
+                cutoff = now_ms - self.policy["raw_days"] * DAY_MS
+                if self.shards is not None:
+                    stats["shards_dropped"] += self.shards.drop_before(cutoff)
+                else:
+                    stats["samples_deleted"] += self._delete_samples_before(conn, cutoff)
+                    stats["chunks_deleted"] += self._delete_chunks_before(conn, cutoff)
+                    stats["zone_chunks_deleted"] += self._prune_zone_maps(conn)
+
+            for name, res_ms in RESOLUTIONS_MS.items():
+                days = self.policy.get(f"rollup_{name}_days")
+                if days is not None:
+                    cutoff = now_ms - days * DAY_MS
+                    stats["rollup_rows_deleted"] += self._delete_rollups_before(conn, res_ms, cutoff)
+                    stats["sketch_rows_deleted"] += self._delete_sketches_before(conn, res_ms, cutoff)
+
+            stats["pages_vacuumed"] += self._incremental_vacuum(conn)
+
+            if self.policy["max_db_mb"] is not None:
+                deleted, chunks, vacuumed = self._enforce_size_cap(conn, self.policy["max_db_mb"] * 1024 * 1024)
+                stats["size_cap_samples_deleted"] = deleted
+                stats["chunks_deleted"] += chunks
+                if deleted or chunks:
+                    stats["zone_chunks_deleted"] += self._prune_zone_maps(conn)
+                stats["pages_vacuumed"] += vacuumed
+        finally:
+            stats["db_size_bytes"] = self.db_size_bytes(conn)
+            if conn is not self._conn:
+                conn.close()
+
+        stats["elapsed_ms"] = (time.perf_counter() - t0) * 1000
+
+        METRICS.incr("retention.runs")
+        METRICS.incr("retention.samples_deleted", stats["samples_deleted"] + stats["size_cap_samples_deleted"])
+        METRICS.incr("retention.rollup_rows_deleted", stats["rollup_rows_deleted"])
+        METRICS.incr("retention.sketch_rows_deleted", stats["sketch_rows_deleted"])
+        METRICS.incr("retention.pages_vacuumed", stats["pages_vacuumed"])
+        METRICS.incr("retention.shards_dropped", stats["shards_dropped"])
+        METRICS.incr("retention.chunks_deleted", stats["chunks_deleted"])
+        METRICS.incr("retention.zone_chunks_deleted", stats["zone_chunks_deleted"])
+        METRICS.set_gauge("retention.db_size_bytes", stats["db_size_bytes"])
+        METRICS.observe("retention.run_ms", stats["elapsed_ms"])
+
+        self.last_stats = stats
+        return stats
+
+    # -----------------------------
+    # Chunked deletes
+    # -----------------------------
+    def _delete_samples_before(self, conn, cutoff_ms, max_rows=None):
+        # Child rows (cpu/ram/gpu/disk) go with the sample via ON DELETE CASCADE
+        total = 0
+        while max_rows is None or total < max_rows:
+            limit = self.policy["chunk_size"]
+            if max_rows is not None:
+                limit = min(limit, max_rows - total)
+            # Change-only sessions: the first surviving tick becomes the keyframe
+            for session_id, last_id in conn.execute(
+                """SELECT session_id, MAX(sample_id) FROM (
+                     SELECT session_id, sample_id FROM sample WHERE ts_unix_ms < ?
+                     ORDER BY ts_unix_ms LIMIT ?)
+                   WHERE session_id IN (SELECT session_id FROM change_keyframe)
+                   GROUP BY session_id""",
+                (cutoff_ms, limit),
+            ).fetchall():
+                ChangeEncoder.anchor_after(conn, session_id, last_id)
+            cur = conn.execute(
+                """DELETE FROM sample WHERE sample_id IN (
+                     SELECT sample_id FROM sample WHERE ts_unix_ms < ?
+                     ORDER BY ts_unix_ms LIMIT ?)""",
+                (cutoff_ms, limit),
+            )
+            conn.commit()
+            if cur.rowcount:
+                invalidate_query_cache(conn)
+            total += cur.rowcount
+            if cur.rowcount < limit or self._stop.is_set():
+                break
+            self._pause()
+        return total
+
+    def _delete_chunks_before(self, conn, cutoff_ms):
+        # Archived sessions (archive.py) expire on the raw schedule; metric_chunk rows cascade
+        total = 0
+        limit = self.policy["chunk_size"]
+        while True:
+            cur = conn.execute(
+                """DELETE FROM sample_chunk
+                   WHERE (session_id, first_sample_id) IN (
+                     SELECT session_id, first_sample_id FROM sample_chunk
+                     WHERE chunk_end_unix_ms < ? LIMIT ?)""",
+                (cutoff_ms, limit),
+            )
+            conn.commit()
+            if cur.rowcount:
+                invalidate_query_cache(conn)
+            total += cur.rowcount
+            if cur.rowcount < limit or self._stop.is_set():
+                break
+            self._pause()
+        return total
+
+    def _delete_rollups_before(self, conn, resolution_ms, cutoff_ms):
+        total = 0
+        limit = self.policy["chunk_size"]
+        while True:
+            cur = conn.execute(
+                """DELETE FROM metric_rollup
+                   WHERE (resolution_ms, metric, bucket_unix_ms, host_uuid) IN (
+                     SELECT resolution_ms, metric, bucket_unix_ms, host_uuid FROM metric_rollup
+                     WHERE resolution_ms = ? AND bucket_unix_ms < ? LIMIT ?)""",
+                (resolution_ms, cutoff_ms, limit),
+            )
+            conn.commit()
+            if cur.rowcount:
+                invalidate_query_cache(conn)
+            total += cur.rowcount
+            if cur.rowcount < limit or self._stop.is_set():
+                break
+            self._pause()
+        return total
+
+    def _delete_sketches_before(self, conn, resolution_ms, cutoff_ms):
+        # Quantile sketches (sketches.py) expire on the rollup schedule of their resolution
+        total = 0
+        limit = self.policy["chunk_size"]
+        while True:
+            cur = conn.execute(
+                """DELETE FROM metric_sketch
+                   WHERE (resolution_ms, metric, bucket_unix_ms, host_uuid) IN (
+                     SELECT resolution_ms, metric, bucket_unix_ms, host_uuid FROM metric_sketch
+                     WHERE resolution_ms = ? AND bucket_unix_ms < ? LIMIT ?)""",
+                (resolution_ms, cutoff_ms, limit),
+            )
+            conn.commit()
+            if cur.rowcount:
+                invalidate_query_cache(conn)
+            total += cur.rowcount
+            if cur.rowcount < limit or self._stop.is_set():
+                break
+            self._pause()
+        return total
+
+    def _prune_zone_maps(self, conn):
+        # Zone maps (zone_maps.py) of chunks older than every remaining raw or archived tick
+        n = ZoneMap.prune(conn)
+        conn.commit()
+        if n:
+            invalidate_query_cache(conn)
+        return n
+
+    def _pause(self):
+        if self.policy["chunk_pause_ms"]:
+            time.sleep(self.policy["chunk_pause_ms"] / 1000)
+
+    # -----------------------------
+    # Space reclamation
+    # -----------------------------
+    def _incremental_vacuum(self, conn):
+        # Older files without incremental auto_vacuum are left alone (see enable_incremental_vacuum)
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return 0
+
+        vacuumed = 0
+        while True:
+            free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if free == 0:
+                break
+            step = min(free, VACUUM_STEP_PAGES)
+            conn.execute(f"PRAGMA incremental_vacuum({step})").fetchall()
+            vacuumed += step
+            if self._stop.is_set():
+                break
+            self._pause()
+        return vacuumed
+
+    def _enforce_size_cap(self, conn, max_bytes):
+        # Trim the oldest ticks, raw or archived (then the oldest 1 minute rollups and sketches),
+        # until the file fits. Returns (raw ticks deleted, archived chunks deleted, pages vacuumed)
+        deleted = 0
+        chunks = 0
+        vacuumed = 0
+        while self.db_size_bytes(conn) > max_bytes:
+            oldest = conn.execute("SELECT MIN(ts_unix_ms) FROM sample").fetchone()[0]
+            # The chunk that ends first (idx_sample_chunk_end) is also the one that starts first
+            chunk = conn.execute(
+                "SELECT chunk_start_unix_ms, chunk_end_unix_ms FROM sample_chunk ORDER BY chunk_end_unix_ms LIMIT 1"
+            ).fetchone()
+            if chunk is not None and (oldest is None or chunk[0] <= oldest):
+                n = self._delete_chunks_before(conn, chunk[1] + 1)
+                chunks += n
+            elif oldest is not None:
+                n = self._delete_samples_before(conn, oldest + DAY_MS, max_rows=self.policy["chunk_size"])
+                deleted += n
+            else:
+                oldest = conn.execute(
+                    "SELECT MIN(bucket_unix_ms) FROM metric_rollup WHERE resolution_ms = ?",
+                    (RESOLUTIONS_MS["1m"],),
+                ).fetchone()[0]
+                if oldest is None:
+                    break
+                n = self._delete_rollups_before(conn, RESOLUTIONS_MS["1m"], oldest + DAY_MS)
+                n += self._delete_sketches_before(conn, RESOLUTIONS_MS["1m"], oldest + DAY_MS)
+            if n == 0 or self._stop.is_set():
+                break
+            vacuumed += self._incremental_vacuum(conn)
+        return deleted, chunks, vacuumed
+
+    @staticmethod
+    def enable_incremental_vacuum(db_path):
+        """
+        Switches an older file to auto_vacuum = INCREMENTAL with one full VACUUM. This rewrites
+        the whole file and holds the write lock throughout, so run it with the dashboard closed.
+        Returns False if the file already uses incremental auto_vacuum.
+        """
+        conn = init_db(db_path)
+        try:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                return False
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+            return True
+        finally:
+            conn.close()
+
+    @staticmethod
+    def db_size_bytes(conn):
+        """In-use size of the main database file (pages minus the freelist)."""
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return (page_count - free) * page_size
+
+
+# -----------------------------
+# CLI
+# -----------------------------
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Offline maintenance for telemetry databases")
+    parser.add_argument("db", nargs="+", help="database files (close the dashboard first)")
+    parser.add_argument("--enable-incremental-vacuum", action="store_true",
+                        help="convert files created before auto_vacuum was enabled (full VACUUM)")
+    args = parser.parse_args(argv)
+    if not args.enable_incremental_vacuum:
+        parser.error("nothing to do: pass --enable-incremental-vacuum")
+
+    for path in args.db:
+        if RetentionManager.enable_incremental_vacuum(path):
+            print(f"{path}: converted to incremental auto_vacuum")
+        else:
+            print(f"{path}: already uses incremental auto_vacuum")
+
+
+if __name__ == "__main__":
+    main()
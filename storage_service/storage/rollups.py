@@ -0,0 +1,242 @@
+# storage_service/storage/rollups.py
+# Author: Andrew Fox
+
+# Maintains the metric_rollup table: count, min, max, sum and sum-of-squares for every
+# tracked metric at 1 minute, 1 hour and 1 day resolution.
+# Rollups are updated incrementally by StorageManager.insert_sample() inside the same
+# transaction as the raw tick. catch_up() back-fills anything written without them
+# (databases created before rollups existed, bulk imports, merged files).
+#
+# Usage:
+#   from storage_service.storage.rollups import RollupManager
+#   RollupManager.catch_up(conn)
+#   points = RollupManager.query(conn, "cpu_percent_total", start_ms, end_ms, max_points=500)
+
+import math
+
+from storage_service.storage.queries import DISK_USAGE_SQL, GPU_POWER_LIMIT_SQL
+
+# Resolution name -> bucket width in milliseconds (finest first)
+RESOLUTIONS_MS = {
+    "1m": 60_000,
+    "1h": 3_600_000,
+    "1d": 86_400_000,
+}
+
+# Metric name -> SQL expression over the aliases used in _TICK_SQL.
+# GPU metrics follow the analytics convention of using GPU 0, and disk usage is the
+# fullest partition on each tick (both read through change-only keyframes, see queries.py).
+ROLLUP_METRICS = {
+    "cpu_percent_total":    "c.cpu_percent_total",
+    "freq_current_mhz":     "c.freq_current_mhz",
+    "ram_usage_percent":    "r.ram_usage_percent",
+    "swap_usage_percent":   "r.swap_usage_percent",
+    "gpu_util_percent":     "g.gpu_util_percent",
+    "gpu_mem_util_percent": "g.gpu_mem_util_percent",
+    "gpu_temp_c":           "g.gpu_temp_c",
+    "gpu_core_clock_mhz":   "g.gpu_core_clock_mhz",
+    "gpu_power_usage_w":    "g.gpu_power_usage_w",
+    "gpu_power_limit_w":    GPU_POWER_LIMIT_SQL,
+    "read_speed_bytes":     "d.read_speed_bytes",
+    "write_speed_bytes":    "d.write_speed_bytes",
+    "avg_read_latency_ms":  "d.avg_read_latency_ms",
+    "avg_write_latency_ms": "d.avg_write_latency_ms",
+    "disk_usage_percent":   DISK_USAGE_SQL,
+}
+
+CATCH_UP_BATCH = 50_000
+
+_TICK_SQL = """
+    SELECT s.sample_id, s.ts_unix_ms, se.host_uuid, {columns}
+    FROM sample s
+    JOIN session                 se ON se.session_id = s.session_id
+    LEFT JOIN cpu_sample         c  ON c.sample_id   = s.sample_id
+    LEFT JOIN ram_sample         r  ON r.sample_id   = s.sample_id
+    LEFT JOIN gpu_sample         g  ON g.sample_id   = s.sample_id AND g.gpu_id = 0
+    LEFT JOIN disk_io_sample     d  ON d.sample_id   = s.sample_id
+    WHERE s.sample_id > ? AND s.sample_id <= ?
+"""
+
+_UPSERT_SQL = """
+    INSERT INTO metric_rollup
+      (resolution_ms, metric, bucket_unix_ms, host_uuid,
+       sample_count, min_value, max_value, sum_value, sum_sq_value)
+    {source}
+    ON CONFLICT (resolution_ms, metric, bucket_unix_ms, host_uuid) DO UPDATE SET
+      sample_count = sample_count + excluded.sample_count,
+      min_value    = MIN(min_value, excluded.min_value),
+      max_value    = MAX(max_value, excluded.max_value),
+      sum_value    = sum_value + excluded.sum_value,
+      sum_sq_value = sum_sq_value + excluded.sum_sq_value
+"""
+
+
+class RollupManager:
+    # Stateless helpers around the metric_rollup and rollup_watermark tables.
+
+    # -----------------------------
+    # Write path
+    # -----------------------------
+    @staticmethod
+    def apply_tick(conn, host_uuid, sample_id, ts_unix_ms, values):
+        """
+        Folds one tick into every resolution. values maps metric name -> value (None is skipped).
+        Must be called inside the caller's insert transaction so rollups and raw rows commit together.
+        """
+        rows = []
+        for metric, value in values.items():
+            if value is None or metric not in ROLLUP_METRICS:
+                continue
+            value = float(value)
+            for res_ms in RESOLUTIONS_MS.values():
+                bucket = ts_unix_ms - ts_unix_ms % res_ms
+                rows.append((res_ms, metric, bucket, host_uuid, 1, value, value, value, value * value))
+
+        if rows:
+            conn.executemany(
+                _UPSERT_SQL.format(source="VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"),
+                rows,
+            )
+        RollupManager._set_watermark(conn, sample_id)
+
+    @staticmethod
+    def catch_up(conn, batch_size=CATCH_UP_BATCH):
+        """
+        Rolls up every raw sample above the watermark, batch_size ticks per transaction.
+        Returns the number of samples processed.
+        """
+        metric_names = list(ROLLUP_METRICS)
+        columns = ", ".join(f"{expr} AS {name}" for name, expr in ROLLUP_METRICS.items())
+        minute_ms = RESOLUTIONS_MS["1m"]
+
+        # 1 minute deltas come straight from the raw ticks, coarser ones from those deltas
+        minute_delta = " UNION ALL ".join(
+            f"""SELECT {minute_ms}, '{name}', ts_unix_ms - ts_unix_ms % {minute_ms}, host_uuid,
+                       COUNT({name}), MIN({name}), MAX({name}), SUM({name}), SUM({name} * {name})
+                FROM temp.rollup_ticks WHERE {name} IS NOT NULL
+                GROUP BY 3, 4"""
+            for name in metric_names
+        )
+
+        processed = 0
+        while True:
+            try:
+                # The writer moves the watermark one tick at a time, so it is only read
+                # under the write lock: a tick committed in between would be counted twice
+                conn.execute("BEGIN IMMEDIATE")
+                lo = RollupManager.get_watermark(conn)
+                max_id = conn.execute("SELECT MAX(sample_id) FROM sample").fetchone()[0]
+                if max_id is None or max_id <= lo:
+                    conn.execute("COMMIT")
+                    return processed
+                hi = min(lo + batch_size, max_id)
+                conn.execute("DROP TABLE IF EXISTS temp.rollup_ticks")
+                conn.execute("DROP TABLE IF EXISTS temp.rollup_delta")
+                conn.execute(
+                    "CREATE TEMP TABLE rollup_ticks AS " + _TICK_SQL.format(columns=columns),
+                    (lo, hi),
+                )
+                conn.execute(
+                    """CREATE TEMP TABLE rollup_delta (
+                         resolution_ms INTEGER, metric TEXT, bucket_unix_ms INTEGER, host_uuid TEXT,
+                         sample_count INTEGER, min_value REAL, max_value REAL,
+                         sum_value REAL, sum_sq_value REAL)"""
+                )
+                conn.execute("INSERT INTO temp.rollup_delta " + minute_delta)
+                for res_ms in list(RESOLUTIONS_MS.values())[1:]:
+                    conn.execute(
+                        f"""INSERT INTO temp.rollup_delta
+                            SELECT {res_ms}, metric, bucket_unix_ms - bucket_unix_ms % {res_ms}, host_uuid,
+                                   SUM(sample_count), MIN(min_value), MAX(max_value),
+                                   SUM(sum_value), SUM(sum_sq_value)
+                            FROM temp.rollup_delta
+                            WHERE resolution_ms = {minute_ms}
+                            GROUP BY 2, 3, 4"""
+                    )
+                conn.execute(_UPSERT_SQL.format(
+                    source="SELECT * FROM temp.rollup_delta WHERE true"
+                ))
+                processed += conn.execute("SELECT COUNT(*) FROM temp.rollup_ticks").fetchone()[0]
+                conn.execute("DROP TABLE temp.rollup_ticks")
+                conn.execute("DROP TABLE temp.rollup_delta")
+                RollupManager._set_watermark(conn, hi)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    @staticmethod
+    def get_watermark(conn):
+        row = conn.execute("SELECT last_sample_id FROM rollup_watermark WHERE id = 1").fetchone()
+        return row[0] if row else 0
+
+    @staticmethod
+    def _set_watermark(conn, sample_id):
+        conn.execute(
+            """INSERT INTO rollup_watermark (id, last_sample_id) VALUES (1, ?)
+               ON CONFLICT (id) DO UPDATE SET last_sample_id = MAX(last_sample_id, excluded.last_sample_id)""",
+            (sample_id,),
+        )
+
+    # -----------------------------
+    # Read path
+    # -----------------------------
+    @staticmethod
+    def choose_resolution(start_ms, end_ms, max_points):
+        """Returns the finest resolution (ms) whose bucket count over the range fits in max_points."""
+        span = max(end_ms - start_ms, 1)
+        for res_ms in RESOLUTIONS_MS.values():
+            if math.ceil(span / res_ms) <= max_points:
+                return res_ms
+        return list(RESOLUTIONS_MS.values())[-1]
+
+    @staticmethod
+    def query(conn, metric, start_ms, end_ms, max_points=500, host_uuid=None, resolution_ms=None):
+        """
+        Returns one dict per bucket in [start_ms, end_ms), oldest first, with
+        bucket_unix_ms, resolution_ms, count, min, max, mean and std.
+        Buckets from different hosts are merged unless host_uuid is given. conn may also be
+        a list of connections holding disjoint ticks (shards and their catalog); their
+        buckets are summed the same way.
+        """
+        if metric not in ROLLUP_METRICS:
+            raise ValueError(f"Unknown rollup metric: {metric}")
+        if resolution_ms is None:
+            resolution_ms = RollupManager.choose_resolution(start_ms, end_ms, max_points)
+
+        sql = """SELECT bucket_unix_ms,
+                        SUM(sample_count) AS n, MIN(min_value) AS lo, MAX(max_value) AS hi,
+                        SUM(sum_value) AS total, SUM(sum_sq_value) AS total_sq
+                 FROM metric_rollup
+                 WHERE resolution_ms = ? AND metric = ?
+                   AND bucket_unix_ms >= ? AND bucket_unix_ms < ?"""
+        params = [resolution_ms, metric, start_ms - start_ms % resolution_ms, end_ms]
+        if host_uuid is not None:
+            sql += " AND host_uuid = ?"
+            params.append(host_uuid)
+        sql += " GROUP BY bucket_unix_ms ORDER BY bucket_unix_ms"
+
+        buckets = {}
+        for c in (conn if isinstance(conn, (list, tuple)) else [conn]):
+            for bucket, *stats in c.execute(sql, params):
+                if bucket in buckets:
+                    n, lo, hi, total, total_sq = buckets[bucket]
+                    stats = [n + stats[0], min(lo, stats[1]), max(hi, stats[2]),
+                             total + stats[3], total_sq + stats[4]]
+                buckets[bucket] = stats
+
+        points = []
+        for bucket in sorted(buckets):
+            n, lo, hi, total, total_sq = buckets[bucket]
+            mean = total / n
+            variance = max(total_sq / n - mean * mean, 0.0)
+            points.append({
+                "bucket_unix_ms": bucket,
+                "resolution_ms":  resolution_ms,
+                "count":          n,
+                "min":            lo,
+                "max":            hi,
+                "mean":           mean,
+                "std":            math.sqrt(variance),
+            })
+        return points
@@ -4,10 +4,13 @@
 # Usage:
 #   from storage_service.storage.schema import init_db
 #   conn = init_db("telemetry.db")
+#   conn = init_db("telemetry.db", profile="server")     # tuning.py profiles
 
 import sqlite3
 from pathlib import Path
 
+from storage_service.storage.tuning import apply_profile, resolve_profile, set_page_size
+
 SCHEMA_SQL = """
 PRAGMA foreign_keys = ON;
 
@@ -38,7 +41,9 @@ CREATE TABLE IF NOT EXISTS session (
   host_uuid          TEXT NOT NULL REFERENCES host(host_uuid) ON DELETE CASCADE,
   started_at_iso     TEXT NOT NULL,
   started_at_unix_ms INTEGER NOT NULL,
-  sample_interval_ms INTEGER
+  sample_interval_ms INTEGER,
+  ended_at_unix_ms   INTEGER,             -- set by StorageManager.close()
+  archived_at_unix_ms INTEGER             -- set once archive.py has compressed the session
 );
 
 -- ----------------------------
@@ -55,6 +60,7 @@ CREATE TABLE IF NOT EXISTS sample (
 );
 
 CREATE INDEX IF NOT EXISTS idx_sample_session_ts ON sample(session_id, ts_unix_ms);
+CREATE INDEX IF NOT EXISTS idx_sample_ts ON sample(ts_unix_ms);
 
 -- ------------------------------------
 -- 3) RAM + swap
@@ -103,12 +109,14 @@ CREATE TABLE IF NOT EXISTS gpu_sample (
   gpu_core_clock_mhz   REAL NOT NULL,
 
   gpu_power_usage_w    REAL NOT NULL,
-  gpu_power_limit_w    REAL NOT NULL,
+  gpu_power_limit_w    REAL,                -- NULL between change_keyframe ticks (change-only mode)
 
   PRIMARY KEY (sample_id, gpu_uuid)
 );
 
-CREATE INDEX IF NOT EXISTS idx_gpu_sample_sample ON gpu_sample(sample_id);
+-- Replaced by idx_gpu_sample_sample_gpu, which also serves the "GPU 0" lookups
+DROP INDEX IF EXISTS idx_gpu_sample_sample;
+CREATE INDEX IF NOT EXISTS idx_gpu_sample_sample_gpu ON gpu_sample(sample_id, gpu_id);
 
 -- ------------------------------------
 -- 6) Disk
@@ -145,34 +153,329 @@ CREATE TABLE IF NOT EXISTS disk_partition_sample (
 );
 
 CREATE INDEX IF NOT EXISTS idx_disk_part_sample_part ON disk_partition_sample(partition_id);
+-- Covering index for the per-tick MAX(usage_percent) in queries.py
+CREATE INDEX IF NOT EXISTS idx_disk_part_sample_usage ON disk_partition_sample(sample_id, usage_percent);
+
+-- ------------------------------------
+-- 7) Rollups (1 min / 1 h / 1 day)
+-- ------------------------------------
+
+-- Per-bucket aggregates maintained by rollups.py; mean and std derive from the sums
+CREATE TABLE IF NOT EXISTS metric_rollup (
+  resolution_ms        INTEGER NOT NULL,
+  metric               TEXT NOT NULL,
+  bucket_unix_ms       INTEGER NOT NULL,
+  host_uuid            TEXT NOT NULL,
+
+  sample_count         INTEGER NOT NULL,
+  min_value            REAL NOT NULL,
+  max_value            REAL NOT NULL,
+  sum_value            REAL NOT NULL,
+  sum_sq_value         REAL NOT NULL,
+
+  PRIMARY KEY (resolution_ms, metric, bucket_unix_ms, host_uuid)
+) WITHOUT ROWID;
+
+-- Highest sample_id already folded into metric_rollup
+CREATE TABLE IF NOT EXISTS rollup_watermark (
+  id                   INTEGER PRIMARY KEY CHECK (id = 1),
+  last_sample_id       INTEGER NOT NULL
+);
+
+-- ------------------------------------
+-- 8) Compressed archive of closed sessions
+-- ------------------------------------
+
+-- One row per chunk of consecutive ticks (see archive.py / compression.py)
+CREATE TABLE IF NOT EXISTS sample_chunk (
+  session_id           INTEGER NOT NULL REFERENCES session(session_id) ON DELETE CASCADE,
+  first_sample_id      INTEGER NOT NULL,
+  chunk_start_unix_ms  INTEGER NOT NULL,
+  chunk_end_unix_ms    INTEGER NOT NULL,
+  sample_count         INTEGER NOT NULL,
+  ts_blob              BLOB NOT NULL,     -- delta-of-delta ts_unix_ms
+  sample_id_blob       BLOB NOT NULL,     -- delta-of-delta sample_id
+  PRIMARY KEY (session_id, first_sample_id)
+) WITHOUT ROWID;
+
+-- Time-range reads find the chunks they overlap (and the newest one) without the blobs
+CREATE INDEX IF NOT EXISTS idx_sample_chunk_end ON sample_chunk(chunk_end_unix_ms, chunk_start_unix_ms);
+
+-- One row per metric per chunk; NaN marks ticks where the metric was missing
+CREATE TABLE IF NOT EXISTS metric_chunk (
+  session_id           INTEGER NOT NULL,
+  first_sample_id      INTEGER NOT NULL,
+  metric               TEXT NOT NULL,
+  value_blob           BLOB NOT NULL,     -- XOR-compressed float64
+  PRIMARY KEY (session_id, first_sample_id, metric),
+  FOREIGN KEY (session_id, first_sample_id)
+    REFERENCES sample_chunk(session_id, first_sample_id) ON DELETE CASCADE
+) WITHOUT ROWID;
+
+-- ------------------------------------
+-- 9) Per-session summary
+-- ------------------------------------
+
+-- Running totals kept by session_summary.py in the same transaction as each tick;
+-- mean = _sum / _count. Outlives the raw rows (archive.py / retention.py)
+CREATE TABLE IF NOT EXISTS session_summary (
+  session_id                   INTEGER PRIMARY KEY REFERENCES session(session_id) ON DELETE CASCADE,
+  sample_count                 INTEGER NOT NULL,
+  first_sample_id              INTEGER NOT NULL,
+  last_sample_id               INTEGER NOT NULL,
+  first_ts_unix_ms             INTEGER NOT NULL,
+  last_ts_unix_ms              INTEGER NOT NULL,
+  cpu_percent_total_min        REAL,
+  cpu_percent_total_max        REAL,
+  cpu_percent_total_sum        REAL NOT NULL DEFAULT 0,
+  cpu_percent_total_count      INTEGER NOT NULL DEFAULT 0,
+  ram_usage_percent_min        REAL,
+  ram_usage_percent_max        REAL,
+  ram_usage_percent_sum        REAL NOT NULL DEFAULT 0,
+  ram_usage_percent_count      INTEGER NOT NULL DEFAULT 0,
+  swap_usage_percent_min       REAL,
+  swap_usage_percent_max       REAL,
+  swap_usage_percent_sum       REAL NOT NULL DEFAULT 0,
+  swap_usage_percent_count     INTEGER NOT NULL DEFAULT 0,
+  gpu_util_percent_min         REAL,
+  gpu_util_percent_max         REAL,
+  gpu_util_percent_sum         REAL NOT NULL DEFAULT 0,
+  gpu_util_percent_count       INTEGER NOT NULL DEFAULT 0,
+  gpu_temp_c_min               REAL,
+  gpu_temp_c_max               REAL,
+  gpu_temp_c_sum               REAL NOT NULL DEFAULT 0,
+  gpu_temp_c_count             INTEGER NOT NULL DEFAULT 0,
+  disk_usage_percent_min       REAL,
+  disk_usage_percent_max       REAL,
+  disk_usage_percent_sum       REAL NOT NULL DEFAULT 0,
+  disk_usage_percent_count     INTEGER NOT NULL DEFAULT 0,
+  finalised_at_unix_ms         INTEGER              -- set by StorageManager.close()
+);
+
+-- ------------------------------------
+-- 10) Change-only encoding
+-- ------------------------------------
+
+-- Ticks where a change-only writer (change_encoding.py) wrote every partition row
+-- ('partition') or every GPU power limit ('gpu'); the ticks in between wrote none and
+-- read the last keyframe's values. Sessions without keyframes are stored densely.
+CREATE TABLE IF NOT EXISTS change_keyframe (
+  session_id           INTEGER NOT NULL REFERENCES session(session_id) ON DELETE CASCADE,
+  kind                 TEXT NOT NULL,
+  sample_id            INTEGER NOT NULL REFERENCES sample(sample_id) ON DELETE CASCADE,
+  PRIMARY KEY (session_id, kind, sample_id)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_change_keyframe_sample ON change_keyframe(sample_id);
+
+-- Per-tick partition and GPU rows with the last keyframe carried forward (LOCF)
+CREATE VIEW IF NOT EXISTS disk_partition_sample_locf AS
+  SELECT s.sample_id, dp.partition_id, dp.total_gb, dp.used_gb, dp.usage_percent
+  FROM sample s
+  JOIN disk_partition_sample dp ON dp.sample_id = COALESCE(
+    (SELECT x.sample_id FROM disk_partition_sample x WHERE x.sample_id = s.sample_id LIMIT 1),
+    (SELECT MAX(k.sample_id) FROM change_keyframe k
+      WHERE k.session_id = s.session_id AND k.kind = 'partition' AND k.sample_id <= s.sample_id));
+
+CREATE VIEW IF NOT EXISTS gpu_sample_locf AS
+  SELECT g.sample_id, g.gpu_uuid, g.gpu_id,
+         g.gpu_util_percent, g.gpu_mem_util_percent, g.gpu_mem_used_mb,
+         g.gpu_temp_c, g.gpu_core_clock_mhz, g.gpu_power_usage_w,
+         COALESCE(g.gpu_power_limit_w,
+           (SELECT gk.gpu_power_limit_w FROM gpu_sample gk
+             WHERE gk.gpu_uuid = g.gpu_uuid AND gk.sample_id = (
+               SELECT MAX(k.sample_id) FROM change_keyframe k
+               WHERE k.session_id = s.session_id AND k.kind = 'gpu' AND k.sample_id <= s.sample_id))
+         ) AS gpu_power_limit_w
+  FROM gpu_sample g
+  JOIN sample s ON s.sample_id = g.sample_id;
+
+-- ------------------------------------
+-- 11) Model-input read model
+-- ------------------------------------
+
+-- One narrow row per tick holding the model's point inputs, columns in
+-- features.POINT_METRICS order (model_input.py). Written with the tick; clustered by
+-- (session_id, sample_id) so a session or recent window is one primary-key range scan.
+CREATE TABLE IF NOT EXISTS model_input (
+  session_id           INTEGER NOT NULL,
+  sample_id            INTEGER NOT NULL REFERENCES sample(sample_id) ON DELETE CASCADE,
+  ts_unix_ms           INTEGER NOT NULL,
+  cpu_percent_total    REAL,
+  freq_current_mhz     REAL,
+  ram_usage_percent    REAL,
+  swap_usage_percent   REAL,
+  gpu_util_percent     REAL,
+  gpu_mem_util_percent REAL,
+  gpu_temp_c           REAL,
+  gpu_core_clock_mhz   REAL,
+  gpu_power_usage_w    REAL,
+  gpu_power_limit_w    REAL,
+  avg_read_latency_ms  REAL,
+  avg_write_latency_ms REAL,
+  read_speed_bytes     REAL,
+  write_speed_bytes    REAL,
+  disk_usage_percent   REAL,
+  PRIMARY KEY (session_id, sample_id)
+) WITHOUT ROWID;
+
+-- Lets sample deletes cascade without scanning model_input
+CREATE INDEX IF NOT EXISTS idx_model_input_sample ON model_input(sample_id);
+
+-- ------------------------------------
+-- 12) Quantile sketches (1 min / 1 h / 1 day)
+-- ------------------------------------
+
+-- One DDSketch per metric per bucket per host (sketches.py); the blob holds the bins
+CREATE TABLE IF NOT EXISTS metric_sketch (
+  resolution_ms        INTEGER NOT NULL,
+  metric               TEXT NOT NULL,
+  bucket_unix_ms       INTEGER NOT NULL,
+  host_uuid            TEXT NOT NULL,
+
+  sample_count         INTEGER NOT NULL,
+  min_value            REAL NOT NULL,
+  max_value            REAL NOT NULL,
+  sketch_blob          BLOB NOT NULL,
+
+  PRIMARY KEY (resolution_ms, metric, bucket_unix_ms, host_uuid)
+) WITHOUT ROWID;
+
+-- Highest sample_id already folded into metric_sketch
+CREATE TABLE IF NOT EXISTS sketch_watermark (
+  id                   INTEGER PRIMARY KEY CHECK (id = 1),
+  last_sample_id       INTEGER NOT NULL
+);
+
+-- ------------------------------------
+-- 13) Zone maps (per 1024-tick chunk)
+-- ------------------------------------
+
+-- Time bounds of each chunk of consecutive sample ids (zone_maps.py)
+CREATE TABLE IF NOT EXISTS zone_chunk (
+  chunk_id             INTEGER PRIMARY KEY,   -- sample_id >> 10
+  first_sample_id      INTEGER NOT NULL,
+  last_sample_id       INTEGER NOT NULL,
+  start_unix_ms        INTEGER NOT NULL,
+  end_unix_ms          INTEGER NOT NULL,
+  tick_count           INTEGER NOT NULL
+);
+
+-- Min / max of every rollup metric per chunk; threshold searches skip chunks that cannot match
+CREATE TABLE IF NOT EXISTS zone_map (
+  metric               TEXT NOT NULL,
+  chunk_id             INTEGER NOT NULL,
+  min_value            REAL NOT NULL,
+  max_value            REAL NOT NULL,
+  PRIMARY KEY (metric, chunk_id)
+) WITHOUT ROWID;
+
+-- Sample id ranges StorageManager left for the background back-fill (backfill.py). The
+-- sketch and zone watermarks move on with the live ticks, so the gaps are kept here
+CREATE TABLE IF NOT EXISTS backfill_range (
+  structure            TEXT NOT NULL,      -- 'metric_sketch' | 'zone_map'
+  after_sample_id      INTEGER NOT NULL,   -- done up to here
+  last_sample_id       INTEGER NOT NULL,
+  PRIMARY KEY (structure, last_sample_id)
+) WITHOUT ROWID;
+
+-- ------------------------------------
+-- 14) Issue episodes
+-- ------------------------------------
+
+-- One row per stretch of time a detected issue label kept firing (episodes.py)
+CREATE TABLE IF NOT EXISTS issue_episode (
+  episode_id           INTEGER PRIMARY KEY,
+  host_uuid            TEXT NOT NULL,
+  session_id           INTEGER,
+  label                TEXT NOT NULL,
+  start_unix_ms        INTEGER NOT NULL,   -- first prediction that fired
+  end_unix_ms          INTEGER NOT NULL,   -- latest prediction that fired
+
+  prediction_count     INTEGER NOT NULL,
+  peak_probability     REAL NOT NULL,
+  peak_unix_ms         INTEGER NOT NULL,
+  peak_metric          TEXT,
+  peak_value           REAL,
+  is_open              INTEGER NOT NULL DEFAULT 1
+);
+
+CREATE INDEX IF NOT EXISTS idx_issue_episode_label_start ON issue_episode(label, start_unix_ms);
+CREATE INDEX IF NOT EXISTS idx_issue_episode_start_end ON issue_episode(start_unix_ms, end_unix_ms);
+
+-- The episodes record() may still extend
+CREATE INDEX IF NOT EXISTS idx_issue_episode_open ON issue_episode(host_uuid, label) WHERE is_open = 1;
+
+-- Longest episode per label: bounds how long before a range an overlapping episode can start
+CREATE TABLE IF NOT EXISTS issue_episode_span (
+  label                TEXT PRIMARY KEY,
+  max_duration_ms      INTEGER NOT NULL
+) WITHOUT ROWID;
 """
 
+# Columns added after the first release: (table, column, type).
+# CREATE TABLE IF NOT EXISTS leaves older files untouched, so init_db adds them.
+ADDED_COLUMNS = [
+    ("session", "ended_at_unix_ms",    "INTEGER"),
+    ("session", "archived_at_unix_ms", "INTEGER"),
+]
+
+# Per-tick tables whose secondary indexes bulk loaders drop and rebuild (synthetic.py, merge.py)
+BULK_TABLES = ("sample", "cpu_sample", "ram_sample", "gpu_sample", "disk_io_sample", "disk_partition_sample",
+               "model_input")
 
-def connect(db_path):
+
+def connect(db_path, profile=None):
     db_path = Path(db_path)
     db_path.parent.mkdir(parents=True, exist_ok=True)
+    settings = resolve_profile(profile)
 
     conn = sqlite3.connect(db_path)
     conn.row_factory = sqlite3.Row
+    set_page_size(conn, settings)
 
     # Pragmas: local telemetry logging
+    # auto_vacuum only takes effect on a new file (older ones: retention.py --enable-incremental-vacuum)
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL;")
     conn.execute("PRAGMA foreign_keys = ON;")
     conn.execute("PRAGMA journal_mode = WAL;")
     conn.execute("PRAGMA synchronous = NORMAL;")
     conn.execute("PRAGMA temp_store = MEMORY;")
     conn.execute("PRAGMA busy_timeout = 5000;")  # ms
 
+    # Optional page / cache / mmap / checkpoint settings on top
+    apply_profile(conn, settings)
     return conn
 
 
-def init_db(db_path, conn=None):
+def init_db(db_path, conn=None, profile=None):
     if conn is None:
-        conn = connect(db_path)
+        conn = connect(db_path, profile)
 
     try:
         conn.executescript(SCHEMA_SQL)
+        for table, column, col_type in ADDED_COLUMNS:
+            existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+            if column not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {col_type}")
         conn.commit()
         return conn
     except Exception:
         conn.rollback()
         raise
+
+
+def drop_bulk_indexes(conn):
+    """
+    Drops the secondary indexes on BULK_TABLES and returns their CREATE statements.
+    Run them after the load; if it fails part way, init_db() recreates the indexes on next open.
+    """
+    rows = conn.execute(
+        f"""SELECT name, sql FROM sqlite_master
+            WHERE type = 'index' AND sql IS NOT NULL
+              AND tbl_name IN ({", ".join("?" * len(BULK_TABLES))})""",
+        BULK_TABLES,
+    ).fetchall()
+    for name, _ in rows:
+        conn.execute(f"DROP INDEX {name}")
+    return [sql for _, sql in rows]
@@ -0,0 +1,210 @@
+# storage_service/storage/session_summary.py
+# Author: Andrew Fox
+
+# Maintains the session_summary table: one row per session with its sample count,
+# first/last sample ids and timestamps, and running min / max / sum / count for a few
+# key metrics (mean = sum / count). StorageManager.insert_sample() folds every tick in
+# inside its own transaction, close() stamps finalised_at_unix_ms, and catch_up()
+# rebuilds sessions that have raw rows but no summary (older files, bulk loads).
+# Readers that used to run MIN/COUNT over sample per session (CSV export, dashboards)
+# read one row here instead, and the row stays after archive.py / retention.py have
+# removed the raw ticks.
+#
+# In the sharded layout each shard file summarises the part of a session it holds;
+# merge() combines those partial rows.
+#
+# Usage:
+#   from storage_service.storage.session_summary import SessionSummary
+#   summary = SessionSummary.get(conn, session_id)
+#   summary["cpu_percent_total_mean"], summary["sample_count"]
+
+from storage_service.storage.rollups import ROLLUP_METRICS
+
+# Metrics with running aggregates; expressions come from rollups.ROLLUP_METRICS
+SUMMARY_METRICS = (
+    "cpu_percent_total",
+    "ram_usage_percent",
+    "swap_usage_percent",
+    "gpu_util_percent",
+    "gpu_temp_c",
+    "disk_usage_percent",
+)
+
+_AGGREGATES = ("min", "max", "sum", "count")
+
+SUMMARY_COLUMNS = (
+    "session_id", "sample_count",
+    "first_sample_id", "last_sample_id", "first_ts_unix_ms", "last_ts_unix_ms",
+    *(f"{m}_{agg}" for m in SUMMARY_METRICS for agg in _AGGREGATES),
+    "finalised_at_unix_ms",
+)
+
+# NULL-tolerant MIN/MAX: a tick with a missing metric must not blank the running value
+_ON_CONFLICT_SQL = """
+    ON CONFLICT (session_id) DO UPDATE SET
+      sample_count     = sample_count + excluded.sample_count,
+      first_sample_id  = MIN(first_sample_id, excluded.first_sample_id),
+      last_sample_id   = MAX(last_sample_id, excluded.last_sample_id),
+      first_ts_unix_ms = MIN(first_ts_unix_ms, excluded.first_ts_unix_ms),
+      last_ts_unix_ms  = MAX(last_ts_unix_ms, excluded.last_ts_unix_ms),
+      finalised_at_unix_ms = COALESCE(excluded.finalised_at_unix_ms, finalised_at_unix_ms),
+      {metric_updates}
+""".format(
+    metric_updates=",\n      ".join(
+        f"{m}_min = COALESCE(MIN({m}_min, excluded.{m}_min), {m}_min, excluded.{m}_min), "
+        f"{m}_max = COALESCE(MAX({m}_max, excluded.{m}_max), {m}_max, excluded.{m}_max), "
+        f"{m}_sum = {m}_sum + excluded.{m}_sum, "
+        f"{m}_count = {m}_count + excluded.{m}_count"
+        for m in SUMMARY_METRICS
+    ),
+)
+
+_UPSERT_SQL = f"""
+    INSERT INTO session_summary ({", ".join(SUMMARY_COLUMNS[:-1])})
+    VALUES ({", ".join("?" * (len(SUMMARY_COLUMNS) - 1))})
+    {_ON_CONFLICT_SQL}
+"""
+
+# Partial rows of another attached file; WHERE true lets ON CONFLICT follow a SELECT
+_MERGE_SQL = f"""
+    INSERT INTO main.session_summary ({", ".join(SUMMARY_COLUMNS)})
+    SELECT {", ".join(SUMMARY_COLUMNS)} FROM {{schema}}.session_summary WHERE true
+    {_ON_CONFLICT_SQL}
+"""
+
+# Whole-session aggregate over the raw ticks (one idx_sample_session_ts range)
+_REBUILD_SQL = """
+    INSERT OR REPLACE INTO session_summary ({columns})
+    SELECT session_id, COUNT(*), MIN(sample_id), MAX(sample_id), MIN(ts_unix_ms), MAX(ts_unix_ms),
+           {aggregates}
+    FROM (
+      SELECT s.session_id, s.sample_id, s.ts_unix_ms, {metrics}
+      FROM sample s
+      LEFT JOIN cpu_sample c ON c.sample_id = s.sample_id
+      LEFT JOIN ram_sample r ON r.sample_id = s.sample_id
+      LEFT JOIN gpu_sample g ON g.sample_id = s.sample_id AND g.gpu_id = 0
+      WHERE s.session_id = ?
+    )
+    GROUP BY session_id
+""".format(
+    columns=", ".join(SUMMARY_COLUMNS[:-1]),
+    aggregates=", ".join(
+        f"MIN({m}), MAX({m}), TOTAL({m}), COUNT({m})" for m in SUMMARY_METRICS
+    ),
+    metrics=", ".join(f"{ROLLUP_METRICS[m]} AS {m}" for m in SUMMARY_METRICS),
+)
+
+
+class SessionSummary:
+    # Stateless helpers around the session_summary table.
+
+    # -----------------------------
+    # Write path
+    # -----------------------------
+    @staticmethod
+    def apply_tick(conn, session_id, sample_id, ts_unix_ms, values):
+        """
+        Folds one tick into its session's row. values maps metric name -> value (None is skipped).
+        Must be called inside the caller's insert transaction so the summary and raw rows commit together.
+        """
+        row = [session_id, 1, sample_id, sample_id, ts_unix_ms, ts_unix_ms]
+        for metric in SUMMARY_METRICS:
+            value = values.get(metric)
+            if value is None:
+                row += [None, None, 0.0, 0]
+            else:
+                value = float(value)
+                row += [value, value, value, 1]
+        conn.execute(_UPSERT_SQL, row)
+
+    @staticmethod
+    def rebuild(conn, session_id):
+        """Recomputes one session's row from its raw ticks (no-op if it has none). Caller commits."""
+        conn.execute(_REBUILD_SQL, (session_id,))
+
+    @staticmethod
+    def catch_up(conn, stop=None):
+        """
+        Builds rows for every session that has raw ticks but no summary yet, one
+        transaction per session. Returns the number of sessions summarised; stop()
+        (if given) is checked between sessions.
+        """
+        missing = [
+            row[0] for row in conn.execute(
+                """SELECT se.session_id FROM session se
+                   WHERE NOT EXISTS (SELECT 1 FROM session_summary ss WHERE ss.session_id = se.session_id)
+                     AND EXISTS (SELECT 1 FROM sample s WHERE s.session_id = se.session_id)"""
+            )
+        ]
+        for i, session_id in enumerate(missing):
+            if stop is not None and stop():
+                return i
+            try:
+                conn.execute("BEGIN IMMEDIATE")     # the backfill job runs this beside the writer
+                SessionSummary.rebuild(conn, session_id)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return len(missing)
+
+    @staticmethod
+    def merge_from(conn, schema):
+        """
+        Folds the session_summary rows of the attached database schema into conn's, adding
+        partial rows of the same session (e.g. a shard merged into the catalog). Caller commits.
+        """
+        conn.execute(_MERGE_SQL.format(schema=schema))
+
+    @staticmethod
+    def finalise(conn, session_id, ended_at_unix_ms):
+        """Stamps the session's row as complete. Caller commits."""
+        conn.execute(
+            "UPDATE session_summary SET finalised_at_unix_ms = ? WHERE session_id = ?",
+            (ended_at_unix_ms, session_id),
+        )
+
+    # -----------------------------
+    # Read path
+    # -----------------------------
+    @staticmethod
+    def get(conn, session_id):
+        """One session's summary as a dict with a _mean per metric, or None if it has no ticks."""
+        row = conn.execute(
+            f"SELECT {', '.join(SUMMARY_COLUMNS)} FROM session_summary WHERE session_id = ?",
+            (session_id,),
+        ).fetchone()
+        return SessionSummary.merge([row]) if row is not None else None
+
+    @staticmethod
+    def merge(rows):
+        """
+        Combines partial rows for one session (e.g. one per shard file, in SUMMARY_COLUMNS
+        order) into a single summary dict with a _mean per metric. Returns None for no rows.
+        """
+        rows = [dict(zip(SUMMARY_COLUMNS, row)) for row in rows]
+        if not rows:
+            return None
+
+        def pick(fn, key):
+            present = [r[key] for r in rows if r[key] is not None]
+            return fn(present) if present else None
+
+        out = {
+            "session_id":           rows[0]["session_id"],
+            "sample_count":         sum(r["sample_count"] for r in rows),
+            "first_sample_id":      min(r["first_sample_id"] for r in rows),
+            "last_sample_id":       max(r["last_sample_id"] for r in rows),
+            "first_ts_unix_ms":     min(r["first_ts_unix_ms"] for r in rows),
+            "last_ts_unix_ms":      max(r["last_ts_unix_ms"] for r in rows),
+            "finalised_at_unix_ms": pick(max, "finalised_at_unix_ms"),
+        }
+        for m in SUMMARY_METRICS:
+            count = sum(r[f"{m}_count"] for r in rows)
+            total = sum(r[f"{m}_sum"] for r in rows)
+            out[f"{m}_min"] = pick(min, f"{m}_min")
+            out[f"{m}_max"] = pick(max, f"{m}_max")
+            out[f"{m}_sum"] = total
+            out[f"{m}_count"] = count
+            out[f"{m}_mean"] = total / count if count else None
+        return out
@@ -0,0 +1,348 @@
+# storage_service/storage/sharding.py
+# Author: Andrew Fox
+
+# Optional sharded layout: one SQLite file per UTC day (or ISO week) plus a small
+# catalog.db that lists the shards, allocates session ids and keeps the long-lived
+# rollups. Each shard carries the full schema from schema.py, so existing queries run
+# against a shard unchanged.
+#
+# Retention drops whole shard files instead of running row-level DELETEs; the shard's
+# rollups, quantile sketches, session summaries (with their session and host rows) and
+# issue episodes are merged into the catalog first so that history survives.
+#
+# Reads either ATTACH the shards overlapping a time range to one connection
+# (attach_range, for ad-hoc cross-shard SQL) or run the same query against each
+# overlapping shard in parallel threads (scan_range).
+#
+# Usage:
+#   from storage_service.storage.sharding import ShardCatalog
+#   shards = ShardCatalog("telemetry_shards", period="day")
+#   storage = StorageManager(shards=shards)
+#   rows = shards.scan_range("SELECT ... FROM sample WHERE ts_unix_ms BETWEEN ? AND ?",
+#                            (start_ms, end_ms), start_ms, end_ms)
+
+import datetime
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from storage_service.storage.episodes import EPISODE_COLUMNS
+from storage_service.storage.schema import init_db
+from storage_service.storage.rollups import RollupManager
+from storage_service.storage.session_summary import SessionSummary
+from storage_service.storage.sketches import DDSketch, SketchManager
+
+DAY_MS = 86_400_000
+
+# Shard period -> (width, offset from the Unix epoch). Weeks start on Monday,
+# four days after the epoch (1970-01-01 was a Thursday).
+SHARD_PERIODS = {
+    "day":  (DAY_MS, 0),
+    "week": (7 * DAY_MS, 4 * DAY_MS),
+}
+
+# Tables copied into every new shard so foreign keys and partition ids stay consistent
+METADATA_TABLES = ["host", "gpu_device", "disk_partition"]
+
+# Default SQLITE_MAX_ATTACHED is 10; keep one slot spare for the caller
+MAX_ATTACHED = 9
+
+CATALOG_SQL = """
+CREATE TABLE IF NOT EXISTS shard (
+  shard_start_unix_ms  INTEGER PRIMARY KEY,
+  shard_end_unix_ms    INTEGER NOT NULL,
+  file_name            TEXT NOT NULL UNIQUE,
+  created_at_iso       TEXT NOT NULL
+);
+
+-- Session ids are allocated here so they are unique across shards
+CREATE TABLE IF NOT EXISTS shard_session (
+  session_id           INTEGER PRIMARY KEY,
+  host_uuid            TEXT NOT NULL,
+  started_at_unix_ms   INTEGER NOT NULL
+);
+"""
+
+
+class ShardCatalog:
+    # Owns the shard directory and its catalog. Every method opens short-lived
+    # connections, so one instance can be shared by the writer and background jobs.
+
+    def __init__(self, root_dir="telemetry_shards", period="day", profile=None):
+        if period not in SHARD_PERIODS:
+            raise ValueError(f"Unknown shard period: {period}")
+        self.root_dir = Path(root_dir)
+        self.period = period
+        self.profile = profile   # tuning.py profile for the shard files
+        self.width_ms, self.offset_ms = SHARD_PERIODS[period]
+        self.catalog_path = self.root_dir / "catalog.db"
+
+        conn = self._catalog()
+        conn.close()
+
+    def _catalog(self):
+        # The catalog also carries the regular schema so merged rollups have a home
+        conn = init_db(self.catalog_path)
+        conn.executescript(CATALOG_SQL)
+        return conn
+
+    # -----------------------------
+    # Layout
+    # -----------------------------
+    def bounds(self, ts_unix_ms):
+        """Returns (start_ms, end_ms) of the shard containing ts_unix_ms."""
+        start = ts_unix_ms - (ts_unix_ms - self.offset_ms) % self.width_ms
+        return start, start + self.width_ms
+
+    def file_name(self, shard_start_ms):
+        day = datetime.datetime.fromtimestamp(shard_start_ms / 1000, tz=datetime.timezone.utc)
+        return f"telemetry-{day.strftime('%Y-%m-%d')}.db"
+
+    def list_shards(self):
+        """Returns [(start_ms, end_ms, path)] oldest first."""
+        conn = self._catalog()
+        try:
+            return [
+                (row[0], row[1], self.root_dir / row[2])
+                for row in conn.execute(
+                    "SELECT shard_start_unix_ms, shard_end_unix_ms, file_name FROM shard ORDER BY 1"
+                )
+            ]
+        finally:
+            conn.close()
+
+    def shards_overlapping(self, start_ms, end_ms):
+        return [s for s in self.list_shards() if s[0] < end_ms and s[1] > start_ms]
+
+    def session_shards(self, session_id):
+        """Shards a session can have ticks in: the one it started in and every later one."""
+        conn = self._catalog()
+        try:
+            row = conn.execute(
+                "SELECT started_at_unix_ms FROM shard_session WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return []
+        start = self.bounds(row[0])[0]
+        return [s for s in self.list_shards() if s[0] >= start]
+
+    # -----------------------------
+    # Writer side
+    # -----------------------------
+    def allocate_session(self, host_uuid, started_at_unix_ms):
+        conn = self._catalog()
+        try:
+            cur = conn.execute(
+                "INSERT INTO shard_session (host_uuid, started_at_unix_ms) VALUES (?, ?)",
+                (host_uuid, started_at_unix_ms),
+            )
+            conn.commit()
+            return cur.lastrowid
+        finally:
+            conn.close()
+
+    def open_shard(self, ts_unix_ms, session_id=None):
+        """
+        Opens (creating and registering if needed) the shard for ts_unix_ms and returns
+        (conn, shard_end_ms). A new shard is seeded from the latest existing one: metadata
+        rows, the running session, and a sample_id floor so ids stay unique across files.
+        """
+        start, end = self.bounds(ts_unix_ms)
+        path = self.root_dir / self.file_name(start)
+        previous = [s for s in self.list_shards() if s[0] < start]
+        is_new = not path.exists()
+
+        conn = init_db(path, profile=self.profile)
+        if is_new and previous:
+            self._seed_from(conn, previous[-1][2], session_id)
+
+        catalog = self._catalog()
+        try:
+            catalog.execute(
+                """INSERT OR IGNORE INTO shard (shard_start_unix_ms, shard_end_unix_ms, file_name, created_at_iso)
+                   VALUES (?, ?, ?, ?)""",
+                (start, end, path.name, datetime.datetime.now().isoformat()),
+            )
+            catalog.commit()
+        finally:
+            catalog.close()
+        return conn, end
+
+    def _seed_from(self, conn, previous_path, session_id):
+        conn.execute("ATTACH DATABASE ? AS prev", (str(previous_path),))
+        try:
+            conn.execute("BEGIN")
+            for table in METADATA_TABLES:
+                conn.execute(f"INSERT OR IGNORE INTO {table} SELECT * FROM prev.{table}")
+            if session_id is not None:
+                conn.execute(
+                    "INSERT OR IGNORE INTO session SELECT * FROM prev.session WHERE session_id = ?",
+                    (session_id,),
+                )
+            # Carry the sample_id floor over as the rollup watermark: ids up to it live in
+            # older shards, so next_sample_id() starts above them and catch_up() skips them
+            floor = conn.execute(
+                """SELECT MAX(COALESCE((SELECT MAX(sample_id) FROM prev.sample), 0),
+                              COALESCE((SELECT last_sample_id FROM prev.rollup_watermark WHERE id = 1), 0))"""
+            ).fetchone()[0]
+            if floor:
+                conn.execute(
+                    "INSERT OR IGNORE INTO rollup_watermark (id, last_sample_id) VALUES (1, ?)",
+                    (floor,),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.execute("DETACH DATABASE prev")
+
+    @staticmethod
+    def next_sample_id(conn):
+        """First sample_id to use in a shard: above both its rows and its seeded floor."""
+        max_id = conn.execute("SELECT MAX(sample_id) FROM sample").fetchone()[0] or 0
+        return max(max_id, RollupManager.get_watermark(conn)) + 1
+
+    # -----------------------------
+    # Retention
+    # -----------------------------
+    def drop_before(self, cutoff_ms):
+        """
+        Deletes every shard file that ends at or before cutoff_ms, after merging its rollups,
+        sketches, session summaries and issue episodes into the catalog (one transaction
+        with unregistering the shard, so a crash can't merge a shard twice). Returns the
+        number of files dropped.
+        """
+        dropped = 0
+        for start, end, path in self.list_shards():
+            if end > cutoff_ms:
+                break
+            catalog = self._catalog()
+            try:
+                attached = path.exists()
+                if attached:
+                    catalog.execute("ATTACH DATABASE ? AS old", (str(path),))
+                    self._merge_shard(catalog)
+                catalog.execute("DELETE FROM shard WHERE shard_start_unix_ms = ?", (start,))
+                catalog.commit()
+                if attached:
+                    catalog.execute("DETACH DATABASE old")
+            finally:
+                catalog.close()
+            for suffix in ("", "-wal", "-shm"):
+                try:
+                    os.remove(f"{path}{suffix}")
+                except FileNotFoundError:
+                    pass
+            dropped += 1
+        return dropped
+
+    @staticmethod
+    def _merge_shard(catalog):
+        """Merges the derived history of the shard attached as `old` into the catalog. Caller commits."""
+        catalog.execute(
+            """INSERT INTO metric_rollup SELECT * FROM old.metric_rollup WHERE true
+               ON CONFLICT (resolution_ms, metric, bucket_unix_ms, host_uuid) DO UPDATE SET
+                 sample_count = sample_count + excluded.sample_count,
+                 min_value    = MIN(min_value, excluded.min_value),
+                 max_value    = MAX(max_value, excluded.max_value),
+                 sum_value    = sum_value + excluded.sum_value,
+                 sum_sq_value = sum_sq_value + excluded.sum_sq_value"""
+        )
+
+        # Sketches for buckets the catalog already has are merged one by one, the rest copied
+        shared = catalog.execute(
+            """SELECT s.resolution_ms, s.metric, s.bucket_unix_ms, s.host_uuid, s.min_value, s.max_value, s.sketch_blob
+               FROM old.metric_sketch s
+               JOIN main.metric_sketch m USING (resolution_ms, metric, bucket_unix_ms, host_uuid)"""
+        ).fetchall()
+        SketchManager.merge_rows(catalog, {
+            (res_ms, metric, bucket, host): DDSketch.from_blob(blob, lo, hi)
+            for res_ms, metric, bucket, host, lo, hi, blob in shared
+        })
+        catalog.execute("INSERT OR IGNORE INTO main.metric_sketch SELECT * FROM old.metric_sketch")
+
+        # Session summaries need their session and host rows; a session that ran across
+        # shards keeps the latest end/archive stamps and sums its partial summaries
+        catalog.execute("INSERT OR IGNORE INTO main.host SELECT * FROM old.host")
+        catalog.execute(
+            """INSERT INTO main.session SELECT * FROM old.session WHERE true
+               ON CONFLICT (session_id) DO UPDATE SET
+                 ended_at_unix_ms    = COALESCE(excluded.ended_at_unix_ms, ended_at_unix_ms),
+                 archived_at_unix_ms = COALESCE(excluded.archived_at_unix_ms, archived_at_unix_ms)"""
+        )
+        SessionSummary.merge_from(catalog, "old")
+
+        # Issue episodes get fresh ids; the longest-episode bounds only grow
+        columns = ", ".join(c for c in EPISODE_COLUMNS if c != "episode_id")
+        catalog.execute(f"INSERT INTO main.issue_episode ({columns}) SELECT {columns} FROM old.issue_episode")
+        catalog.execute(
+            """INSERT INTO main.issue_episode_span SELECT * FROM old.issue_episode_span WHERE true
+               ON CONFLICT (label) DO UPDATE SET max_duration_ms = MAX(max_duration_ms, excluded.max_duration_ms)"""
+        )
+
+    # -----------------------------
+    # Federated reads
+    # -----------------------------
+    def attach_range(self, conn, start_ms, end_ms, tables=("sample",)):
+        """
+        ATTACHes the shards overlapping [start_ms, end_ms) to conn as shard_0, shard_1, ...
+        and creates TEMP VIEWs all_<table> that UNION ALL each table across them.
+        Returns the attached schema names; call detach_range() when done.
+        """
+        shards = self.shards_overlapping(start_ms, end_ms)
+        if len(shards) > MAX_ATTACHED:
+            raise ValueError(f"{len(shards)} shards overlap the range; use scan_range() instead")
+
+        names = []
+        for i, (_, _, path) in enumerate(shards):
+            name = f"shard_{i}"
+            conn.execute(f"ATTACH DATABASE ? AS {name}", (str(path),))
+            names.append(name)
+
+        for table in tables:
+            conn.execute(f"DROP VIEW IF EXISTS temp.all_{table}")
+            if names:
+                union = " UNION ALL ".join(f"SELECT * FROM {n}.{table}" for n in names)
+            else:
+                union = f"SELECT * FROM main.{table} WHERE 0"
+            conn.execute(f"CREATE TEMP VIEW all_{table} AS {union}")
+        return names
+
+    @staticmethod
+    def detach_range(conn, names, tables=("sample",)):
+        for table in tables:
+            conn.execute(f"DROP VIEW IF EXISTS temp.all_{table}")
+        for name in names:
+            conn.execute(f"DETACH DATABASE {name}")
+
+    @staticmethod
+    def connect_read_only(path):
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @staticmethod
+    def read_shard(path, sql, params):
+        """Runs sql on one shard through a short-lived read-only connection."""
+        conn = ShardCatalog.connect_read_only(path)
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+    def scan_range(self, sql, params, start_ms, end_ms, max_workers=4):
+        """
+        Runs sql against every shard overlapping [start_ms, end_ms) in parallel threads
+        (one read-only connection each) and returns all rows, oldest shard first.
+        The query should filter on ts_unix_ms itself; the shard choice only prunes files.
+        """
+        shards = self.shards_overlapping(start_ms, end_ms)
+        if not shards:
+            return []
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(shards))) as pool:
+            results = pool.map(lambda path: self.read_shard(path, sql, params), [path for _, _, path in shards])
+            return [row for rows in results for row in rows]
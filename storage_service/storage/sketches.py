@@ -0,0 +1,431 @@
+# storage_service/storage/sketches.py
+# Author: Andrew Fox
+
+# Mergeable quantile sketches for long-range percentiles ("p99 write latency over the
+# last month") without reading raw ticks. Each sketch is a DDSketch: values are counted
+# in logarithmic bins of ratio gamma = (1 + a) / (1 - a), so any quantile it returns is
+# within a relative error of a = RELATIVE_ACCURACY (1 %) of the true value at that rank,
+# and two sketches merge exactly by adding bin counts. Negative values get their own
+# bins; anything closer to zero than MIN_INDEXABLE is counted as zero.
+#
+# metric_sketch holds one sketch per metric per minute per host, plus hourly and daily
+# merges of those (same RESOLUTIONS_MS as rollups.py), so a range query merges at most
+# ~120 minute, ~46 hour and one sketch per whole day instead of a month of minutes.
+# Ranges are minute-aligned like the rollups: every minute bucket starting in
+# [start_ms - start_ms % 60 s, end_ms) is included.
+#
+# SketchWriter (one per StorageManager) folds ticks into in-memory sketches for the
+# current minute and writes them out, with the sketch watermark, in the transaction of
+# the first tick of the next minute (or on close / shard rotation). A crash loses at most
+# that minute's sketches, and catch_up() rebuilds them from the raw ticks on the next
+# open. catch_up() must not run while a live writer has a minute pending.
+#
+# Usage:
+#   from storage_service.storage.sketches import SketchManager
+#   SketchManager.catch_up(conn)
+#   stats = SketchManager.query(conn, "avg_write_latency_ms", start_ms, end_ms, (0.5, 0.99))
+#   stats["quantiles"][0.99]
+
+import math
+import struct
+
+import numpy as np
+
+from storage_service.storage.rollups import CATCH_UP_BATCH, RESOLUTIONS_MS, ROLLUP_METRICS, _TICK_SQL
+
+RELATIVE_ACCURACY = 0.01
+
+# |value| below this is counted as zero
+MIN_INDEXABLE = 1e-9
+
+DEFAULT_QUANTILES = (0.5, 0.9, 0.99)
+
+SKETCH_METRICS = tuple(ROLLUP_METRICS)
+
+# Blob layout: version, zero count, positive / negative bin counts, then int16 bin keys
+# (positive first) and uint32 bin counts
+_BLOB_VERSION = 1
+_BLOB_HEADER = struct.Struct("<BIHH")
+
+_GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+_LOG_GAMMA = math.log(_GAMMA)
+_MAX_KEY = 2 ** 15 - 1
+
+_UPSERT_SQL = """
+    INSERT OR REPLACE INTO metric_sketch
+      (resolution_ms, metric, bucket_unix_ms, host_uuid, sample_count, min_value, max_value, sketch_blob)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+_SELECT_SQL = """
+    SELECT min_value, max_value, sketch_blob FROM metric_sketch
+    WHERE resolution_ms = ? AND metric = ? AND bucket_unix_ms >= ? AND bucket_unix_ms < ?
+"""
+
+
+class DDSketch:
+    # Log-binned quantile sketch with relative accuracy RELATIVE_ACCURACY.
+
+    def __init__(self):
+        self.bins = {}        # key -> count, values > 0
+        self.neg_bins = {}    # key of -value -> count, values < 0
+        self.zero_count = 0
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    @staticmethod
+    def key(value):
+        """Bin of a positive value: gamma^(key-1) < value <= gamma^key."""
+        return max(-_MAX_KEY, min(_MAX_KEY, math.ceil(math.log(value) / _LOG_GAMMA)))
+
+    @staticmethod
+    def bin_value(key):
+        # Midpoint (in relative terms) of the bin, within RELATIVE_ACCURACY of all its values
+        return 2 * _GAMMA ** key / (_GAMMA + 1)
+
+    def add(self, value, n=1):
+        if value > MIN_INDEXABLE:
+            k = DDSketch.key(value)
+            self.bins[k] = self.bins.get(k, 0) + n
+        elif value < -MIN_INDEXABLE:
+            k = DDSketch.key(-value)
+            self.neg_bins[k] = self.neg_bins.get(k, 0) + n
+        else:
+            self.zero_count += n
+        self.count += n
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        for k, c in other.bins.items():
+            self.bins[k] = self.bins.get(k, 0) + c
+        for k, c in other.neg_bins.items():
+            self.neg_bins[k] = self.neg_bins.get(k, 0) + c
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q):
+        """Value at quantile q in [0, 1], or None for an empty sketch."""
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for k in sorted(self.neg_bins, reverse=True):
+            seen += self.neg_bins[k]
+            if seen > rank:
+                return max(-DDSketch.bin_value(k), self.min)
+        seen += self.zero_count
+        if seen > rank:
+            return 0.0
+        for k in sorted(self.bins):
+            seen += self.bins[k]
+            if seen > rank:
+                return min(DDSketch.bin_value(k), self.max)
+        return self.max
+
+    # -----------------------------
+    # Serialisation (count / min / max live in their own columns)
+    # -----------------------------
+    def to_blob(self):
+        keys = list(self.bins) + list(self.neg_bins)
+        counts = list(self.bins.values()) + list(self.neg_bins.values())
+        header = _BLOB_HEADER.pack(_BLOB_VERSION, self.zero_count, len(self.bins), len(self.neg_bins))
+        return header + np.asarray(keys, dtype="<i2").tobytes() + np.asarray(counts, dtype="<u4").tobytes()
+
+    @staticmethod
+    def from_blob(blob, min_value, max_value):
+        version, zero_count, n_pos, n_neg = _BLOB_HEADER.unpack_from(blob)
+        if version != _BLOB_VERSION:
+            raise ValueError(f"Unknown sketch blob version: {version}")
+        n = n_pos + n_neg
+        keys = np.frombuffer(blob, dtype="<i2", count=n, offset=_BLOB_HEADER.size).tolist()
+        counts = np.frombuffer(blob, dtype="<u4", count=n, offset=_BLOB_HEADER.size + 2 * n).tolist()
+        sketch = DDSketch()
+        sketch.bins = dict(zip(keys[:n_pos], counts[:n_pos]))
+        sketch.neg_bins = dict(zip(keys[n_pos:], counts[n_pos:]))
+        sketch.zero_count = zero_count
+        sketch.count = zero_count + sum(counts)
+        sketch.min = min_value
+        sketch.max = max_value
+        return sketch
+
+
+class SketchWriter:
+    # Current-minute sketches of one host's live writer (StorageManager). apply_tick()
+    # runs inside the tick's transaction; commit() / rollback() follow its outcome.
+
+    def __init__(self, host_uuid):
+        self.host_uuid = host_uuid
+        self.bucket = None          # minute being filled
+        self.sketches = {}          # metric -> DDSketch
+        self.last_sample_id = None
+        self._staged = None
+
+    def apply_tick(self, conn, sample_id, ts_unix_ms, values):
+        """Writes out the previous minute if this tick starts a new one; stages the tick."""
+        bucket = ts_unix_ms - ts_unix_ms % RESOLUTIONS_MS["1m"]
+        flushed = self.bucket is not None and bucket != self.bucket
+        if flushed:
+            self._write(conn)
+        self._staged = (flushed, bucket, sample_id, values)
+
+    def commit(self):
+        if self._staged is None:
+            return
+        flushed, bucket, sample_id, values = self._staged
+        self._staged = None
+        if flushed:
+            self.sketches = {}
+        self.bucket = bucket
+        self.last_sample_id = sample_id
+        for metric, value in values.items():
+            if value is not None and metric in ROLLUP_METRICS:
+                sketch = self.sketches.get(metric)
+                if sketch is None:
+                    sketch = self.sketches[metric] = DDSketch()
+                sketch.add(float(value))
+
+    def rollback(self):
+        self._staged = None
+
+    def flush(self, conn):
+        """Writes out the pending minute (close, shard rotation). Caller commits."""
+        if self.bucket is None:
+            return
+        self._write(conn)
+        self.bucket, self.sketches, self.last_sample_id = None, {}, None
+
+    def pending(self, metric, start_ms, end_ms, host_uuid=None):
+        """The unwritten current-minute sketch for metric if its minute is in the range."""
+        if self.bucket is None or host_uuid not in (None, self.host_uuid):
+            return None
+        if not (start_ms - start_ms % RESOLUTIONS_MS["1m"] <= self.bucket < end_ms):
+            return None
+        return self.sketches.get(metric)
+
+    def _write(self, conn):
+        deltas = {}
+        for metric, sketch in self.sketches.items():
+            for res_ms in RESOLUTIONS_MS.values():
+                deltas[(res_ms, metric, self.bucket - self.bucket % res_ms, self.host_uuid)] = sketch
+        SketchManager.merge_rows(conn, deltas)
+        SketchManager._set_watermark(conn, self.last_sample_id)
+
+
+class SketchManager:
+    # Stateless helpers around the metric_sketch and sketch_watermark tables.
+
+    # -----------------------------
+    # Write path
+    # -----------------------------
+    @staticmethod
+    def merge_rows(conn, deltas):
+        """
+        Merges sketches into metric_sketch. deltas maps (resolution_ms, metric,
+        bucket_unix_ms, host_uuid) -> DDSketch; the sketches are not modified.
+        """
+        rows = []
+        for key, delta in deltas.items():
+            row = conn.execute(
+                """SELECT min_value, max_value, sketch_blob FROM metric_sketch
+                   WHERE resolution_ms = ? AND metric = ? AND bucket_unix_ms = ? AND host_uuid = ?""",
+                key,
+            ).fetchone()
+            sketch = DDSketch() if row is None else DDSketch.from_blob(row[2], row[0], row[1])
+            sketch.merge(delta)
+            rows.append((*key, sketch.count, sketch.min, sketch.max, sketch.to_blob()))
+        conn.executemany(_UPSERT_SQL, rows)
+
+    @staticmethod
+    def catch_up(conn, batch_size=CATCH_UP_BATCH):
+        """
+        Sketches every raw sample above the watermark, batch_size ticks per transaction.
+        Returns the number of samples processed.
+        """
+        watermark = SketchManager.get_watermark(conn)
+        max_id = conn.execute("SELECT MAX(sample_id) FROM sample").fetchone()[0]
+        if max_id is None or max_id <= watermark:
+            return 0
+
+        processed = 0
+        lo = watermark
+        while lo < max_id:
+            hi = min(lo + batch_size, max_id)
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                processed += SketchManager.apply_range(conn, lo, hi)
+                SketchManager._set_watermark(conn, hi)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            lo = hi
+
+        return processed
+
+    @staticmethod
+    def apply_range(conn, lo, hi):
+        """
+        Merges the raw samples with lo < sample_id <= hi into metric_sketch (watermark
+        untouched). Runs in the caller's transaction; returns the number of samples.
+        """
+        columns = ", ".join(f"{expr} AS {name}" for name, expr in ROLLUP_METRICS.items())
+        rows = conn.execute(_TICK_SQL.format(columns=columns), (lo, hi)).fetchall()
+        minute_ms = RESOLUTIONS_MS["1m"]
+        # Minute sketches from the ticks, coarser ones merged from those
+        deltas = {}
+        for (host_uuid, minute, metric), sketch in SketchManager._minute_sketches(rows).items():
+            deltas[(minute_ms, metric, minute, host_uuid)] = sketch
+            for res_ms in list(RESOLUTIONS_MS.values())[1:]:
+                key = (res_ms, metric, minute - minute % res_ms, host_uuid)
+                coarse = deltas.get(key)
+                if coarse is None:
+                    coarse = deltas[key] = DDSketch()
+                coarse.merge(sketch)
+        SketchManager.merge_rows(conn, deltas)
+        return len(rows)
+
+    @staticmethod
+    def _minute_sketches(rows):
+        """
+        {(host_uuid, minute_ms, metric): DDSketch} for _TICK_SQL rows. Bins are counted
+        with np.unique over one int64 (host, minute, sign, key) code per value instead of
+        one add() per value.
+        """
+        if not rows:
+            return {}
+        minute_ms = RESOLUTIONS_MS["1m"]
+        hosts = sorted({row[2] for row in rows})
+        host_code = {h: i for i, h in enumerate(hosts)}
+        ts = np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows))
+        minute_idx = ts // minute_ms
+        first_minute = int(minute_idx.min())
+        n_minutes = int(minute_idx.max()) - first_minute + 1
+        host_idx = np.fromiter((host_code[row[2]] for row in rows), dtype=np.int64, count=len(rows))
+        values = np.array([tuple(row)[3:] for row in rows], dtype=float)   # None -> NaN
+
+        # (host, minute) groups, shared by every metric
+        group_codes, group_of = np.unique(host_idx * n_minutes + minute_idx - first_minute, return_inverse=True)
+        group_of = group_of.reshape(-1)
+        group_keys = [
+            (hosts[code // n_minutes], (first_minute + code % n_minutes) * minute_ms)
+            for code in group_codes.tolist()
+        ]
+        n_keys = 2 * _MAX_KEY + 1
+
+        out = {}
+        for j, metric in enumerate(SKETCH_METRICS):
+            present = ~np.isnan(values[:, j])
+            if not present.any():
+                continue
+            v, g = values[present, j], group_of[present]
+            sign = np.where(v > MIN_INDEXABLE, 1, np.where(v < -MIN_INDEXABLE, -1, 0))
+            with np.errstate(divide="ignore"):
+                keys = np.ceil(np.log(np.abs(v)) / _LOG_GAMMA)
+            keys = np.where(sign == 0, 0, np.clip(keys, -_MAX_KEY, _MAX_KEY)).astype(np.int64)
+
+            lows = np.full(len(group_keys), np.inf)
+            highs = np.full(len(group_keys), -np.inf)
+            np.minimum.at(lows, g, v)
+            np.maximum.at(highs, g, v)
+            sketches = {}
+            for gi in np.unique(g).tolist():
+                sketch = sketches[gi] = DDSketch()
+                sketch.min, sketch.max = float(lows[gi]), float(highs[gi])
+                out[(*group_keys[gi], metric)] = sketch
+
+            codes, counts = np.unique((g * 3 + sign + 1) * n_keys + keys + _MAX_KEY, return_counts=True)
+            for code, count in zip(codes.tolist(), counts.tolist()):
+                rest, k = divmod(code, n_keys)
+                gi, s = divmod(rest, 3)
+                sketch = sketches[gi]
+                sketch.count += count
+                if s == 2:
+                    sketch.bins[k - _MAX_KEY] = count
+                elif s == 0:
+                    sketch.neg_bins[k - _MAX_KEY] = count
+                else:
+                    sketch.zero_count = count
+        return out
+
+    @staticmethod
+    def get_watermark(conn):
+        row = conn.execute("SELECT last_sample_id FROM sketch_watermark WHERE id = 1").fetchone()
+        return row[0] if row else 0
+
+    @staticmethod
+    def _set_watermark(conn, sample_id):
+        conn.execute(
+            """INSERT INTO sketch_watermark (id, last_sample_id) VALUES (1, ?)
+               ON CONFLICT (id) DO UPDATE SET last_sample_id = MAX(last_sample_id, excluded.last_sample_id)""",
+            (sample_id,),
+        )
+
+    # -----------------------------
+    # Read path
+    # -----------------------------
+    @staticmethod
+    def plan(start_ms, end_ms):
+        """
+        Covers the minute buckets starting in [start_ms, end_ms) (start floored to the
+        minute) with the fewest sketches: whole days, then whole hours, then minutes at the
+        edges. Returns a list of (resolution_ms, lo_ms, hi_ms) bucket ranges.
+        """
+        levels = list(RESOLUTIONS_MS.values())
+        minute_ms = levels[0]
+        lo = start_ms - start_ms % minute_ms
+        hi = -(-end_ms // minute_ms) * minute_ms
+
+        def split(lo, hi, depth):
+            if lo >= hi:
+                return []
+            res_ms = levels[depth]
+            if depth == 0:
+                return [(res_ms, lo, hi)]
+            inner_lo = -(-lo // res_ms) * res_ms
+            inner_hi = hi - hi % res_ms
+            if inner_lo >= inner_hi:
+                return split(lo, hi, depth - 1)
+            return split(lo, inner_lo, depth - 1) + [(res_ms, inner_lo, inner_hi)] + split(inner_hi, hi, depth - 1)
+
+        return split(lo, hi, len(levels) - 1)
+
+    @staticmethod
+    def merged(conn, metric, start_ms, end_ms, host_uuid=None):
+        """
+        One DDSketch of metric over the range (all hosts unless host_uuid is given).
+        conn may also be a list of connections (shards and their catalog).
+        """
+        if metric not in ROLLUP_METRICS:
+            raise ValueError(f"Unknown sketch metric: {metric}")
+        sql = _SELECT_SQL + (" AND host_uuid = ?" if host_uuid is not None else "")
+        sketch = DDSketch()
+        for res_ms, lo, hi in SketchManager.plan(start_ms, end_ms):
+            params = (res_ms, metric, lo, hi) + ((host_uuid,) if host_uuid is not None else ())
+            for c in (conn if isinstance(conn, (list, tuple)) else [conn]):
+                for min_value, max_value, blob in c.execute(sql, params):
+                    sketch.merge(DDSketch.from_blob(blob, min_value, max_value))
+        return sketch
+
+    @staticmethod
+    def describe(sketch, quantiles=DEFAULT_QUANTILES):
+        """count, min, max, relative_accuracy and {q: value} for a sketch (None when empty)."""
+        empty = sketch.count == 0
+        return {
+            "count":             sketch.count,
+            "min":               None if empty else sketch.min,
+            "max":               None if empty else sketch.max,
+            "relative_accuracy": RELATIVE_ACCURACY,
+            "quantiles":         {q: sketch.quantile(q) for q in quantiles},
+        }
+
+    @staticmethod
+    def query(conn, metric, start_ms, end_ms, quantiles=DEFAULT_QUANTILES, host_uuid=None):
+        """
+        Percentiles of metric over [start_ms, end_ms) from the stored sketches. Each value
+        is within RELATIVE_ACCURACY of the exact quantile of the sketched ticks.
+        """
+        return SketchManager.describe(SketchManager.merged(conn, metric, start_ms, end_ms, host_uuid), quantiles)
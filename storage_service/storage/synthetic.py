@@ -0,0 +1,367 @@
+# storage_service/storage/synthetic.py
+# Author: Andrew Fox
+
+# Bulk synthetic telemetry generator for load testing.
+# Writes months of multi-host data straight into the current schema, far faster than
+# replaying insert_sample() one tick at a time:
+#   - every host gets back-to-back sessions (with short gaps) over the requested days
+#   - values follow a daily load cycle plus slow drift, bursts and noise, with the
+#     usual couplings (frequency and GPU temperature/power track load, disk usage creeps up)
+#   - method="numpy" builds each batch as NumPy arrays and loads it with executemany();
+#     method="cte" makes SQLite generate the rows itself with recursive CTEs (no Python
+#     per row, simpler shapes)
+#   - secondary indexes are dropped for the load and rebuilt once at the end; foreign
+#     key checks, fsyncs and the journal are off until then (a crash mid-load can leave
+#     a broken file, which is fine for throwaway load-test data)
+# Rollups and quantile sketches are either built afterwards (rollups=True, slow at tens
+# of millions of ticks) or skipped by moving their watermarks past the data. Session summaries
+# and zone maps are always built afterwards, so opening the file with StorageManager doesn't have to.
+#
+# Usage:
+#   from storage_service.storage.synthetic import generate_db
+#   stats = generate_db("synth.db", hosts=10, days=30)
+#
+# CLI:
+#   python -m storage_service.storage.synthetic --db synth.db --hosts 10 --days 30
+
+import datetime
+import os
+import time
+import uuid
+
+import numpy as np
+
+from storage_service.storage.rollups import RollupManager
+from storage_service.storage.schema import drop_bulk_indexes, init_db
+from storage_service.storage.sketches import SketchManager
+from storage_service.storage.model_input import ModelInput
+from storage_service.storage.session_summary import SessionSummary
+from storage_service.storage.zone_maps import ZoneMap
+
+DAY_S = 86_400
+BATCH_TICKS = 100_000
+METHODS = ("numpy", "cte")
+
+
+# -----------------------------
+# Signal helpers
+# -----------------------------
+def _diurnal(ts_s):
+    # 0 at 03:00, 1 at 15:00
+    return 0.5 - 0.5 * np.cos(2 * np.pi * ((ts_s % DAY_S) / DAY_S - 0.125))
+
+
+def _trailing_sum(x, w):
+    c = np.cumsum(np.concatenate((np.zeros(w), x)))
+    return c[w:] - c[:-w]
+
+
+def _wander(rng, n, block, scale):
+    # Random level per block of ticks, smoothed over a quarter block: slow drift and steps
+    levels = rng.normal(0.0, scale, n // block + 2)
+    w = max(block // 4, 1)
+    return _trailing_sum(np.repeat(levels, block)[:n], w) / w
+
+
+def _bursts(rng, n, rate, length, height):
+    # Occasional plateaus (builds, games, backups) of roughly `length` ticks
+    starts = (rng.random(n) < rate / length).astype(np.float64)
+    return (_trailing_sum(starts, length) > 0) * height
+
+
+# -----------------------------
+# Hosts and sessions
+# -----------------------------
+def _make_hosts(rng, n_hosts, gpus_per_host, partitions_per_host):
+    hosts = []
+    for h in range(n_hosts):
+        host_uuid = str(uuid.UUID(int=int(rng.integers(0, 2**63)) << 64 | h))
+        hosts.append({
+            "host_uuid":   host_uuid,
+            "hostname":    f"synth-{h:03d}",
+            "cpu_max_mhz": int(rng.choice([3200, 3600, 4200, 4800, 5200])),
+            "total_ram_gb": float(rng.choice([8, 16, 32, 64])),
+            "vram_mb":     int(rng.choice([4096, 8192, 12288, 24576])),
+            "power_limit_w": float(rng.choice([150, 220, 320, 450])),
+            "gpus":        [f"{host_uuid}-gpu{g}" for g in range(gpus_per_host)],
+            "partitions":  [(f"/dev/sd{chr(97 + p)}", f"/mnt/{chr(97 + p)}", float(rng.choice([256, 512, 1000, 2000])),
+                             float(rng.uniform(20, 80)))
+                            for p in range(partitions_per_host)],
+        })
+    return hosts
+
+
+def _plan_sessions(rng, start_s, end_s, session_hours, gap_hours):
+    """[(start_s, n_ticks)] of back-to-back sessions between start_s and end_s."""
+    sessions, t = [], start_s
+    while t < end_s:
+        length = int(rng.uniform(0.5, 1.5) * session_hours * 3600)
+        length = max(min(length, end_s - t), 1)
+        sessions.append((t, length))
+        t += length + int(rng.uniform(0, gap_hours) * 3600) + 1
+    return sessions
+
+
+def _register(conn, hosts, start_s):
+    iso = datetime.datetime.fromtimestamp(start_s).isoformat()
+    partition_ids = {}
+    for host in hosts:
+        conn.execute(
+            """INSERT OR IGNORE INTO host
+                 (host_uuid, hostname, os_name, machine, cpu_model, cpu_core_count, cpu_thread_count,
+                  cpu_max_mhz, total_ram_gb, gpu_detected, created_at_iso, created_at_unix_ms)
+               VALUES (?, ?, 'Windows', 'AMD64', 'Synthetic CPU', 8, 16, ?, ?, ?, ?, ?)""",
+            (host["host_uuid"], host["hostname"], host["cpu_max_mhz"], host["total_ram_gb"],
+             int(bool(host["gpus"])), iso, start_s * 1000),
+        )
+        for gpu_uuid in host["gpus"]:
+            conn.execute(
+                """INSERT OR IGNORE INTO gpu_device (gpu_uuid, host_uuid, gpu_name, first_seen_iso, first_seen_unix_ms)
+                   VALUES (?, ?, 'Synthetic GPU', ?, ?)""",
+                (gpu_uuid, host["host_uuid"], iso, start_s * 1000),
+            )
+        for device, mountpoint, _, _ in host["partitions"]:
+            conn.execute(
+                """INSERT OR IGNORE INTO disk_partition (host_uuid, device, mountpoint, fstype, first_seen_iso, first_seen_unix_ms)
+                   VALUES (?, ?, ?, 'NTFS', ?, ?)""",
+                (host["host_uuid"], device, mountpoint, iso, start_s * 1000),
+            )
+            partition_ids[(host["host_uuid"], device, mountpoint)] = conn.execute(
+                "SELECT partition_id FROM disk_partition WHERE host_uuid = ? AND device = ? AND mountpoint = ?",
+                (host["host_uuid"], device, mountpoint),
+            ).fetchone()[0]
+    return partition_ids
+
+
+# -----------------------------
+# NumPy batches
+# -----------------------------
+def _insert_numpy(conn, rng, host, partition_ids, session_id, first_id, ts_s):
+    n = len(ts_s)
+    ids = np.arange(first_id, first_id + n, dtype=np.int64)
+    ts_ms = ts_s.astype(np.int64) * 1000
+    day = _diurnal(ts_s)
+    r2 = lambda a: np.round(a, 2).tolist()   # collectors report two decimals
+
+    iso = np.datetime_as_string(ts_ms.astype("datetime64[ms]")).tolist()
+    collect_ms = rng.integers(5, 40, n).tolist()
+    conn.executemany(
+        "INSERT INTO sample (sample_id, session_id, ts_iso, ts_unix_ms, collect_duration_ms, dropped_metrics) "
+        "VALUES (?, ?, ?, ?, ?, 0)",
+        zip(ids.tolist(), [session_id] * n, iso, ts_ms.tolist(), collect_ms),
+    )
+
+    cpu = np.clip(12 + 25 * day + _wander(rng, n, 300, 8) + _bursts(rng, n, 0.01, 900, 45)
+                  + np.abs(rng.normal(0, 3, n)), 0.5, 100)
+    freq = np.clip(host["cpu_max_mhz"] * (0.55 + 0.45 * cpu / 100) + rng.normal(0, 40, n), 800, host["cpu_max_mhz"])
+    conn.executemany("INSERT INTO cpu_sample VALUES (?, ?, ?)", zip(ids.tolist(), r2(cpu), r2(freq)))
+
+    ram = np.clip(40 + 10 * day + _wander(rng, n, 3600, 8) + rng.normal(0, 0.5, n), 5, 99)
+    swap = np.clip(2 + np.maximum(ram - 80, 0) * 1.5 + np.abs(rng.normal(0, 0.3, n)), 0, 100)
+    conn.executemany("INSERT INTO ram_sample VALUES (?, ?, ?, ?)",
+                     zip(ids.tolist(), r2(ram / 100 * host["total_ram_gb"]), r2(ram), r2(swap)))
+
+    for gpu_id, gpu_uuid in enumerate(host["gpus"]):
+        util = np.clip(3 + _bursts(rng, n, 0.005, 3600, 70) + _wander(rng, n, 600, 6) + np.abs(rng.normal(0, 2, n)), 0, 100)
+        smooth = _trailing_sum(util, 60) / 60   # temperature lags load by about a minute
+        mem = np.clip(10 + util * 0.6 + rng.normal(0, 1, n), 0, 100)
+        temp = 35 + 0.45 * smooth + rng.normal(0, 0.5, n)
+        clock = 300 + util / 100 * 1600 + rng.normal(0, 15, n)
+        power = np.clip(8 + util / 100 * (host["power_limit_w"] - 8) + rng.normal(0, 3, n), 5, host["power_limit_w"])
+        conn.executemany(
+            "INSERT INTO gpu_sample VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            zip(ids.tolist(), [gpu_uuid] * n, [gpu_id] * n, r2(util), r2(mem),
+                np.round(mem / 100 * host["vram_mb"]).astype(np.int64).tolist(),
+                r2(temp), r2(clock), r2(power), [host["power_limit_w"]] * n),
+        )
+
+    busy = rng.random(n) < 0.25 + 0.25 * day
+    read = busy * rng.lognormal(13, 1.5, n)
+    write = busy * rng.lognormal(12.5, 1.5, n)
+    read_lat = 0.3 + (read + write) / 1e8 + np.abs(rng.normal(0, 0.3, n))
+    write_lat = 0.4 + (read + write) / 8e7 + np.abs(rng.normal(0, 0.3, n))
+    conn.executemany("INSERT INTO disk_io_sample VALUES (?, ?, ?, ?, ?)",
+                     zip(ids.tolist(), r2(read), r2(write), r2(read_lat), r2(write_lat)))
+
+    for device, mountpoint, total_gb, start_pct in host["partitions"]:
+        # Creeps up ~0.05 %/day from where the partition started
+        pct = np.clip(start_pct + (ts_s - ts_s[0]) / DAY_S * 0.05 + rng.normal(0, 0.01, n), 0, 100)
+        conn.executemany(
+            "INSERT INTO disk_partition_sample VALUES (?, ?, ?, ?, ?)",
+            zip(ids.tolist(), [partition_ids[(host["host_uuid"], device, mountpoint)]] * n,
+                [total_gb] * n, r2(pct / 100 * total_gb), r2(pct)),
+        )
+
+
+# -----------------------------
+# Recursive CTE batches
+# -----------------------------
+_SEQ = "WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i < ? - 1) "
+# Triangle wave stand-in for the daily cycle (math functions are optional in SQLite builds)
+_DAY = "(1.0 - abs(((? + i) % 86400) - 54000) / 43200.0)"
+_NOISE = "(abs(random()) % 1000 / 1000.0)"
+
+
+def _insert_cte(conn, host, partition_ids, session_id, first_id, start_s, n):
+    conn.execute(
+        _SEQ + "INSERT INTO sample (sample_id, session_id, ts_iso, ts_unix_ms, collect_duration_ms, dropped_metrics) "
+               "SELECT ? + i, ?, strftime('%Y-%m-%dT%H:%M:%S', ? + i, 'unixepoch'), (? + i) * 1000, "
+               "5 + abs(random()) % 35, 0 FROM n",
+        (n, first_id, session_id, start_s, start_s),
+    )
+    conn.execute(
+        _SEQ + f"INSERT INTO cpu_sample SELECT ? + i, round(min(100, 5 + 40 * {_DAY} + 20 * {_NOISE}), 2), "
+               f"round(? * (0.6 + 0.4 * {_NOISE}), 2) FROM n",
+        (n, first_id, start_s, host["cpu_max_mhz"]),
+    )
+    conn.execute(
+        _SEQ + f"INSERT INTO ram_sample SELECT ? + i, round(? * (0.4 + 0.1 * {_DAY}), 2), "
+               f"round(40 + 10 * {_DAY} + {_NOISE}, 2), round(2 + {_NOISE}, 2) FROM n",
+        (n, first_id, host["total_ram_gb"], start_s, start_s),
+    )
+    for gpu_id, gpu_uuid in enumerate(host["gpus"]):
+        conn.execute(
+            _SEQ + f"INSERT INTO gpu_sample SELECT ? + i, ?, ?, round(60 * {_NOISE} * {_NOISE}, 2), "
+                   f"round(10 + 20 * {_NOISE}, 2), ? / 4 + abs(random()) % 512, round(40 + 25 * {_NOISE}, 2), "
+                   f"round(300 + 1500 * {_NOISE}, 2), round(8 + 100 * {_NOISE}, 2), ? FROM n",
+            (n, first_id, gpu_uuid, gpu_id, host["vram_mb"], host["power_limit_w"]),
+        )
+    conn.execute(
+        _SEQ + f"INSERT INTO disk_io_sample SELECT ? + i, round(1e6 * {_NOISE} * {_NOISE}, 2), "
+               f"round(5e5 * {_NOISE} * {_NOISE}, 2), round(0.3 + 2 * {_NOISE}, 2), round(0.4 + 2 * {_NOISE}, 2) FROM n",
+        (n, first_id),
+    )
+    for device, mountpoint, total_gb, start_pct in host["partitions"]:
+        conn.execute(
+            _SEQ + "INSERT INTO disk_partition_sample SELECT ? + i, ?, ?, round(? * (? + i * 0.05 / 86400) / 100, 2), "
+                   "round(? + i * 0.05 / 86400, 2) FROM n",
+            (n, first_id, partition_ids[(host["host_uuid"], device, mountpoint)], total_gb, total_gb,
+             start_pct, start_pct),
+        )
+
+
+# -----------------------------
+# Generator
+# -----------------------------
+def generate_db(db_path, hosts=3, days=30, end_ms=None, gpus_per_host=1, partitions_per_host=2,
+                session_hours=24, gap_hours=1, method="numpy", seed=0, rollups=False,
+                batch_ticks=BATCH_TICKS, progress=None):
+    """
+    Appends `days` of 1 Hz telemetry for `hosts` hosts ending at end_ms (default now) to
+    db_path and returns a stats dict. progress(ticks_done, ticks_total) is called per batch.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown method: {method}")
+    rng = np.random.default_rng(seed)
+    end_s = (int(time.time() * 1000) if end_ms is None else end_ms) // 1000
+    start_s = end_s - int(days * DAY_S)
+
+    host_list = _make_hosts(rng, hosts, gpus_per_host, partitions_per_host)
+    plans = [_plan_sessions(rng, start_s, end_s, session_hours, gap_hours) for _ in host_list]
+    total = sum(n for plan in plans for _, n in plan)
+
+    t0 = time.perf_counter()
+    conn = init_db(db_path)
+    conn.row_factory = None
+    conn.execute("PRAGMA foreign_keys = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("PRAGMA cache_size = -262144")   # 256 MiB
+    # No WAL for the load: pages are written once instead of WAL + checkpoint
+    conn.execute("PRAGMA journal_mode = OFF")
+    try:
+        partition_ids = _register(conn, host_list, start_s)
+        next_id = (conn.execute("SELECT MAX(sample_id) FROM sample").fetchone()[0] or 0) + 1
+        index_sql = drop_bulk_indexes(conn)
+        conn.commit()
+
+        done = sessions = 0
+        for host, plan in zip(host_list, plans):
+            for session_start, n in plan:
+                cur = conn.execute(
+                    """INSERT INTO session (host_uuid, started_at_iso, started_at_unix_ms, sample_interval_ms,
+                                            ended_at_unix_ms)
+                       VALUES (?, ?, ?, 1000, ?)""",
+                    (host["host_uuid"], datetime.datetime.fromtimestamp(session_start).isoformat(),
+                     session_start * 1000, (session_start + n) * 1000),
+                )
+                session_id = cur.lastrowid
+                sessions += 1
+                for off in range(0, n, batch_ticks):
+                    size = min(batch_ticks, n - off)
+                    if method == "numpy":
+                        ts_s = np.arange(session_start + off, session_start + off + size, dtype=np.int64)
+                        _insert_numpy(conn, rng, host, partition_ids, session_id, next_id, ts_s)
+                    else:
+                        _insert_cte(conn, host, partition_ids, session_id, next_id, session_start + off, size)
+                    conn.commit()
+                    next_id += size
+                    done += size
+                    if progress is not None:
+                        progress(done, total)
+
+        load_s = time.perf_counter() - t0
+        for sql in index_sql:
+            conn.execute(sql)
+        conn.commit()
+        index_s = time.perf_counter() - t0 - load_s
+
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA foreign_keys = ON")
+        if rollups:
+            RollupManager.catch_up(conn)
+            SketchManager.catch_up(conn)
+        else:
+            RollupManager._set_watermark(conn, next_id - 1)
+            SketchManager._set_watermark(conn, next_id - 1)
+            conn.commit()
+        SessionSummary.catch_up(conn)
+        ModelInput.catch_up(conn)
+        ZoneMap.catch_up(conn)
+    finally:
+        # If the load fails part way, init_db() recreates the dropped indexes on next open
+        conn.close()
+
+    elapsed = time.perf_counter() - t0
+    return {
+        "hosts":       hosts,
+        "sessions":    sessions,
+        "ticks":       total,
+        "method":      method,
+        "load_s":      load_s,
+        "index_s":     index_s,
+        "seconds":     elapsed,
+        "ticks_per_s": total / elapsed if elapsed else None,
+        "db_bytes":    os.path.getsize(db_path),
+    }
+
+
+# -----------------------------
+# CLI
+# -----------------------------
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Generate a synthetic multi-host telemetry database")
+    parser.add_argument("--db", required=True)
+    parser.add_argument("--hosts", type=int, default=3)
+    parser.add_argument("--days", type=float, default=30)
+    parser.add_argument("--gpus", type=int, default=1, help="GPUs per host")
+    parser.add_argument("--partitions", type=int, default=2, help="disk partitions per host")
+    parser.add_argument("--method", choices=METHODS, default="numpy")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rollups", action="store_true", help="build metric rollups and sketches too (slow at large scale)")
+    args = parser.parse_args(argv)
+
+    def progress(done, total):
+        print(f"\r{done:,} / {total:,} ticks", end="", flush=True)
+
+    stats = generate_db(args.db, hosts=args.hosts, days=args.days, gpus_per_host=args.gpus,
+                        partitions_per_host=args.partitions, method=args.method, seed=args.seed,
+                        rollups=args.rollups, progress=progress)
+    print()
+    print(f"Wrote {stats['ticks']:,} ticks in {stats['sessions']} sessions to {args.db} "
+          f"in {stats['seconds']:.1f} s ({stats['ticks_per_s']:,.0f} ticks/s, {stats['db_bytes'] / 1e6:,.0f} MB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+# storage_service/storage/tuning.py
+# Author: Andrew Fox
+
+# Named SQLite tuning profiles for telemetry.db. schema.connect() always sets the base
+# pragmas (WAL, foreign keys, busy timeout, ...); a profile adds page / cache / mmap /
+# checkpoint settings on top:
+#   laptop       low memory: small page cache, no mmap, SQLite's page size
+#   server       plenty of RAM: large cache, 512 MiB mmap, bigger pages, rarer checkpoints
+#   bulk_import  synthetic / merge loads into a new file: huge cache, synchronous OFF
+#                (a crash can lose or corrupt the file being built), no autocheckpoint
+#   archive      read-mostly history: 16 KiB pages for long range scans, 1 GiB mmap
+# page_size only applies to a file that doesn't exist yet (a WAL file can't change it
+# afterwards), so a profile picked for an existing DB changes everything but that.
+# No profile (None) keeps the base pragmas only, as before profiles existed.
+#
+# calibrate() builds a small synthetic DB per candidate profile on the disk the telemetry
+# lives on, runs the benchmark.py insert and read measurements against each and recommends
+# the one with the lowest cost relative to the best result per measurement.
+# Statistics for the query planner are refreshed by optimize.OptimizeManager.
+#
+# Usage:
+#   storage = StorageManager("telemetry.db", profile="server")
+#   conn = init_db("fleet.db", profile="bulk_import")
+#
+# CLI:
+#   python -m storage_service.storage.tuning --work-dir . --out tuning.json
+
+import datetime
+import json
+import shutil
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+
+# cache_size < 0 is KiB (SQLite convention); mmap_size is bytes; wal_autocheckpoint is pages
+PROFILES = {
+    "laptop": {
+        "page_size":          4096,
+        "cache_size":         -8192,        # 8 MiB
+        "mmap_size":          0,
+        "wal_autocheckpoint": 1000,
+        "synchronous":        "NORMAL",
+    },
+    "server": {
+        "page_size":          8192,
+        "cache_size":         -131072,      # 128 MiB
+        "mmap_size":          1 << 29,
+        "wal_autocheckpoint": 4000,
+        "synchronous":        "NORMAL",
+    },
+    "bulk_import": {
+        "page_size":          16384,
+        "cache_size":         -262144,      # 256 MiB
+        "mmap_size":          0,
+        "wal_autocheckpoint": 0,
+        "synchronous":        "OFF",
+    },
+    "archive": {
+        "page_size":          16384,
+        "cache_size":         -65536,       # 64 MiB
+        "mmap_size":          1 << 30,      # default SQLite builds cap mmap just under 2 GiB
+        "wal_autocheckpoint": 1000,
+        "synchronous":        "NORMAL",
+    },
+}
+
+# Profiles that make sense for the live 1 Hz writer (bulk_import is not one)
+CALIBRATION_CANDIDATES = ("laptop", "server", "archive")
+
+# Benchmark results compared by calibrate(): (section, key), lower is better
+_CALIBRATION_MEASURES = (
+    ("build", "seconds"),
+    ("insert", "p50_ms"),
+    ("insert", "p99_ms"),
+    ("reads", "recent_session_1000_ms"),
+    ("reads", "recent_all_10_ms"),
+    ("reads", "range_1h_columns_ms"),
+    ("reads", "range_1d_columns_ms"),
+    ("reads", "range_page_first_ms"),
+)
+
+
+def resolve_profile(profile):
+    """Profile name or settings dict -> settings dict (None for no profile)."""
+    if profile is None or isinstance(profile, dict):
+        return profile
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown tuning profile: {profile}")
+    return PROFILES[profile]
+
+
+def set_page_size(conn, settings):
+    # Must run before anything creates the file; ignored by SQLite on an existing one
+    if settings and "page_size" in settings:
+        conn.execute(f"PRAGMA page_size = {int(settings['page_size'])};")
+
+
+def apply_profile(conn, settings):
+    """Applies every setting except page_size (see set_page_size) to an open connection."""
+    if not settings:
+        return
+    for pragma in ("cache_size", "mmap_size", "wal_autocheckpoint"):
+        if pragma in settings:
+            conn.execute(f"PRAGMA {pragma} = {int(settings[pragma])};")
+    if "synchronous" in settings:
+        if settings["synchronous"] not in ("OFF", "NORMAL", "FULL", "EXTRA"):
+            raise ValueError(f"Unknown synchronous mode: {settings['synchronous']}")
+        conn.execute(f"PRAGMA synchronous = {settings['synchronous']};")
+
+
+def current_settings(conn):
+    """The connection's effective values for the pragmas a profile sets."""
+    out = {}
+    for pragma in ("page_size", "cache_size", "mmap_size", "wal_autocheckpoint"):
+        row = conn.execute(f"PRAGMA {pragma}").fetchone()
+        out[pragma] = row[0] if row is not None else None
+    out["synchronous"] = ("OFF", "NORMAL", "FULL", "EXTRA")[conn.execute("PRAGMA synchronous").fetchone()[0]]
+    return out
+
+
+# -----------------------------
+# Calibration
+# -----------------------------
+def calibrate(work_dir=".", candidates=CALIBRATION_CANDIDATES, n_ticks=200_000, n_inserts=1000,
+              repeats=20, progress=None):
+    """
+    Benchmarks each candidate profile in a temporary directory under work_dir (put it on
+    the telemetry disk) and returns a results document with per-profile scores and the
+    recommended profile. A score of 1.0 means best at every measurement.
+    """
+    # Imported here: benchmark.py pulls in StorageManager and the export code
+    from storage_service.storage.benchmark import bench_insert, bench_reads, build_db
+
+    tmp = tempfile.mkdtemp(prefix="telemetry_tune_", dir=work_dir)
+    results = {}
+    try:
+        for name in candidates:
+            if progress is not None:
+                progress(f"Measuring profile {name}")
+            path = Path(tmp) / f"{name}.db"
+            end_ms = int(time.time() * 1000)
+            t0 = time.perf_counter()
+            conn = build_db(path, n_ticks, end_ms=end_ms, profile=name)
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            build_s = time.perf_counter() - t0
+            try:
+                reads = bench_reads(conn, end_ms, repeats)
+            finally:
+                conn.close()
+            results[name] = {
+                "settings": resolve_profile(name),
+                "build":    {"seconds": build_s, "db_bytes": path.stat().st_size},
+                "insert":   bench_insert(path, n_inserts, profile=name),
+                "reads":    reads,
+            }
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    scores = score_profiles(results)
+    return {
+        "generated_at":   datetime.datetime.now().isoformat(),
+        "sqlite_version": sqlite3.sqlite_version,
+        "work_dir":       str(Path(work_dir).resolve()),
+        "ticks":          n_ticks,
+        "profiles":       results,
+        "scores":         scores,
+        "recommended":    min(scores, key=scores.get) if scores else None,
+    }
+
+
+def score_profiles(results):
+    """Mean of value / best value over _CALIBRATION_MEASURES per profile (lower is better)."""
+    scores = {name: 0.0 for name in results}
+    for section, key in _CALIBRATION_MEASURES:
+        values = {name: r[section][key] for name, r in results.items()}
+        best = max(min(values.values()), 1e-6)
+        for name, value in values.items():
+            scores[name] += max(value, 1e-6) / best / len(_CALIBRATION_MEASURES)
+    return scores
+
+
+# -----------------------------
+# CLI
+# -----------------------------
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark SQLite tuning profiles on this disk")
+    parser.add_argument("--work-dir", default=".", help="where the temporary DBs go (default: current dir)")
+    parser.add_argument("--profiles", nargs="+", default=list(CALIBRATION_CANDIDATES), choices=list(PROFILES))
+    parser.add_argument("--ticks", type=int, default=200_000)
+    parser.add_argument("--inserts", type=int, default=1000)
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--out", default=None, help="also write the full results as JSON")
+    args = parser.parse_args(argv)
+
+    doc = calibrate(args.work_dir, args.profiles, args.ticks, args.inserts, args.repeats, progress=print)
+    for name, score in sorted(doc["scores"].items(), key=lambda kv: kv[1]):
+        r = doc["profiles"][name]
+        print(f"  {name:<12} score {score:5.2f}  insert p99 {r['insert']['p99_ms']:.2f} ms  "
+              f"1 h range {r['reads']['range_1h_columns_ms']:.1f} ms")
+    print(f"Recommended profile: {doc['recommended']} (set storage_tuning_profile)")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(doc, f, indent=2)
+        print(f"Wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
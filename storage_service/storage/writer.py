@@ -0,0 +1,148 @@
+# storage_service/storage/writer.py
+# Author: Andrew Fox
+
+# Asynchronous storage writer. The collector thread submit()s ticks into a bounded
+# in-memory queue and returns immediately; a dedicated writer thread owns the
+# StorageManager (and its SQLite connection) and commits ticks in order. A slow disk
+# or a stalled checkpoint then delays persistence instead of the next sample.
+#
+# Each tick keeps the time it was collected, so queueing delay does not shift
+# timestamps. When the queue is full the overflow policy decides what happens:
+#   block        submit() waits for space (up to block_timeout_s, then the new tick is dropped)
+#   drop_oldest  the oldest queued tick is discarded to make room
+#   coalesce     the newest queued tick is replaced by the new one (latest state wins)
+#
+# Metrics (METRICS, writer.*): queue_depth gauge, commit_ms timing, and submitted /
+# written / dropped / coalesced / errors counters.
+#
+# Usage:
+#   from storage_service.storage.writer import AsyncStorageWriter
+#   writer = AsyncStorageWriter(lambda: StorageManager("telemetry.db"), policy="drop_oldest")
+#   writer.start()
+#   writer.submit(cpu, ram, gpu, disk, collect_ms)
+#   ...
+#   writer.stop()          # drains the queue, then closes the StorageManager
+
+import collections
+import datetime
+import threading
+
+from storage_service.storage.metrics import METRICS
+
+OVERFLOW_POLICIES = ("block", "drop_oldest", "coalesce")
+
+DEFAULT_MAX_QUEUE = 300   # five minutes of 1 Hz ticks
+
+
+class AsyncStorageWriter:
+    # Bounded queue between collection and a single writer thread.
+
+    def __init__(self, storage_factory, max_queue=DEFAULT_MAX_QUEUE, policy="drop_oldest",
+                 block_timeout_s=5.0):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {policy}")
+        if max_queue < 1:
+            raise ValueError("max_queue must be at least 1")
+        # The factory runs on the writer thread: sqlite3 connections stay on the thread that made them
+        self.storage_factory = storage_factory
+        self.max_queue = max_queue
+        self.policy = policy
+        self.block_timeout_s = block_timeout_s
+
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+        self._stop = False
+        self._thread = None
+        self._ready = threading.Event()
+        self._start_error = None
+        self.storage = None
+
+    # -----------------------------
+    # Lifecycle
+    # -----------------------------
+    def start(self):
+        """Starts the writer thread and waits until its StorageManager is open."""
+        self._thread = threading.Thread(target=self._loop, name="AsyncStorageWriter", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._start_error is not None:
+            raise self._start_error
+
+    def stop(self, drain=True):
+        """Stops the writer. With drain=True queued ticks are written first."""
+        with self._cond:
+            if not drain:
+                METRICS.incr("writer.dropped", len(self._queue))
+                self._queue.clear()
+            self._stop = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    # -----------------------------
+    # Collector side
+    # -----------------------------
+    def submit(self, cpu_data, ram_data, gpu_data, disk_data, collect_duration_ms=0, collected_at=None):
+        """Queues one tick. Returns False if the tick was dropped."""
+        tick = (cpu_data, ram_data, gpu_data, disk_data, collect_duration_ms,
+                collected_at or datetime.datetime.now())
+        with self._cond:
+            if self._stop:
+                raise RuntimeError("AsyncStorageWriter is stopped")
+            METRICS.incr("writer.submitted")
+
+            if len(self._queue) >= self.max_queue:
+                if self.policy == "block":
+                    if not self._cond.wait_for(lambda: len(self._queue) < self.max_queue or self._stop,
+                                               timeout=self.block_timeout_s) or self._stop:
+                        METRICS.incr("writer.dropped")
+                        return False
+                elif self.policy == "drop_oldest":
+                    self._queue.popleft()
+                    METRICS.incr("writer.dropped")
+                else:
+                    self._queue[-1] = tick
+                    METRICS.incr("writer.coalesced")
+                    return True
+
+            self._queue.append(tick)
+            METRICS.set_gauge("writer.queue_depth", len(self._queue))
+            self._cond.notify_all()
+        return True
+
+    def queue_depth(self):
+        with self._cond:
+            return len(self._queue)
+
+    # -----------------------------
+    # Writer thread
+    # -----------------------------
+    def _loop(self):
+        try:
+            self.storage = self.storage_factory()
+        except Exception as e:
+            self._start_error = e
+            self._ready.set()
+            return
+        self._ready.set()
+
+        try:
+            while True:
+                with self._cond:
+                    self._cond.wait_for(lambda: self._queue or self._stop)
+                    if not self._queue:
+                        break
+                    tick = self._queue.popleft()
+                    METRICS.set_gauge("writer.queue_depth", len(self._queue))
+                    self._cond.notify_all()   # wake a blocked submit()
+
+                *sample, collected_at = tick
+                try:
+                    with METRICS.timer("writer.commit_ms"):
+                        self.storage.insert_sample(*sample, collected_at=collected_at)
+                    METRICS.incr("writer.written")
+                except Exception:
+                    METRICS.incr("writer.errors")
+        finally:
+            self.storage.close()
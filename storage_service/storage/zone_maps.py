@@ -0,0 +1,293 @@
+# storage_service/storage/zone_maps.py
+# Author: Andrew Fox
+
+# Zone maps for threshold searches ("when did gpu_temp_c exceed 85?") over long history.
+# Ticks are grouped into fixed chunks of ZONE_TICKS consecutive sample ids
+# (chunk_id = sample_id >> ZONE_BITS). zone_chunk holds each chunk's id and time bounds;
+# zone_map holds the min and max of every rollup metric per chunk. Both are upserted by
+# StorageManager.insert_sample() inside the tick's transaction; catch_up() fills
+# anything written without them in SQL (older files, bulk loads).
+#
+# search() reads one primary-key range of zone_map for the metric, keeps only chunks
+# whose min/max can satisfy the condition, and reads the ticks of those chunks to
+# return the matching time intervals. A year of 1 Hz ticks is ~31k zone rows per
+# metric, so a selective search touches a few chunks instead of every tick.
+#
+# Zone rows outlive archiving (archive.py): the ticks of archived sessions are read back
+# from their compressed chunks. Bounds only ever widen (merge.py maps a source chunk onto
+# up to two target chunks), which can cost extra reads but never a missed tick.
+# prune() drops zone rows older than any remaining tick (retention.py).
+#
+# Usage:
+#   from storage_service.storage.zone_maps import ZoneMap
+#   intervals = ZoneMap.search(conn, "gpu_temp_c", 85.0)
+#   intervals = ZoneMap.search(conn, "avg_write_latency_ms", 20.0, ">", start_ms, end_ms)
+
+import operator
+
+import numpy as np
+
+from storage_service.storage.compression import decode_floats, decode_ints
+from storage_service.storage.rollups import CATCH_UP_BATCH, ROLLUP_METRICS, _TICK_SQL
+
+ZONE_BITS = 10
+ZONE_TICKS = 1 << ZONE_BITS     # 1024 ticks per chunk
+
+# Search operator -> (comparison, zone_map condition that can hold a match)
+OPERATORS = {
+    ">":  (operator.gt, "max_value > ?"),
+    ">=": (operator.ge, "max_value >= ?"),
+    "<":  (operator.lt, "min_value < ?"),
+    "<=": (operator.le, "min_value <= ?"),
+}
+
+_CHUNK_UPSERT_SQL = """
+    INSERT INTO zone_chunk (chunk_id, first_sample_id, last_sample_id, start_unix_ms, end_unix_ms, tick_count)
+    {source}
+    ON CONFLICT (chunk_id) DO UPDATE SET
+      first_sample_id = MIN(first_sample_id, excluded.first_sample_id),
+      last_sample_id  = MAX(last_sample_id, excluded.last_sample_id),
+      start_unix_ms   = MIN(start_unix_ms, excluded.start_unix_ms),
+      end_unix_ms     = MAX(end_unix_ms, excluded.end_unix_ms),
+      tick_count      = tick_count + excluded.tick_count
+"""
+
+_ZONE_UPSERT_SQL = """
+    INSERT INTO zone_map (metric, chunk_id, min_value, max_value)
+    {source}
+    ON CONFLICT (metric, chunk_id) DO UPDATE SET
+      min_value = MIN(min_value, excluded.min_value),
+      max_value = MAX(max_value, excluded.max_value)
+"""
+
+_CANDIDATES_SQL = """
+    SELECT z.chunk_id, c.start_unix_ms, c.end_unix_ms
+    FROM zone_map z
+    JOIN zone_chunk c ON c.chunk_id = z.chunk_id
+    WHERE z.metric = ? AND z.{condition}
+      AND c.end_unix_ms >= ? AND c.start_unix_ms < ?
+    ORDER BY z.chunk_id
+"""
+
+
+class ZoneMap:
+    # Stateless helpers around the zone_chunk and zone_map tables.
+
+    # -----------------------------
+    # Write path
+    # -----------------------------
+    @staticmethod
+    def apply_tick(conn, sample_id, ts_unix_ms, values):
+        """Widens the tick's chunk bounds. Must be called inside the caller's insert transaction."""
+        chunk_id = sample_id >> ZONE_BITS
+        conn.execute(
+            _CHUNK_UPSERT_SQL.format(source="VALUES (?, ?, ?, ?, ?, 1)"),
+            (chunk_id, sample_id, sample_id, ts_unix_ms, ts_unix_ms),
+        )
+        conn.executemany(
+            _ZONE_UPSERT_SQL.format(source="VALUES (?, ?, ?, ?)"),
+            [
+                (metric, chunk_id, float(value), float(value))
+                for metric, value in values.items()
+                if value is not None and metric in ROLLUP_METRICS
+            ],
+        )
+
+    @staticmethod
+    def catch_up(conn, batch_size=CATCH_UP_BATCH):
+        """
+        Builds zone rows for every sample above the last covered one, batch_size ids per
+        transaction. Returns the number of samples processed.
+        """
+        # Ids below the oldest raw tick are gone (retention, archiving) and need no pass
+        min_id, max_id = conn.execute("SELECT MIN(sample_id), MAX(sample_id) FROM sample").fetchone()
+        if max_id is None:
+            return 0
+        lo = max(ZoneMap.get_watermark(conn), min_id - 1)
+        if max_id <= lo:
+            return 0
+
+        processed = 0
+        while lo < max_id:
+            hi = min(lo + batch_size, max_id)
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                processed += ZoneMap.apply_range(conn, lo, hi)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            lo = hi
+
+        return processed
+
+    @staticmethod
+    def apply_range(conn, lo, hi):
+        """
+        Widens the zone rows with the raw samples lo < sample_id <= hi. Runs in the
+        caller's transaction; returns the number of samples.
+        """
+        columns = ", ".join(f"{expr} AS {name}" for name, expr in ROLLUP_METRICS.items())
+        zone_delta = " UNION ALL ".join(
+            f"""SELECT '{name}', sample_id >> {ZONE_BITS}, MIN({name}), MAX({name})
+                FROM temp.zone_ticks WHERE {name} IS NOT NULL
+                GROUP BY 2"""
+            for name in ROLLUP_METRICS
+        )
+        conn.execute("DROP TABLE IF EXISTS temp.zone_ticks")
+        conn.execute("CREATE TEMP TABLE zone_ticks AS " + _TICK_SQL.format(columns=columns), (lo, hi))
+        conn.execute(_CHUNK_UPSERT_SQL.format(
+            source=f"""SELECT sample_id >> {ZONE_BITS}, MIN(sample_id), MAX(sample_id),
+                              MIN(ts_unix_ms), MAX(ts_unix_ms), COUNT(*)
+                       FROM temp.zone_ticks WHERE true GROUP BY 1"""
+        ))
+        conn.execute(_ZONE_UPSERT_SQL.format(source=f"SELECT * FROM ({zone_delta}) WHERE true"))
+        processed = conn.execute("SELECT COUNT(*) FROM temp.zone_ticks").fetchone()[0]
+        conn.execute("DROP TABLE temp.zone_ticks")
+        return processed
+
+    @staticmethod
+    def get_watermark(conn):
+        """Highest sample_id covered by zone_chunk (chunks fill in id order)."""
+        row = conn.execute("SELECT last_sample_id FROM zone_chunk ORDER BY chunk_id DESC LIMIT 1").fetchone()
+        return row[0] if row else 0
+
+    @staticmethod
+    def prune(conn):
+        """Deletes zone rows of chunks that end before the oldest raw or archived tick. Caller commits."""
+        oldest = conn.execute(
+            """SELECT MIN(COALESCE((SELECT MIN(ts_unix_ms) FROM sample), 9e18),
+                          COALESCE((SELECT MIN(chunk_start_unix_ms) FROM sample_chunk), 9e18))"""
+        ).fetchone()[0]
+        conn.execute(
+            """DELETE FROM zone_map WHERE chunk_id IN (
+                 SELECT chunk_id FROM zone_chunk WHERE end_unix_ms < ?)""",
+            (oldest,),
+        )
+        return conn.execute("DELETE FROM zone_chunk WHERE end_unix_ms < ?", (oldest,)).rowcount
+
+    # -----------------------------
+    # Read path
+    # -----------------------------
+    @staticmethod
+    def candidates(conn, metric, threshold, op=">", start_ms=None, end_ms=None):
+        """(chunk_id, start_unix_ms, end_unix_ms) of the chunks whose bounds allow a match."""
+        if metric not in ROLLUP_METRICS:
+            raise ValueError(f"Unknown zone map metric: {metric}")
+        if op not in OPERATORS:
+            raise ValueError(f"Unknown operator: {op}")
+        start_ms = -2 ** 63 if start_ms is None else start_ms
+        end_ms = 2 ** 63 - 1 if end_ms is None else end_ms
+        sql = _CANDIDATES_SQL.format(condition=OPERATORS[op][1])
+        return [tuple(row) for row in conn.execute(sql, (metric, threshold, start_ms, end_ms))]
+
+    @staticmethod
+    def search(conn, metric, threshold, op=">", start_ms=None, end_ms=None, host_uuid=None):
+        """
+        Time intervals in [start_ms, end_ms) where metric <op> threshold held, oldest first.
+        Each interval is a run of consecutive matching ticks of one session: a dict with
+        session_id, start_unix_ms and end_unix_ms (first / last matching tick), ticks and
+        peak (the extreme value in the direction of op).
+        """
+        chunks = ZoneMap.candidates(conn, metric, threshold, op, start_ms, end_ms)
+        if not chunks:
+            return []
+        compare = OPERATORS[op][0]
+        start_ms = -2 ** 63 if start_ms is None else start_ms
+        end_ms = 2 ** 63 - 1 if end_ms is None else end_ms
+        archive = _ArchiveReader(conn, metric)
+        sql = _TICK_SQL.format(columns=f"s.session_id, {ROLLUP_METRICS[metric]}") + " ORDER BY s.sample_id"
+
+        intervals = []
+        open_by_session = {}
+        previous_chunk = None
+        for chunk_id, chunk_start, chunk_end in chunks:
+            if previous_chunk is None or chunk_id != previous_chunk + 1:
+                open_by_session = {}    # a skipped chunk had no matching tick
+            previous_chunk = chunk_id
+
+            lo_id, hi_id = chunk_id << ZONE_BITS, ((chunk_id + 1) << ZONE_BITS) - 1
+            ticks = [tuple(row) for row in conn.execute(sql, (lo_id - 1, hi_id))]
+            ticks += archive.ticks(lo_id, hi_id, chunk_start, chunk_end)
+            ticks.sort()
+            for _, ts_unix_ms, tick_host, session_id, value in ticks:
+                if not (start_ms <= ts_unix_ms < end_ms) or (host_uuid is not None and tick_host != host_uuid):
+                    continue
+                current = open_by_session.get(session_id)
+                if value is None or not compare(value, threshold):
+                    open_by_session.pop(session_id, None)
+                    continue
+                if current is None:
+                    current = open_by_session[session_id] = {
+                        "session_id":    session_id,
+                        "start_unix_ms": ts_unix_ms,
+                        "end_unix_ms":   ts_unix_ms,
+                        "ticks":         0,
+                        "peak":          value,
+                    }
+                    intervals.append(current)
+                current["end_unix_ms"] = ts_unix_ms
+                current["ticks"] += 1
+                if compare(value, current["peak"]):
+                    current["peak"] = value
+        intervals.sort(key=lambda i: (i["start_unix_ms"], i["session_id"]))
+        return intervals
+
+
+class _ArchiveReader:
+    # Ticks of archived sessions (archive.py) for one metric, decoded per chunk on demand.
+    # Zone chunks are read in sample id order, so a decoded archive chunk is dropped once
+    # the search has passed its last tick.
+
+    def __init__(self, conn, metric):
+        self.conn = conn
+        self.metric = metric
+        self._span_ms = None    # longest archive chunk; bounds the chunk_end range scan
+        self._decoded = {}
+
+    def ticks(self, lo_id, hi_id, start_ms, end_ms):
+        """(sample_id, ts_unix_ms, host_uuid, session_id, value) for archived ticks with lo_id <= sample_id <= hi_id."""
+        if self._span_ms is None:
+            self._span_ms = self.conn.execute(
+                "SELECT MAX(chunk_end_unix_ms - chunk_start_unix_ms) FROM sample_chunk"
+            ).fetchone()[0]
+        if self._span_ms is None:
+            return []
+        self._decoded = {key: d for key, d in self._decoded.items() if d[0][-1] >= lo_id}
+        # Only chunks overlapping [start_ms, end_ms): an idx_sample_chunk_end range scan
+        chunks = self.conn.execute(
+            """SELECT c.session_id, c.first_sample_id, c.sample_count, se.host_uuid
+               FROM sample_chunk c JOIN session se ON se.session_id = c.session_id
+               WHERE c.chunk_end_unix_ms BETWEEN ? AND ? AND c.chunk_start_unix_ms <= ?""",
+            (start_ms, end_ms + self._span_ms, end_ms),
+        ).fetchall()
+        out = []
+        for session_id, first_id, count, host_uuid in chunks:
+            if first_id > hi_id:
+                continue
+            ids, stamps, values = self._decode(session_id, first_id, count)
+            keep = (ids >= lo_id) & (ids <= hi_id)
+            out += [
+                (sid, ts, host_uuid, session_id, None if np.isnan(v) else v)
+                for sid, ts, v in zip(ids[keep].tolist(), stamps[keep].tolist(), values[keep].tolist())
+            ]
+        return out
+
+    def _decode(self, session_id, first_id, count):
+        key = (session_id, first_id)
+        if key not in self._decoded:
+            ts_blob, id_blob = self.conn.execute(
+                "SELECT ts_blob, sample_id_blob FROM sample_chunk WHERE session_id = ? AND first_sample_id = ?", key
+            ).fetchone()
+            # Archived names: base metrics as-is, GPU 0 as gpu0.<column>, disk usage = fullest partition
+            if self.metric == "disk_usage_percent":
+                where, params = "metric LIKE 'partition%.usage_percent'", ()
+            else:
+                where, params = "metric IN (?, ?)", (self.metric, f"gpu0.{self.metric}")
+            blobs = [row[0] for row in self.conn.execute(
+                f"SELECT value_blob FROM metric_chunk WHERE session_id = ? AND first_sample_id = ? AND {where}",
+                key + params,
+            )]
+            values = np.fmax.reduce([decode_floats(b, count) for b in blobs]) if blobs else np.full(count, np.nan)
+            self._decoded[key] = (decode_ints(id_blob, count), decode_ints(ts_blob, count), values)
+        return self._decoded[key]
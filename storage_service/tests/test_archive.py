@@ -0,0 +1,253 @@
+# storage_service/tests/test_archive.py
+# Author: Andrew Fox
+# Run with: python -m pytest storage_service/tests/test_archive.py -v
+
+import datetime
+import math
+
+import numpy as np
+import pytest
+from storage_service.storage.archive import SessionArchiver
+from storage_service.storage.compression import encode_ints, decode_ints, encode_floats, decode_floats
+from storage_service.storage.main import StorageManager
+from storage_service.storage.retention import RetentionManager, DAY_MS
+
+
+# -----------------------------
+# Shared sample data
+# -----------------------------
+CPU_DATA = {"cpu_percent_total": 25.0, "freq_current_mhz": 2800.0}
+
+RAM_DATA = {"used_ram_gb": 8.0, "ram_usage_percent": 50.0, "swap_usage_percent": 5.0}
+
+GPU_DATA = {
+    "gpus": [
+        {"gpu_id": 0, "gpu_util_percent": 30.0,
+         "gpu_mem_util_percent": 20.0, "gpu_mem_used_mb": 2048.0, "gpu_temp_c": 55.0,
+         "gpu_core_clock_mhz": 1500.0, "gpu_power_usage_w": 120.0, "gpu_power_limit_w": 250.0},
+    ]
+}
+
+DISK_DATA = {
+    "read_speed_bytes": 1000.0,
+    "write_speed_bytes": 500.0,
+    "avg_read_latency_ms": 1.0,
+    "avg_write_latency_ms": 2.0,
+    "disks": [
+        {"device": "C:\\", "mountpoint": "C:\\", "fstype": "NTFS",
+         "total_gb": 500.0, "used_gb": 200.0, "usage_percent": 40.0},
+        {"device": "D:\\", "mountpoint": "D:\\", "fstype": "NTFS",
+         "total_gb": 1000.0, "used_gb": 900.0, "usage_percent": 90.0},
+    ],
+}
+
+
+@pytest.fixture
+def storage():
+    """Fresh in-memory StorageManager for each test."""
+    s = register_gpu(StorageManager(db_path=":memory:"))
+    yield s
+    s.close()
+
+
+def register_gpu(s):
+    # Register a GPU so gpu_sample rows are written even on machines without one
+    s.conn.execute(
+        "INSERT OR IGNORE INTO gpu_device (gpu_uuid, host_uuid, first_seen_iso) VALUES ('GPU-0', ?, '')",
+        (s.host_uuid,),
+    )
+    s.conn.commit()
+    s.gpu_uuid_map[0] = "GPU-0"
+    return s
+
+
+def fill(storage, n):
+    for i in range(n):
+        storage.insert_sample({**CPU_DATA, "cpu_percent_total": float(i)}, RAM_DATA, GPU_DATA, DISK_DATA)
+
+
+def fill_at(storage, n, start_s):
+    """n ticks one second apart from start_s (whole seconds, so ts_iso survives archiving)."""
+    for i in range(n):
+        storage.insert_sample({**CPU_DATA, "cpu_percent_total": float(i)}, RAM_DATA, GPU_DATA, DISK_DATA,
+                              collected_at=datetime.datetime.fromtimestamp(start_s + i))
+
+
+def end_session(storage):
+    storage.conn.execute("UPDATE session SET ended_at_unix_ms = 1 WHERE session_id = ?", (storage.session_id,))
+    storage.conn.commit()
+
+
+def count(storage, table):
+    return storage.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+# -----------------------------
+# Codecs
+# -----------------------------
+class TestCodecs:
+
+    def test_ints_roundtrip(self):
+        values = [1_700_000_000_000 + i * 1000 + (i % 7) - 3 for i in range(500)] + [0, -5, 2 ** 40]
+        assert decode_ints(encode_ints(values), len(values)).tolist() == values
+
+    def test_steady_timestamps_are_tiny(self):
+        values = [1_700_000_000_000 + i * 1000 for i in range(3600)]
+        assert len(encode_ints(values)) < 500
+
+    def test_floats_roundtrip_with_nan(self):
+        values = [25.5, 25.5, 30.125, float("nan"), -1.0, 1e300, 0.0, 0.0]
+        out = decode_floats(encode_floats(values), len(values))
+        for a, b in zip(values, out):
+            assert (math.isnan(a) and math.isnan(b)) or a == b
+
+    def test_constant_floats_are_tiny(self):
+        assert len(encode_floats([250.0] * 3600)) < 500
+
+    def test_empty(self):
+        assert len(decode_ints(encode_ints([]), 0)) == 0
+        assert len(decode_floats(encode_floats([]), 0)) == 0
+
+
+# -----------------------------
+# Archiver
+# -----------------------------
+class TestArchiver:
+
+    def test_open_session_not_archived(self, storage):
+        fill(storage, 3)
+        assert SessionArchiver.closed_sessions(storage.conn) == []
+
+    def test_archive_moves_raw_rows_to_chunks(self, storage):
+        fill(storage, 10)
+        end_session(storage)
+        assert SessionArchiver.archive_session(storage.conn, storage.session_id, chunk_ticks=4) == 10
+        assert count(storage, "sample") == 0
+        assert count(storage, "gpu_sample") == 0
+        assert count(storage, "sample_chunk") == 3
+        assert SessionArchiver.closed_sessions(storage.conn) == []
+
+    def test_read_session_matches_raw(self, storage):
+        fill(storage, 10)
+        before = SessionArchiver.read_session(storage.conn, storage.session_id)
+        end_session(storage)
+        SessionArchiver.archive_session(storage.conn, storage.session_id, chunk_ticks=4)
+        after = SessionArchiver.read_session(storage.conn, storage.session_id)
+        assert set(before) == set(after)
+        for name in before:
+            np.testing.assert_array_equal(before[name], after[name])
+
+    def test_read_session_analytics_view(self, storage):
+        fill(storage, 2)
+        cols = SessionArchiver.read_session(storage.conn, storage.session_id)
+        assert cols["cpu_percent_total"].tolist() == [0.0, 1.0]
+        assert cols["gpu_temp_c"].tolist() == [55.0, 55.0]
+        assert cols["disk_usage_percent"].tolist() == [90.0, 90.0]
+
+    def test_rollups_kept_after_archive(self, storage):
+        fill(storage, 5)
+        end_session(storage)
+        SessionArchiver.archive_session(storage.conn, storage.session_id)
+        n = storage.conn.execute(
+            "SELECT sample_count FROM metric_rollup WHERE metric = 'cpu_percent_total' AND resolution_ms = 86400000"
+        ).fetchone()[0]
+        assert n == 5
+
+    def test_close_marks_session_ended(self, tmp_path):
+        db = tmp_path / "t.db"
+        s = StorageManager(db_path=str(db))
+        fill(s, 2)
+        s.close()
+        job = SessionArchiver(str(db))
+        assert job.run() == [s.session_id]
+
+    def test_retention_expires_chunks(self, storage):
+        fill(storage, 5)
+        end_session(storage)
+        SessionArchiver.archive_session(storage.conn, storage.session_id)
+        job = RetentionManager(conn=storage.conn, policy={"chunk_pause_ms": 0, "raw_days": 7})
+        stats = job.run(now_ms=int(1e13) + 10 * DAY_MS)
+        assert stats["chunks_deleted"] == 1
+        assert count(storage, "metric_chunk") == 0
+
+
+# -----------------------------
+# Time-range readers
+# -----------------------------
+START_S = 1_780_000_000
+
+
+@pytest.fixture
+def two_sessions(tmp_path):
+    """A closed session of 10 ticks and an open one of 5 after it, in one file."""
+    old = register_gpu(StorageManager(db_path=str(tmp_path / "t.db")))
+    fill_at(old, 10, START_S)
+    old.close()
+    s = register_gpu(StorageManager(db_path=str(tmp_path / "t.db")))
+    fill_at(s, 5, START_S + 100)
+    s.old_session_id = old.session_id
+    yield s
+    s.close()
+
+
+def archive_old(storage):
+    assert SessionArchiver.archive_session(storage.conn, storage.old_session_id, chunk_ticks=4) == 10
+    assert storage.conn.execute("SELECT COUNT(*) FROM sample").fetchone()[0] == 5
+
+
+class TestReaders:
+
+    def test_range_pages(self, two_sessions):
+        end_ms = (START_S + 200) * 1000
+        before = list(two_sessions.iter_range(0, end_ms, page_size=3))
+        archive_old(two_sessions)
+        assert list(two_sessions.iter_range(0, end_ms, page_size=3)) == before
+        assert len(before) == 15
+        # A range starting inside an archived chunk
+        rows, cursor = two_sessions.get_range_page((START_S + 5) * 1000, end_ms, page_size=4)
+        assert [r["sample_id"] for r in rows] == [6, 7, 8, 9] and cursor == (rows[-1]["ts_unix_ms"], 9)
+
+    @pytest.mark.parametrize("read", [
+        lambda s: s.get_range_columns((START_S + 3) * 1000, (START_S + 102) * 1000),
+        lambda s: s.get_session_columns(s.old_session_id),
+    ])
+    def test_columns(self, two_sessions, read):
+        before = read(two_sessions)
+        archive_old(two_sessions)
+        after = read(two_sessions)
+        assert set(after) == set(before) and len(after["sample_id"])
+        for name in before:
+            np.testing.assert_array_equal(after[name], before[name])
+
+    @pytest.mark.parametrize("devices", [False, True])
+    def test_recent_all_sessions(self, two_sessions, devices):
+        before = two_sessions.get_recent_samples_all_sessions(12, devices=devices)
+        archive_old(two_sessions)
+        after = two_sessions.get_recent_samples_all_sessions(12, devices=devices)
+        for sample in before + after:
+            for gpu in sample.get("gpus", []):
+                gpu.pop("gpu_uuid")     # not archived
+        assert after == before
+        assert [s["sample_id"] for s in after] == list(range(15, 3, -1))
+        if devices:
+            assert [len(after[-1]["gpus"]), len(after[-1]["partitions"])] == [1, 2]
+
+    def test_iter_ticks_merges_overlapping_sessions(self, tmp_path):
+        # Two sessions with interleaved ticks (e.g. a merged fleet file)
+        path = str(tmp_path / "t.db")
+        ids = []
+        for offset in (0, 1):
+            s = StorageManager(db_path=path)
+            for i in range(6):
+                s.insert_sample(CPU_DATA, RAM_DATA, None, DISK_DATA,
+                                collected_at=datetime.datetime.fromtimestamp(START_S + offset + 2 * i))
+            s.close()
+            ids.append(s.session_id)
+        s = StorageManager(db_path=path)
+        for session_id in ids:
+            SessionArchiver.archive_session(s.conn, session_id, chunk_ticks=4)
+        ticks = list(SessionArchiver.iter_ticks(s.conn, ["ts_unix_ms", "session_id"]))
+        assert [t[0] for t in ticks] == [(START_S + i) * 1000 for i in range(12)]
+        assert [t[1] for t in ticks[:4]] == [ids[0], ids[1], ids[0], ids[1]]
+        assert SessionArchiver.count_ticks(s.conn, (START_S + 3) * 1000, (START_S + 8) * 1000) == 5
+        s.close()
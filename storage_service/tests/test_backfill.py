@@ -0,0 +1,182 @@
+# storage_service/tests/test_backfill.py
+# Author: Andrew Fox
+# Run with: python -m pytest storage_service/tests/test_backfill.py -v
+
+import datetime
+import sqlite3
+
+import pytest
+from storage_service.storage.archive import SessionArchiver
+from storage_service.storage.backfill import BackfillManager
+from storage_service.storage.main import StorageManager
+from storage_service.storage.merge import merge_dbs
+from storage_service.storage.schema import init_db
+from storage_service.storage.sketches import SketchManager
+
+
+# -----------------------------
+# Shared sample data
+# -----------------------------
+CPU_DATA = {"cpu_percent_total": 25.0, "freq_current_mhz": 2800.0}
+
+RAM_DATA = {"used_ram_gb": 8.0, "ram_usage_percent": 50.0, "swap_usage_percent": 5.0}
+
+DISK_DATA = {
+    "read_speed_bytes": 1000.0,
+    "write_speed_bytes": 500.0,
+    "avg_read_latency_ms": 1.0,
+    "avg_write_latency_ms": 2.0,
+    "disks": [
+        {"device": "C:\\", "mountpoint": "C:\\", "fstype": "NTFS",
+         "total_gb": 500.0, "used_gb": 200.0, "usage_percent": 40.0},
+    ],
+}
+
+START_MS = 1_780_000_000_000
+TICKS = 1500
+
+DERIVED_TABLES = ("session_summary", "model_input", "metric_sketch", "sketch_watermark", "zone_map", "zone_chunk")
+
+
+def insert_ticks(storage, n, start_ms=START_MS, step_ms=1000):
+    for i in range(n):
+        ts_ms = start_ms + i * step_ms
+        storage.insert_sample({**CPU_DATA, "cpu_percent_total": float(i % 97)}, RAM_DATA, None, DISK_DATA,
+                              collected_at=datetime.datetime.fromtimestamp(ts_ms / 1000))
+
+
+def derived_rows(conn):
+    return {
+        "summaries": conn.execute(
+            "SELECT session_id, sample_count, first_sample_id, last_sample_id FROM session_summary ORDER BY 1"
+        ).fetchall(),
+        "model_input": conn.execute("SELECT COUNT(*) FROM model_input").fetchone()[0],
+        "sketches": conn.execute(
+            """SELECT resolution_ms, metric, bucket_unix_ms, sample_count, min_value, max_value
+               FROM metric_sketch ORDER BY 1, 2, 3"""
+        ).fetchall(),
+        "zone_chunks": conn.execute("SELECT * FROM zone_chunk ORDER BY chunk_id").fetchall(),
+        "zones": conn.execute("SELECT * FROM zone_map ORDER BY metric, chunk_id").fetchall(),
+    }
+
+
+def ranges(conn):
+    return conn.execute("SELECT * FROM backfill_range ORDER BY structure").fetchall()
+
+
+@pytest.fixture
+def old_file(tmp_path):
+    """A closed file with TICKS ticks whose summaries, model inputs, sketches and zone maps were
+    never built (an older version or a bulk load), plus what the live writer would have built."""
+    path = tmp_path / "t.db"
+    storage = StorageManager(db_path=str(path))
+    insert_ticks(storage, TICKS)
+    storage.close()
+    conn = sqlite3.connect(path)
+    expected = derived_rows(conn)
+    for table in DERIVED_TABLES:
+        conn.execute(f"DELETE FROM {table}")
+    conn.commit()
+    conn.close()
+    return path, expected
+
+
+# -----------------------------
+# record() and fill()
+# -----------------------------
+class TestFill:
+
+    def test_record_only_notes_the_gaps(self, old_file):
+        path, _ = old_file
+        conn = init_db(path)
+        assert BackfillManager.record(conn) == 2
+        assert [tuple(r) for r in ranges(conn)] == [("metric_sketch", 0, TICKS), ("zone_map", 0, TICKS)]
+        assert SketchManager.get_watermark(conn) == TICKS
+        assert conn.execute("SELECT COUNT(*) FROM metric_sketch").fetchone()[0] == 0
+        assert BackfillManager.record(conn) == 1          # zone rows still missing; same range kept
+        assert len(ranges(conn)) == 2
+        conn.close()
+
+    def test_fill_matches_live_writer(self, old_file):
+        path, expected = old_file
+        conn = sqlite3.connect(path)
+        stats = BackfillManager.catch_up(conn, batch_size=400)
+        assert stats == {"summaries": 1, "model_input": 1, "sketch_ticks": TICKS, "zone_ticks": TICKS}
+        assert derived_rows(conn) == expected
+        assert ranges(conn) == []
+        conn.close()
+
+    def test_stop_keeps_progress(self, old_file):
+        path, expected = old_file
+        conn = sqlite3.connect(path)
+        BackfillManager.record(conn)
+        started = lambda: conn.execute("SELECT MAX(after_sample_id) FROM backfill_range").fetchone()[0] > 0
+        stats = BackfillManager.fill(conn, batch_size=400, stop=started)
+        assert stats["sketch_ticks"] == 400 and stats["zone_ticks"] == 0
+        assert ranges(conn) == [("metric_sketch", 400, TICKS), ("zone_map", 0, TICKS)]
+        BackfillManager.fill(conn, batch_size=400)
+        assert derived_rows(conn) == expected
+        conn.close()
+
+
+# -----------------------------
+# StorageManager
+# -----------------------------
+class TestBackgroundJob:
+
+    def test_storage_manager_fills_in_background(self, old_file):
+        path, expected = old_file
+        storage = StorageManager(db_path=str(path))
+        assert storage.backfill.wait(10)
+        assert storage.backfill.last_stats["sketch_ticks"] == TICKS
+        storage.close()
+        conn = sqlite3.connect(path)
+        assert derived_rows(conn) == expected
+        conn.close()
+
+    def test_live_ticks_during_backfill_counted_once(self, old_file):
+        path, _ = old_file
+        storage = StorageManager(db_path=str(path))
+        insert_ticks(storage, 300, start_ms=START_MS + TICKS * 1000)
+        assert storage.backfill.wait(10)
+        session_id = storage.session_id
+        storage.close()
+        conn = sqlite3.connect(path)
+        sketched = conn.execute(
+            """SELECT SUM(sample_count) FROM metric_sketch
+               WHERE resolution_ms = 60000 AND metric = 'cpu_percent_total'"""
+        ).fetchone()[0]
+        assert sketched == TICKS + 300
+        assert conn.execute("SELECT SUM(tick_count) FROM zone_chunk").fetchone()[0] == TICKS + 300
+        assert [row[:2] for row in derived_rows(conn)["summaries"]] == [(session_id - 1, TICKS), (session_id, 300)]
+        conn.close()
+
+    def test_inline_backfill_when_disabled(self, old_file):
+        path, expected = old_file
+        storage = StorageManager(db_path=str(path), background_backfill=False)
+        assert storage.backfill is None and ranges(storage.conn) == []
+        storage.close()
+        conn = sqlite3.connect(path)
+        assert derived_rows(conn)["zones"] == expected["zones"]
+        conn.close()
+
+    def test_archiver_waits_for_backfill(self, old_file):
+        path, _ = old_file
+        conn = init_db(path)
+        BackfillManager.record(conn)
+        assert SessionArchiver.closed_sessions(conn) == []
+        BackfillManager.fill(conn)
+        assert len(SessionArchiver.closed_sessions(conn)) == 1
+        conn.close()
+
+    def test_merge_fills_pending_ranges_of_a_source(self, old_file, tmp_path):
+        path, expected = old_file
+        conn = init_db(path)
+        BackfillManager.record(conn)
+        conn.close()
+        out = tmp_path / "fleet.db"
+        merge_dbs(str(out), [str(path)])
+        conn = sqlite3.connect(out)
+        assert conn.execute("SELECT SUM(tick_count) FROM zone_chunk").fetchone()[0] == TICKS
+        assert len(derived_rows(conn)["sketches"]) == len(expected["sketches"])
+        conn.close()
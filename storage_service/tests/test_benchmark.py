@@ -0,0 +1,62 @@
+# storage_service/tests/test_benchmark.py
+# Author: Andrew Fox
+# Run with: python -m pytest storage_service/tests/test_benchmark.py -v
+# Smoke test at a tiny scale; real runs: python -m storage_service.storage.benchmark
+
+import json
+
+from storage_service.storage.backfill import BackfillManager
+from storage_service.storage.benchmark import build_db, main, run_scale
+from storage_service.storage.rollups import RollupManager
+
+
+# -----------------------------
+# Synthetic database
+# -----------------------------
+class TestBuildDb:
+
+    def test_builds_requested_ticks_ending_at_end_ms(self, tmp_path):
+        conn = build_db(tmp_path / "b.db", 500, n_partitions=3, end_ms=1_000_000)
+        try:
+            assert conn.execute("SELECT COUNT(*) FROM sample").fetchone()[0] == 500
+            assert conn.execute("SELECT MAX(ts_unix_ms) FROM sample").fetchone()[0] == 1_000_000
+            assert conn.execute("SELECT COUNT(*) FROM disk_partition_sample").fetchone()[0] == 1500
+            assert conn.execute("SELECT last_sample_id FROM rollup_watermark").fetchone()[0] == 500
+        finally:
+            conn.close()
+
+    def test_nothing_left_to_catch_up(self, tmp_path):
+        # Every derived structure StorageManager maintains is built or marked done, so the
+        # insert benchmark doesn't race a catch-up or back-fill
+        conn = build_db(tmp_path / "b.db", 2500, end_ms=1_000_000)
+        try:
+            assert RollupManager.catch_up(conn) == 0
+            assert BackfillManager.record(conn) == 0
+            assert BackfillManager.fill(conn) == {"summaries": 0, "model_input": 0, "sketch_ticks": 0, "zone_ticks": 0}
+            assert conn.execute("SELECT sample_count FROM session_summary").fetchone()[0] == 2500
+            assert conn.execute("SELECT COUNT(*) FROM model_input").fetchone()[0] == 2500
+            assert conn.execute("SELECT SUM(tick_count) FROM zone_chunk").fetchone()[0] == 2500
+        finally:
+            conn.close()
+
+
+# -----------------------------
+# Results
+# -----------------------------
+class TestBenchmarkResults:
+
+    def test_run_scale_reports_every_section(self, tmp_path):
+        result = run_scale(2000, tmp_path, n_inserts=20, repeats=2)
+        assert result["ticks"] == 2000
+        assert result["bytes_per_day"] > 0
+        assert result["insert"]["ticks"] == 20
+        assert set(result["reads"]) >= {"recent_session_10_ms", "hot_tier_1000_ms", "range_1d_columns_ms"}
+        assert result["export"]["csv"]["rows"] == result["export"]["npz"]["rows"] == 2000
+        assert list(tmp_path.iterdir()) == []   # DBs and exports are cleaned up
+
+    def test_cli_writes_json(self, tmp_path):
+        out = tmp_path / "bench.json"
+        main(["--scales", "1000", "--out", str(out), "--inserts", "10", "--repeats", "1"])
+        doc = json.loads(out.read_text())
+        assert [s["ticks"] for s in doc["scales"]] == [1000]
+        assert "sqlite_version" in doc
@@ -0,0 +1,242 @@
+# storage_service/tests/test_change_encoding.py
+# Author: Andrew Fox
+# Run with: python -m pytest storage_service/tests/test_change_encoding.py -v
+
+import numpy as np
+import pytest
+from storage_service.storage.archive import SessionArchiver
+from storage_service.storage.change_encoding import ChangeEncoder
+from storage_service.storage.main import StorageManager
+from storage_service.storage.retention import RetentionManager, DAY_MS
+
+
+# -----------------------------
+# Shared sample data
+# -----------------------------
+CPU_DATA = {"cpu_percent_total": 25.0, "freq_current_mhz": 2800.0}
+
+RAM_DATA = {"used_ram_gb": 8.0, "ram_usage_percent": 50.0, "swap_usage_percent": 5.0}
+
+GPU = {"gpu_id": 0, "gpu_util_percent": 30.0, "gpu_mem_util_percent": 20.0, "gpu_mem_used_mb": 2048.0,
+       "gpu_temp_c": 55.0, "gpu_core_clock_mhz": 1500.0, "gpu_power_usage_w": 120.0, "gpu_power_limit_w": 250.0}
+
+DISKS = [
+    {"device": f"{letter}:\\", "mountpoint": f"{letter}:\\", "fstype": "NTFS",
+     "total_gb": 1000.0, "used_gb": 100.0 * (i + 1), "usage_percent": 10.0 * (i + 1)}
+    for i, letter in enumerate("CDEF")
+]
+
+TICKS = 20
+
+
+def disk_data(used_delta=0.0, disks=DISKS):
+    return {
+        "read_speed_bytes": 1000.0, "write_speed_bytes": 500.0,
+        "avg_read_latency_ms": 1.0, "avg_write_latency_ms": 2.0,
+        "disks": [{**d, "used_gb": d["used_gb"] + used_delta,
+                   "usage_percent": (d["used_gb"] + used_delta) / d["total_gb"] * 100} for d in disks],
+    }
+
+
+def make_storage(db_path, change_only=True):
+    s = StorageManager(db_path=str(db_path), change_only=change_only)
+    s.conn.execute("INSERT OR IGNORE INTO gpu_device (gpu_uuid, host_uuid, first_seen_iso) VALUES ('GPU-0', ?, '')",
+                   (s.host_uuid,))
+    s.conn.commit()
+    s.gpu_uuid_map[0] = "GPU-0"
+    return s
+
+
+def write_ticks(s, n=TICKS, used_delta=lambda i: 0.0, power_limit=lambda i: 250.0):
+    for i in range(n):
+        s.insert_sample(CPU_DATA, RAM_DATA, {"gpus": [{**GPU, "gpu_power_limit_w": power_limit(i)}]},
+                        disk_data(used_delta(i)))
+
+
+@pytest.fixture
+def storage(tmp_path):
+    s = make_storage(tmp_path / "t.db")
+    yield s
+    s.close()
+
+
+def count(s, sql, params=()):
+    return s.conn.execute(sql, params).fetchone()[0]
+
+
+# -----------------------------
+# Encoder decisions
+# -----------------------------
+class TestEncoder:
+
+    def test_first_tick_is_keyframe(self):
+        enc = ChangeEncoder()
+        assert enc.partition_keyframe({1: (100.0, 50.0, 50.0)})
+        enc.commit()
+        assert not enc.partition_keyframe({1: (100.0, 50.0, 50.0)})
+
+    def test_change_within_tolerance_not_written(self):
+        enc = ChangeEncoder()
+        enc.partition_keyframe({1: (100.0, 50.0, 50.0)})
+        enc.commit()
+        assert not enc.partition_keyframe({1: (100.0, 50.04, 50.04)})
+        assert enc.partition_keyframe({1: (100.0, 50.2, 50.2)})
+
+    def test_partition_set_change_is_keyframe(self):
+        enc = ChangeEncoder()
+        enc.partition_keyframe({1: (100.0, 50.0, 50.0)})
+        enc.commit()
+        assert enc.partition_keyframe({1: (100.0, 50.0, 50.0), 2: (10.0, 1.0, 10.0)})
+
+    def test_rollback_keeps_last_written(self):
+        enc = ChangeEncoder()
+        enc.gpu_keyframe({"GPU-0": 250.0})
+        enc.commit()
+        assert enc.gpu_keyframe({"GPU-0": 300.0})
+        enc.rollback()
+        assert enc.gpu_keyframe({"GPU-0": 300.0})
+
+    def test_custom_tolerance(self):
+        enc = ChangeEncoder({"gpu_power_limit_w": 10.0})
+        enc.gpu_keyframe({"GPU-0": 250.0})
+        enc.commit()
+        assert not enc.gpu_keyframe({"GPU-0": 255.0})
+
+
+# -----------------------------
+# Write path
+# -----------------------------
+class TestWritePath:
+
+    def test_partition_rows_reduced(self, storage):
+        write_ticks(storage)
+        assert count(storage, "SELECT COUNT(*) FROM disk_partition_sample") == len(DISKS)
+        assert count(storage, "SELECT COUNT(*) FROM change_keyframe WHERE kind = 'partition'") == 1
+
+    def test_dense_writer_unchanged(self, tmp_path):
+        s = make_storage(tmp_path / "dense.db", change_only=False)
+        write_ticks(s)
+        assert count(s, "SELECT COUNT(*) FROM disk_partition_sample") == TICKS * len(DISKS)
+        assert count(s, "SELECT COUNT(*) FROM change_keyframe") == 0
+        assert count(s, "SELECT COUNT(*) FROM gpu_sample WHERE gpu_power_limit_w IS NULL") == 0
+        s.close()
+
+    def test_change_beyond_tolerance_writes_keyframe(self, storage):
+        write_ticks(storage, used_delta=lambda i: 5.0 if i >= 10 else 0.0)
+        assert count(storage, "SELECT COUNT(*) FROM disk_partition_sample") == 2 * len(DISKS)
+
+    def test_gpu_limit_null_between_keyframes(self, storage):
+        write_ticks(storage, power_limit=lambda i: 300.0 if i >= 15 else 250.0)
+        assert count(storage, "SELECT COUNT(*) FROM gpu_sample") == TICKS
+        assert count(storage, "SELECT COUNT(*) FROM gpu_sample WHERE gpu_power_limit_w IS NOT NULL") == 2
+
+    def test_rolled_back_tick_not_a_keyframe(self, storage, monkeypatch):
+        write_ticks(storage, n=2)
+        original = ChangeEncoder.mark
+
+        def mark_then_fail(*args):
+            original(*args)
+            raise RuntimeError("disk full")
+
+        monkeypatch.setattr(ChangeEncoder, "mark", mark_then_fail)
+        with pytest.raises(RuntimeError):
+            storage.insert_sample(CPU_DATA, RAM_DATA, None, disk_data(5.0))
+        monkeypatch.undo()
+        # The failed keyframe was never stored, so the next tick with the same values writes it
+        storage.insert_sample(CPU_DATA, RAM_DATA, None, disk_data(5.0))
+        assert count(storage, "SELECT COUNT(*) FROM disk_partition_sample") == 2 * len(DISKS)
+
+
+# -----------------------------
+# Read paths (filled forward)
+# -----------------------------
+class TestReadPaths:
+
+    def test_recent_samples_filled(self, storage):
+        write_ticks(storage)
+        samples = storage.get_recent_samples(TICKS, devices=True)
+        assert len(samples) == TICKS
+        for sample in samples:
+            assert sample["disk_usage_percent"] == pytest.approx(40.0)
+            assert sample["gpu_power_limit_w"] == pytest.approx(250.0)
+            assert [p["used_gb"] for p in sample["partitions"]] == [d["used_gb"] for d in DISKS]
+            assert sample["gpus"][0]["gpu_power_limit_w"] == pytest.approx(250.0)
+
+    def test_values_follow_keyframes(self, storage):
+        write_ticks(storage, used_delta=lambda i: 5.0 if i >= 10 else 0.0,
+                    power_limit=lambda i: 300.0 if i >= 15 else 250.0)
+        cols = storage.get_session_columns()
+        np.testing.assert_allclose(cols["disk_usage_percent"], [40.0] * 10 + [40.5] * 10)
+        np.testing.assert_allclose(cols["gpu_power_limit_w"], [250.0] * 15 + [300.0] * 5)
+
+    def test_views_match_dense_layout(self, storage):
+        write_ticks(storage)
+        assert count(storage, "SELECT COUNT(*) FROM disk_partition_sample_locf") == TICKS * len(DISKS)
+        assert count(storage, "SELECT COUNT(*) FROM gpu_sample_locf WHERE gpu_power_limit_w = 250.0") == TICKS
+
+    def test_rollups_see_every_tick(self, storage):
+        write_ticks(storage)
+        row = storage.conn.execute(
+            """SELECT SUM(sample_count), MIN(min_value) FROM metric_rollup
+               WHERE metric = 'disk_usage_percent' AND resolution_ms = 60000"""
+        ).fetchone()
+        assert row[0] == TICKS and row[1] == pytest.approx(40.0)
+
+    def test_matches_dense_session(self, tmp_path):
+        reads = []
+        for change_only in (False, True):
+            s = make_storage(tmp_path / f"{change_only}.db", change_only=change_only)
+            write_ticks(s, used_delta=lambda i: 5.0 if i >= 10 else 0.0)
+            reads.append(s.get_session_columns())
+            s.close()
+        for name, values in reads[0].items():
+            if name not in ("sample_id", "ts_unix_ms"):
+                np.testing.assert_allclose(reads[1][name], values, err_msg=name)
+
+
+# -----------------------------
+# Deletes keep a keyframe
+# -----------------------------
+class TestAnchoring:
+
+    def test_retention_moves_keyframe(self, storage):
+        write_ticks(storage)
+        first = count(storage, "SELECT MIN(sample_id) FROM sample")
+        now_ms = count(storage, "SELECT MAX(ts_unix_ms) FROM sample")
+        storage.conn.execute("UPDATE sample SET ts_unix_ms = ts_unix_ms - ? WHERE sample_id < ?",
+                             (30 * DAY_MS, first + 5))
+        storage.conn.commit()
+        stats = RetentionManager(conn=storage.conn, policy={"chunk_pause_ms": 0, "raw_days": 7}).run(now_ms=now_ms)
+        assert stats["samples_deleted"] == 5
+        samples = storage.get_recent_samples(TICKS, devices=True)
+        assert len(samples) == TICKS - 5
+        assert all(s["disk_usage_percent"] == pytest.approx(40.0) for s in samples)
+        assert all(s["gpu_power_limit_w"] == pytest.approx(250.0) for s in samples)
+        assert all(len(s["partitions"]) == len(DISKS) for s in samples)
+
+    def test_archive_round_trip(self, tmp_path):
+        s = make_storage(tmp_path / "t.db")
+        write_ticks(s, used_delta=lambda i: 5.0 if i >= 10 else 0.0)
+        session_id = s.session_id
+        before = s.get_session_columns()
+        conn = s.conn
+        SessionArchiver.archive_session(conn, session_id, chunk_ticks=7)
+        after = SessionArchiver.read_session(conn, session_id)
+        np.testing.assert_allclose(after["disk_usage_percent"], before["disk_usage_percent"])
+        np.testing.assert_allclose(after["gpu_power_limit_w"], before["gpu_power_limit_w"])
+        s.close()
+
+    def test_partially_archived_session(self, tmp_path):
+        s = make_storage(tmp_path / "t.db")
+        write_ticks(s)
+        conn = s.conn
+        # Archive the first chunk only, as an interrupted run would leave it
+        hi = count(s, "SELECT MIN(sample_id) FROM sample") + 6
+        conn.execute("BEGIN")
+        ChangeEncoder.anchor_after(conn, s.session_id, hi)
+        conn.execute("DELETE FROM sample WHERE sample_id <= ?", (hi,))
+        conn.execute("COMMIT")
+        raw = SessionArchiver._raw_columns(conn, s.session_id)
+        np.testing.assert_allclose(raw["partition1.used_gb"], [100.0] * (TICKS - 7))
+        np.testing.assert_allclose(raw["gpu0.gpu_power_limit_w"], [250.0] * (TICKS - 7))
+        s.close()
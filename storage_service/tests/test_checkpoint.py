@@ -0,0 +1,127 @@
+# storage_service/tests/test_checkpoint.py
+# Author: Andrew Fox
+# Run with: python -m pytest storage_service/tests/test_checkpoint.py -v
+
+import sqlite3
+
+import pytest
+from storage_service.storage.checkpoint import CheckpointManager
+from storage_service.storage.main import StorageManager
+from storage_service.storage.metrics import METRICS
+
+
+# -----------------------------
+# Shared sample data
+# -----------------------------
+CPU_DATA = {"cpu_percent_total": 25.0, "freq_current_mhz": 2800.0}
+
+RAM_DATA = {"used_ram_gb": 8.0, "ram_usage_percent": 50.0, "swap_usage_percent": 5.0}
+
+DISK_DATA = {
+    "read_speed_bytes": 0.0,
+    "write_speed_bytes": 0.0,
+    "avg_read_latency_ms": 1.0,
+    "avg_write_latency_ms": 1.0,
+    "disks": [],
+}
+
+
+@pytest.fixture
+def storage(tmp_path):
+    """File-backed StorageManager with autocheckpoint off, so the WAL only shrinks when we say so."""
+    METRICS.reset()
+    s = StorageManager(db_path=str(tmp_path / "t.db"), autocheckpoint=False)
+    write(s, 50)
+    yield s
+    s.close()
+
+
+def write(storage, n):
+    for _ in range(n):
+        storage.insert_sample(CPU_DATA, RAM_DATA, None, DISK_DATA)
+
+
+def open_reader(path):
+    """Reader holding a snapshot, which pins the WAL frames written after it."""
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("BEGIN")
+    conn.execute("SELECT COUNT(*) FROM sample").fetchone()
+    return conn
+
+
+def manager(storage, **policy):
+    return CheckpointManager(storage.conn.execute("PRAGMA database_list").fetchone()[2], policy)
+
+
+# -----------------------------
+# Modes
+# -----------------------------
+class TestCheckpointModes:
+
+    def test_autocheckpoint_disabled_for_writer(self, storage):
+        assert storage.conn.execute("PRAGMA wal_autocheckpoint").fetchone()[0] == 0
+
+    def test_passive_copies_everything_when_idle(self, storage):
+        job = manager(storage)
+        stats = job.run()
+        assert stats["mode"] == "PASSIVE"
+        assert not stats["busy"]
+        assert stats["log_frames"] > 0 and stats["backlog_frames"] == 0
+
+    def test_truncate_above_cap(self, storage):
+        job = manager(storage, wal_cap_mb=0)
+        assert job.wal_size_bytes() > 0
+        stats = job.run()
+        assert stats["mode"] == "TRUNCATE"
+        assert stats["wal_bytes"] == 0
+
+    def test_reader_blocks_truncate_and_reports_busy(self, storage):
+        job = manager(storage, wal_cap_mb=0, busy_timeout_ms=10)
+        job.run()
+        reader = open_reader(job.db_path)
+        try:
+            write(storage, 5)
+            stats = job.run()
+        finally:
+            reader.close()
+        assert stats["busy"]
+        assert METRICS.snapshot()["counters"]["checkpoint.busy"] == 1
+
+    def test_lagging_passive_escalates_to_restart(self, storage):
+        job = manager(storage, escalate_after=2, busy_timeout_ms=10)
+        job.run()
+        reader = open_reader(job.db_path)
+        try:
+            write(storage, 5)
+            assert job.run()["backlog_frames"] > 0
+            assert job.run()["mode"] == "PASSIVE"
+            assert job.choose_mode(0) == "RESTART"
+        finally:
+            reader.close()
+        assert job.run()["mode"] == "RESTART"
+        assert job.choose_mode(0) == "PASSIVE"
+
+
+# -----------------------------
+# Metrics and background thread
+# -----------------------------
+class TestCheckpointJob:
+
+    def test_metrics_published(self, storage):
+        manager(storage).run()
+        snap = METRICS.snapshot()
+        assert snap["counters"]["checkpoint.runs"] == 1
+        assert snap["counters"]["checkpoint.passive"] == 1
+        assert snap["timings"]["checkpoint.passive_ms"]["count"] == 1
+        assert "checkpoint.wal_bytes" in snap["gauges"]
+
+    def test_background_thread_runs_and_stops(self, storage):
+        job = manager(storage, interval_s=0.01, wal_cap_mb=0)
+        job.start()
+        while METRICS.snapshot()["counters"].get("checkpoint.runs", 0) < 2:
+            pass
+        job.stop()
+        # First run truncates the WAL; later runs find it empty and stay PASSIVE
+        counters = METRICS.snapshot()["counters"]
+        assert counters["checkpoint.truncate"] == 1
+        assert job.last_stats["mode"] == "PASSIVE"
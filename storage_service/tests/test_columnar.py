@@ -0,0 +1,99 @@
+# storage_service/tests/test_columnar.py
+# Author: Andrew Fox
+# Run with: python -m pytest storage_service/tests/test_columnar.py -v
+
+import math
+
+import numpy as np
+import pytest
+from storage_service.storage.columnar import fetch_columns
+from storage_service.storage.main import StorageManager
+from storage_service.storage.queries import COLUMNAR_NAMES
+
+
+# -----------------------------
+# Shared sample data
+# -----------------------------
+CPU_DATA = {"cpu_percent_total": 25.0, "freq_current_mhz": 2800.0}
+
+RAM_DATA = {"used_ram_gb": 8.0, "ram_usage_percent": 50.0, "swap_usage_percent": 5.0}
+
+DISK_DATA = {
+    "read_speed_bytes": 1000.0,
+    "write_speed_bytes": 500.0,
+    "avg_read_latency_ms": 1.0,
+    "avg_write_latency_ms": 2.0,
+    "disks": [
+        {"device": "C:\\", "mountpoint": "C:\\", "fstype": "NTFS",
+         "total_gb": 500.0, "used_gb": 200.0, "usage_percent": 40.0},
+    ],
+}
+
+
+@pytest.fixture
+def storage():
+    """Fresh in-memory StorageManager for each test."""
+    s = StorageManager(db_path=":memory:")
+    yield s
+    s.close()
+
+
+def fill(storage, n):
+    for i in range(n):
+        storage.insert_sample({**CPU_DATA, "cpu_percent_total": float(i)}, RAM_DATA, None, DISK_DATA)
+
+
+# -----------------------------
+# fetch_columns
+# -----------------------------
+class TestFetchColumns:
+
+    def test_grows_past_size_hint(self, storage):
+        fill(storage, 7)
+        cols = fetch_columns(storage.conn, "SELECT sample_id, ts_unix_ms FROM sample ORDER BY sample_id", (),
+                             ["sample_id", "ts_unix_ms"], size_hint=2, chunk_rows=3)
+        assert cols["sample_id"].tolist() == list(range(1, 8))
+
+    def test_int_and_float_dtypes(self, storage):
+        fill(storage, 1)
+        cols = storage.get_session_columns()
+        assert cols["sample_id"].dtype == np.int64
+        assert cols["ts_unix_ms"].dtype == np.int64
+        assert cols["cpu_percent_total"].dtype == np.float64
+
+    def test_empty_result(self, storage):
+        cols = storage.get_session_columns()
+        assert set(cols) == set(COLUMNAR_NAMES)
+        assert all(len(v) == 0 for v in cols.values())
+
+
+# -----------------------------
+# StorageManager columnar reads
+# -----------------------------
+class TestColumnarReads:
+
+    def test_session_columns_oldest_first(self, storage):
+        fill(storage, 5)
+        assert storage.get_session_columns()["cpu_percent_total"].tolist() == [0.0, 1.0, 2.0, 3.0, 4.0]
+
+    def test_recent_columns_last_n_oldest_first(self, storage):
+        fill(storage, 5)
+        assert storage.get_recent_columns(2)["cpu_percent_total"].tolist() == [3.0, 4.0]
+
+    def test_missing_gpu_is_nan(self, storage):
+        fill(storage, 1)
+        assert math.isnan(storage.get_recent_columns(1)["gpu_temp_c"][0])
+
+    def test_range_columns(self, storage):
+        fill(storage, 3)
+        storage.conn.execute("UPDATE sample SET ts_unix_ms = sample_id * 1000")
+        storage.conn.commit()
+        cols = storage.get_range_columns(2000, 3000)
+        assert cols["sample_id"].tolist() == [2]
+
+    def test_matches_row_api(self, storage):
+        fill(storage, 3)
+        rows = list(reversed(storage.get_recent_samples(3)))
+        cols = storage.get_session_columns()
+        for name in ("cpu_percent_total", "ram_usage_percent", "disk_usage_percent", "read_speed_bytes"):
+            assert cols[name].tolist() == [r[name] for r in rows]
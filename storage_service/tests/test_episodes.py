@@ -0,0 +1,151 @@
+# storage_service/tests/test_episodes.py
+# Author: Andrew Fox
+# Run with: python -m pytest storage_service/tests/test_episodes.py -v
+
+import sqlite3
+
+import pytest
+from analytics_service.analytics.labels import LABEL_NAMES
+from storage_service.storage.episodes import EPISODE_METRICS, IssueEpisodes
+from storage_service.storage.merge import merge_dbs
+from storage_service.storage.schema import init_db
+from storage_service.storage.synthetic import generate_db
+
+HOST = "host-a"
+START_MS = 1_780_000_000_000
+STEP_MS = 5000
+MINUTE_MS = 60_000
+
+
+def run_predictions(conn, fired_per_step, start_ms=START_MS, host=HOST, values=None):
+    """One record() per entry of fired_per_step (a dict label -> probability), STEP_MS apart."""
+    for i, fired in enumerate(fired_per_step):
+        IssueEpisodes.record(conn, host, 1, start_ms + i * STEP_MS, fired, values)
+
+
+@pytest.fixture
+def conn():
+    c = init_db(":memory:")
+    yield c
+    c.close()
+
+
+# -----------------------------
+# Recording
+# -----------------------------
+class TestRecord:
+
+    def test_firing_label_extends_one_row(self, conn):
+        run_predictions(conn, [{"gpu_overheating": p} for p in (0.7, 0.95, 0.8)],
+                        values={"gpu_temp_c": 91.0})
+        (episode,) = IssueEpisodes.query(conn)
+        assert (episode["start_unix_ms"], episode["end_unix_ms"]) == (START_MS, START_MS + 2 * STEP_MS)
+        assert episode["prediction_count"] == 3
+        assert (episode["peak_probability"], episode["peak_unix_ms"]) == (0.95, START_MS + STEP_MS)
+        assert (episode["peak_metric"], episode["peak_value"], episode["is_open"]) == ("gpu_temp_c", 91.0, 1)
+
+    def test_rising_edges_start_new_episodes(self, conn):
+        steps = [{"ram_pressure": 0.9}, {"ram_pressure": 0.9}, {}, {"ram_pressure": 0.9}]
+        started = [IssueEpisodes.record(conn, HOST, 1, START_MS + i * STEP_MS, f) for i, f in enumerate(steps)]
+        assert started == [["ram_pressure"], [], [], ["ram_pressure"]]
+        episodes = IssueEpisodes.query(conn, "ram_pressure")
+        assert [(e["prediction_count"], e["is_open"]) for e in episodes] == [(2, 0), (1, 1)]
+
+    def test_labels_are_independent(self, conn):
+        run_predictions(conn, [{"disk_full": 0.8, "disk_high_latency": 0.6}, {"disk_full": 0.8}])
+        by_label = {e["label"]: e for e in IssueEpisodes.query(conn)}
+        assert by_label["disk_full"]["prediction_count"] == 2 and by_label["disk_full"]["is_open"] == 1
+        assert by_label["disk_high_latency"]["is_open"] == 0
+
+    def test_gap_closes_stale_episode(self, conn):
+        run_predictions(conn, [{"disk_full": 0.8}])
+        run_predictions(conn, [{"disk_full": 0.8}], start_ms=START_MS + 10 * MINUTE_MS)
+        assert len(IssueEpisodes.query(conn, "disk_full")) == 2
+
+    def test_peak_metric_is_highest_behind_label(self, conn):
+        run_predictions(conn, [{"disk_high_latency": 0.9}] * 2, values={"avg_read_latency_ms": 25.0})
+        run_predictions(conn, [{"disk_high_latency": 0.9}], start_ms=START_MS + 2 * STEP_MS,
+                        values={"avg_read_latency_ms": 5.0, "avg_write_latency_ms": 40.0})
+        (episode,) = IssueEpisodes.query(conn)
+        assert (episode["peak_metric"], episode["peak_value"]) == ("avg_write_latency_ms", 40.0)
+
+    def test_close_open(self, conn):
+        run_predictions(conn, [{"cpu_bottleneck": 0.9, "ram_pressure": 0.8}])
+        run_predictions(conn, [{"cpu_bottleneck": 0.9}], host="host-b")
+        assert IssueEpisodes.close_open(conn, HOST) == 2
+        assert [e["host_uuid"] for e in IssueEpisodes.query(conn) if e["is_open"]] == ["host-b"]
+
+    def test_every_label_has_metrics(self):
+        assert list(EPISODE_METRICS) == LABEL_NAMES
+
+
+# -----------------------------
+# Interval queries
+# -----------------------------
+class TestQuery:
+
+    @pytest.fixture
+    def history(self, conn):
+        # Thermal episodes of 2, 10 and 30 minutes, an hour apart; one GPU episode in between
+        for i, minutes in enumerate((2, 10, 30)):
+            run_predictions(conn, [{"cpu_thermal_throttle": 0.9}] * (minutes * MINUTE_MS // STEP_MS + 1),
+                            start_ms=START_MS + i * 60 * MINUTE_MS)
+            run_predictions(conn, [{}], start_ms=START_MS + i * 60 * MINUTE_MS + 45 * MINUTE_MS)
+        run_predictions(conn, [{"gpu_overheating": 0.9}], start_ms=START_MS + 50 * MINUTE_MS)
+        return conn
+
+    def test_min_duration(self, history):
+        longer = IssueEpisodes.query(history, "cpu_thermal_throttle", min_duration_ms=5 * MINUTE_MS)
+        assert [(e["end_unix_ms"] - e["start_unix_ms"]) // MINUTE_MS for e in longer] == [10, 30]
+        assert IssueEpisodes.query(history, "cpu_thermal_throttle", min_duration_ms=31 * MINUTE_MS) == []
+
+    def test_overlap_includes_episode_started_before_range(self, history):
+        # The 30 minute episode runs from +120 to +150 min
+        inside = IssueEpisodes.query(history, "cpu_thermal_throttle",
+                                     START_MS + 140 * MINUTE_MS, START_MS + 141 * MINUTE_MS)
+        assert [e["start_unix_ms"] for e in inside] == [START_MS + 120 * MINUTE_MS]
+        assert IssueEpisodes.query(history, "cpu_thermal_throttle",
+                                   START_MS + 151 * MINUTE_MS, START_MS + 200 * MINUTE_MS) == []
+
+    def test_all_labels_and_host(self, history):
+        assert [e["label"] for e in IssueEpisodes.query(history)].count("gpu_overheating") == 1
+        assert len(IssueEpisodes.query(history)) == 4
+        assert IssueEpisodes.query(history, host_uuid="other") == []
+
+    def test_unknown_label(self, history):
+        assert IssueEpisodes.query(history, "nope") == []
+
+    @pytest.mark.parametrize("label,index", [
+        ("cpu_thermal_throttle", "idx_issue_episode_label_start"),
+        (None, "idx_issue_episode_start_end"),
+    ])
+    def test_queries_use_interval_indexes(self, history, label, index):
+        sql = IssueEpisodes._query_sql(label is not None, False)
+        params = [START_MS - MINUTE_MS, START_MS + 90 * 86_400_000, START_MS, 5 * MINUTE_MS]
+        detail = [row[3] for row in history.execute("EXPLAIN QUERY PLAN " + sql, [label] * (label is not None) + params)]
+        assert any(f"USING INDEX {index}" in line for line in detail), detail
+        assert not any("TEMP B-TREE" in line for line in detail), detail
+
+
+# -----------------------------
+# Merge
+# -----------------------------
+class TestMerge:
+
+    def test_episodes_copied_with_new_ids(self, tmp_path):
+        sources = []
+        for name, seed in (("a", 0), ("b", 1)):
+            path = str(tmp_path / f"{name}.db")
+            generate_db(path, hosts=1, days=0.01, end_ms=START_MS, gpus_per_host=0, partitions_per_host=1,
+                        session_hours=0.25, seed=seed)
+            c = init_db(path)
+            run_predictions(c, [{"disk_full": 0.9}] * 3, host=name)
+            c.close()
+            sources.append(path)
+        out = str(tmp_path / "fleet.db")
+        merge_dbs(out, sources)
+        conn = sqlite3.connect(out)
+        episodes = IssueEpisodes.query(conn, "disk_full")
+        assert sorted(e["host_uuid"] for e in episodes) == ["a", "b"]
+        assert len({e["episode_id"] for e in episodes}) == 2
+        conn.close()
@@ -0,0 +1,231 @@
+# storage_service/tests/test_export.py
+# Author: Andrew Fox
+# Run with: python -m pytest storage_service/tests/test_export.py -v
+
+import csv
+import datetime
+import json
+
+import numpy as np
+import pytest
+from storage_service.storage.archive import SessionArchiver
+from storage_service.storage.export import (
+    ExportCancelled, build_export_sql, export_columnar, export_csv, load_columnar, main,
+)
+from storage_service.storage.main import StorageManager
+
+
+# -----------------------------
+# Shared sample data
+# -----------------------------
+CPU_DATA = {"cpu_percent_total": 25.0, "freq_current_mhz": 2800.0}
+
+RAM_DATA = {"used_ram_gb": 8.0, "ram_usage_percent": 50.0, "swap_usage_percent": 5.0}
+
+DISK_DATA = {
+    "read_speed_bytes": 1000.0,
+    "write_speed_bytes": 500.0,
+    "avg_read_latency_ms": 1.0,
+    "avg_write_latency_ms": 2.0,
+    "disks": [
+        {"device": "C:\\", "mountpoint": "C:\\", "fstype": "NTFS",
+         "total_gb": 500.0, "used_gb": 200.0, "usage_percent": 40.0},
+    ],
+}
+
+
+@pytest.fixture
+def storage():
+    """In-memory StorageManager with 10 ticks at ts_unix_ms = 1000 * sample_id."""
+    s = StorageManager(db_path=":memory:")
+    for i in range(10):
+        s.insert_sample({**CPU_DATA, "cpu_percent_total": float(i)}, RAM_DATA, None, DISK_DATA)
+    s.conn.execute("UPDATE sample SET ts_unix_ms = sample_id * 1000")
+    s.conn.commit()
+    yield s
+    s.close()
+
+
+def sample_section(path):
+    """Rows after the '--- Sample Data ---' marker (header first)."""
+    with open(path, newline="", encoding="utf-8") as f:
+        rows = list(csv.reader(f))
+    return rows[rows.index(["--- Sample Data ---"]) + 1:]
+
+
+# -----------------------------
+# SQL pushdown
+# -----------------------------
+class TestExportSql:
+
+    def test_only_needed_tables_joined(self):
+        sql, _, headers = build_export_sql(columns=["Sample ID", "CPU %"])
+        assert headers == ["Sample ID", "CPU %"]
+        assert "cpu_sample" in sql
+        assert "gpu_sample" not in sql and "ram_sample" not in sql
+
+    def test_range_in_where(self):
+        sql, params, _ = build_export_sql(start_ms=5, end_ms=9)
+        assert "s.ts_unix_ms >= ?" in sql and "s.ts_unix_ms < ?" in sql
+        assert params == [5, 9]
+
+    def test_no_columns_raises(self):
+        with pytest.raises(ValueError):
+            build_export_sql(columns=["Not a column"])
+
+
+# -----------------------------
+# Streaming export
+# -----------------------------
+class TestExportCsv:
+
+    def test_exports_every_row_in_chunks(self, storage, tmp_path):
+        out = tmp_path / "out.csv"
+        calls = []
+        n = export_csv(storage.conn, out, chunk_rows=3, progress=lambda d, t: calls.append((d, t)))
+        assert n == 10
+        assert len(sample_section(out)) == 11
+        assert calls == [(3, 10), (6, 10), (9, 10), (10, 10)]
+
+    def test_column_and_range_selection(self, storage, tmp_path):
+        out = tmp_path / "out.csv"
+        export_csv(storage.conn, out, columns=["Sample ID", "CPU %"], start_ms=3000, end_ms=6000)
+        assert sample_section(out) == [["Sample ID", "CPU %"], ["3", "2.00"], ["4", "3.00"], ["5", "4.00"]]
+
+    def test_missing_values_written_as_na(self, storage, tmp_path):
+        out = tmp_path / "out.csv"
+        export_csv(storage.conn, out, columns=["GPU Temp (C)"])
+        assert sample_section(out)[1] == ["N/A"]
+
+    def test_sessions_section_has_first_sample(self, storage, tmp_path):
+        out = tmp_path / "out.csv"
+        export_csv(storage.conn, out)
+        with open(out, newline="", encoding="utf-8") as f:
+            rows = list(csv.reader(f))
+        session_row = rows[rows.index(["--- Sessions ---"]) + 2]
+        assert session_row[0] == str(storage.session_id)
+        assert session_row[3] == "1"
+
+    def test_cancel_removes_partial_file(self, storage, tmp_path):
+        out = tmp_path / "out.csv"
+        calls = []
+
+        def cancelled():
+            calls.append(1)
+            return len(calls) > 1
+
+        with pytest.raises(ExportCancelled):
+            export_csv(storage.conn, out, chunk_rows=2, cancelled=cancelled)
+        assert not out.exists()
+
+
+# -----------------------------
+# Columnar export
+# -----------------------------
+class TestExportColumnar:
+
+    def test_npz_round_trip(self, storage, tmp_path):
+        out = tmp_path / "cols"
+        n = export_columnar(storage.conn, out, fmt="npz", columns=["Sample ID", "CPU %"])
+        assert n == 10
+        df = load_columnar(out)
+        assert list(df["sample_id"]) == list(range(1, 11))
+        assert list(df["cpu_percent_total"]) == [float(i) for i in range(10)]
+        assert set(df["session_id"]) == {storage.session_id}
+
+    def test_typed_arrays_and_nan_for_missing(self, storage, tmp_path):
+        out = tmp_path / "cols"
+        export_columnar(storage.conn, out, fmt="npz", columns=["Sample ID", "GPU Temp (C)"])
+        manifest = json.loads((out / "manifest.json").read_text())
+        with np.load(out / manifest["files"][0]["path"]) as data:
+            assert data["sample_id"].dtype == np.int64
+            assert data["ts_unix_ms"].dtype == np.int64
+            assert np.isnan(data["gpu_temp_c"]).all()
+
+    def test_partitioned_by_host_and_session(self, storage, tmp_path):
+        out = tmp_path / "cols"
+        export_columnar(storage.conn, out, fmt="npz", rows_per_file=4)
+        manifest = json.loads((out / "manifest.json").read_text())
+        paths = [f["path"] for f in manifest["files"]]
+        assert len(paths) == 3
+        assert all(f"/session={storage.session_id}/" in p and p.startswith("host=") for p in paths)
+        assert [f["rows"] for f in manifest["files"]] == [4, 4, 2]
+
+    def test_range_pushdown(self, storage, tmp_path):
+        out = tmp_path / "cols"
+        assert export_columnar(storage.conn, out, fmt="npz", start_ms=3000, end_ms=6000) == 3
+        assert list(load_columnar(out)["ts_unix_ms"]) == [3000, 4000, 5000]
+
+    def test_cancel_removes_written_files(self, storage, tmp_path):
+        out = tmp_path / "cols"
+        calls = []
+
+        def cancelled():
+            calls.append(1)
+            return len(calls) > 1
+
+        with pytest.raises(ExportCancelled):
+            export_columnar(storage.conn, out, fmt="npz", rows_per_file=4, cancelled=cancelled)
+        assert not [p for p in out.rglob("*") if p.is_file()]
+
+    def test_unknown_format_raises(self, storage, tmp_path):
+        with pytest.raises(ValueError):
+            export_columnar(storage.conn, tmp_path / "cols", fmt="feather")
+
+    def test_cli(self, tmp_path):
+        db = tmp_path / "t.db"
+        s = StorageManager(db_path=str(db))
+        for i in range(3):
+            s.insert_sample(CPU_DATA, RAM_DATA, None, DISK_DATA)
+        s.close()
+        main(["--db", str(db), "--out", str(tmp_path / "cols"), "--format", "npz"])
+        assert len(load_columnar(tmp_path / "cols")) == 3
+
+
+# -----------------------------
+# Archived sessions
+# -----------------------------
+class TestExportArchived:
+
+    @pytest.fixture
+    def archived(self, tmp_path):
+        """A closed session of 7 ticks and an open one of 3 interleaved with it, in one file."""
+        db = str(tmp_path / "t.db")
+        old = StorageManager(db_path=db)
+        for i in range(7):
+            old.insert_sample({**CPU_DATA, "cpu_percent_total": float(i)}, RAM_DATA, None, DISK_DATA,
+                              collected_at=datetime.datetime.fromtimestamp(1_780_000_000 + 2 * i))
+        old.close()
+        s = StorageManager(db_path=db)
+        for i in range(3):
+            s.insert_sample(CPU_DATA, RAM_DATA, None, DISK_DATA,
+                            collected_at=datetime.datetime.fromtimestamp(1_780_000_001 + 2 * i))
+        s.old_session_id = old.session_id
+        yield s
+        s.close()
+
+    def test_csv_unchanged_by_archiving(self, archived, tmp_path):
+        export_csv(archived.conn, tmp_path / "before.csv", chunk_rows=4)
+        SessionArchiver.archive_session(archived.conn, archived.old_session_id, chunk_ticks=3)
+        calls = []
+        n = export_csv(archived.conn, tmp_path / "after.csv", chunk_rows=4, progress=lambda d, t: calls.append(t))
+        assert n == 10 and set(calls) == {10}
+        assert (tmp_path / "after.csv").read_text() == (tmp_path / "before.csv").read_text()
+        rows = sample_section(tmp_path / "after.csv")[1:]
+        assert [r[2] for r in rows[:4]] == [str(archived.old_session_id), str(archived.session_id)] * 2
+
+    def test_csv_range_cuts_archived_chunks(self, archived, tmp_path):
+        SessionArchiver.archive_session(archived.conn, archived.old_session_id, chunk_ticks=3)
+        out = tmp_path / "out.csv"
+        start_ms = 1_780_000_003_000
+        assert export_csv(archived.conn, out, columns=["Sample ID"], start_ms=start_ms, end_ms=start_ms + 4000) == 4
+        assert sample_section(out)[1:] == [["9"], ["3"], ["10"], ["4"]]
+
+    def test_columnar_unchanged_by_archiving(self, archived, tmp_path):
+        export_columnar(archived.conn, tmp_path / "before", fmt="npz", rows_per_file=4)
+        SessionArchiver.archive_session(archived.conn, archived.old_session_id, chunk_ticks=3)
+        assert export_columnar(archived.conn, tmp_path / "after", fmt="npz", rows_per_file=4) == 10
+        before, after = load_columnar(tmp_path / "before"), load_columnar(tmp_path / "after")
+        assert after.equals(before)
+        manifest = json.loads((tmp_path / "after" / "manifest.json").read_text())
+        assert [f["rows"] for f in manifest["files"]] == [4, 3, 3]
@@ -0,0 +1,129 @@
+# storage_service/tests/test_hot_tier.py
+# Author: Andrew Fox
+# Run with: python -m pytest storage_service/tests/test_hot_tier.py -v
+
+import math
+
+import numpy as np
+import pytest
+from storage_service.storage.columnar import fetch_columns, reverse_columns
+from storage_service.storage.hot_tier import HotTier, get_hot_tier
+from storage_service.storage.main import StorageManager
+from storage_service.storage.queries import COLUMNAR_NAMES, RECENT_COLUMNS_SQL, SESSION_COUNT_SQL
+
+
+# -----------------------------
+# Shared sample data
+# -----------------------------
+CPU_DATA = {"cpu_percent_total": 25.0, "freq_current_mhz": 2800.0}
+
+RAM_DATA = {"used_ram_gb": 8.0, "ram_usage_percent": 50.0, "swap_usage_percent": 5.0}
+
+DISK_DATA = {
+    "read_speed_bytes": 1000.0,
+    "write_speed_bytes": 500.0,
+    "avg_read_latency_ms": 1.0,
+    "avg_write_latency_ms": 2.0,
+    "disks": [
+        {"device": "C:\\", "mountpoint": "C:\\", "fstype": "NTFS",
+         "total_gb": 500.0, "used_gb": 200.0, "usage_percent": 40.0},
+    ],
+}
+
+
+@pytest.fixture
+def storage():
+    s = StorageManager(db_path=":memory:")
+    for i in range(12):
+        s.insert_sample({**CPU_DATA, "cpu_percent_total": float(i)}, RAM_DATA, None, DISK_DATA)
+    yield s
+    s.close()
+
+
+def tick(tier, session_id, sample_id):
+    tier.append(session_id, {"sample_id": sample_id, "ts_unix_ms": sample_id * 1000,
+                             "cpu_percent_total": float(sample_id)})
+
+
+# -----------------------------
+# Ring buffer
+# -----------------------------
+class TestRing:
+
+    def test_wraps_and_keeps_newest(self):
+        tier = HotTier(capacity=3)
+        for i in range(1, 6):
+            tick(tier, 1, i)
+        assert len(tier) == 3
+        assert tier.recent(10)["sample_id"].tolist() == [3, 4, 5]
+
+    def test_count_includes_evicted_ticks(self):
+        tier = HotTier(capacity=3)
+        for i in range(1, 6):
+            tick(tier, 1, i)
+        assert tier.count(1) == 5
+        assert tier.count(2) == 0
+
+    def test_session_window_stops_at_previous_session(self):
+        tier = HotTier(capacity=10)
+        for i in range(1, 4):
+            tick(tier, 1, i)
+        for i in range(4, 6):
+            tick(tier, 2, i)
+        assert tier.recent(10, session_id=2)["sample_id"].tolist() == [4, 5]
+        assert tier.recent(10)["sample_id"].tolist() == [1, 2, 3, 4, 5]
+
+    def test_missing_values_are_nan_and_ids_int(self):
+        tier = HotTier(capacity=2)
+        tick(tier, 1, 1)
+        cols = tier.recent(1)
+        assert cols["sample_id"].dtype == np.int64
+        assert math.isnan(cols["gpu_temp_c"][0])
+
+    def test_registry_returns_same_tier(self, tmp_path):
+        assert get_hot_tier(tmp_path / "a.db") is get_hot_tier(tmp_path / "a.db")
+        assert get_hot_tier(tmp_path / "a.db") is not get_hot_tier(tmp_path / "b.db")
+
+
+# -----------------------------
+# StorageManager integration
+# -----------------------------
+class TestStorageHotTier:
+
+    def test_recent_columns_match_sql(self, storage):
+        hot = storage.get_recent_columns(5)
+        sql = reverse_columns(fetch_columns(storage.conn, RECENT_COLUMNS_SQL,
+                                            (storage.session_id, 5), COLUMNAR_NAMES))
+        for name in COLUMNAR_NAMES:
+            np.testing.assert_array_equal(hot[name], sql[name], err_msg=name)
+
+    def test_count_matches_sql(self, storage):
+        expected = storage.conn.execute(SESSION_COUNT_SQL, (storage.session_id,)).fetchone()[0]
+        assert storage.get_sample_count() == expected == 12
+
+    def test_reads_run_no_sql(self, storage):
+        statements = []
+        storage.conn.set_trace_callback(statements.append)
+        storage.get_recent_columns(10)
+        storage.get_sample_count()
+        storage.conn.set_trace_callback(None)
+        assert statements == []
+
+    def test_refilled_from_disk_on_startup(self, tmp_path):
+        db = str(tmp_path / "t.db")
+        first = StorageManager(db_path=db, hot_tier=HotTier())
+        for _ in range(5):
+            first.insert_sample(CPU_DATA, RAM_DATA, None, DISK_DATA)
+        first.close()
+
+        tier = HotTier()
+        second = StorageManager(db_path=db, hot_tier=tier)
+        try:
+            assert len(tier) == 5
+            assert tier.count(first.session_id) == 5
+            assert tier.session_id == second.session_id
+            assert second.get_sample_count() == 0
+            assert len(second.get_recent_columns(10)["sample_id"]) == 0
+            assert tier.recent(10)["sample_id"].tolist() == [1, 2, 3, 4, 5]
+        finally:
+            second.close()
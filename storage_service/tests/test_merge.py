@@ -0,0 +1,188 @@
+# storage_service/tests/test_merge.py
+# Author: Andrew Fox
+# Run with: python -m pytest storage_service/tests/test_merge.py -v
+
+import sqlite3
+
+import numpy as np
+import pytest
+from storage_service.storage.archive import SessionArchiver
+from storage_service.storage.merge import merge_dbs, main
+from storage_service.storage.rollups import RollupManager
+from storage_service.storage.schema import init_db
+from storage_service.storage.session_summary import SessionSummary
+from storage_service.storage.sketches import SketchManager
+from storage_service.storage.synthetic import generate_db
+
+END_MS = 1_780_000_000_000
+HOUR_MS = 3_600_000
+
+
+def query(path, sql, params=()):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def sources(tmp_path):
+    """Three files: a and b come from the same host (same seed), c from another."""
+    paths = []
+    for name, seed, end_ms in (("a", 0, END_MS - 2 * HOUR_MS), ("b", 0, END_MS), ("c", 1, END_MS)):
+        path = str(tmp_path / f"{name}.db")
+        generate_db(path, hosts=1, days=0.02, end_ms=end_ms, gpus_per_host=1, partitions_per_host=2,
+                    session_hours=0.25, seed=seed, rollups=True)
+        paths.append(path)
+    return paths
+
+
+def total(paths, sql):
+    return sum(query(p, sql)[0][0] for p in paths)
+
+
+# -----------------------------
+# Row copy and id remapping
+# -----------------------------
+class TestMerge:
+
+    def test_every_row_copied(self, tmp_path, sources):
+        out = str(tmp_path / "fleet.db")
+        stats = merge_dbs(out, sources)
+        assert stats["merged"] == sources and stats["skipped"] == []
+        for table in ("session", "sample", "cpu_sample", "ram_sample", "gpu_sample",
+                      "disk_io_sample", "disk_partition_sample"):
+            assert query(out, f"SELECT COUNT(*) FROM {table}")[0][0] == total(sources, f"SELECT COUNT(*) FROM {table}"), table
+        assert query(out, "PRAGMA foreign_key_check") == []
+
+    def test_hosts_and_partitions_deduplicated(self, tmp_path, sources):
+        out = str(tmp_path / "fleet.db")
+        merge_dbs(out, sources)
+        assert query(out, "SELECT COUNT(*) FROM host")[0][0] == 2
+        assert query(out, "SELECT COUNT(*) FROM gpu_device")[0][0] == 2
+        assert query(out, "SELECT COUNT(*) FROM disk_partition")[0][0] == 4
+
+    def test_partition_rows_point_at_own_host(self, tmp_path, sources):
+        out = str(tmp_path / "fleet.db")
+        merge_dbs(out, sources)
+        mismatched = query(out, """
+            SELECT COUNT(*) FROM disk_partition_sample dps
+            JOIN sample s ON s.sample_id = dps.sample_id
+            JOIN session se ON se.session_id = s.session_id
+            JOIN disk_partition dp ON dp.partition_id = dps.partition_id
+            WHERE dp.host_uuid <> se.host_uuid""")[0][0]
+        assert mismatched == 0
+
+    def test_values_follow_their_ticks(self, tmp_path, sources):
+        out = str(tmp_path / "fleet.db")
+        merge_dbs(out, sources)
+        sql = """SELECT s.ts_unix_ms, se.host_uuid, c.cpu_percent_total FROM sample s
+                 JOIN session se USING (session_id) JOIN cpu_sample c USING (sample_id)
+                 ORDER BY 2, 1"""
+        expected = sorted(row for p in sources for row in query(p, sql))
+        assert sorted(query(out, sql)) == expected
+
+    def test_indexes_rebuilt(self, tmp_path, sources):
+        out = str(tmp_path / "fleet.db")
+        merge_dbs(out, sources)
+        names = {row[0] for row in query(out, "SELECT name FROM sqlite_master WHERE type = 'index'")}
+        assert {"idx_sample_session_ts", "idx_sample_ts", "idx_disk_part_sample_usage"} <= names
+
+    def test_rerun_skips_merged_sources(self, tmp_path, sources):
+        out = str(tmp_path / "fleet.db")
+        merge_dbs(out, sources)
+        stats = merge_dbs(out, sources)
+        assert stats["merged"] == [] and stats["skipped"] == sources
+        assert query(out, "SELECT COUNT(*) FROM sample")[0][0] == total(sources, "SELECT COUNT(*) FROM sample")
+
+    def test_appends_to_existing_target(self, tmp_path, sources):
+        out = str(tmp_path / "fleet.db")
+        merge_dbs(out, sources[:1])
+        merge_dbs(out, sources[1:])
+        assert query(out, "SELECT COUNT(*) FROM sample")[0][0] == total(sources, "SELECT COUNT(*) FROM sample")
+        assert query(out, "SELECT COUNT(DISTINCT sample_id) FROM sample")[0][0] == \
+            total(sources, "SELECT COUNT(*) FROM sample")
+
+
+# -----------------------------
+# Rollups, summaries, archived sessions
+# -----------------------------
+class TestDerivedData:
+
+    def test_rollups_match_sources(self, tmp_path, sources):
+        out = str(tmp_path / "fleet.db")
+        merge_dbs(out, sources)
+        sql = "SELECT SUM(sample_count) FROM metric_rollup WHERE resolution_ms = 60000 AND metric = 'cpu_percent_total'"
+        assert query(out, sql)[0][0] == total(sources, sql)
+        # Watermark already covers the merged ticks, so opening the file rolls nothing up twice
+        conn = init_db(out)
+        assert RollupManager.catch_up(conn) == 0
+        conn.close()
+
+    def test_sketches_match_sources(self, tmp_path, sources):
+        out = str(tmp_path / "fleet.db")
+        merge_dbs(out, sources)
+        for res_ms in (60_000, 86_400_000):
+            sql = ("SELECT SUM(sample_count) FROM metric_sketch "
+                   f"WHERE resolution_ms = {res_ms} AND metric = 'cpu_percent_total'")
+            assert query(out, sql)[0][0] == total(sources, sql)
+        # a and b share a host and a day: their day sketches were merged, not duplicated
+        assert query(out, "SELECT COUNT(*) FROM metric_sketch WHERE resolution_ms = 86400000 "
+                          "AND metric = 'cpu_percent_total'")[0][0] == 2
+        conn = init_db(out)
+        assert SketchManager.catch_up(conn) == 0
+        conn.close()
+
+    def test_session_summaries_remapped(self, tmp_path, sources):
+        out = str(tmp_path / "fleet.db")
+        merge_dbs(out, sources)
+        conn = init_db(out)
+        try:
+            assert SessionSummary.catch_up(conn) == 0
+            for session_id, count, first_id in conn.execute(
+                "SELECT session_id, COUNT(*), MIN(sample_id) FROM sample GROUP BY session_id"
+            ).fetchall():
+                summary = SessionSummary.get(conn, session_id)
+                assert (summary["sample_count"], summary["first_sample_id"]) == (count, first_id)
+        finally:
+            conn.close()
+
+    def test_archived_session_survives(self, tmp_path, sources):
+        conn = init_db(sources[2])
+        session_id = conn.execute("SELECT MIN(session_id) FROM session").fetchone()[0]
+        before = SessionArchiver.read_session(conn, session_id)
+        SessionArchiver.archive_session(conn, session_id, chunk_ticks=100)
+        started = conn.execute("SELECT started_at_unix_ms FROM session WHERE session_id = ?",
+                               (session_id,)).fetchone()[0]
+        conn.close()
+
+        out = str(tmp_path / "fleet.db")
+        merge_dbs(out, sources)
+        host_uuid = query(sources[2], "SELECT host_uuid FROM host")[0][0]
+        conn = init_db(out)
+        try:
+            new_id = conn.execute("SELECT session_id FROM session WHERE started_at_unix_ms = ? AND host_uuid = ?",
+                                  (started, host_uuid)).fetchone()[0]
+            after = SessionArchiver.read_session(conn, new_id)
+            partitions = {row[0] for row in conn.execute(
+                "SELECT partition_id FROM disk_partition WHERE host_uuid = ?", (host_uuid,))}
+        finally:
+            conn.close()
+        assert len(after["sample_id"]) == len(before["sample_id"])
+        np.testing.assert_array_equal(after["ts_unix_ms"], before["ts_unix_ms"])
+        np.testing.assert_allclose(after["disk_usage_percent"], before["disk_usage_percent"])
+        archived = {int(k.split(".")[0][len("partition"):]) for k in after if k.startswith("partition")}
+        assert archived == partitions
+
+
+# -----------------------------
+# CLI
+# -----------------------------
+class TestCli:
+
+    def test_main_merges(self, tmp_path, sources, capsys):
+        out = str(tmp_path / "fleet.db")
+        main(["--out", out, *sources])
+        assert "Merged 3 databases" in capsys.readouterr().out
+        assert query(out, "SELECT COUNT(*) FROM sample")[0][0] == total(sources, "SELECT COUNT(*) FROM sample")
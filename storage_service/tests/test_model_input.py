@@ -0,0 +1,148 @@
+# storage_service/tests/test_model_input.py
+# Author: Andrew Fox
+# Run with: python -m pytest storage_service/tests/test_model_input.py -v
+
+import numpy as np
+import pytest
+from storage_service.storage.archive import SessionArchiver
+from storage_service.storage.main import StorageManager
+from storage_service.storage.model_input import (
+    MODEL_INPUT_METRICS, RECENT_SQL, SESSION_SQL, ModelInput,
+)
+from storage_service.storage.schema import init_db
+
+
+# -----------------------------
+# Shared sample data
+# -----------------------------
+CPU_DATA = {"cpu_percent_total": 25.0, "freq_current_mhz": 2800.0}
+
+RAM_DATA = {"used_ram_gb": 8.0, "ram_usage_percent": 50.0, "swap_usage_percent": 5.0}
+
+DISK_DATA = {
+    "read_speed_bytes": 1000.0,
+    "write_speed_bytes": 500.0,
+    "avg_read_latency_ms": 1.0,
+    "avg_write_latency_ms": 2.0,
+    "disks": [
+        {"device": "C:\\", "mountpoint": "C:\\", "fstype": "NTFS",
+         "total_gb": 500.0, "used_gb": 200.0, "usage_percent": 40.0},
+        {"device": "D:\\", "mountpoint": "D:\\", "fstype": "NTFS",
+         "total_gb": 1000.0, "used_gb": 900.0, "usage_percent": 90.0},
+    ],
+}
+
+GPU_DATA = {"gpus": [{"gpu_id": 0, "gpu_util_percent": 60.0, "gpu_mem_util_percent": 10.0,
+                      "gpu_mem_used_mb": 1024, "gpu_temp_c": 70.0, "gpu_core_clock_mhz": 1500.0,
+                      "gpu_power_usage_w": 100.0, "gpu_power_limit_w": 250.0}]}
+
+TICKS = 12
+
+
+def write_session(db_path, **kwargs):
+    """StorageManager with one GPU and TICKS ticks; the GPU only reports every third tick."""
+    s = StorageManager(db_path=str(db_path), **kwargs)
+    s.conn.execute("INSERT OR IGNORE INTO gpu_device (gpu_uuid, host_uuid, first_seen_iso) VALUES ('GPU-0', ?, '')",
+                   (s.host_uuid,))
+    s.conn.commit()
+    s.gpu_uuid_map[0] = "GPU-0"
+    for i in range(TICKS):
+        gpu = GPU_DATA if i % 3 == 0 else None
+        s.insert_sample({**CPU_DATA, "cpu_percent_total": float(i)}, RAM_DATA, gpu, DISK_DATA)
+    return s
+
+
+@pytest.fixture
+def storage(tmp_path):
+    s = write_session(tmp_path / "t.db")
+    yield s
+    s.close()
+
+
+def assert_matches_tick_queries(cols, expected):
+    np.testing.assert_array_equal(cols["sample_id"], expected["sample_id"])
+    for metric in MODEL_INPUT_METRICS:
+        np.testing.assert_allclose(cols[metric], expected[metric], err_msg=metric)
+
+
+# -----------------------------
+# Write path
+# -----------------------------
+class TestWritePath:
+
+    def test_one_row_per_tick(self, storage):
+        assert storage.conn.execute("SELECT COUNT(*) FROM model_input").fetchone()[0] == TICKS
+
+    def test_matches_tick_queries(self, storage):
+        assert_matches_tick_queries(storage.get_model_input(), storage.get_session_columns())
+
+    def test_missing_gpu_is_nan(self, storage):
+        cols = storage.get_model_input()
+        assert np.isnan(cols["gpu_temp_c"]).sum() == TICKS - TICKS // 3
+        assert cols["disk_usage_percent"][0] == pytest.approx(90.0)
+
+    def test_change_only_session_matches(self, tmp_path):
+        s = write_session(tmp_path / "c.db", change_only=True)
+        assert_matches_tick_queries(s.get_model_input(), s.get_session_columns())
+        s.close()
+
+    def test_rows_cascade_with_samples(self, storage):
+        storage.conn.execute("DELETE FROM sample WHERE sample_id <= (SELECT MIN(sample_id) + 4 FROM sample)")
+        storage.conn.commit()
+        assert storage.conn.execute("SELECT COUNT(*) FROM model_input").fetchone()[0] == TICKS - 5
+
+
+# -----------------------------
+# Catch-up
+# -----------------------------
+class TestCatchUp:
+
+    def test_rebuild_matches_incremental(self, storage):
+        incremental = storage.get_model_input()
+        storage.conn.execute("DELETE FROM model_input")
+        storage.conn.commit()
+        assert ModelInput.catch_up(storage.conn) == 1
+        assert ModelInput.catch_up(storage.conn) == 0
+        assert_matches_tick_queries(storage.get_model_input(), incremental)
+
+    def test_storage_manager_catches_up_on_open(self, tmp_path):
+        s = write_session(tmp_path / "t.db")
+        session_id = s.session_id
+        s.conn.execute("DELETE FROM model_input")
+        s.close()
+
+        reopened = StorageManager(db_path=str(tmp_path / "t.db"))
+        assert reopened.backfill.wait(10)
+        assert len(reopened.get_model_input(session_id=session_id)["sample_id"]) == TICKS
+        reopened.close()
+
+
+# -----------------------------
+# Read path
+# -----------------------------
+class TestReadPath:
+
+    def test_recent_is_oldest_first(self, storage):
+        cols = storage.get_model_input(5)
+        np.testing.assert_allclose(cols["cpu_percent_total"], [7.0, 8.0, 9.0, 10.0, 11.0])
+
+    def test_archived_session_read_from_chunks(self, tmp_path):
+        s = write_session(tmp_path / "t.db")
+        session_id = s.session_id
+        expected = s.get_model_input()
+        s.close()
+
+        conn = init_db(tmp_path / "t.db")
+        try:
+            SessionArchiver.archive_session(conn, session_id, chunk_ticks=5)
+            assert conn.execute("SELECT COUNT(*) FROM model_input").fetchone()[0] == 0
+            assert_matches_tick_queries(ModelInput.read_session(conn, session_id), expected)
+        finally:
+            conn.close()
+
+    @pytest.mark.parametrize("sql, params", [(SESSION_SQL, (1,)), (RECENT_SQL, (1, 10))])
+    def test_single_primary_key_range_scan(self, sql, params):
+        conn = init_db(":memory:")
+        lines = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+        conn.close()
+        assert lines == ["SEARCH model_input USING PRIMARY KEY (session_id=?)"]
@@ -0,0 +1,73 @@
+# storage_service/tests/test_optimize.py
+# Author: Andrew Fox
+# Run with: python -m pytest storage_service/tests/test_optimize.py -v
+
+import sqlite3
+
+import pytest
+from storage_service.storage.benchmark import build_db
+from storage_service.storage.metrics import METRICS
+from storage_service.storage.optimize import OptimizeManager, close_optimize
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    METRICS.reset()
+    path = tmp_path / "t.db"
+    build_db(path, 2000).close()
+    return path
+
+
+def stat_tables(path):
+    conn = sqlite3.connect(path)
+    try:
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone():
+            return set()
+        return {row[0] for row in conn.execute("SELECT DISTINCT tbl FROM sqlite_stat1")}
+    finally:
+        conn.close()
+
+
+# -----------------------------
+# Scheduled ANALYZE
+# -----------------------------
+class TestOptimizeManager:
+
+    def test_run_fills_statistics(self, db_path):
+        stats = OptimizeManager(str(db_path)).run()
+        assert stats["stat_rows"] > 0
+        assert {"sample", "gpu_sample", "disk_partition_sample"} <= stat_tables(db_path)
+
+    def test_run_on_shared_connection_leaves_it_open(self, db_path):
+        conn = sqlite3.connect(db_path)
+        OptimizeManager(conn=conn).run()
+        assert conn.execute("SELECT COUNT(*) FROM sample").fetchone()[0] == 2000
+        conn.close()
+
+    def test_metrics_published(self, db_path):
+        OptimizeManager(str(db_path)).run()
+        snap = METRICS.snapshot()
+        assert snap["counters"]["optimize.runs"] == 1
+        assert snap["gauges"]["optimize.stat_rows"] > 0
+
+    def test_background_job_stops(self, db_path):
+        job = OptimizeManager(str(db_path), {"interval_s": 0.01})
+        job.start()
+        for _ in range(200):
+            if job.last_stats is not None:
+                break
+            job._stop.wait(0.01)
+        job.stop()
+        assert job.last_stats is not None
+
+
+# -----------------------------
+# On close
+# -----------------------------
+class TestCloseOptimize:
+
+    def test_close_optimize_runs(self, db_path):
+        conn = sqlite3.connect(db_path)
+        conn.execute("SELECT * FROM sample WHERE session_id = 1 ORDER BY ts_unix_ms DESC LIMIT 10").fetchall()
+        close_optimize(conn)
+        conn.close()
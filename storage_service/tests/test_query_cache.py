@@ -0,0 +1,203 @@
+# storage_service/tests/test_query_cache.py
+# Author: Andrew Fox
+# Run with: python -m pytest storage_service/tests/test_query_cache.py -v
+
+import numpy as np
+import pytest
+from storage_service.storage.archive import SessionArchiver
+from storage_service.storage.main import StorageManager
+from storage_service.storage.metrics import METRICS
+from storage_service.storage.query_cache import (
+    QueryCache, get_query_cache, invalidate_query_cache, normalise_sql,
+)
+from storage_service.storage.retention import RetentionManager
+from storage_service.storage.schema import init_db
+
+
+# -----------------------------
+# Shared sample data
+# -----------------------------
+CPU_DATA = {"cpu_percent_total": 25.0, "freq_current_mhz": 2800.0}
+
+RAM_DATA = {"used_ram_gb": 8.0, "ram_usage_percent": 50.0, "swap_usage_percent": 5.0}
+
+DISK_DATA = {
+    "read_speed_bytes": 1000.0,
+    "write_speed_bytes": 500.0,
+    "avg_read_latency_ms": 1.0,
+    "avg_write_latency_ms": 2.0,
+    "disks": [
+        {"device": "C:\\", "mountpoint": "C:\\", "fstype": "NTFS",
+         "total_gb": 500.0, "used_gb": 200.0, "usage_percent": 40.0},
+    ],
+}
+
+SQL = "SELECT sample_id FROM sample WHERE session_id = ? ORDER BY sample_id"
+
+
+def insert(storage, n, start=0):
+    for i in range(n):
+        storage.insert_sample({**CPU_DATA, "cpu_percent_total": float(start + i)}, RAM_DATA, None, DISK_DATA)
+
+
+@pytest.fixture
+def storage():
+    METRICS.reset()
+    s = StorageManager(db_path=":memory:")
+    insert(s, 10)
+    yield s
+    s.close()
+
+
+# -----------------------------
+# Lookups
+# -----------------------------
+class TestLookups:
+
+    def test_second_read_is_a_hit(self, storage):
+        cache = QueryCache()
+        first = cache.fetchall(storage.conn, SQL, (storage.session_id,))
+        second = cache.fetchall(storage.conn, SQL, (storage.session_id,))
+        assert [r[0] for r in first] == [r[0] for r in second]
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    def test_params_are_part_of_the_key(self, storage):
+        cache = QueryCache()
+        cache.fetchall(storage.conn, SQL, (storage.session_id,))
+        assert cache.fetchall(storage.conn, SQL, (storage.session_id + 1,)) == []
+        assert cache.misses == 2
+
+    def test_whitespace_differences_share_an_entry(self, storage):
+        cache = QueryCache()
+        cache.fetchall(storage.conn, SQL, (storage.session_id,))
+        cache.fetchall(storage.conn, "  " + SQL.replace(" ", "\n    "), (storage.session_id,))
+        assert cache.hits == 1
+
+    def test_normalise_keeps_literals(self):
+        assert normalise_sql("SELECT  'a   b'\n FROM\tt") == "SELECT 'a   b' FROM t"
+        assert normalise_sql("SELECT 'a   b'") != normalise_sql("SELECT 'a b'")
+
+    def test_returned_values_are_copies(self, storage):
+        cache = QueryCache()
+        cache.fetchall(storage.conn, SQL, (storage.session_id,)).clear()
+        assert len(cache.fetchall(storage.conn, SQL, (storage.session_id,))) == 10
+
+    def test_cached_arrays_are_read_only(self, storage):
+        cols = storage.get_session_columns()
+        with pytest.raises(ValueError):
+            cols["cpu_percent_total"][0] = 1.0
+
+    def test_open_write_transaction_bypasses(self, storage):
+        cache = QueryCache()
+        storage.conn.execute("BEGIN")
+        storage.conn.execute("DELETE FROM sample")
+        assert cache.fetchall(storage.conn, SQL, (storage.session_id,)) == []
+        storage.conn.rollback()
+        assert len(cache.fetchall(storage.conn, SQL, (storage.session_id,))) == 10
+        assert cache.stats()["bypassed"] == 1
+
+
+# -----------------------------
+# Staleness
+# -----------------------------
+class TestWatermark:
+
+    def test_new_tick_makes_entries_stale(self, storage):
+        cache = QueryCache()
+        assert len(cache.fetchall(storage.conn, SQL, (storage.session_id,))) == 10
+        insert(storage, 1, start=10)
+        assert len(cache.fetchall(storage.conn, SQL, (storage.session_id,))) == 11
+        assert cache.stale == 1
+        assert cache.stats()["entries"] == 1
+
+    def test_storage_manager_reads_follow_inserts(self, storage):
+        assert len(storage.get_recent_samples(100)) == 10
+        insert(storage, 2, start=10)
+        assert storage.get_recent_samples(1)[0]["cpu_percent_total"] == 11.0
+        assert len(storage.get_session_columns()["sample_id"]) == 12
+        assert len(storage.get_model_input()["sample_id"]) == 12
+
+    def test_invalidate_drops_entries(self, storage):
+        cache = QueryCache()
+        cache.fetchall(storage.conn, SQL, (storage.session_id,))
+        storage.conn.execute("DELETE FROM sample WHERE sample_id = (SELECT MIN(sample_id) FROM sample)")
+        storage.conn.commit()
+        cache.invalidate()
+        assert len(cache.fetchall(storage.conn, SQL, (storage.session_id,))) == 9
+        assert cache.hits == 0
+
+    def test_retention_invalidates_registered_cache(self, tmp_path):
+        s = StorageManager(db_path=str(tmp_path / "t.db"))
+        insert(s, 5)
+        # Two old ticks below the cutoff; the newest tick (the watermark) stays
+        s.conn.execute("UPDATE sample SET ts_unix_ms = 0 WHERE sample_id <= (SELECT MIN(sample_id) + 1 FROM sample)")
+        s.conn.commit()
+        assert s.query_cache is get_query_cache(tmp_path / "t.db")
+        assert len(s.get_recent_samples(100)) == 5
+        RetentionManager(conn=s.conn, policy={"raw_days": 0}).run(now_ms=1)
+        assert len(s.get_recent_samples(100)) == 3
+        s.close()
+
+    def test_archive_invalidates_registered_cache(self, tmp_path):
+        old = StorageManager(db_path=str(tmp_path / "t.db"))
+        insert(old, 3)
+        old.close()
+        s = StorageManager(db_path=str(tmp_path / "t.db"))
+        insert(s, 3)
+        assert len(s.get_recent_samples(100)) == 3
+        assert len(s.get_recent_samples_all_sessions(100)) == 6
+        SessionArchiver.archive_session(s.conn, old.session_id)
+        # Raw rows of the old session are gone; its ticks now come from the chunks
+        assert s.query_cache.stale >= 2
+        assert s.conn.execute("SELECT COUNT(*) FROM sample").fetchone()[0] == 3
+        assert [r["sample_id"] for r in s.get_recent_samples_all_sessions(100)] == [6, 5, 4, 3, 2, 1]
+        s.close()
+
+    def test_invalidate_ignores_memory_databases(self):
+        conn = init_db(":memory:")
+        invalidate_query_cache(conn)
+        conn.close()
+
+
+# -----------------------------
+# Memory cap
+# -----------------------------
+class TestEviction:
+
+    def test_least_recently_used_goes_first(self, storage):
+        cache = QueryCache()
+        for sid in range(3):
+            cache.fetchall(storage.conn, SQL, (sid,))
+        cache.fetchall(storage.conn, SQL, (0,))             # 0 is now the most recent
+        cache.max_bytes = cache.stats()["bytes"] - 1
+        cache.fetchall(storage.conn, SQL, (3,))
+        keys = [key[1] for key in cache._entries]
+        assert (1,) not in keys and (0,) in keys
+        assert cache.evictions >= 1
+        assert cache.stats()["bytes"] <= cache.max_bytes
+
+    def test_oversized_results_are_not_stored(self, storage):
+        cache = QueryCache(max_bytes=256)
+        cache.fetch_columns(storage.conn, SQL, (storage.session_id,), ["sample_id"])
+        assert cache.stats()["entries"] == 0
+
+
+# -----------------------------
+# Counters
+# -----------------------------
+class TestCounters:
+
+    def test_metrics_published(self, storage):
+        storage.get_recent_samples(5)
+        storage.get_recent_samples(5)
+        snap = METRICS.snapshot()
+        assert snap["counters"]["query_cache.hits"] == 1
+        assert snap["counters"]["query_cache.misses"] == 1
+        assert snap["gauges"]["query_cache.entries"] == 1
+
+    def test_hit_rate(self, storage):
+        cache = storage.query_cache
+        for _ in range(4):
+            np.testing.assert_array_equal(storage.get_range_columns(0, 2 ** 62)["sample_id"],
+                                          storage.get_session_columns()["sample_id"])
+        assert cache.stats()["hit_rate"] == pytest.approx(6 / 8)
@@ -0,0 +1,116 @@
+# storage_service/tests/test_query_plans.py
+# Author: Andrew Fox
+# Run with: python -m pytest storage_service/tests/test_query_plans.py -v
+# Latency checks at 1M / 10M ticks are opt-in (they build large temporary DBs):
+#   TELEMETRY_PERF=1 python -m pytest storage_service/tests/test_query_plans.py -v
+
+import os
+import statistics
+import time
+
+import pytest
+from storage_service.storage.benchmark import build_db
+from storage_service.storage.optimize import OptimizeManager
+from storage_service.storage.schema import init_db
+from storage_service.storage.queries import (
+    HOT_QUERIES, RECENT_SESSION_SQL, RECENT_ALL_SQL, SESSION_COUNT_SQL,
+)
+
+
+def plan(conn, sql, params):
+    """Return the EXPLAIN QUERY PLAN detail lines for a query."""
+    return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+
+
+@pytest.fixture(scope="module", params=["fresh", "analyzed"])
+def conn(request, tmp_path_factory):
+    """Plans must hold on an empty file and once ANALYZE has filled sqlite_stat1."""
+    if request.param == "fresh":
+        c = init_db(":memory:")
+    else:
+        c = build_db(tmp_path_factory.mktemp("plans") / "analyzed.db", 5000, n_partitions=3)
+        OptimizeManager(conn=c).run()
+    yield c
+    c.close()
+
+
+# -----------------------------
+# Plan shape
+# -----------------------------
+class TestQueryPlans:
+
+    @pytest.mark.parametrize("name", list(HOT_QUERIES))
+    def test_no_temp_btree(self, conn, name):
+        sql, params = HOT_QUERIES[name]
+        for line in plan(conn, sql, params):
+            assert "TEMP B-TREE" not in line, f"{name}: {line}"
+
+    @pytest.mark.parametrize("name", list(HOT_QUERIES))
+    def test_no_full_table_scan(self, conn, name):
+        sql, params = HOT_QUERIES[name]
+        lines = plan(conn, sql, params)
+        # Scanning a materialized LIMIT subquery is fine, it holds at most n ids
+        windows = {"SCAN " + line.split()[1] for line in lines if line.startswith("MATERIALIZE")}
+        for line in lines:
+            if line.startswith("SCAN") and line not in windows:
+                assert "USING" in line and "INDEX" in line, f"{name}: {line}"
+
+    def test_recent_session_walks_session_index(self, conn):
+        lines = plan(conn, *HOT_QUERIES["recent_session"])
+        assert "SEARCH s USING INDEX idx_sample_session_ts (session_id=?)" in lines
+
+    def test_recent_all_walks_ts_index(self, conn):
+        lines = plan(conn, *HOT_QUERIES["recent_all"])
+        assert "SCAN s USING INDEX idx_sample_ts" in lines
+
+    def test_gpu_lookup_uses_sample_gpu_index(self, conn):
+        lines = plan(conn, *HOT_QUERIES["recent_session"])
+        assert any("idx_gpu_sample_sample_gpu (sample_id=? AND gpu_id=?)" in l for l in lines)
+
+    def test_disk_usage_uses_covering_index(self, conn):
+        lines = plan(conn, *HOT_QUERIES["recent_session"])
+        assert "SEARCH dp USING COVERING INDEX idx_disk_part_sample_usage (sample_id=?)" in lines
+
+    def test_device_rows_seek_by_sample_id(self, conn):
+        gpus = plan(conn, *HOT_QUERIES["recent_session_gpus"])
+        parts = plan(conn, *HOT_QUERIES["recent_session_partitions"])
+        assert "SEARCH g USING INDEX idx_gpu_sample_sample_gpu (sample_id=?)" in gpus
+        assert any(l.startswith("SEARCH dp USING") and "(sample_id=?)" in l for l in parts)
+
+    def test_range_page_seeks_ts_index(self, conn):
+        lines = plan(conn, *HOT_QUERIES["range_page"])
+        assert any(l.startswith("SEARCH s USING") and "idx_sample_ts (ts_unix_ms>? AND ts_unix_ms<?)" in l
+                   for l in lines)
+
+    def test_session_count_is_covering(self, conn):
+        lines = plan(conn, *HOT_QUERIES["session_count"])
+        assert lines == ["SEARCH sample USING COVERING INDEX idx_sample_session_ts (session_id=?)"]
+
+
+# -----------------------------
+# Latency at scale
+# -----------------------------
+def median_ms(conn, sql, params, repeats=50):
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        conn.execute(sql, params).fetchall()
+        times.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(times)
+
+
+@pytest.mark.skipif(not os.environ.get("TELEMETRY_PERF"), reason="set TELEMETRY_PERF=1 to run latency checks")
+class TestQueryLatency:
+
+    @pytest.mark.parametrize("n_ticks", [1_000_000, 10_000_000])
+    def test_hot_queries_stay_fast(self, tmp_path, n_ticks):
+        conn = build_db(tmp_path / "perf.db", n_ticks)
+        try:
+            # Recent-window reads must not grow with table size
+            assert median_ms(conn, RECENT_SESSION_SQL, (1, 10)) < 5.0
+            assert median_ms(conn, RECENT_ALL_SQL, (10,)) < 5.0
+            assert median_ms(conn, RECENT_SESSION_SQL, (1, 1000)) < 50.0
+            # COUNT(*) walks the whole covering index, so it is linear but cheap
+            assert median_ms(conn, SESSION_COUNT_SQL, (1,), repeats=5) < n_ticks / 10_000
+        finally:
+            conn.close()
@@ -0,0 +1,118 @@
+# storage_service/tests/test_read_pool.py
+# Author: Andrew Fox
+# Run with: python -m pytest storage_service/tests/test_read_pool.py -v
+
+import sqlite3
+import threading
+
+import pytest
+from storage_service.storage.metrics import METRICS
+from storage_service.storage.read_pool import ReadPool, get_read_pool
+from storage_service.storage.schema import init_db
+
+
+@pytest.fixture
+def db(tmp_path):
+    """File DB with one host row, plus the writer connection."""
+    path = tmp_path / "t.db"
+    conn = init_db(path)
+    conn.execute("INSERT INTO host (host_uuid, hostname, created_at_iso) VALUES ('h', 'box', '')")
+    conn.commit()
+    yield path, conn
+    conn.close()
+
+
+@pytest.fixture
+def pool(db):
+    p = ReadPool(db[0], size=2)
+    yield p
+    p.close()
+
+
+def host_count(conn):
+    return conn.execute("SELECT COUNT(*) FROM host").fetchone()[0]
+
+
+# -----------------------------
+# Borrowing
+# -----------------------------
+class TestBorrowing:
+
+    def test_reads_committed_rows(self, pool):
+        with pool.connection() as conn:
+            assert conn.execute("SELECT hostname FROM host").fetchone()["hostname"] == "box"
+
+    def test_connections_are_read_only(self, pool):
+        with pool.connection() as conn:
+            with pytest.raises(sqlite3.OperationalError):
+                conn.execute("DELETE FROM host")
+
+    def test_connections_are_reused(self, pool):
+        with pool.connection() as a:
+            pass
+        with pool.connection() as b:
+            pass
+        assert a is b
+
+    def test_borrow_times_out_when_exhausted(self, pool):
+        with pool.connection(), pool.connection():
+            with pytest.raises(TimeoutError):
+                with pool.connection(timeout_s=0.05):
+                    pass
+
+    def test_borrow_from_other_thread(self, pool):
+        result = []
+
+        def worker():
+            with pool.connection() as conn:
+                result.append(host_count(conn))
+
+        t = threading.Thread(target=worker)
+        t.start()
+        t.join()
+        assert result == [1]
+
+    def test_borrow_metrics_recorded(self, pool):
+        METRICS.reset()
+        with pool.connection():
+            pass
+        snap = METRICS.snapshot()
+        assert snap["counters"]["read_pool.borrows"] == 1
+        assert snap["timings"]["read_pool.hold_ms"]["count"] == 1
+
+
+# -----------------------------
+# Snapshots
+# -----------------------------
+class TestSnapshot:
+
+    def test_snapshot_ignores_later_commits(self, db, pool):
+        _, writer = db
+        with pool.snapshot() as conn:
+            before = host_count(conn)
+            writer.execute("INSERT INTO host (host_uuid, hostname, created_at_iso) VALUES ('h2', 'b2', '')")
+            writer.commit()
+            assert host_count(conn) == before
+
+    def test_connection_sees_later_commits(self, db, pool):
+        _, writer = db
+        with pool.connection() as conn:
+            before = host_count(conn)
+            writer.execute("INSERT INTO host (host_uuid, hostname, created_at_iso) VALUES ('h2', 'b2', '')")
+            writer.commit()
+            assert host_count(conn) == before + 1
+
+    def test_snapshot_released_on_return(self, pool):
+        with pool.snapshot() as conn:
+            pass
+        assert not conn.in_transaction
+
+
+class TestSharedPool:
+
+    def test_same_path_same_pool(self, db):
+        path, _ = db
+        a = get_read_pool(path)
+        assert get_read_pool(str(path)) is a
+        a.close()
+        assert get_read_pool(path) is not a
@@ -0,0 +1,174 @@
+# storage_service/tests/test_retention.py
+# Author: Andrew Fox
+# Run with: python -m pytest storage_service/tests/test_retention.py -v
+
+import sqlite3
+
+import pytest
+from storage_service.storage.archive import SessionArchiver
+from storage_service.storage.main import StorageManager
+from storage_service.storage.metrics import METRICS
+from storage_service.storage.retention import RetentionManager, DAY_MS
+from storage_service.storage.rollups import RESOLUTIONS_MS
+from storage_service.storage.schema import init_db
+
+NOW_MS = 1_700_000_000_000
+
+
+@pytest.fixture
+def storage():
+    """Fresh in-memory StorageManager for each test."""
+    s = StorageManager(db_path=":memory:")
+    yield s
+    s.close()
+
+
+def insert_raw(storage, ts_unix_ms, cpu_percent=10.0):
+    """Insert a raw tick with a chosen timestamp."""
+    cur = storage.conn.execute(
+        "INSERT INTO sample (session_id, ts_iso, ts_unix_ms) VALUES (?, '', ?)",
+        (storage.session_id, ts_unix_ms),
+    )
+    storage.conn.execute(
+        "INSERT INTO cpu_sample (sample_id, cpu_percent_total) VALUES (?, ?)",
+        (cur.lastrowid, cpu_percent),
+    )
+    storage.conn.commit()
+
+
+def make_job(storage, **policy):
+    return RetentionManager(conn=storage.conn, policy={"chunk_pause_ms": 0, **policy})
+
+
+def count(storage, table):
+    return storage.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+# -----------------------------
+# Raw retention
+# -----------------------------
+class TestRawRetention:
+
+    def test_expired_samples_deleted(self, storage):
+        insert_raw(storage, NOW_MS - 10 * DAY_MS)
+        insert_raw(storage, NOW_MS - 1000)
+        stats = make_job(storage, raw_days=7).run(now_ms=NOW_MS)
+        assert stats["samples_deleted"] == 1
+        assert count(storage, "sample") == 1
+
+    def test_default_policy_keeps_raw_ticks(self, storage):
+        insert_raw(storage, NOW_MS - 400 * DAY_MS)
+        stats = make_job(storage).run(now_ms=NOW_MS)
+        assert stats["samples_deleted"] == stats["chunks_deleted"] == 0
+        assert count(storage, "sample") == 1
+
+    def test_child_rows_cascade(self, storage):
+        insert_raw(storage, NOW_MS - 10 * DAY_MS)
+        make_job(storage, raw_days=7).run(now_ms=NOW_MS)
+        assert count(storage, "cpu_sample") == 0
+
+    def test_deletes_in_chunks(self, storage):
+        for i in range(7):
+            insert_raw(storage, NOW_MS - 10 * DAY_MS + i)
+        stats = make_job(storage, raw_days=7, chunk_size=2).run(now_ms=NOW_MS)
+        assert stats["samples_deleted"] == 7
+        assert count(storage, "sample") == 0
+
+    def test_rollups_survive_raw_expiry(self, storage):
+        insert_raw(storage, NOW_MS - 10 * DAY_MS, cpu_percent=42.0)
+        make_job(storage, raw_days=7, rollup_1m_days=None).run(now_ms=NOW_MS)
+        row = storage.conn.execute(
+            "SELECT max_value FROM metric_rollup WHERE metric = 'cpu_percent_total' AND resolution_ms = ?",
+            (RESOLUTIONS_MS["1m"],),
+        ).fetchone()
+        assert row[0] == pytest.approx(42.0)
+
+
+# -----------------------------
+# Rollup retention
+# -----------------------------
+class TestRollupRetention:
+
+    def test_old_minute_rollups_deleted_hourly_kept(self, storage):
+        insert_raw(storage, NOW_MS - 100 * DAY_MS)
+        make_job(storage, raw_days=7, rollup_1m_days=90).run(now_ms=NOW_MS)
+        resolutions = {
+            row[0] for row in storage.conn.execute("SELECT DISTINCT resolution_ms FROM metric_rollup")
+        }
+        assert RESOLUTIONS_MS["1m"] not in resolutions
+        assert RESOLUTIONS_MS["1h"] in resolutions
+
+
+# -----------------------------
+# Size cap and reporting
+# -----------------------------
+class TestSizeCapAndMetrics:
+
+    def test_size_cap_trims_oldest(self, storage):
+        for i in range(20):
+            insert_raw(storage, NOW_MS - i * 1000)
+        stats = make_job(storage, raw_days=None, max_db_mb=0).run(now_ms=NOW_MS)
+        assert stats["size_cap_samples_deleted"] == 20
+        assert count(storage, "sample") == 0
+
+    def test_size_cap_trims_archived_sessions_before_the_live_one(self, tmp_path):
+        old = StorageManager(db_path=str(tmp_path / "t.db"))
+        for i in range(4000):
+            insert_raw(old, NOW_MS - 2 * DAY_MS + i * 1000, cpu_percent=(i * 7919 % 10007) / 100.0)
+        old.close()
+        s = StorageManager(db_path=str(tmp_path / "t.db"))
+        try:
+            SessionArchiver.archive_session(s.conn, old.session_id, chunk_ticks=1000)
+            for i in range(50):
+                insert_raw(s, NOW_MS - 50_000 + i * 1000)
+            first_chunk = s.conn.execute("SELECT MIN(chunk_start_unix_ms) FROM sample_chunk").fetchone()[0]
+            cap_mb = (RetentionManager.db_size_bytes(s.conn) - 1) / (1024 * 1024)
+            stats = make_job(s, raw_days=None, max_db_mb=cap_mb).run(now_ms=NOW_MS)
+            assert stats["size_cap_samples_deleted"] == 0 and count(s, "sample") == 50
+            assert 1 <= stats["chunks_deleted"] < 4
+            assert s.conn.execute("SELECT MIN(chunk_start_unix_ms) FROM sample_chunk").fetchone()[0] > first_chunk
+            # A cap the archives alone exceed: every chunk goes, then the raw ticks
+            stats = make_job(s, raw_days=None, max_db_mb=0).run(now_ms=NOW_MS)
+            assert count(s, "sample_chunk") == count(s, "sample") == 0
+        finally:
+            s.close()
+
+    def test_metrics_published(self, storage):
+        METRICS.reset()
+        insert_raw(storage, NOW_MS - 10 * DAY_MS)
+        make_job(storage, raw_days=7).run(now_ms=NOW_MS)
+        snap = METRICS.snapshot()
+        assert snap["counters"]["retention.samples_deleted"] == 1
+        assert snap["timings"]["retention.run_ms"]["count"] == 1
+        assert "retention.db_size_bytes" in snap["gauges"]
+
+    def test_old_file_is_not_vacuumed_by_the_job(self, tmp_path):
+        conn = sqlite3.connect(tmp_path / "old.db")
+        conn.execute("PRAGMA auto_vacuum = NONE")
+        init_db(tmp_path / "old.db", conn=conn)
+        conn.close()
+        s = StorageManager(db_path=tmp_path / "old.db")
+        try:
+            insert_raw(s, NOW_MS - 10 * DAY_MS)
+            statements = []
+            s.conn.set_trace_callback(statements.append)
+            stats = make_job(s, raw_days=7).run(now_ms=NOW_MS)
+            s.conn.set_trace_callback(None)
+            assert stats["samples_deleted"] == 1 and stats["pages_vacuumed"] == 0
+            assert not any(sql.strip().upper() == "VACUUM" for sql in statements)
+            assert s.conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 0
+        finally:
+            s.close()
+
+        assert RetentionManager.enable_incremental_vacuum(tmp_path / "old.db")
+        assert not RetentionManager.enable_incremental_vacuum(tmp_path / "old.db")
+        conn = sqlite3.connect(tmp_path / "old.db")
+        assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+        conn.close()
+
+    def test_new_database_uses_incremental_auto_vacuum(self, tmp_path):
+        s = StorageManager(db_path=tmp_path / "telemetry.db")
+        try:
+            assert s.conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+        finally:
+            s.close()
@@ -0,0 +1,183 @@
+# storage_service/tests/test_rollups.py
+# Author: Andrew Fox
+# Run with: python -m pytest storage_service/tests/test_rollups.py -v
+
+import threading
+
+import pytest
+from storage_service.storage.main import StorageManager
+from storage_service.storage.rollups import RollupManager, RESOLUTIONS_MS
+from storage_service.storage.schema import connect
+
+
+# -----------------------------
+# Shared sample data
+# -----------------------------
+CPU_DATA = {"cpu_percent_total": 25.0, "freq_current_mhz": 2800.0}
+
+RAM_DATA = {"used_ram_gb": 8.0, "ram_usage_percent": 50.0, "swap_usage_percent": 5.0}
+
+DISK_DATA = {
+    "read_speed_bytes": 0.0,
+    "write_speed_bytes": 0.0,
+    "avg_read_latency_ms": 1.0,
+    "avg_write_latency_ms": 1.0,
+    "disks": [
+        {"device": "C:\\", "mountpoint": "C:\\", "fstype": "NTFS",
+         "total_gb": 500.0, "used_gb": 200.0, "usage_percent": 40.0},
+        {"device": "D:\\", "mountpoint": "D:\\", "fstype": "NTFS",
+         "total_gb": 1000.0, "used_gb": 900.0, "usage_percent": 90.0},
+    ],
+}
+
+
+@pytest.fixture
+def storage():
+    """Fresh in-memory StorageManager for each test."""
+    s = StorageManager(db_path=":memory:")
+    yield s
+    s.close()
+
+
+def insert_raw(storage, ts_unix_ms, cpu_percent):
+    """Insert a raw tick directly, bypassing the rollup write path."""
+    cur = storage.conn.execute(
+        "INSERT INTO sample (session_id, ts_iso, ts_unix_ms) VALUES (?, '', ?)",
+        (storage.session_id, ts_unix_ms),
+    )
+    storage.conn.execute(
+        "INSERT INTO cpu_sample (sample_id, cpu_percent_total) VALUES (?, ?)",
+        (cur.lastrowid, cpu_percent),
+    )
+    storage.conn.commit()
+
+
+# -----------------------------
+# Incremental maintenance
+# -----------------------------
+class TestIncrementalRollups:
+
+    def test_every_resolution_is_written(self, storage):
+        storage.insert_sample(CPU_DATA, RAM_DATA, None, DISK_DATA)
+        resolutions = {
+            row[0] for row in storage.conn.execute(
+                "SELECT DISTINCT resolution_ms FROM metric_rollup WHERE metric = 'cpu_percent_total'"
+            )
+        }
+        assert resolutions == set(RESOLUTIONS_MS.values())
+
+    def test_counts_accumulate(self, storage):
+        for _ in range(3):
+            storage.insert_sample(CPU_DATA, RAM_DATA, None, DISK_DATA)
+        row = storage.conn.execute(
+            """SELECT SUM(sample_count), SUM(sum_value) FROM metric_rollup
+               WHERE metric = 'cpu_percent_total' AND resolution_ms = ?""",
+            (RESOLUTIONS_MS["1d"],),
+        ).fetchone()
+        assert row[0] == 3
+        assert row[1] == pytest.approx(75.0)
+
+    def test_disk_usage_uses_fullest_partition(self, storage):
+        storage.insert_sample(CPU_DATA, RAM_DATA, None, DISK_DATA)
+        row = storage.conn.execute(
+            "SELECT max_value FROM metric_rollup WHERE metric = 'disk_usage_percent' LIMIT 1"
+        ).fetchone()
+        assert row[0] == pytest.approx(90.0)
+
+    def test_watermark_tracks_last_sample(self, storage):
+        storage.insert_sample(CPU_DATA, RAM_DATA, None, DISK_DATA)
+        storage.insert_sample(CPU_DATA, RAM_DATA, None, DISK_DATA)
+        last_id = storage.conn.execute("SELECT MAX(sample_id) FROM sample").fetchone()[0]
+        assert RollupManager.get_watermark(storage.conn) == last_id
+
+
+# -----------------------------
+# Catch-up job
+# -----------------------------
+class TestCatchUp:
+
+    def test_catch_up_rolls_up_raw_rows(self, storage):
+        base = 1_700_000_000_000 - 1_700_000_000_000 % RESOLUTIONS_MS["1h"]
+        for i, value in enumerate([10.0, 20.0, 30.0]):
+            insert_raw(storage, base + i * 1000, value)
+        assert RollupManager.catch_up(storage.conn) == 3
+
+        points = RollupManager.query(storage.conn, "cpu_percent_total", base, base + 60_000,
+                                     resolution_ms=RESOLUTIONS_MS["1m"])
+        assert len(points) == 1
+        assert points[0]["count"] == 3
+        assert points[0]["min"] == pytest.approx(10.0)
+        assert points[0]["max"] == pytest.approx(30.0)
+        assert points[0]["mean"] == pytest.approx(20.0)
+
+    def test_catch_up_splits_minute_buckets(self, storage):
+        base = 1_700_000_000_000 - 1_700_000_000_000 % RESOLUTIONS_MS["1h"]
+        insert_raw(storage, base, 10.0)
+        insert_raw(storage, base + 60_000, 20.0)
+        RollupManager.catch_up(storage.conn, batch_size=1)
+
+        minutes = RollupManager.query(storage.conn, "cpu_percent_total", base, base + 120_000,
+                                      resolution_ms=RESOLUTIONS_MS["1m"])
+        hours = RollupManager.query(storage.conn, "cpu_percent_total", base, base + 120_000,
+                                    resolution_ms=RESOLUTIONS_MS["1h"])
+        assert [p["count"] for p in minutes] == [1, 1]
+        assert hours[0]["count"] == 2
+        assert hours[0]["std"] == pytest.approx(5.0)
+
+    def test_catch_up_is_idempotent(self, storage):
+        insert_raw(storage, 1_700_000_000_000, 10.0)
+        RollupManager.catch_up(storage.conn)
+        assert RollupManager.catch_up(storage.conn) == 0
+
+    def test_live_tick_during_catch_up_counted_once(self, tmp_path, monkeypatch):
+        # Retention and the archiver catch up on their own connections while the writer
+        # ticks; a tick committed right after catch_up reads the watermark must not be
+        # rolled up again
+        s = StorageManager(db_path=str(tmp_path / "t.db"))
+        insert_raw(s, 1_700_000_000_000, 10.0)
+        reading, ticked = threading.Event(), threading.Event()
+        get_watermark = RollupManager.get_watermark
+
+        def slow_get_watermark(conn):
+            if not reading.is_set():
+                reading.set()
+                ticked.wait(0.5)      # the writer can't commit while catch_up holds the lock
+            return get_watermark(conn)
+
+        def catch_up():
+            conn = connect(tmp_path / "t.db")
+            RollupManager.catch_up(conn)
+            conn.close()
+
+        monkeypatch.setattr(RollupManager, "get_watermark", staticmethod(slow_get_watermark))
+        job = threading.Thread(target=catch_up)
+        job.start()
+        assert reading.wait(5)
+        s.insert_sample(CPU_DATA, RAM_DATA, None, DISK_DATA)
+        ticked.set()
+        job.join()
+        counted = s.conn.execute(
+            "SELECT SUM(sample_count) FROM metric_rollup WHERE metric = 'cpu_percent_total' AND resolution_ms = ?",
+            (RESOLUTIONS_MS["1m"],),
+        ).fetchone()[0]
+        assert counted == s.conn.execute("SELECT COUNT(*) FROM sample").fetchone()[0] == 2
+        s.close()
+
+
+# -----------------------------
+# Query API
+# -----------------------------
+class TestRollupQuery:
+
+    def test_choose_resolution_short_range_uses_minutes(self):
+        assert RollupManager.choose_resolution(0, 3_600_000, 500) == RESOLUTIONS_MS["1m"]
+
+    def test_choose_resolution_month_uses_hours(self):
+        assert RollupManager.choose_resolution(0, 30 * 86_400_000, 1000) == RESOLUTIONS_MS["1h"]
+
+    def test_choose_resolution_year_uses_days(self):
+        assert RollupManager.choose_resolution(0, 365 * 86_400_000, 500) == RESOLUTIONS_MS["1d"]
+
+    def test_unknown_metric_raises(self, storage):
+        with pytest.raises(ValueError):
+            storage.get_rollups("not_a_metric", 0, 1)
@@ -0,0 +1,211 @@
+# storage_service/tests/test_session_summary.py
+# Author: Andrew Fox
+# Run with: python -m pytest storage_service/tests/test_session_summary.py -v
+
+import csv
+
+import pytest
+from storage_service.storage.export import export_csv
+from storage_service.storage.main import StorageManager
+from storage_service.storage.schema import init_db
+from storage_service.storage.session_summary import SessionSummary, SUMMARY_COLUMNS, SUMMARY_METRICS
+
+
+# -----------------------------
+# Shared sample data
+# -----------------------------
+CPU_DATA = {"cpu_percent_total": 25.0, "freq_current_mhz": 2800.0}
+
+RAM_DATA = {"used_ram_gb": 8.0, "ram_usage_percent": 50.0, "swap_usage_percent": 5.0}
+
+DISK_DATA = {
+    "read_speed_bytes": 1000.0,
+    "write_speed_bytes": 500.0,
+    "avg_read_latency_ms": 1.0,
+    "avg_write_latency_ms": 2.0,
+    "disks": [
+        {"device": "C:\\", "mountpoint": "C:\\", "fstype": "NTFS",
+         "total_gb": 500.0, "used_gb": 200.0, "usage_percent": 40.0},
+    ],
+}
+
+GPU_DATA = {"gpus": [{"gpu_id": 0, "gpu_util_percent": 60.0, "gpu_mem_util_percent": 10.0,
+                      "gpu_mem_used_mb": 1024, "gpu_temp_c": 70.0, "gpu_core_clock_mhz": 1500.0,
+                      "gpu_power_usage_w": 100.0, "gpu_power_limit_w": 250.0}]}
+
+CPU_VALUES = [10.0, 30.0, 20.0, 40.0]
+
+
+def write_session(db_path):
+    """StorageManager with one GPU and len(CPU_VALUES) ticks; the GPU only reports every other tick."""
+    s = StorageManager(db_path=str(db_path))
+    s.conn.execute("INSERT OR IGNORE INTO gpu_device (gpu_uuid, host_uuid, first_seen_iso) VALUES ('GPU-0', ?, '')",
+                   (s.host_uuid,))
+    s.conn.commit()
+    s.gpu_uuid_map[0] = "GPU-0"
+    for i, cpu in enumerate(CPU_VALUES):
+        gpu = GPU_DATA if i % 2 == 0 else None
+        s.insert_sample({**CPU_DATA, "cpu_percent_total": cpu}, RAM_DATA, gpu, DISK_DATA)
+    return s
+
+
+@pytest.fixture
+def storage(tmp_path):
+    s = write_session(tmp_path / "t.db")
+    yield s
+    s.close()
+
+
+def raw_bounds(conn, session_id):
+    return conn.execute(
+        """SELECT COUNT(*), MIN(sample_id), MAX(sample_id), MIN(ts_unix_ms), MAX(ts_unix_ms)
+           FROM sample WHERE session_id = ?""",
+        (session_id,),
+    ).fetchone()
+
+
+# -----------------------------
+# Incremental maintenance
+# -----------------------------
+class TestIncremental:
+
+    def test_counts_and_bounds_match_raw_rows(self, storage):
+        summary = storage.get_session_summary()
+        count, first_id, last_id, first_ts, last_ts = raw_bounds(storage.conn, storage.session_id)
+        assert summary["sample_count"] == count == len(CPU_VALUES)
+        assert (summary["first_sample_id"], summary["last_sample_id"]) == (first_id, last_id)
+        assert (summary["first_ts_unix_ms"], summary["last_ts_unix_ms"]) == (first_ts, last_ts)
+
+    def test_min_max_mean(self, storage):
+        summary = storage.get_session_summary()
+        assert summary["cpu_percent_total_min"] == pytest.approx(10.0)
+        assert summary["cpu_percent_total_max"] == pytest.approx(40.0)
+        assert summary["cpu_percent_total_mean"] == pytest.approx(25.0)
+        assert summary["disk_usage_percent_mean"] == pytest.approx(40.0)
+
+    def test_missing_values_do_not_blank_aggregates(self, storage):
+        summary = storage.get_session_summary()
+        assert summary["gpu_util_percent_count"] == 2
+        assert summary["gpu_util_percent_min"] == pytest.approx(60.0)
+        assert summary["gpu_temp_c_mean"] == pytest.approx(70.0)
+
+    def test_metric_never_seen_has_no_mean(self):
+        s = StorageManager(db_path=":memory:")
+        s.insert_sample(CPU_DATA, RAM_DATA, None, DISK_DATA)
+        summary = s.get_session_summary()
+        assert summary["gpu_util_percent_min"] is None
+        assert summary["gpu_util_percent_mean"] is None
+        s.close()
+
+    def test_empty_session_has_no_summary(self):
+        s = StorageManager(db_path=":memory:")
+        assert s.get_session_summary() is None
+        s.close()
+
+    def test_rolled_back_tick_is_not_counted(self, storage, monkeypatch):
+        original = SessionSummary.apply_tick
+
+        def apply_then_fail(*args):
+            original(*args)
+            raise RuntimeError("disk full")
+
+        monkeypatch.setattr(SessionSummary, "apply_tick", apply_then_fail)
+        with pytest.raises(RuntimeError):
+            storage.insert_sample(CPU_DATA, RAM_DATA, None, DISK_DATA)
+        assert storage.get_session_summary()["sample_count"] == len(CPU_VALUES)
+
+
+# -----------------------------
+# Rebuild / catch-up
+# -----------------------------
+class TestRebuild:
+
+    def test_rebuild_matches_incremental(self, storage):
+        incremental = storage.get_session_summary()
+        SessionSummary.rebuild(storage.conn, storage.session_id)
+        storage.conn.commit()
+        rebuilt = storage.get_session_summary()
+        for key, value in incremental.items():
+            assert rebuilt[key] == pytest.approx(value), key
+
+    def test_catch_up_fills_missing_sessions(self, tmp_path):
+        storage = write_session(tmp_path / "t.db")
+        session_id = storage.session_id
+        expected = storage.get_session_summary()
+        storage.close()
+
+        conn = init_db(tmp_path / "t.db")
+        conn.execute("DELETE FROM session_summary")
+        conn.commit()
+        assert SessionSummary.catch_up(conn) == 1
+        assert SessionSummary.catch_up(conn) == 0
+        rebuilt = SessionSummary.get(conn, session_id)
+        conn.close()
+        for m in SUMMARY_METRICS:
+            assert rebuilt[f"{m}_count"] == expected[f"{m}_count"]
+            assert rebuilt[f"{m}_sum"] == pytest.approx(expected[f"{m}_sum"])
+
+    def test_storage_manager_catches_up_on_open(self, tmp_path):
+        storage = write_session(tmp_path / "t.db")
+        session_id = storage.session_id
+        storage.conn.execute("DELETE FROM session_summary")
+        storage.close()
+
+        reopened = StorageManager(db_path=str(tmp_path / "t.db"))
+        assert reopened.backfill.wait(10)
+        assert reopened.get_session_summary(session_id)["sample_count"] == len(CPU_VALUES)
+        reopened.close()
+
+    def test_merge_combines_partial_rows(self, storage):
+        # Two shard files' worth of the same session
+        full = storage.get_session_summary()
+        storage.conn.execute("DELETE FROM session_summary")
+        storage.conn.execute("DELETE FROM sample WHERE sample_id > ?", (full["first_sample_id"] + 1,))
+        SessionSummary.rebuild(storage.conn, storage.session_id)
+        first_half = storage.conn.execute(f"SELECT {', '.join(SUMMARY_COLUMNS)} FROM session_summary").fetchone()
+        storage.conn.rollback()
+
+        storage.conn.execute("DELETE FROM session_summary")
+        storage.conn.execute("DELETE FROM sample WHERE sample_id <= ?", (full["first_sample_id"] + 1,))
+        SessionSummary.rebuild(storage.conn, storage.session_id)
+        second_half = storage.conn.execute(f"SELECT {', '.join(SUMMARY_COLUMNS)} FROM session_summary").fetchone()
+        storage.conn.rollback()
+
+        merged = SessionSummary.merge([first_half, second_half])
+        for key, value in full.items():
+            assert merged[key] == pytest.approx(value), key
+
+
+# -----------------------------
+# Session close + readers
+# -----------------------------
+class TestFinalise:
+
+    def test_close_finalises_row(self, tmp_path):
+        storage = write_session(tmp_path / "t.db")
+        session_id = storage.session_id
+        assert storage.get_session_summary()["finalised_at_unix_ms"] is None
+        storage.close()
+
+        conn = init_db(tmp_path / "t.db")
+        summary = SessionSummary.get(conn, session_id)
+        ended = conn.execute("SELECT ended_at_unix_ms FROM session WHERE session_id = ?",
+                             (session_id,)).fetchone()[0]
+        conn.close()
+        assert summary["finalised_at_unix_ms"] == ended
+
+    def test_summary_outlives_raw_rows(self, storage):
+        storage.conn.execute("DELETE FROM sample WHERE session_id = ?", (storage.session_id,))
+        storage.conn.commit()
+        assert storage.get_session_summary()["sample_count"] == len(CPU_VALUES)
+
+    def test_export_sessions_section_reads_summary(self, storage, tmp_path):
+        out = tmp_path / "out.csv"
+        export_csv(storage.conn, out)
+        with open(out, newline="", encoding="utf-8") as f:
+            rows = list(csv.reader(f))
+        session_row = rows[rows.index(["--- Sessions ---"]) + 2]
+        summary = storage.get_session_summary()
+        assert session_row[3] == str(summary["first_sample_id"])
+        assert session_row[4] == str(summary["last_sample_id"])
+        assert session_row[5] == str(len(CPU_VALUES))
@@ -0,0 +1,283 @@
+# storage_service/tests/test_sharding.py
+# Author: Andrew Fox
+# Run with: python -m pytest storage_service/tests/test_sharding.py -v
+
+import datetime
+import sqlite3
+
+import numpy as np
+import pytest
+import storage_service.storage.main as storage_main
+from storage_service.storage.episodes import IssueEpisodes
+from storage_service.storage.export import export_columnar, export_csv, main as export_main, shard_connections
+from storage_service.storage.main import StorageManager
+from storage_service.storage.sharding import ShardCatalog, DAY_MS
+
+
+# -----------------------------
+# Shared sample data
+# -----------------------------
+CPU_DATA = {"cpu_percent_total": 25.0, "freq_current_mhz": 2800.0}
+
+RAM_DATA = {"used_ram_gb": 8.0, "ram_usage_percent": 50.0, "swap_usage_percent": 5.0}
+
+DISK_DATA = {
+    "read_speed_bytes": 0.0,
+    "write_speed_bytes": 0.0,
+    "avg_read_latency_ms": 1.0,
+    "avg_write_latency_ms": 1.0,
+    "disks": [
+        {"device": "C:\\", "mountpoint": "C:\\", "fstype": "NTFS",
+         "total_gb": 500.0, "used_gb": 200.0, "usage_percent": 40.0},
+    ],
+}
+
+DAY_1 = datetime.datetime(2026, 3, 2, 23, 59, 0, tzinfo=datetime.timezone.utc)
+DAY_2 = datetime.datetime(2026, 3, 3, 0, 1, 0, tzinfo=datetime.timezone.utc)
+
+
+class FakeDatetime(datetime.datetime):
+    """Stands in for datetime.datetime so ticks can cross a shard boundary."""
+    current = DAY_1
+
+    @classmethod
+    def now(cls, tz=None):
+        return cls.current
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    FakeDatetime.current = DAY_1
+    monkeypatch.setattr(storage_main.datetime, "datetime", FakeDatetime)
+    return FakeDatetime
+
+
+@pytest.fixture
+def shards(tmp_path):
+    return ShardCatalog(tmp_path / "shards", period="day")
+
+
+def ms(dt):
+    return int(dt.timestamp() * 1000)
+
+
+# -----------------------------
+# Layout
+# -----------------------------
+class TestShardLayout:
+
+    def test_day_bounds(self, shards):
+        start, end = shards.bounds(ms(DAY_1))
+        assert end - start == DAY_MS
+        assert start == ms(DAY_1.replace(hour=0, minute=0))
+
+    def test_week_starts_on_monday(self, tmp_path):
+        weekly = ShardCatalog(tmp_path / "weekly", period="week")
+        start, _ = weekly.bounds(ms(DAY_2))
+        assert datetime.datetime.fromtimestamp(start / 1000, tz=datetime.timezone.utc).weekday() == 0
+
+    def test_unknown_period_raises(self, tmp_path):
+        with pytest.raises(ValueError):
+            ShardCatalog(tmp_path / "x", period="month")
+
+
+# -----------------------------
+# Writer
+# -----------------------------
+class TestShardedWriter:
+
+    def test_rotation_creates_second_shard(self, shards, clock):
+        storage = StorageManager(shards=shards)
+        storage.insert_sample(CPU_DATA, RAM_DATA, None, DISK_DATA)
+        clock.current = DAY_2
+        storage.insert_sample(CPU_DATA, RAM_DATA, None, DISK_DATA)
+        storage.close()
+        assert len(shards.list_shards()) == 2
+
+    def test_sample_ids_unique_across_shards(self, shards, clock):
+        storage = StorageManager(shards=shards)
+        storage.insert_sample(CPU_DATA, RAM_DATA, None, DISK_DATA)
+        storage.insert_sample(CPU_DATA, RAM_DATA, None, DISK_DATA)
+        clock.current = DAY_2
+        storage.insert_sample(CPU_DATA, RAM_DATA, None, DISK_DATA)
+        storage.close()
+
+        rows = shards.scan_range("SELECT sample_id FROM sample", (), 0, ms(DAY_2) + DAY_MS)
+        ids = [r["sample_id"] for r in rows]
+        assert ids == [1, 2, 3]
+
+    def test_session_and_partitions_carried_over(self, shards, clock):
+        storage = StorageManager(shards=shards)
+        storage.insert_sample(CPU_DATA, RAM_DATA, None, DISK_DATA)
+        first_partition = dict(storage.partition_id_map)
+        clock.current = DAY_2
+        storage.insert_sample(CPU_DATA, RAM_DATA, None, DISK_DATA)
+        row = storage.conn.execute("SELECT COUNT(*) FROM session WHERE session_id = ?",
+                                   (storage.session_id,)).fetchone()
+        assert row[0] == 1
+        assert storage.partition_id_map == first_partition
+        storage.close()
+
+    def test_session_ids_unique_across_restarts(self, shards, clock):
+        a = StorageManager(shards=shards)
+        a.close()
+        b = StorageManager(shards=shards)
+        b.close()
+        assert b.session_id == a.session_id + 1
+
+
+# -----------------------------
+# Retention and federated reads
+# -----------------------------
+class TestShardRetentionAndReads:
+
+    def _two_days(self, shards, clock):
+        storage = StorageManager(shards=shards)
+        storage.insert_sample(CPU_DATA, RAM_DATA, None, DISK_DATA)
+        clock.current = DAY_2
+        storage.insert_sample(CPU_DATA, RAM_DATA, None, DISK_DATA)
+        storage.close()
+
+    def test_drop_before_removes_file(self, shards, clock):
+        self._two_days(shards, clock)
+        old_path = shards.list_shards()[0][2]
+        assert shards.drop_before(ms(DAY_2)) == 1
+        assert not old_path.exists()
+        assert len(shards.list_shards()) == 1
+
+    def test_drop_before_keeps_rollups_in_catalog(self, shards, clock):
+        self._two_days(shards, clock)
+        shards.drop_before(ms(DAY_2))
+        conn = sqlite3.connect(shards.catalog_path)
+        n = conn.execute("SELECT COUNT(*) FROM metric_rollup").fetchone()[0]
+        conn.close()
+        assert n > 0
+
+    def test_drop_before_keeps_sketches_summaries_and_episodes(self, shards, clock):
+        self._two_days(shards, clock)
+        old_path = shards.list_shards()[0][2]
+        conn = sqlite3.connect(old_path)
+        IssueEpisodes.record(conn, "host", 1, ms(DAY_1), {"disk_full": 0.9})
+        session_id, sketches = conn.execute(
+            "SELECT (SELECT session_id FROM session), (SELECT COUNT(*) FROM metric_sketch)"
+        ).fetchone()
+        conn.close()
+        shards.drop_before(ms(DAY_2))
+        shards.drop_before(ms(DAY_2))      # nothing left to merge twice
+
+        catalog = sqlite3.connect(shards.catalog_path)
+        assert catalog.execute("SELECT COUNT(*) FROM metric_sketch").fetchone()[0] == sketches > 0
+        assert catalog.execute("SELECT session_id, sample_count FROM session_summary").fetchall() == [(session_id, 1)]
+        assert [e["label"] for e in IssueEpisodes.query(catalog)] == ["disk_full"]
+        catalog.close()
+
+    def test_drop_before_sums_summaries_of_a_session(self, shards, clock):
+        storage = StorageManager(shards=shards)
+        for dt in (DAY_1, DAY_2, DAY_2 + datetime.timedelta(days=1)):
+            clock.current = dt
+            storage.insert_sample(CPU_DATA, RAM_DATA, None, DISK_DATA)
+        storage.close()
+        shards.drop_before(ms(DAY_2) + DAY_MS)
+        catalog = sqlite3.connect(shards.catalog_path)
+        assert catalog.execute("SELECT sample_count, first_sample_id, last_sample_id FROM session_summary"
+                               ).fetchall() == [(2, 1, 2)]
+        catalog.close()
+
+    def test_scan_range_prunes_shards(self, shards, clock):
+        self._two_days(shards, clock)
+        start, end = shards.bounds(ms(DAY_2))
+        rows = shards.scan_range("SELECT sample_id FROM sample", (), start, end)
+        assert len(rows) == 1
+
+    def test_attach_range_union_view(self, shards, clock):
+        self._two_days(shards, clock)
+        conn = sqlite3.connect(":memory:")
+        names = shards.attach_range(conn, 0, ms(DAY_2) + DAY_MS)
+        assert conn.execute("SELECT COUNT(*) FROM all_sample").fetchone()[0] == 2
+        shards.detach_range(conn, names)
+        conn.close()
+
+    def test_range_pages_cross_shards(self, shards, clock):
+        storage = StorageManager(shards=shards)
+        for dt in (DAY_1, DAY_1 + datetime.timedelta(seconds=1), DAY_2, DAY_2 + datetime.timedelta(seconds=1)):
+            clock.current = dt
+            storage.insert_sample(CPU_DATA, RAM_DATA, None, DISK_DATA)
+        try:
+            rows, cursor = storage.get_range_page(0, ms(DAY_2) + DAY_MS, page_size=3)
+            assert len(rows) == 3 and cursor is not None
+            rest, cursor = storage.get_range_page(0, ms(DAY_2) + DAY_MS, cursor, page_size=3)
+            assert cursor is None
+            assert [r["sample_id"] for r in rows + rest] == [1, 2, 3, 4]
+        finally:
+            storage.close()
+
+    def test_export_reads_every_shard(self, shards, clock, tmp_path):
+        storage = StorageManager(shards=shards)
+        for dt in (DAY_1, DAY_2, DAY_2 + datetime.timedelta(seconds=1)):
+            clock.current = dt
+            storage.insert_sample(CPU_DATA, RAM_DATA, None, DISK_DATA)
+        storage.close()
+        conns = shard_connections(shards)
+        try:
+            assert export_csv(conns, tmp_path / "out.csv") == 3
+            lines = (tmp_path / "out.csv").read_text(encoding="utf-8").splitlines()
+            # The session ran across both shards: one row, counts summed
+            assert [line.split(",")[5] for line in lines if line.startswith(f"{storage.session_id},")] == ["3"]
+            assert export_columnar(conns, tmp_path / "cols", fmt="npz", rows_per_file=2) == 3
+            # Part numbers carry on across shards: part-00000 (day 1), part-00001 (day 2)
+            parts = sorted((tmp_path / "cols").rglob("part-*.npz"))
+            assert [np.load(p)["sample_id"].tolist() for p in parts] == [[1], [2, 3]]
+            assert len(shard_connections(shards, ms(DAY_2))) == 1
+        finally:
+            for conn in conns:
+                conn.close()
+        export_main(["--shards", str(shards.root_dir), "--out", str(tmp_path / "cli.csv")])
+        assert (tmp_path / "cli.csv").read_text(encoding="utf-8") != ""
+
+    def test_session_summary_merges_shards(self, shards, clock):
+        storage = StorageManager(shards=shards)
+        for cpu, dt in ((10.0, DAY_1), (20.0, DAY_2), (60.0, DAY_2 + datetime.timedelta(seconds=1))):
+            clock.current = dt
+            storage.insert_sample({**CPU_DATA, "cpu_percent_total": cpu}, RAM_DATA, None, DISK_DATA)
+        try:
+            summary = storage.get_session_summary()
+            assert summary["sample_count"] == 3
+            assert (summary["first_sample_id"], summary["last_sample_id"]) == (1, 3)
+            assert summary["cpu_percent_total_max"] == pytest.approx(60.0)
+            assert summary["cpu_percent_total_mean"] == pytest.approx(30.0)
+            shards.drop_before(ms(DAY_2))
+            assert storage.get_session_summary()["sample_count"] == 3
+        finally:
+            storage.close()
+
+    def test_session_and_recent_reads_cross_shards(self, shards, clock):
+        storage = StorageManager(shards=shards)
+        for dt in (DAY_1, DAY_1 + datetime.timedelta(seconds=1), DAY_2):
+            clock.current = dt
+            storage.insert_sample(CPU_DATA, RAM_DATA, None, DISK_DATA)
+        try:
+            assert [s["sample_id"] for s in storage.get_recent_samples(10)] == [3, 2, 1]
+            assert [s["sample_id"] for s in storage.get_recent_samples(2)] == [3, 2]
+            recent = storage.get_recent_samples_all_sessions(10, devices=True)
+            assert [(s["sample_id"], len(s["partitions"])) for s in recent] == [(3, 1), (2, 1), (1, 1)]
+            assert storage.get_session_columns()["sample_id"].tolist() == [1, 2, 3]
+            assert storage.get_range_columns(ms(DAY_1) + 500, ms(DAY_2) + 1)["sample_id"].tolist() == [2, 3]
+        finally:
+            storage.close()
+
+    def test_rollups_and_percentiles_cross_shards_and_catalog(self, shards, clock):
+        storage = StorageManager(shards=shards)
+        for cpu, dt in ((10.0, DAY_1), (20.0, DAY_2), (60.0, DAY_2 + datetime.timedelta(seconds=1))):
+            clock.current = dt
+            storage.insert_sample({**CPU_DATA, "cpu_percent_total": cpu}, RAM_DATA, None, DISK_DATA)
+        start, end = ms(DAY_1) - 3_600_000, ms(DAY_2) + 3_600_000
+        try:
+            for host in (None, storage.host_uuid):
+                points = storage.get_rollups("cpu_percent_total", start, end, host_uuid=host)
+                assert [(p["count"], p["min"], p["max"]) for p in points] == [(1, 10.0, 10.0), (2, 20.0, 60.0)]
+                stats = storage.get_percentiles("cpu_percent_total", start, end, host_uuid=host)
+                assert stats["count"] == 3 and stats["min"] == pytest.approx(10.0)
+                # Second pass reads day 1 from the catalog
+                shards.drop_before(ms(DAY_2))
+        finally:
+            storage.close()
@@ -0,0 +1,233 @@
+# storage_service/tests/test_sketches.py
+# Author: Andrew Fox
+# Run with: python -m pytest storage_service/tests/test_sketches.py -v
+
+import datetime
+import sqlite3
+
+import numpy as np
+import pytest
+from storage_service.storage.main import StorageManager
+from storage_service.storage.retention import RetentionManager
+from storage_service.storage.rollups import RESOLUTIONS_MS
+from storage_service.storage.sketches import (
+    RELATIVE_ACCURACY, DDSketch, SketchManager, SketchWriter,
+)
+
+
+# -----------------------------
+# Shared sample data
+# -----------------------------
+CPU_DATA = {"cpu_percent_total": 25.0, "freq_current_mhz": 2800.0}
+
+RAM_DATA = {"used_ram_gb": 8.0, "ram_usage_percent": 50.0, "swap_usage_percent": 5.0}
+
+DISK_DATA = {
+    "read_speed_bytes": 1000.0,
+    "write_speed_bytes": 500.0,
+    "avg_read_latency_ms": 1.0,
+    "avg_write_latency_ms": 2.0,
+    "disks": [
+        {"device": "C:\\", "mountpoint": "C:\\", "fstype": "NTFS",
+         "total_gb": 500.0, "used_gb": 200.0, "usage_percent": 40.0},
+    ],
+}
+
+START_MS = 1_780_000_000_000 - 1_780_000_000_000 % 3_600_000   # on the hour
+QUANTILES = (0.0, 0.25, 0.5, 0.9, 0.99, 1.0)
+
+
+def insert_ticks(storage, latencies, start_ms=START_MS, step_ms=1000):
+    """One tick per latency value, step_ms apart."""
+    for i, latency in enumerate(latencies):
+        ts_ms = start_ms + i * step_ms
+        storage.insert_sample(CPU_DATA, RAM_DATA, None, {**DISK_DATA, "avg_write_latency_ms": float(latency)},
+                              collected_at=datetime.datetime.fromtimestamp(ts_ms / 1000))
+
+
+def assert_within_accuracy(result, values):
+    for q, estimate in result.items():
+        exact = np.quantile(values, q, method="lower")
+        assert abs(estimate - exact) <= RELATIVE_ACCURACY * abs(exact) + 1e-12, q
+
+
+def stored_sketches(conn):
+    return {
+        tuple(row[:4]): (row[4], row[5], row[6], DDSketch.from_blob(row[7], row[5], row[6]))
+        for row in conn.execute("SELECT * FROM metric_sketch")
+    }
+
+
+@pytest.fixture
+def storage():
+    s = StorageManager(db_path=":memory:")
+    yield s
+    s.close()
+
+
+# -----------------------------
+# DDSketch
+# -----------------------------
+class TestDDSketch:
+
+    @pytest.mark.parametrize("values", [
+        np.random.default_rng(0).lognormal(0.0, 2.0, 5000),
+        np.random.default_rng(1).normal(0.0, 50.0, 5000),           # negative values too
+        np.r_[np.zeros(300), np.random.default_rng(2).uniform(0, 100, 700)],
+    ], ids=["lognormal", "signed", "zeros"])
+    def test_quantiles_within_relative_accuracy(self, values):
+        sketch = DDSketch()
+        for v in values:
+            sketch.add(float(v))
+        assert sketch.count == len(values)
+        assert_within_accuracy({q: sketch.quantile(q) for q in QUANTILES}, values)
+
+    def test_merge_equals_sketch_of_union(self):
+        rng = np.random.default_rng(3)
+        a, b, union = DDSketch(), DDSketch(), DDSketch()
+        for v in rng.exponential(5.0, 1000):
+            a.add(v)
+            union.add(v)
+        for v in rng.exponential(50.0, 1000):
+            b.add(v)
+            union.add(v)
+        a.merge(b)
+        assert (a.bins, a.count, a.min, a.max) == (union.bins, union.count, union.min, union.max)
+
+    def test_blob_round_trip(self):
+        sketch = DDSketch()
+        for v in (-3.0, 0.0, 0.5, 2.0, 2.0, 1e9):
+            sketch.add(v)
+        back = DDSketch.from_blob(sketch.to_blob(), sketch.min, sketch.max)
+        assert (back.bins, back.neg_bins, back.zero_count, back.count) == \
+               (sketch.bins, sketch.neg_bins, sketch.zero_count, sketch.count)
+
+    def test_minute_blob_is_compact(self):
+        sketch = DDSketch()
+        for v in np.random.default_rng(4).normal(2.0, 0.2, 60):
+            sketch.add(v)
+        assert len(sketch.to_blob()) < 200
+
+    def test_empty_sketch(self):
+        assert DDSketch().quantile(0.5) is None
+        assert SketchManager.describe(DDSketch())["min"] is None
+
+
+# -----------------------------
+# Range decomposition
+# -----------------------------
+class TestPlan:
+
+    def test_covers_every_minute_once(self):
+        start, end = START_MS - 3 * 86_400_000 + 7 * 60_000 + 1234, START_MS + 5 * 3_600_000 + 13 * 60_000
+        covered = []
+        for res_ms, lo, hi in SketchManager.plan(start, end):
+            assert lo % res_ms == 0 and hi % res_ms == 0
+            covered.append((lo, hi))
+        covered.sort()
+        assert covered[0][0] == start - start % 60_000 and covered[-1][1] == end
+        assert all(a[1] == b[0] for a, b in zip(covered, covered[1:]))
+
+    def test_month_needs_few_sketches(self):
+        start = START_MS + 17 * 60_000 + 5
+        end = start + 30 * 86_400_000
+        buckets = sum((hi - lo) // res_ms for res_ms, lo, hi in SketchManager.plan(start, end))
+        assert buckets <= 30 + 2 * 23 + 2 * 59
+
+    def test_partial_minute_is_widened(self):
+        assert SketchManager.plan(START_MS + 10, START_MS + 20) == [(60_000, START_MS, START_MS + 60_000)]
+
+
+# -----------------------------
+# Live writer
+# -----------------------------
+class TestWriter:
+
+    def test_minute_written_when_next_one_starts(self, storage):
+        insert_ticks(storage, [1.0] * 60)
+        assert storage.conn.execute("SELECT COUNT(*) FROM metric_sketch").fetchone()[0] == 0
+        insert_ticks(storage, [2.0], start_ms=START_MS + 60_000)
+        counts = dict(storage.conn.execute(
+            "SELECT resolution_ms, sample_count FROM metric_sketch WHERE metric = 'avg_write_latency_ms'"
+        ))
+        assert counts == {res_ms: 60 for res_ms in RESOLUTIONS_MS.values()}
+        assert SketchManager.get_watermark(storage.conn) == storage.sketch_writer.last_sample_id - 1
+
+    def test_percentiles_include_current_minute(self, storage):
+        values = np.random.default_rng(5).lognormal(0.0, 1.0, 150)
+        insert_ticks(storage, values)
+        result = storage.get_percentiles("avg_write_latency_ms", START_MS, START_MS + 3_600_000, QUANTILES)
+        assert result["count"] == 150
+        assert result["relative_accuracy"] == RELATIVE_ACCURACY
+        assert_within_accuracy(result["quantiles"], values)
+
+    def test_rollback_discards_staged_tick(self, storage):
+        writer = SketchWriter(storage.host_uuid)
+        writer.apply_tick(storage.conn, 1, START_MS, {"avg_write_latency_ms": 1.0})
+        writer.rollback()
+        writer.commit()
+        assert writer.bucket is None and writer.sketches == {}
+
+    def test_close_writes_pending_minute(self, tmp_path):
+        s = StorageManager(db_path=str(tmp_path / "t.db"))
+        insert_ticks(s, [3.0] * 10)
+        s.close()
+        conn = sqlite3.connect(tmp_path / "t.db")
+        assert SketchManager.get_watermark(conn) == conn.execute("SELECT MAX(sample_id) FROM sample").fetchone()[0]
+        assert SketchManager.query(conn, "avg_write_latency_ms", START_MS, START_MS + 60_000)["count"] == 10
+        conn.close()
+
+    def test_host_filter(self, storage):
+        insert_ticks(storage, [1.0] * 5)
+        assert storage.get_percentiles("avg_write_latency_ms", START_MS, START_MS + 60_000,
+                                       host_uuid="other")["count"] == 0
+
+    def test_unknown_metric(self, storage):
+        with pytest.raises(ValueError):
+            storage.get_percentiles("nope", START_MS, START_MS + 60_000)
+
+
+# -----------------------------
+# Catch-up and expiry
+# -----------------------------
+class TestCatchUp:
+
+    def test_rebuild_matches_live_writer(self, tmp_path):
+        s = StorageManager(db_path=str(tmp_path / "t.db"))
+        insert_ticks(s, np.random.default_rng(6).gamma(2.0, 1.0, 400), step_ms=7000)
+        s.close()
+        conn = sqlite3.connect(tmp_path / "t.db")
+        live = stored_sketches(conn)
+        conn.execute("DELETE FROM metric_sketch")
+        conn.execute("DELETE FROM sketch_watermark")
+        conn.commit()
+        assert SketchManager.catch_up(conn, batch_size=150) == 400
+        rebuilt = stored_sketches(conn)
+        conn.close()
+        assert live.keys() == rebuilt.keys()
+        for key, (count, lo, hi, sketch) in live.items():
+            other = rebuilt[key]
+            assert (count, lo, hi) == other[:3], key
+            assert (sketch.bins, sketch.zero_count) == (other[3].bins, other[3].zero_count), key
+
+    def test_query_reads_every_level(self, storage):
+        values = np.random.default_rng(7).lognormal(1.0, 0.5, 300)
+        insert_ticks(storage, values, start_ms=START_MS - 86_400_000 - 30_000, step_ms=600_000)
+        storage.sketch_writer.flush(storage.conn)
+        storage.conn.commit()
+        result = SketchManager.query(storage.conn, "avg_write_latency_ms", START_MS - 2 * 86_400_000,
+                                     START_MS + 3 * 86_400_000, QUANTILES)
+        assert result["count"] == 300
+        assert_within_accuracy(result["quantiles"], values)
+
+    def test_retention_expires_minute_sketches(self, storage):
+        insert_ticks(storage, [1.0] * 3, start_ms=0, step_ms=60_000)
+        storage.sketch_writer.flush(storage.conn)
+        storage.conn.commit()
+        minute_rows = storage.conn.execute(
+            "SELECT COUNT(*) FROM metric_sketch WHERE resolution_ms = 60000").fetchone()[0]
+        stats = RetentionManager(conn=storage.conn, policy={"raw_days": None, "rollup_1m_days": 1}).run(
+            now_ms=10 * 86_400_000)
+        assert stats["sketch_rows_deleted"] == minute_rows > 0
+        assert storage.conn.execute(
+            "SELECT COUNT(*) FROM metric_sketch WHERE resolution_ms = 60000").fetchone()[0] == 0
@@ -165,3 +165,123 @@ class TestReadSamples:
         storage.insert_sample(CPU_DATA, RAM_DATA, None, DISK_DATA)
         sample = storage.get_recent_samples()[0]
         assert sample["disk_usage_percent"] == pytest.approx(40.0)
+
+
+# -----------------------------
+# Multi-device hosts
+# -----------------------------
+def gpu(gpu_id, util):
+    return {"gpu_id": gpu_id, "gpu_util_percent": util, "gpu_mem_util_percent": 10.0,
+            "gpu_mem_used_mb": 1024, "gpu_temp_c": 50.0 + gpu_id, "gpu_core_clock_mhz": 1500.0,
+            "gpu_power_usage_w": 100.0, "gpu_power_limit_w": 250.0}
+
+
+MULTI_GPU_DATA = {"gpus": [gpu(1, 80.0), gpu(0, 20.0)]}
+
+MULTI_DISK_DATA = {
+    **DISK_DATA,
+    "disks": [
+        {"device": f"/dev/sd{c}", "mountpoint": f"/mnt/{c}", "fstype": "ext4",
+         "total_gb": 100.0, "used_gb": 10.0 * (i + 1), "usage_percent": 10.0 * (i + 1)}
+        for i, c in enumerate("abcd")
+    ],
+}
+
+
+@pytest.fixture
+def multi_device():
+    """StorageManager on a host with 2 GPUs and 4 partitions, 10 ticks written."""
+    s = StorageManager(db_path=":memory:")
+    for gpu_id in (0, 1):
+        s.conn.execute(
+            "INSERT INTO gpu_device (gpu_uuid, host_uuid, first_seen_iso) VALUES (?, ?, '')",
+            (f"GPU-{gpu_id}", s.host_uuid),
+        )
+        s.gpu_uuid_map[gpu_id] = f"GPU-{gpu_id}"
+    s.conn.commit()
+    for _ in range(10):
+        s.insert_sample(CPU_DATA, RAM_DATA, MULTI_GPU_DATA, MULTI_DISK_DATA)
+    yield s
+    s.close()
+
+
+class TestMultiDeviceReads:
+
+    def test_one_row_per_tick(self, multi_device):
+        samples = multi_device.get_recent_samples(n=5)
+        assert len(samples) == 5
+        assert len({s["sample_id"] for s in samples}) == 5
+
+    def test_all_sessions_one_row_per_tick(self, multi_device):
+        assert len(multi_device.get_recent_samples_all_sessions(n=7, devices=True)) == 7
+
+    def test_flat_columns_are_gpu0_and_busiest_partition(self, multi_device):
+        sample = multi_device.get_recent_samples(n=1)[0]
+        assert sample["gpu_util_percent"] == pytest.approx(20.0)
+        assert sample["disk_usage_percent"] == pytest.approx(40.0)
+
+    def test_devices_attached_in_id_order(self, multi_device):
+        sample = multi_device.get_recent_samples(n=1, devices=True)[0]
+        assert [g["gpu_id"] for g in sample["gpus"]] == [0, 1]
+        assert [g["gpu_util_percent"] for g in sample["gpus"]] == [20.0, 80.0]
+        assert [p["mountpoint"] for p in sample["partitions"]] == ["/mnt/a", "/mnt/b", "/mnt/c", "/mnt/d"]
+
+    def test_devices_only_for_returned_ticks(self, multi_device):
+        samples = multi_device.get_recent_samples(n=3, devices=True)
+        assert sum(len(s["gpus"]) for s in samples) == 6
+        assert sum(len(s["partitions"]) for s in samples) == 12
+
+    def test_devices_off_by_default(self, multi_device):
+        assert "gpus" not in multi_device.get_recent_samples(n=1)[0]
+
+    def test_tick_without_devices_gets_empty_lists(self, storage):
+        storage.insert_sample(CPU_DATA, RAM_DATA, None, {**DISK_DATA, "disks": []})
+        sample = storage.get_recent_samples(devices=True)[0]
+        assert sample["gpus"] == [] and sample["partitions"] == []
+
+
+# -----------------------------
+# Time-range pages
+# -----------------------------
+@pytest.fixture
+def timeline():
+    """StorageManager with 25 ticks at ts_unix_ms = 1000 * sample_id, some sharing a timestamp."""
+    s = StorageManager(db_path=":memory:")
+    for _ in range(25):
+        s.insert_sample(CPU_DATA, RAM_DATA, None, DISK_DATA)
+    s.conn.execute("UPDATE sample SET ts_unix_ms = sample_id * 1000")
+    s.conn.execute("UPDATE sample SET ts_unix_ms = 10000 WHERE sample_id BETWEEN 10 AND 14")
+    s.conn.commit()
+    yield s
+    s.close()
+
+
+class TestRangePages:
+
+    def test_pages_cover_range_exactly_once(self, timeline):
+        seen, cursor = [], None
+        while True:
+            rows, cursor = timeline.get_range_page(5000, 20000, cursor, page_size=4)
+            assert len(rows) <= 4
+            seen += [r["sample_id"] for r in rows]
+            if cursor is None:
+                break
+        assert seen == list(range(5, 20))
+
+    def test_cursor_splits_equal_timestamps(self, timeline):
+        rows, cursor = timeline.get_range_page(10000, 11000, page_size=2)
+        assert cursor == (10000, 11)
+        rest, cursor = timeline.get_range_page(10000, 11000, cursor, page_size=10)
+        assert [r["sample_id"] for r in rows + rest] == [10, 11, 12, 13, 14]
+        assert cursor is None
+
+    def test_rows_carry_session_and_metrics(self, timeline):
+        rows, _ = timeline.get_range_page(1000, 2000)
+        assert rows[0]["session_id"] == timeline.session_id
+        assert rows[0]["cpu_percent_total"] == pytest.approx(25.0)
+
+    def test_iter_range_streams_all(self, timeline):
+        assert [r["sample_id"] for r in timeline.iter_range(0, 100000, page_size=7)] == list(range(1, 26))
+
+    def test_empty_range(self, timeline):
+        assert timeline.get_range_page(500000, 600000) == ([], None)
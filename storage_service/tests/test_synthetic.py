@@ -0,0 +1,93 @@
+# storage_service/tests/test_synthetic.py
+# Author: Andrew Fox
+# Run with: python -m pytest storage_service/tests/test_synthetic.py -v
+
+import sqlite3
+
+import pytest
+from storage_service.storage.main import StorageManager
+from storage_service.storage.rollups import RollupManager
+from storage_service.storage.synthetic import generate_db, main
+
+END_MS = 1_780_000_000_000
+
+
+def query(path, sql):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute(sql).fetchall()
+    finally:
+        conn.close()
+
+
+# -----------------------------
+# Generated data
+# -----------------------------
+@pytest.mark.parametrize("method", ["numpy", "cte"])
+class TestGenerateDb:
+
+    def test_every_tick_has_every_table(self, tmp_path, method):
+        db = str(tmp_path / "s.db")
+        stats = generate_db(db, hosts=2, days=0.1, end_ms=END_MS, gpus_per_host=2,
+                            partitions_per_host=3, session_hours=1, method=method)
+        ticks = stats["ticks"]
+        assert query(db, "SELECT COUNT(*) FROM sample")[0][0] == ticks
+        for table, per_tick in (("cpu_sample", 1), ("ram_sample", 1), ("disk_io_sample", 1),
+                                ("gpu_sample", 2), ("disk_partition_sample", 3)):
+            assert query(db, f"SELECT COUNT(*) FROM {table}")[0][0] == ticks * per_tick, table
+        assert query(db, "PRAGMA foreign_key_check") == []
+
+    def test_multiple_hosts_and_closed_sessions(self, tmp_path, method):
+        db = str(tmp_path / "s.db")
+        generate_db(db, hosts=3, days=0.2, end_ms=END_MS, session_hours=1, method=method)
+        assert query(db, "SELECT COUNT(DISTINCT host_uuid) FROM session")[0][0] == 3
+        assert query(db, "SELECT COUNT(*) FROM session WHERE ended_at_unix_ms IS NULL")[0][0] == 0
+        assert query(db, "SELECT MAX(ts_unix_ms) FROM sample")[0][0] <= END_MS
+
+    def test_values_in_range(self, tmp_path, method):
+        db = str(tmp_path / "s.db")
+        generate_db(db, hosts=1, days=0.1, end_ms=END_MS, method=method)
+        lo, hi = query(db, "SELECT MIN(cpu_percent_total), MAX(cpu_percent_total) FROM cpu_sample")[0]
+        assert 0 <= lo <= hi <= 100
+        lo, hi = query(db, "SELECT MIN(usage_percent), MAX(usage_percent) FROM disk_partition_sample")[0]
+        assert 0 <= lo <= hi <= 100
+
+
+class TestGeneratorSetup:
+
+    def test_indexes_rebuilt(self, tmp_path):
+        db = str(tmp_path / "s.db")
+        generate_db(db, hosts=1, days=0.01, end_ms=END_MS)
+        names = {row[0] for row in query(db, "SELECT name FROM sqlite_master WHERE type = 'index'")}
+        assert {"idx_sample_session_ts", "idx_sample_ts", "idx_gpu_sample_sample_gpu"} <= names
+        assert query(db, "PRAGMA journal_mode")[0][0] == "wal"
+
+    def test_appends_after_existing_data(self, tmp_path):
+        db = str(tmp_path / "s.db")
+        first = generate_db(db, hosts=1, days=0.01, end_ms=END_MS, seed=1)
+        second = generate_db(db, hosts=1, days=0.01, end_ms=END_MS, seed=2)
+        assert query(db, "SELECT COUNT(*) FROM sample")[0][0] == first["ticks"] + second["ticks"]
+
+    def test_rollup_watermark_skips_catch_up(self, tmp_path):
+        db = str(tmp_path / "s.db")
+        stats = generate_db(db, hosts=1, days=0.01, end_ms=END_MS)
+        storage = StorageManager(db_path=db)
+        try:
+            assert RollupManager.get_watermark(storage.conn) == stats["ticks"]
+        finally:
+            storage.close()
+
+    def test_rollups_built_on_request(self, tmp_path):
+        db = str(tmp_path / "s.db")
+        generate_db(db, hosts=1, days=0.01, end_ms=END_MS, rollups=True)
+        assert query(db, "SELECT COUNT(*) FROM metric_rollup")[0][0] > 0
+
+    def test_unknown_method_raises(self, tmp_path):
+        with pytest.raises(ValueError):
+            generate_db(str(tmp_path / "s.db"), method="csv")
+
+    def test_cli(self, tmp_path, capsys):
+        db = str(tmp_path / "s.db")
+        main(["--db", db, "--hosts", "1", "--days", "0.01", "--method", "cte"])
+        assert "ticks" in capsys.readouterr().out
+        assert query(db, "SELECT COUNT(*) FROM sample")[0][0] > 0
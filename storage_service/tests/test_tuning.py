@@ -0,0 +1,103 @@
+# storage_service/tests/test_tuning.py
+# Author: Andrew Fox
+# Run with: python -m pytest storage_service/tests/test_tuning.py -v
+# Calibration runs at a tiny scale; real runs: python -m storage_service.storage.tuning
+
+import json
+
+import pytest
+from storage_service.storage.main import StorageManager
+from storage_service.storage.schema import init_db
+from storage_service.storage.tuning import (
+    PROFILES, calibrate, current_settings, main, resolve_profile, score_profiles,
+)
+
+
+# -----------------------------
+# Profiles
+# -----------------------------
+class TestProfiles:
+
+    @pytest.mark.parametrize("name", list(PROFILES))
+    def test_new_file_gets_every_setting(self, tmp_path, name):
+        conn = init_db(tmp_path / "t.db", profile=name)
+        try:
+            assert current_settings(conn) == PROFILES[name]
+            assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        finally:
+            conn.close()
+
+    def test_existing_file_keeps_page_size(self, tmp_path):
+        init_db(tmp_path / "t.db").close()
+        conn = init_db(tmp_path / "t.db", profile="archive")
+        try:
+            settings = current_settings(conn)
+            assert settings["page_size"] == 4096
+            assert settings["mmap_size"] == PROFILES["archive"]["mmap_size"]
+        finally:
+            conn.close()
+
+    def test_no_profile_keeps_base_pragmas(self, tmp_path):
+        conn = init_db(tmp_path / "t.db")
+        try:
+            assert current_settings(conn)["synchronous"] == "NORMAL"
+            assert conn.execute("PRAGMA foreign_keys").fetchone()[0] == 1
+        finally:
+            conn.close()
+
+    def test_custom_settings_dict(self, tmp_path):
+        conn = init_db(tmp_path / "t.db", profile={"cache_size": -1024})
+        try:
+            assert current_settings(conn)["cache_size"] == -1024
+        finally:
+            conn.close()
+
+    def test_unknown_profile_rejected(self):
+        with pytest.raises(ValueError):
+            resolve_profile("turbo")
+
+    def test_storage_manager_profile(self, tmp_path):
+        s = StorageManager(db_path=str(tmp_path / "t.db"), profile="server")
+        try:
+            assert current_settings(s.conn)["cache_size"] == PROFILES["server"]["cache_size"]
+        finally:
+            s.close()
+
+    def test_autocheckpoint_off_wins_over_profile(self, tmp_path):
+        s = StorageManager(db_path=str(tmp_path / "t.db"), profile="server", autocheckpoint=False)
+        try:
+            assert current_settings(s.conn)["wal_autocheckpoint"] == 0
+        finally:
+            s.close()
+
+
+# -----------------------------
+# Calibration
+# -----------------------------
+class TestCalibration:
+
+    def test_scores_relative_to_best(self):
+        results = {
+            "a": {"build": {"seconds": 1.0}, "insert": {"p50_ms": 1.0, "p99_ms": 2.0},
+                  "reads": {k: 1.0 for k in ("recent_session_1000_ms", "recent_all_10_ms", "range_1h_columns_ms",
+                                             "range_1d_columns_ms", "range_page_first_ms")}},
+        }
+        results["b"] = {section: {k: v * 2 for k, v in values.items()} for section, values in results["a"].items()}
+        scores = score_profiles(results)
+        assert scores["a"] == pytest.approx(1.0)
+        assert scores["b"] == pytest.approx(2.0)
+
+    def test_calibrate_recommends_a_candidate(self, tmp_path):
+        doc = calibrate(tmp_path, candidates=("laptop", "server"), n_ticks=2000, n_inserts=20, repeats=2)
+        assert doc["recommended"] in ("laptop", "server")
+        assert set(doc["scores"]) == {"laptop", "server"}
+        assert min(doc["scores"].values()) >= 1.0
+        assert doc["profiles"]["server"]["insert"]["ticks"] == 20
+        assert list(tmp_path.iterdir()) == []   # temporary DBs are cleaned up
+
+    def test_cli_writes_json(self, tmp_path, capsys):
+        out = tmp_path / "tuning.json"
+        main(["--work-dir", str(tmp_path), "--profiles", "laptop", "--ticks", "1000",
+              "--inserts", "10", "--repeats", "1", "--out", str(out)])
+        assert "Recommended profile: laptop" in capsys.readouterr().out
+        assert json.loads(out.read_text())["recommended"] == "laptop"
@@ -0,0 +1,163 @@
+# storage_service/tests/test_writer.py
+# Author: Andrew Fox
+# Run with: python -m pytest storage_service/tests/test_writer.py -v
+
+import datetime
+import threading
+
+import pytest
+from storage_service.storage.main import StorageManager
+from storage_service.storage.metrics import METRICS
+from storage_service.storage.writer import AsyncStorageWriter
+
+
+# -----------------------------
+# Shared sample data
+# -----------------------------
+CPU_DATA = {"cpu_percent_total": 25.0, "freq_current_mhz": 2800.0}
+
+RAM_DATA = {"used_ram_gb": 8.0, "ram_usage_percent": 50.0, "swap_usage_percent": 5.0}
+
+DISK_DATA = {
+    "read_speed_bytes": 0.0,
+    "write_speed_bytes": 0.0,
+    "avg_read_latency_ms": 1.0,
+    "avg_write_latency_ms": 1.0,
+    "disks": [],
+}
+
+
+class GatedStorage:
+    """Stands in for StorageManager; insert_sample blocks until the gate opens."""
+
+    def __init__(self):
+        self.gate = threading.Event()
+        self.inserted = []
+        self.closed = False
+
+    def insert_sample(self, cpu_data, ram_data, gpu_data, disk_data, collect_duration_ms=0, collected_at=None):
+        self.gate.wait()
+        self.inserted.append(cpu_data["cpu_percent_total"])
+
+    def close(self):
+        self.closed = True
+
+
+def tick(writer, value):
+    return writer.submit({**CPU_DATA, "cpu_percent_total": float(value)}, RAM_DATA, None, DISK_DATA)
+
+
+@pytest.fixture
+def gated():
+    METRICS.reset()
+    storage = GatedStorage()
+    yield storage
+    storage.gate.set()
+
+
+def stalled_writer(storage, policy, max_queue=2, **kwargs):
+    """Writer whose thread is stuck on the first tick, so the queue fills deterministically."""
+    writer = AsyncStorageWriter(lambda: storage, max_queue=max_queue, policy=policy, **kwargs)
+    writer.start()
+    tick(writer, 0)
+    while writer.queue_depth():   # wait for the writer to take tick 0 and block on it
+        pass
+    return writer
+
+
+# -----------------------------
+# Overflow policies
+# -----------------------------
+class TestOverflowPolicies:
+
+    def test_drop_oldest(self, gated):
+        writer = stalled_writer(gated, "drop_oldest")
+        for v in (1, 2, 3):
+            tick(writer, v)
+        gated.gate.set()
+        writer.stop()
+        assert gated.inserted == [0.0, 2.0, 3.0]
+        assert METRICS.snapshot()["counters"]["writer.dropped"] == 1
+
+    def test_coalesce_keeps_latest(self, gated):
+        writer = stalled_writer(gated, "coalesce")
+        for v in (1, 2, 3):
+            tick(writer, v)
+        gated.gate.set()
+        writer.stop()
+        assert gated.inserted == [0.0, 1.0, 3.0]
+        assert METRICS.snapshot()["counters"]["writer.coalesced"] == 1
+
+    def test_block_times_out_and_drops_new_tick(self, gated):
+        writer = stalled_writer(gated, "block", block_timeout_s=0.05)
+        tick(writer, 1)
+        tick(writer, 2)
+        assert tick(writer, 3) is False
+        gated.gate.set()
+        writer.stop()
+        assert gated.inserted == [0.0, 1.0, 2.0]
+
+    def test_block_waits_for_space(self, gated):
+        writer = stalled_writer(gated, "block", max_queue=1)
+        tick(writer, 1)
+        threading.Timer(0.05, gated.gate.set).start()
+        assert tick(writer, 2) is True
+        writer.stop()
+        assert gated.inserted == [0.0, 1.0, 2.0]
+
+    def test_unknown_policy_raises(self):
+        with pytest.raises(ValueError):
+            AsyncStorageWriter(lambda: None, policy="spill")
+
+
+# -----------------------------
+# Lifecycle and metrics
+# -----------------------------
+class TestWriterLifecycle:
+
+    def test_stop_drains_and_closes(self, gated):
+        gated.gate.set()
+        writer = AsyncStorageWriter(lambda: gated, max_queue=10)
+        writer.start()
+        for v in range(5):
+            tick(writer, v)
+        writer.stop()
+        assert gated.inserted == [0.0, 1.0, 2.0, 3.0, 4.0]
+        assert gated.closed
+
+    def test_submit_after_stop_raises(self, gated):
+        writer = AsyncStorageWriter(lambda: gated)
+        writer.start()
+        writer.stop()
+        with pytest.raises(RuntimeError):
+            tick(writer, 0)
+
+    def test_metrics_published(self, gated):
+        gated.gate.set()
+        writer = AsyncStorageWriter(lambda: gated)
+        writer.start()
+        tick(writer, 0)
+        writer.stop()
+        snap = METRICS.snapshot()
+        assert snap["counters"]["writer.written"] == 1
+        assert snap["timings"]["writer.commit_ms"]["count"] == 1
+        assert snap["gauges"]["writer.queue_depth"] == 0
+
+    def test_factory_error_raised_on_start(self):
+        def boom():
+            raise OSError("disk gone")
+        with pytest.raises(OSError):
+            AsyncStorageWriter(boom).start()
+
+    def test_writes_real_storage_with_collection_time(self, tmp_path):
+        db = tmp_path / "t.db"
+        writer = AsyncStorageWriter(lambda: StorageManager(db_path=str(db)))
+        writer.start()
+        collected = datetime.datetime(2026, 1, 1, 12, 0, 0)
+        writer.submit(CPU_DATA, RAM_DATA, None, DISK_DATA, 5, collected_at=collected)
+        writer.stop()
+
+        check = StorageManager(db_path=str(db))
+        ts = check.conn.execute("SELECT ts_unix_ms FROM sample").fetchone()[0]
+        check.close()
+        assert ts == int(collected.timestamp() * 1000)
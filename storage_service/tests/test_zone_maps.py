@@ -0,0 +1,246 @@
+# storage_service/tests/test_zone_maps.py
+# Author: Andrew Fox
+# Run with: python -m pytest storage_service/tests/test_zone_maps.py -v
+
+import datetime
+import sqlite3
+
+import numpy as np
+import pytest
+from storage_service.storage.archive import SessionArchiver
+from storage_service.storage.main import StorageManager
+from storage_service.storage.merge import merge_dbs
+from storage_service.storage.retention import RetentionManager
+from storage_service.storage.synthetic import generate_db
+from storage_service.storage.zone_maps import ZONE_TICKS, ZoneMap, _ArchiveReader
+
+
+# -----------------------------
+# Shared sample data
+# -----------------------------
+CPU_DATA = {"cpu_percent_total": 25.0, "freq_current_mhz": 2800.0}
+
+RAM_DATA = {"used_ram_gb": 8.0, "ram_usage_percent": 50.0, "swap_usage_percent": 5.0}
+
+DISK_DATA = {
+    "read_speed_bytes": 1000.0,
+    "write_speed_bytes": 500.0,
+    "avg_read_latency_ms": 1.0,
+    "avg_write_latency_ms": 2.0,
+    "disks": [
+        {"device": "C:\\", "mountpoint": "C:\\", "fstype": "NTFS",
+         "total_gb": 500.0, "used_gb": 200.0, "usage_percent": 40.0},
+    ],
+}
+
+START_MS = 1_780_000_000_000
+END_MS = 1_780_000_000_000
+
+
+def insert_ticks(storage, cpu_values, start_ms=START_MS, step_ms=1000):
+    """One tick per cpu value, step_ms apart."""
+    for i, cpu in enumerate(cpu_values):
+        ts_ms = start_ms + i * step_ms
+        storage.insert_sample({**CPU_DATA, "cpu_percent_total": float(cpu)}, RAM_DATA, None, DISK_DATA,
+                              collected_at=datetime.datetime.fromtimestamp(ts_ms / 1000))
+
+
+def spiky(n, spikes, seed=0):
+    """Low cpu noise with a few runs of high values at the given (start, length) positions."""
+    values = np.random.default_rng(seed).uniform(5.0, 40.0, n)
+    for start, length in spikes:
+        values[start:start + length] = 95.0 + np.arange(length) % 3
+    return values
+
+
+def brute_force(conn, metric_sql, threshold):
+    """(start_unix_ms, end_unix_ms, ticks) of runs of consecutive ticks above threshold."""
+    runs, current = [], None
+    for ts, value in conn.execute(
+        f"""SELECT s.ts_unix_ms, {metric_sql} FROM sample s
+            LEFT JOIN cpu_sample c ON c.sample_id = s.sample_id ORDER BY s.sample_id"""
+    ):
+        if value is not None and value > threshold:
+            if current is None:
+                current = [ts, ts, 0]
+                runs.append(current)
+            current[1] = ts
+            current[2] += 1
+        else:
+            current = None
+    return [tuple(r) for r in runs]
+
+
+def as_runs(intervals):
+    return [(i["start_unix_ms"], i["end_unix_ms"], i["ticks"]) for i in intervals]
+
+
+def zone_rows(conn):
+    return (
+        conn.execute("SELECT * FROM zone_chunk ORDER BY chunk_id").fetchall(),
+        conn.execute("SELECT * FROM zone_map ORDER BY metric, chunk_id").fetchall(),
+    )
+
+
+@pytest.fixture
+def storage():
+    s = StorageManager(db_path=":memory:")
+    yield s
+    s.close()
+
+
+# -----------------------------
+# Maintenance
+# -----------------------------
+class TestMaintenance:
+
+    def test_live_ticks_widen_bounds(self, storage):
+        insert_ticks(storage, [10.0, 70.0, 30.0])
+        assert tuple(storage.conn.execute(
+            "SELECT min_value, max_value FROM zone_map WHERE metric = 'cpu_percent_total'"
+        ).fetchone()) == (10.0, 70.0)
+        assert storage.conn.execute("SELECT SUM(tick_count) FROM zone_chunk").fetchone()[0] == 3
+
+    def test_chunks_follow_sample_ids(self, storage):
+        insert_ticks(storage, spiky(2 * ZONE_TICKS + 10, []))
+        for chunk_id, first_id, last_id, _, _, count in storage.conn.execute("SELECT * FROM zone_chunk"):
+            assert first_id // ZONE_TICKS == last_id // ZONE_TICKS == chunk_id
+            assert count == last_id - first_id + 1
+
+    def test_catch_up_matches_live_maintenance(self, tmp_path):
+        s = StorageManager(db_path=str(tmp_path / "t.db"))
+        insert_ticks(s, spiky(1500, [(700, 5)]))
+        s.close()
+        conn = sqlite3.connect(tmp_path / "t.db")
+        live = zone_rows(conn)
+        conn.execute("DELETE FROM zone_map")
+        conn.execute("DELETE FROM zone_chunk")
+        conn.commit()
+        assert ZoneMap.catch_up(conn, batch_size=400) == 1500
+        assert ZoneMap.catch_up(conn) == 0
+        assert zone_rows(conn) == live
+        conn.close()
+
+
+# -----------------------------
+# Search
+# -----------------------------
+class TestSearch:
+
+    def test_matches_brute_force(self, storage):
+        insert_ticks(storage, spiky(4 * ZONE_TICKS, [(100, 4), (1500, 1), (1023, 3), (3000, 20)]))
+        intervals = storage.search_threshold("cpu_percent_total", 90.0)
+        assert as_runs(intervals) == brute_force(storage.conn, "c.cpu_percent_total", 90.0)
+        assert [i["peak"] for i in intervals] == [97.0, 97.0, 95.0, 97.0]
+        assert {i["session_id"] for i in intervals} == {storage.session_id}
+
+    def test_run_across_chunk_boundary_is_one_interval(self, storage):
+        insert_ticks(storage, spiky(3 * ZONE_TICKS, [(ZONE_TICKS - 3, 8)]))
+        assert [i["ticks"] for i in storage.search_threshold("cpu_percent_total", 90.0)] == [8]
+
+    def test_skips_chunks_that_cannot_match(self, storage):
+        insert_ticks(storage, spiky(6 * ZONE_TICKS, [(2 * ZONE_TICKS + 10, 2)]))
+        assert len(ZoneMap.candidates(storage.conn, "cpu_percent_total", 90.0)) == 1
+        assert ZoneMap.candidates(storage.conn, "cpu_percent_total", 99.0) == []
+        assert len(ZoneMap.candidates(storage.conn, "cpu_percent_total", 5.0, "<=")) == 0
+
+    @pytest.mark.parametrize("op,threshold,expected", [
+        (">", 30.0, [40.0]), (">=", 30.0, [30.0, 40.0]), ("<", 20.0, [10.0]), ("<=", 20.0, [10.0, 20.0]),
+    ])
+    def test_operators(self, storage, op, threshold, expected):
+        insert_ticks(storage, [10.0, 30.0, 20.0, 40.0])
+        peaks = [i["peak"] for i in storage.search_threshold("cpu_percent_total", threshold, op)]
+        assert sorted(peaks) == expected
+
+    def test_time_range_and_host(self, storage):
+        insert_ticks(storage, spiky(200, [(10, 3), (150, 3)]))
+        late = storage.search_threshold("cpu_percent_total", 90.0, start_ms=START_MS + 100_000)
+        assert [i["start_unix_ms"] for i in late] == [START_MS + 150_000]
+        assert storage.search_threshold("cpu_percent_total", 90.0, end_ms=START_MS + 11_000)[0]["ticks"] == 1
+        assert storage.search_threshold("cpu_percent_total", 90.0, host_uuid="other") == []
+
+    def test_result_follows_inserts(self, storage):
+        insert_ticks(storage, [10.0] * 5)
+        assert storage.search_threshold("cpu_percent_total", 90.0) == []
+        insert_ticks(storage, [99.0], start_ms=START_MS + 5000)
+        assert len(storage.search_threshold("cpu_percent_total", 90.0)) == 1
+
+    def test_unknown_metric_or_operator(self, storage):
+        with pytest.raises(ValueError):
+            storage.search_threshold("nope", 1.0)
+        with pytest.raises(ValueError):
+            storage.search_threshold("cpu_percent_total", 1.0, "==")
+
+
+# -----------------------------
+# Archive, retention, merge
+# -----------------------------
+class TestHistory:
+
+    def test_archived_ticks_still_found(self, tmp_path):
+        old = StorageManager(db_path=str(tmp_path / "t.db"))
+        insert_ticks(old, spiky(1200, [(50, 3), (1100, 2)]))
+        expected = as_runs(old.search_threshold("cpu_percent_total", 90.0))
+        old.close()
+        s = StorageManager(db_path=str(tmp_path / "t.db"))
+        assert SessionArchiver.archive_session(s.conn, old.session_id, chunk_ticks=500) == 1200
+        assert s.conn.execute("SELECT COUNT(*) FROM sample WHERE session_id = ?",
+                              (old.session_id,)).fetchone()[0] == 0
+        assert as_runs(s.search_threshold("cpu_percent_total", 90.0)) == expected
+        assert as_runs(s.search_threshold("disk_usage_percent", 39.0)) == [(START_MS, START_MS + 1199_000, 1200)]
+        s.close()
+
+    def test_archive_decoded_only_near_candidates(self, tmp_path, monkeypatch):
+        old = StorageManager(db_path=str(tmp_path / "t.db"))
+        insert_ticks(old, spiky(4 * ZONE_TICKS, [(2 * ZONE_TICKS + 10, 3)]))
+        old.close()
+        s = StorageManager(db_path=str(tmp_path / "t.db"))
+        SessionArchiver.archive_session(s.conn, old.session_id, chunk_ticks=256)
+        decoded, held = [], []
+        decode = _ArchiveReader._decode
+
+        def spy(self, session_id, first_id, count):
+            if (session_id, first_id) not in self._decoded:
+                decoded.append(first_id)
+            result = decode(self, session_id, first_id, count)
+            held.append(len(self._decoded))
+            return result
+
+        monkeypatch.setattr(_ArchiveReader, "_decode", spy)
+        assert [i["ticks"] for i in s.search_threshold("cpu_percent_total", 90.0)] == [3]
+        # The candidate zone chunk holds 4 archive chunks; one either side may share a boundary second
+        assert len(decoded) <= 6
+        decoded.clear()
+        assert sum(i["ticks"] for i in s.search_threshold("cpu_percent_total", 0.0)) == 4 * ZONE_TICKS
+        assert len(decoded) == s.conn.execute("SELECT COUNT(*) FROM sample_chunk").fetchone()[0] == 16
+        assert max(held) <= 6          # chunks behind the search are dropped
+        s.close()
+
+    def test_retention_prunes_old_chunks(self, storage):
+        insert_ticks(storage, [99.0] * (ZONE_TICKS - 1), start_ms=0)      # sample ids 1..1023: chunk 0
+        insert_ticks(storage, [99.0] * (ZONE_TICKS + 5), start_ms=10 * 86_400_000)
+        stats = RetentionManager(conn=storage.conn, policy={"raw_days": 1}).run(now_ms=11 * 86_400_000)
+        assert stats["zone_chunks_deleted"] == 1
+        assert [i["ticks"] for i in storage.search_threshold("cpu_percent_total", 90.0)] == [ZONE_TICKS + 5]
+
+    def test_merged_file_matches_sources(self, tmp_path):
+        sources = []
+        for name, seed in (("a", 0), ("b", 1)):
+            path = str(tmp_path / f"{name}.db")
+            generate_db(path, hosts=1, days=0.02, end_ms=END_MS, gpus_per_host=1, partitions_per_host=1,
+                        session_hours=0.25, seed=seed)
+            sources.append(path)
+        expected = []
+        for path in sources:
+            conn = sqlite3.connect(path)
+            expected += [(i["start_unix_ms"], i["ticks"]) for i in ZoneMap.search(conn, "gpu_temp_c", 37.0)]
+            conn.close()
+        out = str(tmp_path / "fleet.db")
+        merge_dbs(out, sources)
+        conn = sqlite3.connect(out)
+        assert ZoneMap.catch_up(conn) == 0
+        merged = [(i["start_unix_ms"], i["ticks"]) for i in ZoneMap.search(conn, "gpu_temp_c", 37.0)]
+        assert sorted(merged) == sorted(expected) and merged
+        assert conn.execute("SELECT SUM(tick_count) FROM zone_chunk").fetchone()[0] == \
+            conn.execute("SELECT COUNT(*) FROM sample").fetchone()[0]
+        conn.close()